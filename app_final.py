@@ -16,10 +16,14 @@ import plotly.express as px
 import plotly.graph_objects as go
 
 # Importar servicios
+from services.migracion_service import aplicar_migraciones
+from services.trabajos_service import iniciar_workers
+from services.ollama_monitor import iniciar_monitor
 from services import (
     # Database SQLite
-    ensure_sheet_exists, read_sheet, append_rows, read_table,
+    ensure_sheet_exists, append_rows,
     set_eval_active, update_cuestionarios_version,
+    count_rows, get_respuestas_evaluacion,
     # Ollama
     ollama_generate, ollama_analyze_risk,
     extract_json_array, validate_ia_questions,
@@ -32,11 +36,12 @@ from services import (
     get_activo, actualizar_estado_activo, validar_duplicado,
     # Cuestionarios
     generar_cuestionario, get_cuestionario,
-    guardar_respuestas, verificar_cuestionario_completo, invalidar_analisis_ia,
+    guardar_respuestas, get_respuestas, verificar_cuestionario_completo, invalidar_analisis_ia,
     verificar_respuestas_existentes,
     # Motor MAGERIT v3
     get_nivel_riesgo, get_color_riesgo,
     evaluar_activo_magerit, guardar_resultado_magerit,
+    evaluar_evaluacion_magerit, guardar_resultados_magerit,
     get_resultado_magerit, get_resumen_evaluacion, get_amenazas_activo,
     # IA MAGERIT
     analizar_activo_con_ia, verificar_ollama_disponible,
@@ -135,29 +140,12 @@ def calcular_estado_activo(eval_id: str, activo_id: str) -> str:
     """
     try:
         # 1. Verificar si existe cuestionario
-        cuestionarios = read_sheet("CUESTIONARIOS")
-        if cuestionarios.empty or "ID_Evaluacion" not in cuestionarios.columns:
-            return "Pendiente"
-        
-        tiene_cuestionario = not cuestionarios[
-            (cuestionarios["ID_Evaluacion"].astype(str) == str(eval_id)) &
-            (cuestionarios["ID_Activo"].astype(str) == str(activo_id))
-        ].empty
-        
-        if not tiene_cuestionario:
+        claves = {"ID_Evaluacion": eval_id, "ID_Activo": activo_id}
+        if count_rows("CUESTIONARIOS", claves) == 0:
             return "Pendiente"
         
         # 2. Verificar respuestas
-        respuestas = read_sheet("RESPUESTAS")
-        if respuestas.empty or "ID_Evaluacion" not in respuestas.columns:
-            return "Pendiente"
-        
-        respuestas_activo = respuestas[
-            (respuestas["ID_Evaluacion"].astype(str) == str(eval_id)) &
-            (respuestas["ID_Activo"].astype(str) == str(activo_id))
-        ]
-        
-        if respuestas_activo.empty:
+        if count_rows("RESPUESTAS", claves) == 0:
             return "Pendiente"
         
         # 3. Verificar si cuestionario está completo
@@ -169,15 +157,8 @@ def calcular_estado_activo(eval_id: str, activo_id: str) -> str:
             return "Incompleto"
         
         # 4. Verificar si tiene evaluación IA
-        analisis = read_sheet("ANALISIS_RIESGO")
-        if not analisis.empty and "ID_Evaluacion" in analisis.columns:
-            tiene_analisis = not analisis[
-                (analisis["ID_Evaluacion"].astype(str) == str(eval_id)) &
-                (analisis["ID_Activo"].astype(str) == str(activo_id))
-            ].empty
-            
-            if tiene_analisis:
-                return "Evaluado"
+        if count_rows("ANALISIS_RIESGO", claves) > 0:
+            return "Evaluado"
         
         return "Completo"
     
@@ -292,6 +273,12 @@ if "eval_actual" not in st.session_state:
 if "eval_nombre" not in st.session_state:
     st.session_state["eval_nombre"] = None
 
+# Aplicar migraciones pendientes del esquema SQLite y arrancar la cola de trabajos
+aplicar_migraciones()
+iniciar_workers()
+# Health checks de Ollama en segundo plano: la UI lee el estado cacheado
+iniciar_monitor()
+
 # Asegurar hojas necesarias
 ensure_sheet_exists("CUESTIONARIOS", CUESTIONARIOS_HEADERS)
 ensure_sheet_exists("RESPUESTAS", RESPUESTAS_HEADERS)
@@ -787,18 +774,17 @@ with tab2:
             activos_dict = dict(zip(activos["ID_Activo"], activos["Nombre_Activo"]))
             
             # Mostrar tabla de activos con estado
+            # Conteo de respuestas por activo en una sola consulta de la evaluación
+            respuestas_por_activo = get_respuestas_evaluacion(
+                st.session_state["eval_actual"], columns=["ID_Activo"]
+            )["ID_Activo"].value_counts()
             datos_activos = []
             for _, activo in activos.iterrows():
                 activo_id_temp = activo["ID_Activo"]
                 cuest_temp = get_cuestionario(st.session_state["eval_actual"], activo_id_temp)
-                resp_temp = read_sheet("RESPUESTAS")
-                resp_activo = resp_temp[
-                    (resp_temp["ID_Evaluacion"] == st.session_state["eval_actual"]) &
-                    (resp_temp["ID_Activo"] == activo_id_temp)
-                ] if not resp_temp.empty else pd.DataFrame()
                 
                 total_preg = len(cuest_temp)
-                respondidas = len(resp_activo)
+                respondidas = int(respuestas_por_activo.get(activo_id_temp, 0))
                 
                 if total_preg == 0:
                     estado = "🔴 Sin cuestionario"
@@ -855,11 +841,7 @@ with tab2:
             
             if not cuestionario_error and not cuestionario_df.empty:
                 # ===== Cargar respuestas existentes =====
-                respuestas_df = read_sheet("RESPUESTAS")
-                respuestas_existentes = respuestas_df[
-                    (respuestas_df["ID_Evaluacion"] == st.session_state["eval_actual"]) &
-                    (respuestas_df["ID_Activo"] == activo_id)
-                ] if not respuestas_df.empty else pd.DataFrame()
+                respuestas_existentes = get_respuestas(st.session_state["eval_actual"], activo_id)
                 
                 total_preguntas = len(cuestionario_df)
                 respondidas = len(respuestas_existentes)
@@ -1037,11 +1019,10 @@ with tab2:
                                     })
                             
                             # Verificar análisis previo
-                            analisis_previo = read_sheet("ANALISIS_RIESGO")
-                            tenia_analisis = not analisis_previo[
-                                (analisis_previo["ID_Evaluacion"] == st.session_state["eval_actual"]) &
-                                (analisis_previo["ID_Activo"] == activo_id)
-                            ].empty if not analisis_previo.empty else False
+                            tenia_analisis = count_rows("ANALISIS_RIESGO", {
+                                "ID_Evaluacion": st.session_state["eval_actual"],
+                                "ID_Activo": activo_id
+                            }) > 0
                             
                             exito = guardar_respuestas(
                                 st.session_state["eval_actual"],
@@ -1116,7 +1097,9 @@ with tab3:
             if activos.empty:
                 st.warning("⚠️ No hay activos. Crea uno en el tab 📦 Activos.")
             else:
-                respuestas_df = read_table("RESPUESTAS")
+                respuestas_por_activo = get_respuestas_evaluacion(
+                    st.session_state["eval_actual"], columns=["ID_Activo"]
+                )["ID_Activo"].value_counts()
                 
                 # Calcular estados
                 datos_activos = []
@@ -1128,16 +1111,12 @@ with tab3:
                     
                     # Verificar cuestionario
                     cuest = get_cuestionario(st.session_state["eval_actual"], activo_id)
-                    resp_activo = respuestas_df[
-                        (respuestas_df["ID_Evaluacion"] == st.session_state["eval_actual"]) &
-                        (respuestas_df["ID_Activo"] == activo_id)
-                    ] if not respuestas_df.empty else pd.DataFrame()
                     
                     # Verificar resultado MAGERIT existente
                     resultado_existente = get_resultado_magerit(st.session_state["eval_actual"], activo_id)
                     
                     total_preg = len(cuest)
-                    respondidas = len(resp_activo)
+                    respondidas = int(respuestas_por_activo.get(activo_id, 0))
                     
                     if resultado_existente:
                         estado = "✅ Evaluado"
@@ -1185,6 +1164,7 @@ with tab3:
                         progress_bar = st.progress(0)
                         status_text = st.empty()
                         resultados_log = []
+                        analisis_ia = {}
                         
                         for i, activo_id in enumerate(activos_listos):
                             status_text.text(f"Analizando {activo_id}... ({i+1}/{len(activos_listos)})")
@@ -1199,19 +1179,7 @@ with tab3:
                                 )
                                 
                                 if exito_ia:
-                                    # 2. Ejecutar motor MAGERIT
-                                    resultado_magerit = evaluar_activo_magerit(
-                                        st.session_state["eval_actual"],
-                                        activo_id,
-                                        resultado_ia.get("amenazas", []),
-                                        resultado_ia.get("probabilidad", 3),
-                                        resultado_ia.get("observaciones", ""),
-                                        modelo_ia
-                                    )
-                                    
-                                    # 3. Guardar resultado
-                                    guardar_resultado_magerit(resultado_magerit)
-                                    resultados_log.append(f"✅ {activo_id}: {len(resultado_magerit.amenazas)} amenazas identificadas")
+                                    analisis_ia[activo_id] = resultado_ia
                                 else:
                                     resultados_log.append(f"⚠️ {activo_id}: {mensaje_ia[:200]}")
                             
@@ -1220,6 +1188,22 @@ with tab3:
                             
                             progress_bar.progress((i + 1) / len(activos_listos))
                         
+                        # 2. Ejecutar motor MAGERIT sobre todos los activos analizados
+                        # 3. Guardar resultados en una sola transacción
+                        if analisis_ia:
+                            status_text.text(f"Calculando riesgos MAGERIT de {len(analisis_ia)} activos...")
+                            try:
+                                resultados_magerit = evaluar_evaluacion_magerit(
+                                    st.session_state["eval_actual"],
+                                    analisis_ia,
+                                    modelo_ia
+                                )
+                                guardar_resultados_magerit(list(resultados_magerit.values()))
+                                for activo_id, resultado_magerit in resultados_magerit.items():
+                                    resultados_log.append(f"✅ {activo_id}: {len(resultado_magerit.amenazas)} amenazas identificadas")
+                            except Exception as e:
+                                resultados_log.append(f"❌ Motor MAGERIT: {str(e)[:200]}")
+                        
                         status_text.text("✅ Evaluación MAGERIT completada")
                         
                         # Contar resultados
@@ -2396,7 +2380,7 @@ with tab_ia:
             
             # Verificar Ollama
             st.subheader("🖥️ Ollama Local")
-            is_local, endpoint, modelos, error = verificar_ollama_local()
+            is_local, endpoint, modelos, error = verificar_ollama_local(desde_monitor=True)
             
             if is_local:
                 st.success(f"✅ Conectado: {endpoint}")
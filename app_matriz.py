@@ -17,8 +17,8 @@ Replica exactamente la estructura de la matriz Excel de referencia:
 12. MATRIZ_EXCEL - Exportación y visualización completa
 13. RESUMEN_EJECUTIVO - Informe para gerencia generado por IA
 """
+import os
 import json
-import datetime as dt
 import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
@@ -45,8 +45,16 @@ from services.carga_masiva_service import (
     get_campos_info,
     ResultadoCarga
 )
+from services.migracion_service import aplicar_migraciones
+from services.recalculo_incremental_service import propagar_cambios
+from services.analisis_masivo_service import lote_pendiente, get_tareas_lote
+from services.trabajos_service import (
+    iniciar_workers, encolar_trabajo, ultimo_trabajo, ESTADOS_ACTIVOS
+)
+from services.ollama_monitor import iniciar_monitor
+from components.trabajos_ui import render_estado_trabajo
+from components.telemetria_ui import render_panel_telemetria
 from services.matriz_service import (
-    init_matriz_tables,
     # Constantes
     ESCALA_DISPONIBILIDAD, ESCALA_INTEGRIDAD, ESCALA_CONFIDENCIALIDAD,
     ESCALA_CRITICIDAD, ESCALA_FRECUENCIA, ESCALA_DEGRADACION,
@@ -58,11 +66,12 @@ from services.matriz_service import (
     # Valoración
     guardar_valoracion_dic, get_valoraciones_evaluacion, get_valoracion_activo,
     # Vulnerabilidades
-    agregar_vulnerabilidad_amenaza, actualizar_vulnerabilidad_amenaza,
+    agregar_vulnerabilidades_amenazas,
+    actualizar_vulnerabilidad_amenaza,
     eliminar_vulnerabilidad_amenaza, get_vulnerabilidades_activo,
     get_vulnerabilidades_evaluacion,
     # Riesgo
-    calcular_riesgo_amenaza, get_riesgos_activo, get_riesgos_evaluacion,
+    recalcular_riesgos_evaluacion, get_riesgos_activo, get_riesgos_evaluacion,
     # Mapa
     generar_mapa_riesgos, get_mapa_riesgos,
     # Riesgo Activos
@@ -72,9 +81,7 @@ from services.matriz_service import (
     agregar_salvaguarda, actualizar_estado_salvaguarda, eliminar_salvaguarda,
     get_salvaguardas_activo, get_salvaguardas_evaluacion,
     # Estadísticas
-    get_estadisticas_evaluacion_matriz,
-    # Exportar
-    exportar_matriz_excel
+    get_estadisticas_evaluacion_matriz
 )
 
 # Servicios adicionales para nuevos tabs
@@ -85,7 +92,9 @@ from services.maturity_service import (
 from services.ia_advanced_service import generar_resumen_ejecutivo
 
 # Importar catálogos para Tab 1
-from services.ollama_magerit_service import get_catalogo_amenazas, get_catalogo_controles
+from services.ollama_magerit_service import (
+    get_catalogo_amenazas, get_catalogo_controles, TAMANO_GRUPO_DEFAULT, get_modo_rapido, set_modo_rapido
+)
 
 # ==================== CONFIGURACIÓN ====================
 
@@ -96,8 +105,11 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Inicializar tablas
-init_matriz_tables()
+# Inicializar tablas / aplicar migraciones pendientes del esquema
+aplicar_migraciones()
+iniciar_workers()
+# Health checks de Ollama en segundo plano: la UI lee el estado cacheado
+iniciar_monitor()
 
 # ==================== ESTILOS ====================
 
@@ -189,6 +201,12 @@ with st.sidebar:
     
     st.info(f"📌 **ID:** {ID_EVALUACION}")
     
+    # Re-derivar solo los activos con cambios desde la última ejecución
+    propagacion = propagar_cambios(ID_EVALUACION)
+    if propagacion.total_filas:
+        st.caption(f"🔁 Actualizados {propagacion.total_filas} registros derivados de "
+                   f"{len(propagacion.activos)} activo(s) en {propagacion.segundos:.2f} s")
+    
     # Editar o eliminar evaluación actual
     col_edit, col_del = st.columns(2)
     with col_edit:
@@ -328,14 +346,22 @@ with st.sidebar:
     
     # Exportar
     st.subheader("📥 Exportar")
-    if st.button("📊 Descargar Excel", type="secondary"):
-        excel_bytes = exportar_matriz_excel(ID_EVALUACION, NOMBRE_EVALUACION)
-        st.download_button(
-            "💾 Guardar Excel",
-            data=excel_bytes,
-            file_name=f"Matriz_{NOMBRE_EVALUACION}_{dt.date.today()}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+    trabajo_excel = ultimo_trabajo(ID_EVALUACION, "exportar_matriz_excel")
+    if st.button("📊 Generar Excel", type="secondary",
+                 disabled=trabajo_excel is not None and trabajo_excel["Estado"] in ESTADOS_ACTIVOS):
+        encolar_trabajo("exportar_matriz_excel", ID_EVALUACION, {"nombre_evaluacion": NOMBRE_EVALUACION})
+        st.rerun()
+    if trabajo_excel is not None:
+        trabajo_excel = render_estado_trabajo(trabajo_excel["ID_Trabajo"], "exportar_matriz_excel")
+        archivo = (trabajo_excel or {}).get("Resultado") or {}
+        if trabajo_excel["Estado"] == "completado" and os.path.exists(archivo.get("archivo", "")):
+            with open(archivo["archivo"], "rb") as f:
+                st.download_button(
+                    "💾 Guardar Excel",
+                    data=f.read(),
+                    file_name=archivo["nombre"],
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
 
 
 # ==================== TABS PRINCIPALES ====================
@@ -2137,14 +2163,26 @@ with tab4:
         with col2:
             st.metric("Modelos", len(estado_ia['modelos']))
         with col3:
-            st.metric("Cache", estado_ia['archivos_cache'])
+            cache_ia = estado_ia['cache']
+            st.metric("Cache", cache_ia['entradas'], delta=f"{cache_ia['tasa_aciertos']:.0%} aciertos",
+                      delta_color="off")
         with col4:
             st.metric("Reintentos", estado_ia['intentos_fallidos'])
+        if estado_ia['latencia_p50_ms'] is not None:
+            cargados = ", ".join(estado_ia['modelos_cargados']) or "ninguno"
+            st.caption(f"⏱️ Latencia health check: p50 {estado_ia['latencia_p50_ms']:.0f} ms · "
+                       f"p95 {estado_ia['latencia_p95_ms']:.0f} ms · en memoria: {cargados}")
+        parseo_ia = estado_ia['parseo']
+        if parseo_ia['respuestas']:
+            st.caption(f"📐 JSON de la IA: {parseo_ia['respuestas']} respuestas, "
+                       f"{parseo_ia['tasa_fallos']:.0%} sin JSON válido, {parseo_ia['reparadas']} reparadas")
         if estado_ia['disponible']:
             st.success(f"✅ {estado_ia['mensaje']}")
         else:
             st.warning(f"⚠️ {estado_ia['mensaje']}")
     
+    render_panel_telemetria("ia_matriz")
+    
     if ollama_disponible:
         st.success(f"🟢 IA Local - **Disponibilidad 100%** garantizada - {len(modelos)} modelos")
     else:
@@ -2207,124 +2245,62 @@ with tab4:
         
         st.markdown("---")
         
-        if st.button("🤖 Analizar TODOS los activos con IA", type="primary", use_container_width=True):
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            log_container = st.container()
-            
-            exitos = 0
-            errores = 0
-            omitidos_analizados = 0
-            omitidos_sin_dic = 0
-            activos_sin_dic = []
-            
-            for idx, activo_id in enumerate(activos["ID_Activo"].tolist()):
-                progress = (idx + 1) / total_activos
-                progress_bar.progress(progress)
-                status_text.text(f"Analizando {idx + 1}/{total_activos}: {activo_id}")
-                
-                # Verificar si ya está analizado
-                vuln_existentes = get_vulnerabilidades_activo(ID_EVALUACION, activo_id)
-                if not vuln_existentes.empty:
-                    with log_container:
-                        st.caption(f"⏭️ {activo_id}: Ya analizado, omitido")
-                    omitidos_analizados += 1
-                    continue
-                
-                # Obtener datos del activo
-                activo_row = activos[activos["ID_Activo"] == activo_id].iloc[0]
-                valoracion = get_valoracion_activo(ID_EVALUACION, activo_id)
-                
-                if not valoracion or valoracion.get("Criticidad", 0) == 0:
-                    with log_container:
-                        st.caption(f"⚠️ {activo_id}: Sin valoración DIC, omitido")
-                    omitidos_sin_dic += 1
-                    activos_sin_dic.append(f"{activo_id} ({activo_row['Nombre_Activo']})")
-                    continue
-                
-                # Preparar datos
-                activo_dict = {
-                    "ID_Activo": activo_id,
-                    "Nombre_Activo": activo_row['Nombre_Activo'],
-                    "Tipo_Activo": activo_row['Tipo_Activo'],
-                    "Descripcion": activo_row.get('Descripcion', ''),
-                    "Ubicacion": activo_row.get('Ubicacion', '')
-                }
-                
-                valoracion_dict = {
-                    "Valor_D": valoracion.get("Valor_D", 0),
-                    "Valor_I": valoracion.get("Valor_I", 0),
-                    "Valor_C": valoracion.get("Valor_C", 0),
-                    "D": valoracion.get("D", "N"),
-                    "I": valoracion.get("I", "N"),
-                    "C": valoracion.get("C", "N"),
-                    "Criticidad": valoracion.get("Criticidad", 0),
-                    "Criticidad_Nivel": valoracion.get("Criticidad_Nivel", "Sin valorar")
-                }
-                
-                # Analizar con IA
-                exito, amenazas, mensaje = analizar_amenazas_por_criticidad(activo_dict, valoracion_dict)
-                
-                if exito and amenazas:
-                    # Guardar automáticamente cada amenaza
-                    guardadas = 0
-                    errores_guardar = 0
-                    for am in amenazas:
-                        try:
-                            # CORREGIDO: Mapear campos correctamente desde IA
-                            # La IA retorna: codigo_amenaza, codigo_vulnerabilidad, 
-                            # nombre_amenaza, degradacion_d/i/c (valores 0-100)
-                            
-                            # Obtener código de amenaza
-                            cod_amenaza = am.get('codigo_amenaza', am.get('codigo', am.get('cod_amenaza', '')))
-                            
-                            # Obtener código de vulnerabilidad
-                            cod_vuln = am.get('codigo_vulnerabilidad', am.get('codigo_vuln', am.get('cod_vulnerabilidad', '')))
-                            
-                            # Obtener nombre de amenaza
-                            nombre_amenaza = am.get('nombre_amenaza', am.get('nombre', am.get('amenaza', '')))
-                            
-                            # Obtener degradaciones (IA retorna 0-100, DB espera 0-1)
-                            deg_d_raw = am.get('degradacion_d', am.get('deg_d', 0))
-                            deg_i_raw = am.get('degradacion_i', am.get('deg_i', 0))
-                            deg_c_raw = am.get('degradacion_c', am.get('deg_c', 0))
-                            
-                            # Convertir de 0-100 a 0-1 si es necesario
-                            deg_d = deg_d_raw / 100 if deg_d_raw > 1 else deg_d_raw
-                            deg_i = deg_i_raw / 100 if deg_i_raw > 1 else deg_i_raw
-                            deg_c = deg_c_raw / 100 if deg_c_raw > 1 else deg_c_raw
-                            
-                            agregar_vulnerabilidad_amenaza(
-                                id_evaluacion=ID_EVALUACION,
-                                id_activo=activo_id,
-                                nombre_activo=activo_row['Nombre_Activo'],
-                                vulnerabilidad=am.get('vulnerabilidad', ''),
-                                amenaza=nombre_amenaza,
-                                cod_amenaza=cod_amenaza,
-                                cod_vulnerabilidad=cod_vuln,
-                                deg_d=deg_d,
-                                deg_i=deg_i,
-                                deg_c=deg_c
-                            )
-                            guardadas += 1
-                        except Exception as e:
-                            errores_guardar += 1
-                    
-                    if guardadas > 0:
-                        with log_container:
-                            st.caption(f"✅ {activo_id}: {guardadas} amenazas guardadas")
-                        exitos += 1
+        trabajo_masivo = ultimo_trabajo(ID_EVALUACION, "analisis_masivo")
+        trabajo_activo = trabajo_masivo is not None and trabajo_masivo["Estado"] in ESTADOS_ACTIVOS
+        
+        if lote_pendiente(ID_EVALUACION) and not trabajo_activo:
+            st.info("⏸️ Hay un análisis masivo sin terminar: al pulsar el botón se reanuda desde los activos pendientes.")
+        
+        agrupar = st.checkbox("⚡ Agrupar activos similares (menos llamadas a la IA)", value=False,
+                              help="Analiza juntos los activos del mismo tipo y nivel de criticidad "
+                                   f"(hasta {TAMANO_GRUPO_DEFAULT} por consulta)")
+        
+        modo_rapido, umbral_confianza = get_modo_rapido(ID_EVALUACION)
+        col_rapido, col_umbral = st.columns([2, 1])
+        with col_rapido:
+            nuevo_modo = st.checkbox("🚀 Ruta rápida heurística (solo los activos ambiguos van a la IA)",
+                                     value=modo_rapido, key="modo_rapido_ia",
+                                     help="El motor heurístico resuelve sin IA los activos de tipo conocido "
+                                          "con respuestas de control suficientes. Se guarda para esta evaluación.")
+        with col_umbral:
+            nuevo_umbral = st.slider("Confianza mínima", 0.5, 1.0, umbral_confianza, 0.05,
+                                     key="umbral_confianza_ia", disabled=not nuevo_modo)
+        if (nuevo_modo, nuevo_umbral) != (modo_rapido, umbral_confianza):
+            set_modo_rapido(ID_EVALUACION, nuevo_modo, nuevo_umbral)
+        
+        if st.button("🤖 Analizar TODOS los activos con IA", type="primary", use_container_width=True,
+                     disabled=trabajo_activo):
+            # Se ejecuta en segundo plano (trabajos_service): sobrevive a reruns y cierres del navegador
+            encolar_trabajo("analisis_masivo", ID_EVALUACION,
+                            {"tamano_grupo": TAMANO_GRUPO_DEFAULT} if agrupar else None)
+            st.rerun()
+        
+        if trabajo_masivo is not None:
+            trabajo_masivo = render_estado_trabajo(trabajo_masivo["ID_Trabajo"], "analisis_masivo")
+        
+        if trabajo_masivo is not None and trabajo_masivo["Estado"] == "completado" and trabajo_masivo["Resultado"]:
+            nombres_activos = dict(zip(activos["ID_Activo"].tolist(), activos["Nombre_Activo"].tolist()))
+            tareas_lote = get_tareas_lote(trabajo_masivo["Resultado"]["id_lote"])
+            
+            with st.expander("📜 Detalle por activo", expanded=False):
+                for tarea in tareas_lote:
+                    if tarea.estado == "completado":
+                        ruta = " (ruta rápida, sin IA)" if tarea.ruta == "heuristica" else ""
+                        st.caption(f"✅ {tarea.id_activo}: {tarea.num_amenazas} amenazas guardadas{ruta}")
+                    elif tarea.estado == "omitido":
+                        icono = "⏭️" if tarea.mensaje == "Ya analizado" else "⚠️"
+                        st.caption(f"{icono} {tarea.id_activo}: {tarea.mensaje}, omitido")
                     else:
-                        with log_container:
-                            st.caption(f"❌ {activo_id}: Error al guardar ({errores_guardar} fallos)")
-                        errores += 1
-                else:
-                    with log_container:
-                        st.caption(f"❌ {activo_id}: {mensaje}")
-                    errores += 1
+                        st.caption(f"❌ {tarea.id_activo}: {tarea.mensaje}")
             
-            progress_bar.progress(1.0)
-            status_text.text("✅ Análisis masivo completado")
+            exitos = sum(1 for t in tareas_lote if t.estado == "completado")
+            errores = sum(1 for t in tareas_lote if t.estado == "error")
+            omitidos_analizados = sum(1 for t in tareas_lote if t.mensaje == "Ya analizado")
+            activos_sin_dic = [f"{t.id_activo} ({nombres_activos.get(t.id_activo, '')})"
+                               for t in tareas_lote if t.mensaje == "Sin valoración DIC"]
+            omitidos_sin_dic = len(activos_sin_dic)
+            llamadas_evitadas = trabajo_masivo["Resultado"].get("llamadas_evitadas", 0)
+            st.caption(f"⏱️ {trabajo_masivo['Resultado']['resumen']}")
             
             st.success(f"""
             **Análisis Masivo Finalizado**
@@ -2333,6 +2309,7 @@ with tab4:
             - ❌ Errores: {errores}
             - ⏭️ Ya analizados: {omitidos_analizados}
             - ⚠️ Sin valoración DIC: {omitidos_sin_dic}
+            - 🚀 Llamadas a la IA evitadas (ruta rápida): {llamadas_evitadas}
             """)
             
             # Mostrar activos sin DIC
@@ -2367,9 +2344,6 @@ with tab4:
                 use_container_width=True,
                 hide_index=True
             )
-            
-            if st.button("🔄 Recargar para ver resultados", use_container_width=True):
-                st.rerun()
         
         st.stop()  # Detener para no mostrar el análisis individual
     
@@ -2701,34 +2675,27 @@ with tab4:
                 with col_save1:
                     texto_guardar = "💾 Confirmar Re-Análisis" if estado_analisis == "RE-ANALIZANDO" else "💾 Guardar Todas"
                     if st.button(texto_guardar, type="primary", key="btn_guardar_amenazas"):
-                        # Si es re-análisis, eliminar amenazas existentes primero
-                        if estado_analisis == "RE-ANALIZANDO":
-                            with get_connection() as conn:
-                                cursor = conn.cursor()
-                                cursor.execute("""
-                                    DELETE FROM VULNERABILIDADES_AMENAZAS 
-                                    WHERE ID_Evaluacion = ? AND ID_Activo = ?
-                                """, (ID_EVALUACION, activo_sel))
-                                conn.commit()
-                        
+                        # Si es re-análisis, las amenazas existentes se reemplazan en la misma transacción
                         guardadas = 0
-                        for am in amenazas_a_guardar:
-                            try:
-                                agregar_vulnerabilidad_amenaza(
-                                    id_evaluacion=ID_EVALUACION,
-                                    id_activo=activo_sel,
-                                    nombre_activo=activo_info['Nombre_Activo'],
-                                    vulnerabilidad=am['vulnerabilidad'],
-                                    amenaza=am['nombre'],
-                                    cod_amenaza=am['codigo'],
-                                    cod_vulnerabilidad=am.get('codigo_vuln', ''),
-                                    deg_d=am['deg_d'] / 100,
-                                    deg_i=am['deg_i'] / 100,
-                                    deg_c=am['deg_c'] / 100
-                                )
-                                guardadas += 1
-                            except Exception as e:
-                                st.error(f"Error guardando {am['codigo']}: {e}")
+                        try:
+                            guardadas = agregar_vulnerabilidades_amenazas(
+                                ID_EVALUACION, activo_sel, activo_info['Nombre_Activo'],
+                                [
+                                    {
+                                        "vulnerabilidad": am['vulnerabilidad'],
+                                        "amenaza": am['nombre'],
+                                        "cod_amenaza": am['codigo'],
+                                        "cod_vulnerabilidad": am.get('codigo_vuln', ''),
+                                        "deg_d": am['deg_d'] / 100,
+                                        "deg_i": am['deg_i'] / 100,
+                                        "deg_c": am['deg_c'] / 100
+                                    }
+                                    for am in amenazas_a_guardar
+                                ],
+                                reemplazar=(estado_analisis == "RE-ANALIZANDO")
+                            ).filas
+                        except Exception as e:
+                            st.error(f"Error guardando amenazas: {e}")
                         
                         if guardadas > 0:
                             if estado_analisis == "RE-ANALIZANDO":
@@ -2948,9 +2915,6 @@ with tab5:
     ⚠️ **Importante:** El cálculo de riesgos se ejecuta una vez. Los resultados alimentan el mapa de riesgos, agregaciones y salvaguardas.
     """)
     
-    # Importar función de cálculo de frecuencia
-    from services.cuestionario_dic_service import calcular_frecuencia_desde_cuestionario, calcular_frecuencia_todas_amenazas
-    
     # Mostrar escalas de referencia
     with st.expander("📊 Ver Escalas de Referencia MAGERIT", expanded=False):
         col_ref1, col_ref2, col_ref3 = st.columns(3)
@@ -3079,25 +3043,17 @@ with tab5:
         with col_calc1:
             texto_boton = "⚡ Recalcular Todos los Riesgos" if estado_calculo == "RECALCULANDO" else "⚡ Calcular Todos los Riesgos"
             if st.button(texto_boton, type="primary", key="calc_all_risks"):
-                # Si es recálculo, eliminar riesgos existentes
-                if estado_calculo == "RECALCULANDO":
-                    with get_connection() as conn:
-                        cursor = conn.cursor()
-                        cursor.execute("DELETE FROM RIESGO_AMENAZA WHERE ID_Evaluacion = ?", (ID_EVALUACION,))
-                        conn.commit()
-                
-                total_guardados = 0
-                for _, activo in activos_calc.iterrows():
-                    id_activo = activo["ID_Activo"]
-                    amenazas = calcular_frecuencia_todas_amenazas(ID_EVALUACION, id_activo)
-                    for am in amenazas:
-                        calcular_riesgo_amenaza(
-                            id_evaluacion=ID_EVALUACION,
-                            id_activo=id_activo,
-                            id_va=am['id_va'],
-                            frecuencia=am['frecuencia']
-                        )
-                        total_guardados += 1
+                # Frecuencia y riesgo de todas las amenazas en una pasada;
+                # en recálculo se eliminan antes los riesgos de esos activos (misma transacción)
+                barra_riesgos = st.progress(0.0)
+                resumen_calculo = recalcular_riesgos_evaluacion(
+                    ID_EVALUACION,
+                    ids_activos=None if filtro_global == "TODOS" else activos_calc["ID_Activo"].tolist(),
+                    reemplazar=(estado_calculo == "RECALCULANDO"),
+                    progreso=lambda hechos, total: barra_riesgos.progress(hechos / max(total, 1))
+                )
+                total_guardados = resumen_calculo.riesgos
+                st.caption(f"⏱️ {resumen_calculo}")
                 
                 if estado_calculo == "RECALCULANDO":
                     st.success(f"✅ Recálculo completado: {total_guardados} riesgos recalculados")
@@ -3845,7 +3801,7 @@ with tab8:
     """)
     
     # Importar función de sugerencia de IA
-    from services.ollama_magerit_service import sugerir_salvaguardas_ia, sugerir_salvaguardas_batch
+    from services.ollama_magerit_service import sugerir_salvaguardas_ia
     
     # Obtener filtro global
     filtro_global = st.session_state.get("activo_filtro_global", "TODOS")
@@ -3952,7 +3908,8 @@ with tab8:
                 if estado_generacion == "REGENERANDO":
                     st.caption("⚠️ Esto eliminará las salvaguardas existentes y las regenerará desde los riesgos actuales.")
                 else:
-                    st.caption("La IA analizará cada riesgo y sugerirá salvaguardas y controles ISO 27002")
+                    st.caption("La IA analizará cada combinación única de amenaza, vulnerabilidad y zona "
+                               "y sugerirá salvaguardas y controles ISO 27002")
             
             # Botón cancelar si está regenerando
             if estado_generacion == "REGENERANDO" and not generar_ia:
@@ -3972,31 +3929,22 @@ with tab8:
                         cursor = conn.cursor()
                         cursor.execute("DELETE FROM SALVAGUARDAS WHERE ID_Evaluacion = ?", (ID_EVALUACION,))
                         conn.commit()
-                with st.spinner("🔄 Generando salvaguardas con IA... (puede tomar unos segundos)"):
-                    try:
-                        # Generar salvaguardas en batch
-                        riesgos_con_salvaguardas = sugerir_salvaguardas_batch(riesgos)
-                        st.session_state.salvaguardas_generadas = riesgos_con_salvaguardas
-                        st.success("✅ Salvaguardas generadas correctamente")
-                    except Exception as e:
-                        st.error(f"Error al generar salvaguardas: {e}")
-                        # Fallback: generar heurísticamente
-                        from services.ollama_magerit_service import generar_salvaguarda_heuristica, sugerir_control_heuristico, get_catalogo_controles
-                        catalogo = get_catalogo_controles()
-                        salvaguardas = []
-                        controles = []
-                        for _, row in riesgos.iterrows():
-                            zona = "ALTO" if row.get("Riesgo", 0) >= 6 else "MEDIO" if row.get("Riesgo", 0) >= 4 else "BAJO"
-                            salvaguardas.append(generar_salvaguarda_heuristica(
-                                row.get("Amenaza", ""), 
-                                row.get("Vulnerabilidad", ""), 
-                                zona
-                            ))
-                            controles.append(sugerir_control_heuristico(row.get("Amenaza", ""), catalogo))
-                        riesgos["Salvaguarda_Sugerida"] = salvaguardas
-                        riesgos["Control_ISO"] = controles
-                        riesgos["Generado_IA"] = "🔧"
-                        st.session_state.salvaguardas_generadas = riesgos
+                # Generación con IA en segundo plano (trabajos_service)
+                encolar_trabajo("salvaguardas_batch", ID_EVALUACION,
+                                {"id_activo": None if filtro_global == "TODOS" else filtro_global})
+                st.rerun()
+            
+            trabajo_salv = ultimo_trabajo(ID_EVALUACION, "salvaguardas_batch")
+            if trabajo_salv is not None:
+                trabajo_salv = render_estado_trabajo(trabajo_salv["ID_Trabajo"], "salvaguardas_batch")
+                # Cargar una sola vez el resultado de cada trabajo completado
+                if (trabajo_salv and trabajo_salv["Estado"] == "completado" and trabajo_salv["Resultado"]
+                        and st.session_state.get("salvaguardas_trabajo") != trabajo_salv["ID_Trabajo"]):
+                    st.session_state.salvaguardas_generadas = pd.DataFrame(trabajo_salv["Resultado"])
+                    st.session_state.salvaguardas_trabajo = trabajo_salv["ID_Trabajo"]
+                    # El trabajo ya las guardó en SALVAGUARDAS: se sale del modo regeneración
+                    st.session_state.regenerando_salvaguardas = False
+                    st.success("✅ Salvaguardas generadas y guardadas correctamente")
             
             # Usar datos guardados o generar heurísticamente
             if st.session_state.salvaguardas_generadas is not None:
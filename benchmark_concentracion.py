@@ -0,0 +1,99 @@
+"""
+Benchmark del riesgo por concentración con el grafo de dependencias
+
+Genera una evaluación datacenter → host → VM → aplicación y mide la
+construcción del grafo (dos consultas), el cálculo en memoria de blast
+radius, SPOF y herencia, y el guardado en bloque. Como referencia, mide
+calcular_blast_radius de un host aislado, que construye el grafo completo.
+Por último mide la simulación Monte Carlo de propagación de fallos.
+Trabaja sobre una base temporal.
+
+Uso: python benchmark_concentracion.py [num_vms] [vms_por_host] [ensayos]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services import database_service as db
+from services import concentration_risk_service as crs
+from services import simulacion_propagacion_service as sps
+
+
+def _preparar_bd(num_vms: int, vms_por_host: int):
+    db.init_database()
+    rnd = random.Random(42)
+    num_hosts = max(1, num_vms // vms_por_host)
+    activos = [{"ID_Activo": f"DC-{d}", "Tipo_Activo": "Instalación", "ID_Host": ""} for d in range(3)]
+    activos += [{"ID_Activo": f"HOST-{h:05d}", "Tipo_Activo": "Servidor Físico", "ID_Host": f"DC-{h % 3}"}
+                for h in range(num_hosts)]
+    activos += [{"ID_Activo": f"VM-{v:06d}", "Tipo_Activo": "Servidor Virtual",
+                 "ID_Host": f"HOST-{rnd.randrange(num_hosts):05d}",
+                 "Tipo_Dependencia": rnd.choice(["total", "total", "parcial", "ninguna"])}
+                for v in range(num_vms)]
+    activos += [{"ID_Activo": f"APP-{a:06d}", "Tipo_Activo": "Aplicación",
+                 "ID_Host": f"VM-{rnd.randrange(num_vms):06d}"} for a in range(num_vms // 4)]
+    for activo in activos:
+        activo.update({"ID_Evaluacion": "EVA-B", "Nombre_Activo": activo["ID_Activo"]})
+    db.insert_rows("EVALUACIONES", [{"ID_Evaluacion": "EVA-B", "Nombre": "Benchmark"}])
+    db.insert_rows("INVENTARIO_ACTIVOS", activos)
+    db.insert_rows("RESULTADOS_MAGERIT", [
+        {"ID_Evaluacion": "EVA-B", "ID_Activo": a["ID_Activo"], "Impacto_D": rnd.randint(1, 5),
+         "Impacto_I": rnd.randint(1, 5), "Impacto_C": rnd.randint(1, 5),
+         "Riesgo_Inherente": rnd.uniform(1, 20), "Fecha_Evaluacion": "2026-01-01"}
+        for a in activos
+    ])
+    return len(activos), num_hosts
+
+
+def ejecutar(num_vms: int = 10000, vms_por_host: int = 20, ensayos: int = 20000):
+    original_path = db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench_concentracion.db")
+        try:
+            num_activos, num_hosts = _preparar_bd(num_vms, vms_por_host)
+
+            t0 = time.perf_counter()
+            grafo = crs.construir_grafo("EVA-B")
+            t_grafo = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            concentracion = crs.calcular_concentracion_grafo(grafo)
+            herencias = crs.calcular_herencia_grafo(grafo, concentracion)
+            t_calculo = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            crs.calcular_concentracion_evaluacion("EVA-B", grafo)
+            crs.calcular_herencia_evaluacion("EVA-B", grafo)
+            t_completo = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            crs.calcular_blast_radius("EVA-B", "HOST-00000")
+            t_host = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            sps.calcular_propagacion_evaluacion("EVA-B", ensayos, semilla=42, grafo=grafo)
+            t_simulacion = time.perf_counter() - t0
+        finally:
+            db.close_connections()
+            db.DB_PATH = original_path
+
+    spof = sum(r.es_spof for r in concentracion.values())
+    print("=" * 70)
+    print(f"BENCHMARK CONCENTRACIÓN ({num_activos} activos, {num_hosts} hosts, {num_vms} VMs)")
+    print("=" * 70)
+    print(f"Construcción del grafo (2 consultas):   {t_grafo * 1000:>10.1f} ms")
+    print(f"Blast radius + SPOF + herencia:         {t_calculo * 1000:>10.1f} ms")
+    print(f"  {len(concentracion)} hosts ({spof} SPOF), {len(herencias)} activos con herencia")
+    print(f"Cálculo y guardado en bloque:           {t_completo * 1000:>10.1f} ms")
+    print(f"Un host aislado (calcular_blast_radius):{t_host * 1000:>10.1f} ms")
+    print(f"Monte Carlo ({ensayos} ensayos) y guardado:{t_simulacion:>8.2f} s")
+    return {"grafo_s": t_grafo, "calculo_s": t_calculo, "completo_s": t_completo, "host_s": t_host,
+            "simulacion_s": t_simulacion}
+
+
+if __name__ == "__main__":
+    ejecutar(*(int(a) for a in sys.argv[1:4]))
@@ -0,0 +1,147 @@
+"""
+Benchmark del pool de conexiones SQLite (filas/segundo antes y después)
+
+Compara el esquema anterior (una conexión nueva por llamada, journal DELETE)
+contra el pool por hilo con WAL de services/database_service.py.
+Trabaja sobre una base temporal: no toca tita_database.db.
+
+Uso: python benchmark_conexiones.py [num_filas]
+"""
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services import database_service as db
+
+
+@contextmanager
+def _conexion_por_llamada():
+    """Réplica del get_connection() original: conexión nueva en cada llamada"""
+    conn = sqlite3.connect(db.DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.close()
+
+
+def _preparar_bd(ruta: str, wal: bool):
+    conn = sqlite3.connect(ruta)
+    conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+    conn.execute('''
+        CREATE TABLE RESPUESTAS (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Evaluacion TEXT, ID_Activo TEXT, ID_Pregunta TEXT,
+            Respuesta TEXT, Valor_Numerico INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_resp ON RESPUESTAS(ID_Evaluacion, ID_Activo)')
+    conn.commit()
+    conn.close()
+
+
+def _carga(num_filas: int) -> dict:
+    """Ejecuta el patrón típico de la app: row_exists + insert_row + lectura filtrada"""
+    t0 = time.perf_counter()
+    for i in range(num_filas):
+        fila = {
+            "ID_Evaluacion": "EVA-BENCH",
+            "ID_Activo": f"ACT-{i % 50:03d}",
+            "ID_Pregunta": f"P{i}",
+            "Respuesta": "Si",
+            "Valor_Numerico": i % 4,
+        }
+        if not db.row_exists("RESPUESTAS", {"ID_Pregunta": fila["ID_Pregunta"], "ID_Activo": fila["ID_Activo"]}):
+            db.insert_row("RESPUESTAS", fila)
+    t_escritura = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    filas_leidas = 0
+    for i in range(num_filas // 10):
+        filas_leidas += len(db.query_rows("RESPUESTAS", {"ID_Evaluacion": "EVA-BENCH", "ID_Activo": f"ACT-{i % 50:03d}"}))
+    t_lectura = time.perf_counter() - t0
+
+    return {
+        "escritura_filas_s": num_filas / t_escritura,
+        "lectura_consultas_s": (num_filas // 10) / t_lectura,
+        "filas_leidas": filas_leidas,
+    }
+
+
+def _lectores_concurrentes(segundos: float = 1.0) -> int:
+    """Cuenta lecturas completadas por 4 hilos mientras otro hilo escribe"""
+    detener = threading.Event()
+    lecturas = [0]
+    lock = threading.Lock()
+
+    def escritor():
+        i = 0
+        while not detener.is_set():
+            db.insert_row("RESPUESTAS", {"ID_Evaluacion": "EVA-W", "ID_Activo": "W", "ID_Pregunta": f"W{i}"})
+            i += 1
+
+    def lector():
+        while not detener.is_set():
+            db.query_rows("RESPUESTAS", {"ID_Evaluacion": "EVA-BENCH", "ID_Activo": "ACT-001"})
+            with lock:
+                lecturas[0] += 1
+
+    hilos = [threading.Thread(target=escritor)] + [threading.Thread(target=lector) for _ in range(4)]
+    for h in hilos:
+        h.start()
+    time.sleep(segundos)
+    detener.set()
+    for h in hilos:
+        h.join()
+    return lecturas[0]
+
+
+def ejecutar(num_filas: int = 2000):
+    original_get_connection = db.get_connection
+    original_path = db.DB_PATH
+    resultados = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for modo in ("por_llamada", "pool_wal"):
+            db.DB_PATH = os.path.join(tmp, f"bench_{modo}.db")
+            _preparar_bd(db.DB_PATH, wal=(modo == "pool_wal"))
+            db.get_connection = _conexion_por_llamada if modo == "por_llamada" else original_get_connection
+            try:
+                r = _carga(num_filas)
+                r["lecturas_concurrentes"] = _lectores_concurrentes()
+                resultados[modo] = r
+            finally:
+                db.get_connection = original_get_connection
+                db.close_connections()
+
+    db.DB_PATH = original_path
+
+    print("=" * 70)
+    print(f"BENCHMARK CONEXIONES SQLite ({num_filas} filas)")
+    print("=" * 70)
+    print(f"{'Métrica':<32}{'Antes (por llamada)':>20}{'Después (pool WAL)':>20}")
+    for clave, etiqueta in [
+        ("escritura_filas_s", "Escritura (filas/s)"),
+        ("lectura_consultas_s", "Lectura filtrada (consultas/s)"),
+        ("lecturas_concurrentes", "Lecturas con escritor (1 s)"),
+    ]:
+        antes = resultados["por_llamada"][clave]
+        despues = resultados["pool_wal"][clave]
+        print(f"{etiqueta:<32}{antes:>20,.0f}{despues:>20,.0f}")
+    mejora = resultados["pool_wal"]["escritura_filas_s"] / resultados["por_llamada"]["escritura_filas_s"]
+    print(f"\n⚡ Aceleración en escritura: x{mejora:.1f}")
+    return resultados
+
+
+if __name__ == "__main__":
+    ejecutar(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,103 @@
+"""
+Benchmark de escritura en bloque (executemany + transacciones por bloques)
+
+Compara la inserción fila a fila (un execute por fila y un row_exists +
+insert/update por upsert) contra insert_rows/upsert_rows de
+services/database_service.py. Trabaja sobre una base temporal.
+
+Uso: python benchmark_escritura_bloque.py [num_activos] [num_respuestas]
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services import database_service as db
+
+
+def _preparar_bd():
+    with db.get_connection() as conn:
+        conn.execute('''
+            CREATE TABLE INVENTARIO_ACTIVOS (
+                ID_Activo TEXT PRIMARY KEY, ID_Evaluacion TEXT, Nombre_Activo TEXT,
+                Tipo_Activo TEXT, Ubicacion TEXT, Estado TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE RESPUESTAS (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ID_Evaluacion TEXT, ID_Activo TEXT, ID_Pregunta TEXT,
+                Respuesta TEXT, Valor_Numerico INTEGER,
+                UNIQUE(ID_Evaluacion, ID_Activo, ID_Pregunta)
+            )
+        ''')
+
+
+def _activos(n: int):
+    return [
+        {"ID_Activo": f"ACT-B-{i:05d}", "ID_Evaluacion": "EVA-B", "Nombre_Activo": f"Servidor {i}",
+         "Tipo_Activo": "Servidor Virtual", "Ubicacion": "DC", "Estado": "Pendiente"}
+        for i in range(n)
+    ]
+
+
+def _respuestas(n: int, valor: int = 0):
+    return [
+        {"ID_Evaluacion": "EVA-B", "ID_Activo": f"ACT-B-{i // 20:05d}", "ID_Pregunta": f"P{i % 20}",
+         "Respuesta": "Si", "Valor_Numerico": valor}
+        for i in range(n)
+    ]
+
+
+def _fila_a_fila(num_activos: int, num_respuestas: int) -> dict:
+    t0 = time.perf_counter()
+    for fila in _activos(num_activos):
+        db.insert_row("INVENTARIO_ACTIVOS", fila)
+    t_activos = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for fila in _respuestas(num_respuestas):
+        clave = {k: fila[k] for k in ("ID_Evaluacion", "ID_Activo", "ID_Pregunta")}
+        if db.row_exists("RESPUESTAS", clave):
+            db.update_row("RESPUESTAS", {"Valor_Numerico": fila["Valor_Numerico"]}, clave)
+        else:
+            db.insert_row("RESPUESTAS", fila)
+    t_respuestas = time.perf_counter() - t0
+    return {"activos_filas_s": num_activos / t_activos, "respuestas_filas_s": num_respuestas / t_respuestas}
+
+
+def _en_bloque(num_activos: int, num_respuestas: int) -> dict:
+    r_activos = db.insert_rows("INVENTARIO_ACTIVOS", _activos(num_activos))
+    r_respuestas = db.upsert_rows("RESPUESTAS", _respuestas(num_respuestas),
+                                  ["ID_Evaluacion", "ID_Activo", "ID_Pregunta"])
+    print(f"   {r_activos}\n   {r_respuestas}")
+    return {"activos_filas_s": r_activos.filas_por_segundo, "respuestas_filas_s": r_respuestas.filas_por_segundo}
+
+
+def ejecutar(num_activos: int = 10000, num_respuestas: int = 200000):
+    original_path = db.DB_PATH
+    resultados = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for modo, funcion in (("fila_a_fila", _fila_a_fila), ("bloque", _en_bloque)):
+            db.DB_PATH = os.path.join(tmp, f"bench_{modo}.db")
+            try:
+                _preparar_bd()
+                resultados[modo] = funcion(num_activos, num_respuestas)
+            finally:
+                db.close_connections()
+    db.DB_PATH = original_path
+
+    print("=" * 70)
+    print(f"BENCHMARK ESCRITURA EN BLOQUE ({num_activos} activos, {num_respuestas} respuestas)")
+    print("=" * 70)
+    print(f"{'Métrica':<28}{'Fila a fila':>20}{'En bloque':>20}")
+    for clave, etiqueta in [("activos_filas_s", "Activos (filas/s)"),
+                            ("respuestas_filas_s", "Respuestas upsert (filas/s)")]:
+        print(f"{etiqueta:<28}{resultados['fila_a_fila'][clave]:>20,.0f}{resultados['bloque'][clave]:>20,.0f}")
+    return resultados
+
+
+if __name__ == "__main__":
+    ejecutar(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,101 @@
+"""
+Benchmark del motor MAGERIT por lotes
+
+Compara evaluar_activo_magerit (un activo y una amenaza a la vez) contra
+evaluar_evaluacion_magerit (toda la evaluación con operaciones por columnas).
+El cálculo individual se mide sobre una muestra y se extrapola al total.
+Trabaja sobre una base temporal.
+
+Uso: python benchmark_motor_magerit.py [num_activos] [muestra_individual]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services import database_service as db
+from services import magerit_engine as motor
+
+AMENAZAS = [("N.1", "Fuego", "Desastres Naturales"), ("I.5", "Avería de origen físico", "De origen industrial"),
+            ("I.8", "Fallo de comunicaciones", "De origen industrial"),
+            ("E.1", "Errores de los usuarios", "Errores y fallos no intencionados"),
+            ("E.8", "Difusión de software dañino", "Errores y fallos no intencionados"),
+            ("A.5", "Suplantación de identidad", "Ataques intencionados"),
+            ("A.11", "Acceso no autorizado", "Ataques intencionados"),
+            ("A.24", "Denegación de servicio", "Ataques intencionados")]
+CONTROLES = [("5.29", "Continuidad", "Organizacional"), ("8.13", "Backups", "Tecnológico"),
+             ("8.7", "Antimalware", "Tecnológico"), ("8.20", "Seguridad de redes", "Tecnológico")]
+PREGUNTAS = ["A01", "A02", "A03", "A04", "B01", "B02", "B03", "C01", "C02", "C03", "D01", "D02"]
+
+
+def _preparar_bd(num_activos: int) -> dict:
+    db.init_database()
+    with db.get_connection() as conn:
+        conn.execute("DROP TABLE CATALOGO_AMENAZAS_MAGERIT")
+        conn.execute("CREATE TABLE CATALOGO_AMENAZAS_MAGERIT (codigo TEXT PRIMARY KEY, amenaza TEXT, tipo_amenaza TEXT)")
+        conn.executemany("INSERT INTO CATALOGO_AMENAZAS_MAGERIT VALUES (?, ?, ?)", AMENAZAS)
+        conn.execute("CREATE TABLE CATALOGO_CONTROLES_ISO27002 (codigo TEXT PRIMARY KEY, nombre TEXT, categoria TEXT)")
+        conn.executemany("INSERT INTO CATALOGO_CONTROLES_ISO27002 VALUES (?, ?, ?)", CONTROLES)
+
+    rnd = random.Random(42)
+    db.insert_rows("EVALUACIONES", [{"ID_Evaluacion": "EVA-B", "Nombre": "Benchmark"}])
+    db.insert_rows("INVENTARIO_ACTIVOS", [
+        {"ID_Activo": f"ACT-B-{i:05d}", "ID_Evaluacion": "EVA-B", "Nombre_Activo": f"Activo {i}",
+         "Tipo_Activo": rnd.choice(["Servidor Físico", "Servidor Virtual", "Base de Datos"])}
+        for i in range(num_activos)
+    ])
+    db.insert_rows("RESPUESTAS", [
+        {"ID_Evaluacion": "EVA-B", "ID_Activo": f"ACT-B-{i:05d}", "ID_Pregunta": f"PF-{codigo}",
+         "Valor_Numerico": rnd.randint(1, 4), "Peso": rnd.randint(1, 5), "Dimension": rnd.choice("DIC")}
+        for i in range(num_activos) for codigo in PREGUNTAS
+    ])
+    return {
+        f"ACT-B-{i:05d}": {
+            "amenazas": [{"codigo": codigo, "dimension": "D",
+                          "controles_iso_recomendados": [{"control": "8.13", "prioridad": "Alta", "motivo": ""}]}
+                         for codigo, _, _ in rnd.sample(AMENAZAS, 5)],
+            "probabilidad": rnd.randint(1, 5),
+        }
+        for i in range(num_activos)
+    }
+
+
+def ejecutar(num_activos: int = 5000, muestra_individual: int = 200):
+    original_path = db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench_motor.db")
+        try:
+            analisis = _preparar_bd(num_activos)
+
+            muestra = list(analisis)[:muestra_individual]
+            t0 = time.perf_counter()
+            for activo_id in muestra:
+                datos = analisis[activo_id]
+                motor.evaluar_activo_magerit("EVA-B", activo_id, datos["amenazas"], datos["probabilidad"])
+            t_individual = (time.perf_counter() - t0) / len(muestra) * num_activos
+
+            t0 = time.perf_counter()
+            resultados = motor.evaluar_evaluacion_magerit("EVA-B", analisis)
+            t_lote = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            motor.guardar_resultados_magerit(list(resultados.values()))
+            t_guardado = time.perf_counter() - t0
+        finally:
+            db.close_connections()
+            db.DB_PATH = original_path
+
+    print("=" * 70)
+    print(f"BENCHMARK MOTOR MAGERIT ({num_activos} activos, {num_activos * 5} pares activo-amenaza)")
+    print("=" * 70)
+    print(f"Activo por activo (extrapolado de {len(muestra)}): {t_individual:>10.2f} s")
+    print(f"Evaluación completa por lotes:          {t_lote:>10.2f} s")
+    print(f"Guardado en bloque de resultados:       {t_guardado:>10.2f} s")
+    return {"individual_s": t_individual, "lote_s": t_lote, "guardado_s": t_guardado}
+
+
+if __name__ == "__main__":
+    ejecutar(*(int(a) for a in sys.argv[1:3]))
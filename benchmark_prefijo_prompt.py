@@ -0,0 +1,210 @@
+"""
+Benchmark de reutilización del prefijo del prompt MAGERIT (TTFT y latencia)
+
+Compara, por activo, el tiempo hasta el primer token y la latencia total:
+- Antes: el prompt que construía construir_prompt_amenazas_criticidad antes
+  de separar el prefijo, por /api/generate. Ya empezaba por el rol y el
+  contexto MAGERIT (prefijo compartido entre activos), pero los datos del
+  activo iban antes del catálogo, la tabla de degradación y las reglas.
+- Después: prefijo fijo como mensaje system por /api/chat + consulta corta del
+  activo; con keep_alive, Ollama reutiliza del KV cache los tokens del prefijo.
+
+Cada variante se mide en su propio bucle, tras una llamada de calentamiento,
+para que una no expulse del KV cache el prefijo de la otra. También muestra
+los tokens de prompt que el modelo evaluó realmente (prompt_eval_count). Las
+llamadas no usan el cache de respuestas. Necesita Ollama en marcha con el
+modelo descargado.
+
+Uso: python benchmark_prefijo_prompt.py [modelo] [num_activos]
+"""
+import os
+import sys
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.ollama_client import get_cliente, OllamaError
+from services.ia_context_magerit import get_amenazas_para_tipo_activo, get_contexto_completo_ia, DEGRADACION_TIPICA
+from services.ollama_magerit_service import (
+    MODELO_DEFAULT,
+    get_catalogo_amenazas,
+    construir_sistema_amenazas_criticidad,
+    construir_consulta_amenazas_criticidad
+)
+
+OPCIONES = {"temperature": 0.3, "num_predict": 200}
+
+ACTIVOS_PRUEBA = [
+    ("Servidor", "Servidor de aplicaciones"),
+    ("Base de datos", "Base de datos académica"),
+    ("Aplicación", "Portal de estudiantes"),
+    ("Red", "Firewall perimetral"),
+    ("Servicio", "Correo institucional"),
+    ("Hardware", "Equipo de escritorio"),
+]
+
+
+def _activos(num_activos: int):
+    for i in range(num_activos):
+        tipo, nombre = ACTIVOS_PRUEBA[i % len(ACTIVOS_PRUEBA)]
+        activo = {"ID_Activo": f"ACT-BENCH-{i:03d}", "Nombre_Activo": f"{nombre} {i}", "Tipo_Activo": tipo}
+        valoracion = {"Valor_D": 1 + i % 3, "Valor_I": 1 + (i + 1) % 3, "Valor_C": 1 + (i + 2) % 3,
+                      "Criticidad": 1 + i % 3}
+        yield activo, valoracion
+
+
+def _prompt_original(activo_info: dict, valoracion: dict, catalogo_amenazas: dict) -> str:
+    """Prompt de amenazas por criticidad tal como se construía antes del prefijo fijo"""
+    amenazas_tipicas = get_amenazas_para_tipo_activo(str(activo_info.get("Tipo_Activo", "")).lower())
+    amenazas_tipicas_texto = "\n".join([f"  - {a}" for a in amenazas_tipicas])
+    contexto_magerit = get_contexto_completo_ia()
+
+    amenazas_por_tipo = {}
+    for codigo, info in catalogo_amenazas.items():
+        amenazas_por_tipo.setdefault(info.get("tipo_amenaza", "Otros"), []).append(f"{codigo}: {info['amenaza']}")
+    amenazas_texto = ""
+    for tipo, lista in amenazas_por_tipo.items():
+        amenazas_texto += f"\n**{tipo}:**\n" + "".join(f"  - {a}\n" for a in lista)
+
+    degradacion_info = "".join(f"  - {categoria}: D={rangos['D']}%, I={rangos['I']}%, C={rangos['C']}%\n"
+                               for categoria, rangos in DEGRADACION_TIPICA.items())
+
+    return f"""Eres un experto certificado en seguridad de la información y gestión de riesgos bajo la metodología MAGERIT v3 del CCN (Centro Criptológico Nacional de España).
+
+## CONTEXTO METODOLÓGICO MAGERIT v3
+{contexto_magerit}
+
+## ACTIVO A ANALIZAR
+- **ID**: {activo_info.get('ID_Activo', '')}
+- **Nombre**: {activo_info.get('Nombre_Activo', '')}
+- **Tipo**: {activo_info.get('Tipo_Activo', '')}
+- **Descripción**: {activo_info.get('Descripcion', 'N/A')}
+- **Ubicación**: {activo_info.get('Ubicacion', 'N/A')}
+
+## VALORACIÓN D/I/C DEL ACTIVO
+- **Disponibilidad (D)**: {valoracion.get('Valor_D', 0)} - Nivel: {valoracion.get('D', 'N')}
+- **Integridad (I)**: {valoracion.get('Valor_I', 0)} - Nivel: {valoracion.get('I', 'N')}
+- **Confidencialidad (C)**: {valoracion.get('Valor_C', 0)} - Nivel: {valoracion.get('C', 'N')}
+- **CRITICIDAD**: {valoracion.get('Criticidad', 0)} - Nivel: {valoracion.get('Criticidad_Nivel', 'Sin valorar')}
+
+## AMENAZAS TÍPICAS PARA ACTIVOS TIPO "{activo_info.get('Tipo_Activo', 'General').upper()}"
+{amenazas_tipicas_texto}
+
+## CATÁLOGO COMPLETO DE AMENAZAS MAGERIT v3 (USAR SOLO ESTOS CÓDIGOS)
+{amenazas_texto}
+
+## DEGRADACIÓN TÍPICA POR CATEGORÍA DE AMENAZA
+{degradacion_info}
+
+## TU TAREA
+Basándote en la CRITICIDAD del activo, su tipo y la metodología MAGERIT v3, identifica las amenazas más relevantes.
+Para cada amenaza, debes:
+1. Indicar la VULNERABILIDAD específica que permite que la amenaza se materialice
+2. Estimar la DEGRADACIÓN (0-100%) para D, I, C según la criticidad del activo y la categoría de amenaza
+
+**Reglas para DEGRADACIÓN según CRITICIDAD:**
+- Criticidad ALTA (>=3): Degradaciones altas (60-100%)
+- Criticidad MEDIA (2): Degradaciones medias (30-60%)
+- Criticidad BAJA (1): Degradaciones bajas (10-30%)
+- Sin valorar (0): Degradación mínima (5-15%)
+
+## FORMATO DE RESPUESTA OBLIGATORIO
+Responde ÚNICAMENTE con un JSON válido:
+
+```json
+{{
+  "amenazas_identificadas": [
+    {{
+      "codigo_amenaza": "A.24",
+      "nombre_amenaza": "Denegación de servicio",
+      "vulnerabilidad": "Descripción específica de la vulnerabilidad",
+      "degradacion_d": 80,
+      "degradacion_i": 20,
+      "degradacion_c": 10,
+      "justificacion": "Justificación técnica basada en MAGERIT"
+    }}
+  ],
+  "resumen_analisis": "Resumen del análisis según metodología MAGERIT v3"
+}}
+```
+
+## REGLAS CRÍTICAS OBLIGATORIAS
+1. **SOLO usa códigos de amenaza del catálogo MAGERIT proporcionado (N.*, I.*, E.*, A.*)**
+2. **Prioriza las amenazas típicas para el tipo de activo indicado**
+3. **Identifica entre 3 y 7 amenazas relevantes** según el tipo y criticidad
+4. **Las degradaciones deben ser números entre 0 y 100**
+5. **Las vulnerabilidades deben ser específicas y técnicas**
+6. **Aplica las fórmulas MAGERIT: Impacto = MAX(D×DegD, I×DegI, C×DegC)**
+
+Responde SOLO con el JSON, sin explicaciones adicionales:"""
+
+
+def _medir(llamar) -> dict:
+    respuesta = llamar()
+    return {
+        "ttft": respuesta.primer_token_s or respuesta.segundos,
+        "total": respuesta.segundos,
+        "tokens_prompt": respuesta.tokens_prompt,
+    }
+
+
+def ejecutar(modelo: str = MODELO_DEFAULT, num_activos: int = 6):
+    cliente = get_cliente()
+    if not cliente.disponible():
+        print("❌ Ollama no está disponible: inicia Ollama y vuelve a ejecutar el benchmark")
+        return None
+    catalogo = get_catalogo_amenazas()
+    if not catalogo:
+        print("❌ Catálogo de amenazas vacío: ejecuta seed_catalogos_magerit.py")
+        return None
+
+    sistema = construir_sistema_amenazas_criticidad(catalogo)
+    # Carga del modelo fuera de la medición
+    cliente.precargar(modelo)
+    descartar = lambda _: None
+    variantes = {
+        "antes": lambda activo, valoracion: cliente.generar(
+            _prompt_original(activo, valoracion, catalogo), modelo, OPCIONES,
+            usar_cache=False, max_intentos=1, al_token=descartar),
+        "despues": lambda activo, valoracion: cliente.chat(
+            [{"role": "system", "content": sistema},
+             {"role": "user", "content": construir_consulta_amenazas_criticidad(activo, valoracion)}],
+            modelo, OPCIONES, usar_cache=False, max_intentos=1, al_token=descartar),
+    }
+    resultados = {"antes": [], "despues": []}
+
+    try:
+        # Un bucle por variante: el activo extra del final solo calienta el KV cache
+        activos = list(_activos(num_activos + 1))
+        calentamiento, activos = activos[-1], activos[:-1]
+        for variante, llamar in variantes.items():
+            llamar(*calentamiento)
+            for activo, valoracion in activos:
+                resultados[variante].append(_medir(lambda: llamar(activo, valoracion)))
+    except OllamaError as e:
+        print(f"❌ Error de Ollama durante el benchmark: {e}")
+        return None
+
+    print("=" * 70)
+    print(f"BENCHMARK PREFIJO DEL PROMPT MAGERIT ({modelo}, {num_activos} activos)")
+    print(f"Prefijo fijo: {len(sistema):,} caracteres")
+    print("=" * 70)
+    print(f"{'Métrica (mediana por activo)':<32}{'Antes (generate)':>18}{'Después (chat)':>18}")
+    for clave, etiqueta, formato in [
+        ("ttft", "Primer token (s)", "{:>18.2f}"),
+        ("total", "Latencia total (s)", "{:>18.2f}"),
+        ("tokens_prompt", "Tokens de prompt evaluados", "{:>18,.0f}"),
+    ]:
+        antes = statistics.median(r[clave] for r in resultados["antes"])
+        despues = statistics.median(r[clave] for r in resultados["despues"])
+        print(f"{etiqueta:<32}" + formato.format(antes) + formato.format(despues))
+    # Ambas variantes ya calentadas: la comparación es con su prefijo compartido en cache
+    ttft_antes = statistics.mean(r["ttft"] for r in resultados["antes"])
+    ttft_despues = statistics.mean(r["ttft"] for r in resultados["despues"])
+    print(f"\n⚡ Aceleración del primer token (ambas con el prefijo en cache): x{ttft_antes / max(ttft_despues, 1e-6):.1f}")
+    return resultados
+
+
+if __name__ == "__main__":
+    ejecutar(sys.argv[1] if len(sys.argv) > 1 else MODELO_DEFAULT,
+             int(sys.argv[2]) if len(sys.argv) > 2 else 6)
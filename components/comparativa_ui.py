@@ -10,6 +10,7 @@ from services import (
     comparar_evaluaciones,
     listar_historial_comparativas,
     get_tendencia_riesgo,
+    tendencia_activos,
     ComparativaEvaluacion
 )
 from services.database_service import get_connection
@@ -226,13 +227,16 @@ def render_tendencia(evaluaciones: List):
         st.info("Se requieren al menos 2 evaluaciones para mostrar tendencia.")
         return
     
-    # Seleccionar evaluaciones a incluir
-    st.markdown("**Seleccione las evaluaciones a incluir en la tendencia:**")
-    
-    eval_ids = []
-    for e in evaluaciones[:10]:  # Máximo 10 evaluaciones
-        if st.checkbox(f"{e[1]} ({e[2]})", value=True, key=f"trend_{e[0]}"):
-            eval_ids.append(e[0])
+    # Seleccionar evaluaciones a incluir (por defecto las 12 más recientes);
+    # los resúmenes por evaluación están precalculados, la serie puede ser larga
+    etiquetas = {e[0]: f"{e[1]} ({e[2]})" for e in evaluaciones}
+    eval_ids = st.multiselect(
+        "Seleccione las evaluaciones a incluir en la tendencia:",
+        list(etiquetas),
+        default=[e[0] for e in evaluaciones[:12]],
+        format_func=etiquetas.get,
+        key="trend_evaluaciones"
+    )
     
     if len(eval_ids) < 2:
         st.warning("Seleccione al menos 2 evaluaciones.")
@@ -243,8 +247,9 @@ def render_tendencia(evaluaciones: List):
             tendencia = get_tendencia_riesgo(eval_ids)
         
         if tendencia:
-            # Crear DataFrame para gráfico
-            df_trend = pd.DataFrame(tendencia)
+            # Crear DataFrame para gráfico, en orden cronológico (el multiselect
+            # devuelve las evaluaciones en el orden en que se eligieron)
+            df_trend = pd.DataFrame(tendencia).sort_values("fecha", kind="stable").reset_index(drop=True)
             
             if not df_trend.empty:
                 st.markdown("### Evolución del Riesgo")
@@ -255,13 +260,15 @@ def render_tendencia(evaluaciones: List):
                     use_container_width=True
                 )
                 
-                # Tabla detalle
+                # Tabla detalle (delta respecto a la evaluación anterior en el tiempo)
                 st.markdown("### Detalle por Evaluación")
                 st.dataframe(df_trend, use_container_width=True, hide_index=True)
                 
-                # Análisis
-                primera = df_trend.iloc[-1]["riesgo_promedio"] if len(df_trend) > 0 else 0
-                ultima = df_trend.iloc[0]["riesgo_promedio"] if len(df_trend) > 0 else 0
+                render_variacion_activos(eval_ids)
+                
+                # Análisis: la más antigua frente a la más reciente
+                primera = df_trend.iloc[0]["riesgo_promedio"]
+                ultima = df_trend.iloc[-1]["riesgo_promedio"]
                 
                 if ultima < primera:
                     reduccion = ((primera - ultima) / primera) * 100
@@ -273,3 +280,33 @@ def render_tendencia(evaluaciones: List):
                     st.info("➡️ **Tendencia estable:** Sin cambios significativos")
         else:
             st.error("No se pudo calcular la tendencia.")
+
+
+def render_variacion_activos(eval_ids: List[str]):
+    """Activos con mayor variación acumulada de riesgo en la serie seleccionada"""
+    activos = tendencia_activos(eval_ids)
+    if activos.empty:
+        return
+    
+    # Última aparición de cada activo: delta acumulado desde la primera
+    ultimos = activos.groupby("ID_Activo", sort=False).tail(1)
+    ultimos = ultimos[ultimos["Delta_Acumulado"].abs() > 0.5]
+    if ultimos.empty:
+        st.info("Ningún activo varió su riesgo de forma significativa en la serie.")
+        return
+    
+    columnas = {"ID_Activo": "ID", "Nombre_Activo": "Activo", "Riesgo": "Actual",
+                "Delta": "Último Delta", "Delta_Acumulado": "Delta Acumulado"}
+    col_mej, col_det = st.columns(2)
+    with col_mej:
+        st.markdown("### ✅ Mayores Mejoras")
+        mejoras = ultimos.nsmallest(10, "Delta_Acumulado")
+        mejoras = mejoras[mejoras["Delta_Acumulado"] < 0]
+        st.dataframe(mejoras[list(columnas)].rename(columns=columnas).round(2),
+                     use_container_width=True, hide_index=True)
+    with col_det:
+        st.markdown("### ⚠️ Mayores Deterioros")
+        deterioros = ultimos.nlargest(10, "Delta_Acumulado")
+        deterioros = deterioros[deterioros["Delta_Acumulado"] > 0]
+        st.dataframe(deterioros[list(columnas)].rename(columns=columnas).round(2),
+                     use_container_width=True, hide_index=True)
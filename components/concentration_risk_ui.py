@@ -11,19 +11,20 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from services.database_service import read_table
+from services.database_service import get_activos_evaluacion
 from services.concentration_risk_service import (
     init_concentration_tables,
     asignar_host_a_vm,
     get_vms_de_host,
     get_hosts_evaluacion,
-    calcular_concentracion_evaluacion,
-    calcular_herencia_evaluacion,
     get_hosts_spof,
     get_ranking_hosts_blast_radius,
     get_vms_con_riesgo_heredado,
     get_resumen_concentracion
 )
+from services.simulacion_propagacion_service import get_resultados_propagacion, ENSAYOS_DEFAULT
+from services.trabajos_service import encolar_trabajo, ultimo_trabajo, ESTADOS_ACTIVOS
+from components.trabajos_ui import render_estado_trabajo
 
 
 def render_asignacion_dependencias(eval_id: str):
@@ -33,8 +34,7 @@ def render_asignacion_dependencias(eval_id: str):
     # Inicializar tablas
     init_concentration_tables()
     
-    activos = read_table("INVENTARIO_ACTIVOS")
-    activos_eval = activos[activos["ID_Evaluacion"] == eval_id] if not activos.empty else pd.DataFrame()
+    activos_eval = get_activos_evaluacion(eval_id)
     
     if activos_eval.empty:
         st.info("No hay activos registrados en esta evaluación.")
@@ -128,18 +128,18 @@ def render_dashboard_concentracion(eval_id: str):
     """Renderiza el dashboard de riesgo por concentración"""
     st.subheader("📊 Dashboard de Riesgo por Concentración")
     
-    # Botón para recalcular
+    # Botón para recalcular (Fase 1: Blast Radius, Fase 2: Herencia) en segundo plano
+    trabajo = ultimo_trabajo(eval_id, "concentracion")
+    en_curso = trabajo is not None and trabajo["Estado"] in ESTADOS_ACTIVOS
     col1, col2, col3 = st.columns([2, 1, 1])
     with col3:
-        if st.button("🔄 Recalcular", type="primary"):
-            with st.spinner("Calculando riesgo por concentración..."):
-                # Fase 1: Blast Radius
-                resultados = calcular_concentracion_evaluacion(eval_id)
-                
-                # Fase 2: Herencia
-                herencias = calcular_herencia_evaluacion(eval_id)
-                
-                st.success(f"✅ Calculado: {len(resultados)} hosts, {len(herencias)} VMs")
+        if st.button("🔄 Recalcular", type="primary", disabled=en_curso):
+            encolar_trabajo("concentracion", eval_id)
+            st.rerun()
+    if trabajo is not None:
+        trabajo = render_estado_trabajo(trabajo["ID_Trabajo"], "concentracion")
+        if trabajo and trabajo["Estado"] == "completado" and trabajo["Resultado"]:
+            st.success(f"✅ Calculado: {trabajo['Resultado']['hosts']} hosts, {trabajo['Resultado']['vms']} VMs")
     
     # Métricas resumen
     resumen = get_resumen_concentracion(eval_id)
@@ -180,7 +180,7 @@ def render_dashboard_concentracion(eval_id: str):
             """)
     
     # Tabs para visualización
-    tab1, tab2, tab3 = st.tabs(["📈 Ranking Hosts", "🔗 VMs Heredadas", "📊 Gráficos"])
+    tab1, tab2, tab3, tab4 = st.tabs(["📈 Ranking Hosts", "🔗 VMs Heredadas", "📊 Gráficos", "🎲 Simulación"])
     
     with tab1:
         render_ranking_hosts(eval_id)
@@ -190,6 +190,9 @@ def render_dashboard_concentracion(eval_id: str):
     
     with tab3:
         render_graficos_concentracion(eval_id)
+    
+    with tab4:
+        render_simulacion_propagacion(eval_id)
 
 
 def render_ranking_hosts(eval_id: str):
@@ -262,6 +265,65 @@ def render_vms_heredadas(eval_id: str):
             st.caption(f"📝 {vm['Justificacion']}")
 
 
+def render_simulacion_propagacion(eval_id: str):
+    """Simulación Monte Carlo de propagación de fallos por el grafo de dependencias"""
+    st.markdown("#### Simulación de Propagación de Fallos (Monte Carlo)")
+    st.caption("Cada ensayo simula un año: los activos fallan según la frecuencia de sus amenazas MAGERIT "
+               "y la degradación baja a sus dependientes. Pérdida = criticidad × degradación.")
+    
+    trabajo = ultimo_trabajo(eval_id, "propagacion")
+    en_curso = trabajo is not None and trabajo["Estado"] in ESTADOS_ACTIVOS
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        ensayos = st.number_input("Ensayos", min_value=1000, max_value=200000, value=ENSAYOS_DEFAULT,
+                                  step=5000, key="propagacion_ensayos")
+    with col2:
+        st.write("")
+        if st.button("🎲 Simular", disabled=en_curso, key="propagacion_simular"):
+            encolar_trabajo("propagacion", eval_id, {"ensayos": int(ensayos)})
+            st.rerun()
+    if trabajo is not None:
+        render_estado_trabajo(trabajo["ID_Trabajo"], "propagacion")
+    
+    resultados = get_resultados_propagacion(eval_id)
+    if resultados.empty:
+        st.info("No hay simulaciones. Haga clic en 'Simular'.")
+        return
+    
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Pérdida esperada total", f"{resultados['Perdida_Esperada'].sum():.1f}")
+    c2.metric("Pérdida heredada", f"{resultados['Perdida_Heredada'].sum():.1f}")
+    c3.metric("Ensayos", int(resultados["Ensayos"].iloc[0]))
+    
+    st.markdown("**Activos por pérdida esperada**")
+    st.dataframe(
+        resultados[[
+            "Nombre_Activo", "ID_Host", "Prob_Afectado", "Perdida_Esperada", "Perdida_Heredada",
+            "Impacto_P50", "Impacto_P95", "Impacto_P99"
+        ]].rename(columns={
+            "Nombre_Activo": "Activo",
+            "ID_Host": "Depende de",
+            "Prob_Afectado": "P(afectado)",
+            "Perdida_Esperada": "Pérdida Esperada",
+            "Perdida_Heredada": "Heredada",
+            "Impacto_P50": "P50",
+            "Impacto_P95": "P95",
+            "Impacto_P99": "P99"
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    hosts = resultados[resultados["Num_Dependientes"] > 0].sort_values("Perdida_Dependientes", ascending=False)
+    if not hosts.empty:
+        st.markdown("**Blast radius transitivo: pérdida de los dependientes**")
+        fig = px.bar(
+            hosts.head(15), x="Nombre_Activo", y=["Perdida_Dependientes", "Perdida_Dependientes_P95"],
+            barmode="group", labels={"value": "Pérdida", "Nombre_Activo": "", "variable": ""}
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+
 def render_graficos_concentracion(eval_id: str):
     """Renderiza gráficos de concentración"""
     st.markdown("#### Visualización de Concentración")
@@ -10,11 +10,12 @@ import json
 import datetime as dt
 from typing import Dict, List, Optional, Any
 
-from services.database_service import get_connection, read_table
+from services.database_service import get_connection, get_activos_evaluacion
 from services.degradacion_service import (
     DegradacionAmenaza,
     obtener_degradacion,
     guardar_degradacion,
+    guardar_degradaciones,
     obtener_degradaciones_activo,
     eliminar_degradacion,
     calcular_impacto_con_degradacion,
@@ -156,8 +157,7 @@ def render_degradacion_tab(eval_id: str):
     """)
     
     # Obtener activos de la evaluación
-    activos = read_table("INVENTARIO_ACTIVOS")
-    activos_eval = activos[activos["ID_Evaluacion"] == eval_id]
+    activos_eval = get_activos_evaluacion(eval_id)
     
     if activos_eval.empty:
         st.warning("⚠️ No hay activos en esta evaluación. Ve a la pestaña **Activos** para crearlos.")
@@ -269,18 +269,19 @@ def render_degradacion_tab(eval_id: str):
             if pendientes_df.empty:
                 st.info("No hay amenazas pendientes")
             else:
-                progress = st.progress(0)
-                for i, (_, row) in enumerate(pendientes_df.iterrows()):
+                sugerencias = []
+                for codigo_amenaza, tipo_amenaza in zip(pendientes_df["Código"], pendientes_df["Tipo"]):
                     sugerencia = sugerir_degradacion_ia(
                         tipo_activo=tipo_activo,
-                        codigo_amenaza=row["Código"],
-                        tipo_amenaza=row["Tipo"]
+                        codigo_amenaza=codigo_amenaza,
+                        tipo_amenaza=tipo_amenaza
                     )
                     sugerencia.id_evaluacion = eval_id
                     sugerencia.id_activo = activo_id
-                    sugerencia.justificacion = f"Sugerencia automática basada en tipo '{row['Tipo']}'"
-                    guardar_degradacion(sugerencia)
-                    progress.progress((i + 1) / len(pendientes_df))
+                    sugerencia.justificacion = f"Sugerencia automática basada en tipo '{tipo_amenaza}'"
+                    sugerencias.append(sugerencia)
+                # Un único guardado para todas las pendientes
+                guardar_degradaciones(sugerencias)
                 
                 st.success(f"✅ {len(pendientes_df)} degradaciones sugeridas por IA")
                 st.rerun()
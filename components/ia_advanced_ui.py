@@ -8,6 +8,7 @@ Interfaz de usuario para:
 4. Predicción de Riesgo Futuro
 5. Priorización Inteligente de Controles
 """
+import os
 import streamlit as st
 import pandas as pd
 import plotly.express as px
@@ -15,8 +16,8 @@ import plotly.graph_objects as go
 from datetime import datetime
 from services.ia_advanced_service import (
     generar_plan_tratamiento,
-    generar_planes_evaluacion,
     consultar_chatbot_magerit,
+    consultar_chatbot_magerit_stream,
     generar_resumen_ejecutivo,
     generar_prediccion_riesgo,
     generar_priorizacion_controles,
@@ -28,7 +29,10 @@ from services.ia_advanced_service import (
     ControlPriorizado,
     PlanTratamiento
 )
-from services.database_service import read_table
+from services.database_service import get_resultados_magerit_evaluacion
+from components.telemetria_ui import render_panel_telemetria
+from services.trabajos_service import encolar_trabajo, ultimo_trabajo, ESTADOS_ACTIVOS
+from components.trabajos_ui import render_estado_trabajo
 import json
 
 
@@ -37,22 +41,7 @@ def _obtener_amenazas_evaluacion(eval_id: str) -> pd.DataFrame:
     Extrae las amenazas de una evaluación desde RESULTADOS_MAGERIT.Amenazas_JSON.
     Retorna un DataFrame con las amenazas desagregadas.
     """
-    resultados = read_table("RESULTADOS_MAGERIT")
-    if resultados.empty:
-        return pd.DataFrame()
-    
-    # Normalizar nombre de columna
-    col_eval = None
-    for c in ["ID_Evaluacion", "id_evaluacion"]:
-        if c in resultados.columns:
-            col_eval = c
-            break
-    
-    if not col_eval:
-        return pd.DataFrame()
-    
-    # Filtrar por evaluación
-    resultados_eval = resultados[resultados[col_eval] == eval_id]
+    resultados_eval = get_resultados_magerit_evaluacion(eval_id)
     if resultados_eval.empty:
         return pd.DataFrame()
     
@@ -110,6 +99,8 @@ def render_ia_avanzada_ui():
     else:
         st.warning(f"⚠️ {mensaje_ia} - Se usarán métodos heurísticos como fallback")
     
+    render_panel_telemetria("ia_avanzada")
+    
     # Selector de modelo
     col1, col2 = st.columns([3, 1])
     with col1:
@@ -256,23 +247,25 @@ def _render_planes_tratamiento(eval_id: str, modelo: str):
     col1, col2 = st.columns([3, 1])
     with col1:
         btn_label = "🚀 Generar Todos los Planes" if not planes_guardados else "🔄 Regenerar Todos los Planes"
-        generar_todos = st.button(btn_label, use_container_width=True, type="primary" if not planes_guardados else "secondary")
+        trabajo_planes = ultimo_trabajo(eval_id, "planes_tratamiento")
+        generar_todos = st.button(btn_label, use_container_width=True, type="primary" if not planes_guardados else "secondary",
+                                  disabled=trabajo_planes is not None and trabajo_planes["Estado"] in ESTADOS_ACTIVOS)
     with col2:
         if planes_guardados:
             st.caption(f"📅 {resultado_guardado['fecha'][:10]}")
     
     if generar_todos:
-        with st.spinner(f"Generando planes para {len(amenazas_criticas)} amenazas críticas..."):
-            planes = generar_planes_evaluacion(eval_id, modelo)
-        
-        if planes:
-            # Guardar en BD
-            datos_guardar = {"planes": [p.__dict__ for p in planes]}
-            guardar_resultado_ia(eval_id, "planes_tratamiento", datos_guardar, modelo)
-            st.success(f"✅ Se generaron {len(planes)} planes de tratamiento")
-            st.rerun()
-        else:
-            st.info("ℹ️ No se encontraron amenazas de nivel ALTO o CRÍTICO")
+        # Generación y guardado en segundo plano (trabajos_service)
+        encolar_trabajo("planes_tratamiento", eval_id, {"modelo": modelo})
+        st.rerun()
+    
+    if trabajo_planes is not None:
+        trabajo_planes = render_estado_trabajo(trabajo_planes["ID_Trabajo"], "planes_tratamiento")
+        if trabajo_planes and trabajo_planes["Estado"] == "completado" and trabajo_planes["Resultado"]:
+            if trabajo_planes["Resultado"]["planes"]:
+                st.success(f"✅ Se generaron {trabajo_planes['Resultado']['planes']} planes de tratamiento")
+            else:
+                st.info("ℹ️ No se encontraron amenazas de nivel ALTO o CRÍTICO")
     
     # Mostrar planes guardados
     if planes_guardados:
@@ -365,20 +358,15 @@ def _render_chatbot(eval_id: str, modelo: str):
         # Mostrar pregunta del usuario
         st.chat_message("user").write(pregunta)
         
-        # Generar respuesta
-        with st.spinner("Pensando..."):
-            exito, respuesta, historial = consultar_chatbot_magerit(
+        # Respuesta en streaming: el texto aparece a medida que se genera
+        # (el historial se actualiza al terminar el stream)
+        with st.chat_message("assistant"):
+            st.write_stream(consultar_chatbot_magerit_stream(
                 eval_id,
                 pregunta,
                 st.session_state.chatbot_historial,
                 modelo
-            )
-        
-        # Mostrar respuesta
-        st.chat_message("assistant").write(respuesta)
-        
-        # Actualizar historial
-        st.session_state.chatbot_historial = historial
+            ))
     
     # Botón para limpiar historial
     if st.session_state.chatbot_historial:
@@ -560,7 +548,7 @@ def _mostrar_resumen_ejecutivo(resumen):
     col1, col2, col3 = st.columns(3)
     
     # Importar servicio de exportación
-    from services.export_service import generar_documento_ejecutivo, generar_datos_powerbi
+    from services.export_service import generar_documento_ejecutivo
     
     with col1:
         # Exportar HTML
@@ -605,45 +593,26 @@ def _mostrar_resumen_ejecutivo(resumen):
     st.markdown("### 📊 Datos para Power BI")
     st.markdown("Exporta datasets optimizados para crear dashboards en Power BI.")
     
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        if st.button("📊 Generar Datos Power BI", use_container_width=True):
-            with st.spinner("Generando datasets..."):
-                exito_pbi, datasets, mensaje_pbi = generar_datos_powerbi(resumen.id_evaluacion)
-            
-            if exito_pbi:
-                st.success(f"✅ {mensaje_pbi}")
-                
-                # Mostrar preview de datasets
-                with st.expander("👀 Vista previa de datasets", expanded=False):
-                    for nombre, df in datasets.items():
-                        st.markdown(f"**{nombre}** ({len(df)} registros)")
-                        st.dataframe(df.head(3), use_container_width=True)
-                
-                # Guardar en session_state para descarga
-                st.session_state["powerbi_datasets"] = datasets
-            else:
-                st.error(f"❌ {mensaje_pbi}")
-    
-    with col2:
-        if "powerbi_datasets" in st.session_state:
-            import io
-            # Crear Excel en memoria
-            buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                for nombre, df in st.session_state["powerbi_datasets"].items():
-                    if not df.empty:
-                        df.to_excel(writer, sheet_name=nombre[:31], index=False)
-            
-            st.download_button(
-                "⬇️ Descargar Excel para Power BI",
-                data=buffer.getvalue(),
-                file_name=f"powerbi_data_{resumen.id_evaluacion}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True,
-                help="Archivo Excel con múltiples hojas listo para importar en Power BI"
-            )
+    # Generación del Excel en segundo plano (trabajos_service)
+    trabajo_pbi = ultimo_trabajo(resumen.id_evaluacion, "exportar_powerbi")
+    if st.button("📊 Generar Datos Power BI", use_container_width=True,
+                 disabled=trabajo_pbi is not None and trabajo_pbi["Estado"] in ESTADOS_ACTIVOS):
+        encolar_trabajo("exportar_powerbi", resumen.id_evaluacion)
+        st.rerun()
+    
+    if trabajo_pbi is not None:
+        trabajo_pbi = render_estado_trabajo(trabajo_pbi["ID_Trabajo"], "exportar_powerbi")
+        archivo = (trabajo_pbi or {}).get("Resultado") or {}
+        if trabajo_pbi["Estado"] == "completado" and os.path.exists(archivo.get("archivo", "")):
+            with open(archivo["archivo"], "rb") as f:
+                st.download_button(
+                    "⬇️ Descargar Excel para Power BI",
+                    data=f.read(),
+                    file_name=f"powerbi_data_{resumen.id_evaluacion}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True,
+                    help="Archivo Excel con múltiples hojas listo para importar en Power BI"
+                )
 
 
 # ==================== 4. PREDICCIÓN DE RIESGO ====================
@@ -78,7 +78,7 @@ def render_tab_validacion_ia():
         
         # Verificar Ollama
         st.subheader("🖥️ Ollama Local")
-        is_local, endpoint, modelos, error = verificar_ollama_local()
+        is_local, endpoint, modelos, error = verificar_ollama_local(desde_monitor=True)
         
         if is_local:
             st.success(f"✅ Conectado: {endpoint}")
@@ -0,0 +1,55 @@
+"""
+Componente UI de telemetría de la IA - Proyecto TITA
+====================================================
+Throughput (tokens/s), latencias, tokens y uso del cache/fallback por
+modelo, a partir de TELEMETRIA_LLM. Sirve para dimensionar el hardware y
+elegir el modelo con datos reales.
+"""
+import streamlit as st
+import plotly.express as px
+
+from services.telemetria_llm_service import (
+    tendencia_throughput,
+    resumen_por_modelo,
+    resumen_por_origen
+)
+
+PERIODOS = {"Últimas 24 horas": (1, "hora"), "Últimos 7 días": (7, "hora"), "Últimos 30 días": (30, "dia")}
+
+
+def render_panel_telemetria(clave: str = "telemetria"):
+    """Panel plegable con tendencias de throughput y resumen por modelo y origen"""
+    with st.expander("📈 Telemetría de inferencia (tokens/s, latencia, cache)", expanded=False):
+        etiqueta = st.selectbox("Periodo", list(PERIODOS), index=1, key=f"{clave}_periodo")
+        dias, agrupacion = PERIODOS[etiqueta]
+
+        modelos = resumen_por_modelo(dias)
+        if modelos.empty:
+            st.info("Aún no hay llamadas a la IA registradas en este periodo.")
+            return
+
+        llamadas = int(modelos["Llamadas"].sum())
+        cache = int(modelos["Aciertos_Cache"].sum())
+        fallbacks = int(modelos["Fallbacks"].sum())
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Llamadas", llamadas)
+        col2.metric("Desde cache", cache, delta=f"{cache / llamadas:.0%}" if llamadas else None,
+                    delta_color="off")
+        col3.metric("Errores", int(modelos["Errores"].sum()))
+        col4.metric("Fallback heurístico", fallbacks)
+
+        tendencia = tendencia_throughput(dias, agrupacion)
+        if not tendencia.empty:
+            fig = px.line(tendencia, x="Periodo", y="Tokens_Por_Segundo", color="Modelo", markers=True,
+                          labels={"Tokens_Por_Segundo": "Tokens/s", "Periodo": ""},
+                          title="Velocidad de generación por modelo")
+            st.plotly_chart(fig, use_container_width=True)
+            fig_latencia = px.bar(tendencia, x="Periodo", y=["Latencia_Media_s", "Espera_Media_s"],
+                                  barmode="group", labels={"value": "Segundos", "Periodo": "", "variable": ""},
+                                  title="Latencia media y espera en cola")
+            st.plotly_chart(fig_latencia, use_container_width=True)
+
+        st.markdown("**Por modelo**")
+        st.dataframe(modelos.round(2), use_container_width=True, hide_index=True)
+        st.markdown("**Por origen**")
+        st.dataframe(resumen_por_origen(dias).round(2), use_container_width=True, hide_index=True)
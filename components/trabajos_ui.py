@@ -0,0 +1,76 @@
+"""
+Componente UI para trabajos en segundo plano - Proyecto TITA
+=============================================================
+Muestra el estado de un trabajo encolado (progreso, mensaje, cancelación)
+y lo refresca solo mientras sigue activo.
+"""
+from typing import Dict, Optional
+
+import streamlit as st
+
+from services.trabajos_service import (
+    TIPOS_TRABAJO,
+    ESTADOS_ACTIVOS,
+    get_trabajo,
+    cancelar_trabajo
+)
+
+INTERVALO_REFRESCO = 2  # segundos
+
+ICONOS_ESTADO = {
+    "encolado": "⏳",
+    "ejecutando": "⚙️",
+    "completado": "✅",
+    "error": "❌",
+    "cancelado": "⏹️"
+}
+
+
+def _panel_trabajo(id_trabajo: str, clave: str):
+    """Progreso y botón de cancelar de un trabajo activo"""
+    trabajo = get_trabajo(id_trabajo)
+    if trabajo is None:
+        return
+    if trabajo["Estado"] not in ESTADOS_ACTIVOS:
+        # Terminó durante el refresco parcial: recargar la página completa
+        st.rerun()
+    descripcion = TIPOS_TRABAJO.get(trabajo["Tipo"], (None, trabajo["Tipo"]))[1]
+    texto = trabajo["Mensaje"] or ("En cola" if trabajo["Estado"] == "encolado" else "Iniciando...")
+    st.progress(float(trabajo["Progreso"] or 0.0),
+                text=f"{ICONOS_ESTADO[trabajo['Estado']]} {descripcion}: {texto}")
+    if st.button("⏹️ Cancelar", key=f"cancelar_trabajo_{clave}"):
+        cancelar_trabajo(id_trabajo)
+        st.rerun()
+
+
+# Refresco periódico solo del panel (Streamlit >= 1.37); si no existe, botón manual
+_panel_auto = st.fragment(run_every=INTERVALO_REFRESCO)(_panel_trabajo) if hasattr(st, "fragment") else None
+
+
+def render_estado_trabajo(id_trabajo: str, clave: str) -> Optional[Dict]:
+    """
+    Renderiza el estado del trabajo.
+
+    Returns:
+        El trabajo (con Resultado decodificado) o None si no existe
+    """
+    trabajo = get_trabajo(id_trabajo)
+    if trabajo is None:
+        return None
+
+    estado = trabajo["Estado"]
+    if estado in ESTADOS_ACTIVOS:
+        if _panel_auto is not None:
+            _panel_auto(id_trabajo, clave)
+        else:
+            _panel_trabajo(id_trabajo, clave)
+            if st.button("🔄 Actualizar estado", key=f"refrescar_trabajo_{clave}"):
+                st.rerun()
+        st.caption("El trabajo sigue en segundo plano aunque cambies de pestaña o cierres el navegador.")
+    elif estado == "completado":
+        st.caption(f"{ICONOS_ESTADO[estado]} Último trabajo completado: {(trabajo['Fecha_Fin'] or '')[:19]}")
+    elif estado == "error":
+        st.error(f"{ICONOS_ESTADO[estado]} El trabajo falló: {trabajo['Mensaje']}")
+    else:
+        st.warning(f"{ICONOS_ESTADO[estado]} Trabajo cancelado")
+    return trabajo
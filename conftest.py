@@ -0,0 +1,19 @@
+"""Fixtures compartidas por las pruebas: base de datos SQLite temporal"""
+import pytest
+
+from services import database_service as db
+
+
+@pytest.fixture
+def bd_vacia(tmp_path, monkeypatch):
+    """Base de datos temporal sin esquema; cierra las conexiones del pool al terminar"""
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "prueba.db"))
+    yield db.DB_PATH
+    db.close_connections()
+
+
+@pytest.fixture
+def bd_temporal(bd_vacia):
+    """Base de datos temporal con el esquema completo y las migraciones aplicadas"""
+    db.init_database()
+    return bd_vacia
@@ -1,14 +1,14 @@
 import json
-import re
 import datetime as dt
 from typing import List, Dict, Any
 
 import pandas as pd
-import requests
 from openpyxl import load_workbook
 
+from services.ollama_client import get_cliente
+from services.salida_estructurada import formato, extraer_json, ESQUEMA_PREGUNTAS
+
 EXCEL_PATH = "matriz_riesgos_v2.xlsx"
-OLLAMA_URL = "http://localhost:11434/api/generate"
 
 # Cambia aquí el modelo si quieres: llama3 / mistral / phi3
 DEFAULT_MODEL = "llama3"
@@ -57,26 +57,13 @@ def upsert_eval(sheet_name: str, id_cols: List[str], row: Dict[str, Any]):
     wb.save(EXCEL_PATH)
 
 def ollama_generate(model: str, prompt: str) -> str:
-    r = requests.post(
-        OLLAMA_URL,
-        json={"model": model, "prompt": prompt, "stream": False},
-        timeout=90
-    )
-    r.raise_for_status()
-    return r.json().get("response", "")
+    return get_cliente().generar(prompt, model, timeout=90, formato=formato(ESQUEMA_PREGUNTAS)).texto
 
 def extract_json(text: str):
     """
     Ollama a veces devuelve texto extra. Intentamos extraer el bloque JSON.
     """
-    # intenta capturar el primer array JSON [...]
-    m = re.search(r"\[\s*{.*}\s*\]", text, re.DOTALL)
-    if not m:
-        return None
-    try:
-        return json.loads(m.group(0))
-    except Exception:
-        return None
+    return extraer_json(text, list, origen="preguntas")
 
 def base_questions_for_asset(bank: pd.DataFrame, tipo_activo: str, max_n=12) -> pd.DataFrame:
     """
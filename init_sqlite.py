@@ -11,7 +11,7 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from services.database_service import (
-    init_database, insert_rows, read_table, DB_PATH
+    init_database, insert_rows, read_table, close_connections, DB_PATH
 )
 
 # ==================== DATOS INICIALES ====================
@@ -228,7 +228,11 @@ def main():
     
     # Eliminar base de datos existente
     if os.path.exists(DB_PATH):
+        close_connections()
         os.unlink(DB_PATH)
+        for sufijo in ("-wal", "-shm"):
+            if os.path.exists(DB_PATH + sufijo):
+                os.unlink(DB_PATH + sufijo)
         print(f"   🗑️ Eliminada BD anterior: {DB_PATH}")
     
     # Crear estructura
@@ -13,6 +13,7 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from services.database_service import get_connection, init_database, read_table, DB_PATH
+from services.catalogos_service import marcar_catalogos_modificados
 import sqlite3
 
 
@@ -463,6 +464,7 @@ def main():
     print("\n🛡️ Insertando 93 controles ISO 27002:2022...")
     insertar_controles()
     print("   ✅ Controles insertados")
+    marcar_catalogos_modificados()
     
     # Validar
     exito = validar_conteos()
@@ -12,8 +12,12 @@ from .database_service import (
     delete_row,
     delete_rows,
     query_rows,
+    query_one,
+    count_rows,
     row_exists,
     upsert_row,
+    upsert_rows,
+    ResultadoEscritura,
     read_sheet,      # Compatibilidad con código existente
     append_rows,     # Compatibilidad con código existente
     set_eval_active, # Compatibilidad con código existente
@@ -21,6 +25,12 @@ from .database_service import (
     ensure_sheet_exists,
     update_cuestionarios_version,
     exportar_a_excel,
+    close_connections,
+    write_transaction,
+    get_evaluacion,
+    get_activos_evaluacion,
+    get_respuestas_evaluacion,
+    get_resultados_magerit_evaluacion,
     DB_PATH
 )
 
@@ -71,7 +81,9 @@ from .magerit_engine import (
     calcular_impacto_desde_respuestas,
     identificar_controles_existentes,
     evaluar_activo_magerit,
+    evaluar_evaluacion_magerit,
     guardar_resultado_magerit,
+    guardar_resultados_magerit,
     get_resultado_magerit,
     get_amenazas_activo,
     get_resumen_evaluacion
@@ -153,6 +165,8 @@ from .concentration_risk_service import (
     calcular_riesgo_heredado,
     calcular_concentracion_evaluacion,
     calcular_herencia_evaluacion,
+    construir_grafo,
+    GrafoDependencias,
     get_hosts_spof,
     get_ranking_hosts_blast_radius,
     get_vms_con_riesgo_heredado,
@@ -162,11 +176,20 @@ from .concentration_risk_service import (
     RiesgoHeredado
 )
 
+# Simulación Monte Carlo de propagación de fallos
+from .simulacion_propagacion_service import (
+    simular_propagacion,
+    calcular_propagacion_evaluacion,
+    get_resultados_propagacion,
+    ResultadoPropagacion
+)
+
 # Servicio de IA Avanzada
 from .ia_advanced_service import (
     generar_plan_tratamiento,
     generar_planes_evaluacion,
     consultar_chatbot_magerit,
+    consultar_chatbot_magerit_stream,
     generar_resumen_ejecutivo,
     generar_prediccion_riesgo,
     generar_priorizacion_controles,
@@ -224,6 +247,9 @@ from .comparativa_service import (
     guardar_comparativa,
     listar_historial_comparativas,
     get_tendencia_riesgo,
+    actualizar_resumenes,
+    tendencia_evaluaciones,
+    tendencia_activos,
     ComparativaEvaluacion
 )
 
@@ -246,13 +272,23 @@ __all__ = [
     'init_database',
     'read_table',
     'insert_rows',
+    'upsert_rows',
+    'ResultadoEscritura',
     'update_row',
     'delete_row',
     'query_rows',
+    'query_one',
+    'count_rows',
+    'get_evaluacion',
+    'get_activos_evaluacion',
+    'get_respuestas_evaluacion',
+    'get_resultados_magerit_evaluacion',
     'read_sheet',
     'append_rows',
     'set_eval_active',
     'export_to_excel',
+    'close_connections',
+    'write_transaction',
     'DB_PATH',
     # Ollama
     'ollama_generate',
@@ -292,7 +328,9 @@ __all__ = [
     'calcular_impacto_desde_respuestas',
     'identificar_controles_existentes',
     'evaluar_activo_magerit',
+    'evaluar_evaluacion_magerit',
     'guardar_resultado_magerit',
+    'guardar_resultados_magerit',
     'get_resultado_magerit',
     'get_amenazas_activo',
     'get_resumen_evaluacion',
@@ -343,6 +381,8 @@ __all__ = [
     'calcular_riesgo_heredado',
     'calcular_concentracion_evaluacion',
     'calcular_herencia_evaluacion',
+    'construir_grafo',
+    'GrafoDependencias',
     'get_hosts_spof',
     'get_ranking_hosts_blast_radius',
     'get_vms_con_riesgo_heredado',
@@ -350,10 +390,16 @@ __all__ = [
     'DependenciaVM',
     'ResultadoConcentracion',
     'RiesgoHeredado',
+    # Simulación de propagación
+    'simular_propagacion',
+    'calcular_propagacion_evaluacion',
+    'get_resultados_propagacion',
+    'ResultadoPropagacion',
     # IA Advanced Service
     'generar_plan_tratamiento',
     'generar_planes_evaluacion',
     'consultar_chatbot_magerit',
+    'consultar_chatbot_magerit_stream',
     'generar_resumen_ejecutivo',
     'generar_prediccion_riesgo',
     'generar_priorizacion_controles',
@@ -389,6 +435,9 @@ __all__ = [
     'guardar_comparativa',
     'listar_historial_comparativas',
     'get_tendencia_riesgo',
+    'actualizar_resumenes',
+    'tendencia_evaluaciones',
+    'tendencia_activos',
     'ComparativaEvaluacion',
     # Auditoria Service
     'registrar_cambio',
@@ -2,8 +2,12 @@
 Servicio de gestión de activos con validación de duplicados - Versión SQLite
 """
 import pandas as pd
-from typing import Optional, Dict, List
-from services.database_service import read_table, insert_rows, update_row, delete_row, query_rows
+from typing import Dict, List
+from services.database_service import (
+    insert_rows, update_row, delete_row, count_rows,
+    get_activos_evaluacion,
+    get_activo  # re-exportado: services.get_activo se importa desde este módulo
+)
 import datetime as dt
 
 
@@ -17,6 +21,17 @@ def generar_clave_activo(eval_id: str, nombre: str, ubicacion: str, tipo_servici
     return f"{eval_id}_{normalizar_nombre(nombre)}_{normalizar_nombre(ubicacion)}_{normalizar_nombre(tipo_servicio)}"
 
 
+def claves_activos_evaluacion(eval_id: str) -> set:
+    """Claves lógicas de todos los activos de la evaluación (para validar en lote)"""
+    activos_eval = get_activos_evaluacion(
+        eval_id, columns=["Nombre_Activo", "Ubicacion", "Tipo_Servicio"]
+    )
+    return {
+        generar_clave_activo(eval_id, a.Nombre_Activo, a.Ubicacion, a.Tipo_Servicio)
+        for a in activos_eval.itertuples(index=False)
+    }
+
+
 def validar_duplicado(eval_id: str, nombre: str, ubicacion: str, 
                      tipo_servicio: str, id_activo_excluir: str = None) -> tuple:
     """
@@ -25,12 +40,9 @@ def validar_duplicado(eval_id: str, nombre: str, ubicacion: str,
     Returns:
         (es_duplicado: bool, mensaje: str)
     """
-    activos = read_table("INVENTARIO_ACTIVOS")
-    if activos.empty:
-        return False, ""
-    
-    # Filtrar por evaluación
-    activos_eval = activos[activos["ID_Evaluacion"].astype(str) == str(eval_id)]
+    activos_eval = get_activos_evaluacion(
+        eval_id, columns=["ID_Activo", "Nombre_Activo", "Ubicacion", "Tipo_Servicio"]
+    )
     
     if activos_eval.empty:
         return False, ""
@@ -82,14 +94,8 @@ def crear_activo(eval_id: str, datos: Dict) -> tuple:
         return False, msg_dup, ""
     
     # Generar ID único
-    activos = read_table("INVENTARIO_ACTIVOS")
-    if activos.empty:
-        nuevo_id = f"ACT-{eval_id}-001"
-    else:
-        # Filtrar activos de esta evaluación
-        activos_eval = activos[activos["ID_Evaluacion"].astype(str) == str(eval_id)]
-        max_num = len(activos_eval)
-        nuevo_id = f"ACT-{eval_id}-{str(max_num + 1).zfill(3)}"
+    max_num = count_rows("INVENTARIO_ACTIVOS", {"ID_Evaluacion": eval_id})
+    nuevo_id = f"ACT-{eval_id}-{str(max_num + 1).zfill(3)}"
     
     # Crear registro
     nuevo_activo = {
@@ -204,23 +210,6 @@ def eliminar_activo(eval_id: str, id_activo: str) -> tuple:
         return False, f"❌ Error al eliminar activo: {str(e)}"
 
 
-def get_activo(eval_id: str, id_activo: str) -> Optional[Dict]:
-    """Obtiene los datos de un activo específico"""
-    activos = read_table("INVENTARIO_ACTIVOS")
-    if activos.empty:
-        return None
-    
-    activo_filtrado = activos[
-        (activos["ID_Evaluacion"].astype(str) == str(eval_id)) &
-        (activos["ID_Activo"].astype(str) == str(id_activo))
-    ]
-    
-    if activo_filtrado.empty:
-        return None
-    
-    return activo_filtrado.iloc[0].to_dict()
-
-
 def editar_activo(eval_id: str, id_activo: str, datos: Dict) -> tuple:
     """
     Edita un activo existente con validación de duplicados
@@ -0,0 +1,457 @@
+"""
+Análisis masivo de activos con IA - Proyecto TITA
+
+Ejecuta analizar_amenazas_por_criticidad sobre todos los activos de una
+evaluación con concurrencia acotada (OLLAMA_NUM_PARALLEL), timeout por tarea,
+reintentos con espera exponencial y resultados devueltos en el orden del
+inventario. El estado de cada activo queda en ANALISIS_MASIVO_TAREAS, así un
+lote interrumpido (pestaña cerrada, caída del proceso) se reanuda donde quedó.
+
+Las llamadas a la IA corren en hilos; las escrituras en SQLite y el callback
+de progreso se ejecutan en el hilo que llama (el script de Streamlit).
+
+Con tamano_grupo > 1 los activos se agrupan por (tipo, banda de criticidad)
+y cada grupo se resuelve en una sola llamada (analizar_grupo_por_criticidad):
+un inventario de 300 VMs similares baja de 300 llamadas a unas pocas decenas.
+
+Con la ruta rápida (modo_rapido, configurable por evaluación) el motor
+heurístico resuelve primero los activos con confianza suficiente (tipo
+cubierto y respuestas de control) y solo los ambiguos llegan a la IA.
+
+Uso:
+    from services.analisis_masivo_service import ejecutar_analisis_masivo
+    resultado = ejecutar_analisis_masivo(eval_id, progreso=lambda hechos, total, tarea: ...)
+"""
+import os
+import time
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from services.database_service import (
+    get_connection, write_transaction, insert_rows, query_rows, get_respuestas_evaluacion
+)
+from services.matriz_service import agregar_vulnerabilidades_amenazas, get_valoraciones_evaluacion
+
+
+# ==================== CONFIGURACIÓN ====================
+
+# Igual que el servidor Ollama: más hilos que slots solo encolan peticiones
+CONCURRENCIA_DEFAULT = int(os.environ.get("OLLAMA_NUM_PARALLEL") or 4)
+TIMEOUT_TAREA = 180  # segundos por activo (incluye reintentos)
+REINTENTOS = 2
+ESPERA_REINTENTO = 1.0  # segundos, se duplica en cada reintento
+
+ESTADOS_ABIERTOS = ("pendiente", "procesando", "error")
+
+Analizador = Callable[[Dict, Dict], Tuple[bool, List[Dict], str]]
+AnalizadorGrupo = Callable[[List[Tuple[Dict, Dict]]], Dict[str, Tuple[bool, List[Dict], str]]]
+ResultadoTarea = Tuple[bool, List[Dict], str, int]  # (éxito, amenazas, mensaje, intentos)
+
+
+@dataclass
+class TareaAnalisis:
+    """Estado del análisis de un activo dentro de un lote"""
+    id_activo: str
+    orden: int
+    estado: str = "pendiente"
+    intentos: int = 0
+    mensaje: str = ""
+    num_amenazas: int = 0
+    segundos: float = 0.0
+    ruta: str = ""  # "ia" o "heuristica" (ruta rápida)
+
+
+@dataclass
+class ResultadoAnalisisMasivo:
+    """Resumen de un lote de análisis masivo"""
+    id_lote: str
+    id_evaluacion: str
+    tareas: List[TareaAnalisis] = field(default_factory=list)
+    concurrencia: int = 1
+    segundos: float = 0.0
+
+    def _contar(self, estado: str) -> int:
+        return sum(1 for t in self.tareas if t.estado == estado)
+
+    @property
+    def exitos(self) -> int:
+        return self._contar("completado")
+
+    @property
+    def errores(self) -> int:
+        return self._contar("error")
+
+    @property
+    def omitidos(self) -> int:
+        return self._contar("omitido")
+
+    @property
+    def llamadas_evitadas(self) -> int:
+        """Activos resueltos por la ruta rápida sin llamar a la IA"""
+        return sum(1 for t in self.tareas if t.estado == "completado" and t.ruta == "heuristica")
+
+    def __str__(self) -> str:
+        texto = (f"{self.id_lote}: {self.exitos} analizados, {self.errores} errores, "
+                 f"{self.omitidos} omitidos en {self.segundos:.1f} s (concurrencia {self.concurrencia})")
+        if self.llamadas_evitadas:
+            texto += f"; {self.llamadas_evitadas} sin IA por la ruta rápida"
+        return texto
+
+
+# ==================== LOTES REANUDABLES ====================
+
+def lote_pendiente(id_evaluacion: str) -> Optional[str]:
+    """Último lote de la evaluación con activos sin terminar, si existe"""
+    with get_connection() as conn:
+        row = conn.execute(f'''
+            SELECT ID_Lote FROM ANALISIS_MASIVO_TAREAS
+            WHERE ID_Evaluacion = ? AND Estado IN ({", ".join("?" * len(ESTADOS_ABIERTOS))})
+            ORDER BY id DESC LIMIT 1
+        ''', (id_evaluacion, *ESTADOS_ABIERTOS)).fetchone()
+    return row[0] if row else None
+
+
+def preparar_lote(id_evaluacion: str, ids_activos: List[str], reanudar: bool = True) -> str:
+    """
+    Crea el lote de tareas o reanuda el último sin terminar.
+
+    Al reanudar, las tareas que quedaron "procesando" (proceso caído) y las
+    que fallaron vuelven a pendiente, y se agregan los activos nuevos.
+    """
+    id_lote = lote_pendiente(id_evaluacion) if reanudar else None
+    fecha = dt.datetime.now().isoformat()
+    with write_transaction() as conn:
+        if id_lote is None:
+            id_lote = f"LOTE-{id_evaluacion}-{dt.datetime.now():%Y%m%d%H%M%S%f}"
+            existentes, siguiente = set(), 0
+        else:
+            conn.execute('''
+                UPDATE ANALISIS_MASIVO_TAREAS SET Estado = 'pendiente', Fecha_Actualizacion = ?
+                WHERE ID_Lote = ? AND Estado IN ('procesando', 'error')
+            ''', (fecha, id_lote))
+            filas = conn.execute("SELECT ID_Activo, Orden FROM ANALISIS_MASIVO_TAREAS WHERE ID_Lote = ?",
+                                 (id_lote,)).fetchall()
+            existentes = {f[0] for f in filas}
+            siguiente = max((f[1] for f in filas), default=-1) + 1
+        nuevas = [a for a in dict.fromkeys(ids_activos) if a not in existentes]
+        insert_rows("ANALISIS_MASIVO_TAREAS", [
+            {"ID_Lote": id_lote, "ID_Evaluacion": id_evaluacion, "ID_Activo": id_activo,
+             "Orden": siguiente + i, "Estado": "pendiente", "Fecha_Actualizacion": fecha}
+            for i, id_activo in enumerate(nuevas)
+        ])
+    return id_lote
+
+
+def get_tareas_lote(id_lote: str) -> List[TareaAnalisis]:
+    """Tareas del lote en el orden del inventario"""
+    df = query_rows("ANALISIS_MASIVO_TAREAS", {"ID_Lote": id_lote}, order_by="Orden")
+    return [
+        TareaAnalisis(id_activo=a, orden=o, estado=e, intentos=int(i or 0), mensaje=m or "",
+                      num_amenazas=int(n or 0), segundos=float(s or 0.0), ruta=r or "")
+        for a, o, e, i, m, n, s, r in zip(df["ID_Activo"].tolist(), df["Orden"].tolist(), df["Estado"].tolist(),
+                                          df["Intentos"].tolist(), df["Mensaje"].tolist(),
+                                          df["Num_Amenazas"].tolist(), df["Segundos"].tolist(),
+                                          df["Ruta"].tolist())
+    ]
+
+
+def _actualizar_tareas(id_lote: str, tareas: List[TareaAnalisis]):
+    fecha = dt.datetime.now().isoformat()
+    with write_transaction() as conn:
+        conn.executemany('''
+            UPDATE ANALISIS_MASIVO_TAREAS
+            SET Estado = ?, Intentos = ?, Mensaje = ?, Num_Amenazas = ?, Segundos = ?, Ruta = ?,
+                Fecha_Actualizacion = ?
+            WHERE ID_Lote = ? AND ID_Activo = ?
+        ''', [(t.estado, t.intentos, t.mensaje, t.num_amenazas, t.segundos, t.ruta or None, fecha,
+               id_lote, t.id_activo) for t in tareas])
+
+
+# ==================== ANÁLISIS ====================
+
+def filas_vulnerabilidades(amenazas: List[Dict]) -> List[Dict]:
+    """
+    Convierte las amenazas devueltas por la IA al formato de
+    agregar_vulnerabilidades_amenazas (degradaciones 0-100 → 0-1).
+    """
+    filas = []
+    for am in amenazas:
+        deg_d = am.get('degradacion_d', am.get('deg_d', 0))
+        deg_i = am.get('degradacion_i', am.get('deg_i', 0))
+        deg_c = am.get('degradacion_c', am.get('deg_c', 0))
+        filas.append({
+            "vulnerabilidad": am.get('vulnerabilidad', ''),
+            "amenaza": am.get('nombre_amenaza', am.get('nombre', am.get('amenaza', ''))),
+            "cod_amenaza": am.get('codigo_amenaza', am.get('codigo', am.get('cod_amenaza', ''))),
+            "cod_vulnerabilidad": am.get('codigo_vulnerabilidad', am.get('codigo_vuln', am.get('cod_vulnerabilidad', ''))),
+            "deg_d": deg_d / 100 if deg_d > 1 else deg_d,
+            "deg_i": deg_i / 100 if deg_i > 1 else deg_i,
+            "deg_c": deg_c / 100 if deg_c > 1 else deg_c,
+        })
+    return filas
+
+
+def _analizar_con_reintentos(
+    analizador: Analizador,
+    activo: Dict,
+    valoracion: Dict,
+    reintentos: int,
+    inicios: Dict[str, float]
+) -> Dict[str, ResultadoTarea]:
+    """Corre en un hilo del pool; reintenta excepciones y respuestas fallidas"""
+    inicios[activo["ID_Activo"]] = time.monotonic()
+    mensaje = ""
+    for intento in range(reintentos + 1):
+        if intento:
+            time.sleep(ESPERA_REINTENTO * 2 ** (intento - 1))
+        try:
+            exito, amenazas, mensaje = analizador(activo, valoracion)
+        except Exception as e:
+            exito, amenazas, mensaje = False, [], f"Error inesperado: {e}"
+        if exito and amenazas:
+            return {activo["ID_Activo"]: (True, amenazas, mensaje, intento + 1)}
+    return {activo["ID_Activo"]: (False, [], mensaje or "La IA no devolvió amenazas", reintentos + 1)}
+
+
+def _analizar_grupo_con_reintentos(
+    analizador_grupo: AnalizadorGrupo,
+    grupo: List[Tuple[Dict, Dict]],
+    reintentos: int,
+    inicios: Dict[str, float]
+) -> Dict[str, ResultadoTarea]:
+    """Como _analizar_con_reintentos, pero cada reintento solo lleva los activos que fallaron"""
+    ahora = time.monotonic()
+    for activo, _ in grupo:
+        inicios[activo["ID_Activo"]] = ahora
+    resultados: Dict[str, ResultadoTarea] = {}
+    mensajes: Dict[str, str] = {}
+    pendientes = list(grupo)
+    for intento in range(reintentos + 1):
+        if intento:
+            time.sleep(ESPERA_REINTENTO * 2 ** (intento - 1))
+        try:
+            parciales, error = analizador_grupo(pendientes), ""
+        except Exception as e:
+            parciales, error = {}, f"Error inesperado: {e}"
+        fallidos = []
+        for activo, valoracion in pendientes:
+            exito, amenazas, mensaje = parciales.get(activo["ID_Activo"], (False, [], error))
+            if exito and amenazas:
+                resultados[activo["ID_Activo"]] = (True, amenazas, mensaje, intento + 1)
+            else:
+                mensajes[activo["ID_Activo"]] = mensaje
+                fallidos.append((activo, valoracion))
+        pendientes = fallidos
+        if not pendientes:
+            break
+    for activo, _ in pendientes:
+        resultados[activo["ID_Activo"]] = (False, [], mensajes.get(activo["ID_Activo"]) or
+                                           "La IA no devolvió amenazas", reintentos + 1)
+    return resultados
+
+
+def _datos_activos(id_evaluacion: str) -> Tuple[Dict[str, Dict], Dict[str, Dict], set]:
+    """Inventario, valoraciones y activos ya analizados en tres consultas"""
+    inventario = query_rows("INVENTARIO_ACTIVOS", {"ID_Evaluacion": id_evaluacion},
+                            columns=["ID_Activo", "Nombre_Activo", "Tipo_Activo", "Descripcion", "Ubicacion"])
+    activos = {
+        a: {"ID_Activo": a, "Nombre_Activo": n, "Tipo_Activo": t, "Descripcion": d or "", "Ubicacion": u or ""}
+        for a, n, t, d, u in zip(*(inventario[c].tolist() for c in inventario.columns))
+    }
+    valoraciones = {}
+    df = get_valoraciones_evaluacion(id_evaluacion)
+    for v in df.to_dict("records"):
+        valoraciones[v["ID_Activo"]] = {
+            "Valor_D": v.get("Valor_D", 0), "Valor_I": v.get("Valor_I", 0), "Valor_C": v.get("Valor_C", 0),
+            "D": v.get("D", "N"), "I": v.get("I", "N"), "C": v.get("C", "N"),
+            "Criticidad": v.get("Criticidad", 0) or 0,
+            "Criticidad_Nivel": v.get("Criticidad_Nivel", "Sin valorar"),
+        }
+    with get_connection() as conn:
+        analizados = {r[0] for r in conn.execute(
+            "SELECT DISTINCT ID_Activo FROM VULNERABILIDADES_AMENAZAS WHERE ID_Evaluacion = ?", (id_evaluacion,)
+        ).fetchall()}
+    return activos, valoraciones, analizados
+
+
+def _respuestas_control_por_activo(id_evaluacion: str) -> Dict[str, int]:
+    """Preguntas de control distintas respondidas por activo, en una consulta"""
+    from services.ollama_magerit_service import es_pregunta_control
+    df = get_respuestas_evaluacion(id_evaluacion, columns=["ID_Activo", "ID_Pregunta"])
+    conteo: Dict[str, int] = {}
+    for id_activo, id_pregunta in set(zip(df["ID_Activo"].tolist(), df["ID_Pregunta"].tolist())):
+        if es_pregunta_control(id_pregunta):
+            conteo[id_activo] = conteo.get(id_activo, 0) + 1
+    return conteo
+
+
+def ejecutar_analisis_masivo(
+    id_evaluacion: str,
+    ids_activos: Optional[List[str]] = None,
+    analizador: Optional[Analizador] = None,
+    concurrencia: Optional[int] = None,
+    timeout_tarea: float = TIMEOUT_TAREA,
+    reintentos: int = REINTENTOS,
+    reanudar: bool = True,
+    progreso: Optional[Callable[[int, int, TareaAnalisis], None]] = None,
+    tamano_grupo: int = 1,
+    analizador_grupo: Optional[AnalizadorGrupo] = None,
+    modo_rapido: Optional[bool] = None,
+    umbral_confianza: Optional[float] = None
+) -> ResultadoAnalisisMasivo:
+    """
+    Analiza con IA los activos de la evaluación que aún no tienen amenazas.
+
+    Los activos ya analizados o sin valoración D/I/C se omiten. Cada activo
+    se guarda en VULNERABILIDADES_AMENAZAS en cuanto termina, de modo que un
+    corte no pierde el trabajo hecho. Una tarea que supera timeout_tarea se
+    da por fallida (el hilo se abandona y su respuesta se descarta).
+
+    Args:
+        analizador: Función (activo, valoracion) → (éxito, amenazas, mensaje);
+            por defecto analizar_amenazas_por_criticidad
+        concurrencia: Peticiones simultáneas (por defecto OLLAMA_NUM_PARALLEL)
+        progreso: Callback (hechos, total, tarea) en el hilo que llama
+        tamano_grupo: Activos por llamada; con más de 1 se agrupan por
+            (tipo, banda de criticidad) y el timeout escala con el grupo
+        analizador_grupo: Función [(activo, valoracion)] → {ID_Activo: (éxito,
+            amenazas, mensaje)}; por defecto analizar_grupo_por_criticidad
+        modo_rapido: Resolver con el motor heurístico los activos cuya
+            confianza alcance umbral_confianza; None toma la configuración
+            de la evaluación (get_modo_rapido)
+
+    Returns:
+        ResultadoAnalisisMasivo con las tareas en el orden del inventario
+    """
+    from services.ollama_magerit_service import (
+        analizar_amenazas_por_criticidad, analizar_grupo_por_criticidad, agrupar_activos,
+        get_modo_rapido, confianza_heuristica, analisis_ruta_rapida
+    )
+    analizador = analizador or analizar_amenazas_por_criticidad
+    analizador_grupo = analizador_grupo or analizar_grupo_por_criticidad
+    concurrencia = max(1, concurrencia or CONCURRENCIA_DEFAULT)
+    t0 = time.perf_counter()
+
+    activos, valoraciones, analizados = _datos_activos(id_evaluacion)
+    if ids_activos is None:
+        ids_activos = list(activos)
+    id_lote = preparar_lote(id_evaluacion, [a for a in ids_activos if a in activos], reanudar=reanudar)
+    tareas = [t for t in get_tareas_lote(id_lote) if t.estado == "pendiente"]
+    total = len(tareas)
+    hechos = 0
+
+    # Omisiones que no requieren IA
+    omitidas, a_analizar = [], []
+    for tarea in tareas:
+        if tarea.id_activo in analizados:
+            tarea.estado, tarea.mensaje = "omitido", "Ya analizado"
+        elif tarea.id_activo not in activos:
+            tarea.estado, tarea.mensaje = "omitido", "Activo eliminado del inventario"
+        elif not valoraciones.get(tarea.id_activo, {}).get("Criticidad"):
+            tarea.estado, tarea.mensaje = "omitido", "Sin valoración DIC"
+        else:
+            tarea.estado = "procesando"
+            a_analizar.append(tarea)
+            continue
+        omitidas.append(tarea)
+    _actualizar_tareas(id_lote, omitidas + a_analizar)
+    for tarea in omitidas:
+        hechos += 1
+        if progreso:
+            progreso(hechos, total, tarea)
+
+    # Ruta rápida: el motor heurístico resuelve los activos no ambiguos sin IA
+    rapido_evaluacion, umbral_evaluacion = get_modo_rapido(id_evaluacion)
+    if modo_rapido is None:
+        modo_rapido = rapido_evaluacion
+    umbral = umbral_confianza if umbral_confianza is not None else umbral_evaluacion
+    if modo_rapido and a_analizar:
+        respuestas_control = _respuestas_control_por_activo(id_evaluacion)
+        resueltas, ambiguas = [], []
+        for tarea in a_analizar:
+            activo = activos[tarea.id_activo]
+            confianza = confianza_heuristica(activo["Tipo_Activo"], respuestas_control.get(tarea.id_activo, 0))
+            if confianza < umbral:
+                ambiguas.append(tarea)
+                continue
+            tarea.ruta, tarea.intentos = "heuristica", 1
+            exito, amenazas, mensaje = analisis_ruta_rapida(activo, valoraciones[tarea.id_activo], confianza)
+            _cerrar_tarea(id_evaluacion, activo, tarea, exito, amenazas, mensaje)
+            resueltas.append(tarea)
+        _actualizar_tareas(id_lote, resueltas)
+        for tarea in resueltas:
+            hechos += 1
+            if progreso:
+                progreso(hechos, total, tarea)
+        a_analizar = ambiguas
+    for tarea in a_analizar:
+        tarea.ruta = "ia"
+
+    inicios: Dict[str, float] = {}
+    executor = ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix="analisis_ia")
+    try:
+        # Cada futuro resuelve un bloque de tareas (una sola en el modo individual)
+        en_curso: Dict = {}
+        if tamano_grupo > 1:
+            por_id = {t.id_activo: t for t in a_analizar}
+            grupos = agrupar_activos([(activos[t.id_activo], valoraciones[t.id_activo]) for t in a_analizar],
+                                     tamano_grupo)
+            for grupo in grupos:
+                futuro = executor.submit(_analizar_grupo_con_reintentos, analizador_grupo, grupo,
+                                         reintentos, inicios)
+                en_curso[futuro] = [por_id[activo["ID_Activo"]] for activo, _ in grupo]
+        else:
+            for t in a_analizar:
+                futuro = executor.submit(_analizar_con_reintentos, analizador, activos[t.id_activo],
+                                         valoraciones[t.id_activo], reintentos, inicios)
+                en_curso[futuro] = [t]
+        while en_curso:
+            listos, _ = wait(en_curso, timeout=1.0, return_when=FIRST_COMPLETED)
+            ahora = time.monotonic()
+            vencidos = [f for f in en_curso if f not in listos
+                        and ahora - inicios.get(en_curso[f][0].id_activo, ahora) > timeout_tarea * len(en_curso[f])]
+            for futuro in list(listos) + vencidos:
+                bloque = en_curso.pop(futuro)
+                if futuro in listos:
+                    resultados = futuro.result()
+                else:
+                    futuro.cancel()
+                    limite = timeout_tarea * len(bloque)
+                    resultados = {t.id_activo: (False, [], f"Timeout después de {limite:.0f} s", reintentos + 1)
+                                  for t in bloque}
+                for tarea in bloque:
+                    tarea.segundos = ahora - inicios.get(tarea.id_activo, ahora)
+                    exito, amenazas, mensaje, tarea.intentos = resultados[tarea.id_activo]
+                    _cerrar_tarea(id_evaluacion, activos[tarea.id_activo], tarea, exito, amenazas, mensaje)
+                _actualizar_tareas(id_lote, bloque)
+                for tarea in bloque:
+                    hechos += 1
+                    if progreso:
+                        progreso(hechos, total, tarea)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return ResultadoAnalisisMasivo(
+        id_lote=id_lote, id_evaluacion=id_evaluacion, tareas=get_tareas_lote(id_lote),
+        concurrencia=concurrencia, segundos=time.perf_counter() - t0
+    )
+
+
+def _cerrar_tarea(id_evaluacion: str, activo: Dict, tarea: TareaAnalisis,
+                  exito: bool, amenazas: List[Dict], mensaje: str):
+    """Guarda las amenazas del activo y fija el estado final de la tarea"""
+    if not exito:
+        tarea.estado, tarea.mensaje = "error", mensaje
+        return
+    try:
+        guardadas = agregar_vulnerabilidades_amenazas(
+            id_evaluacion, activo["ID_Activo"], activo["Nombre_Activo"], filas_vulnerabilidades(amenazas)
+        ).filas
+    except Exception as e:
+        tarea.estado, tarea.mensaje = "error", f"Error al guardar: {e}"
+        return
+    tarea.estado = "completado" if guardadas else "error"
+    tarea.num_amenazas = guardadas
+    tarea.mensaje = mensaje if guardadas else "No se guardó ninguna amenaza"
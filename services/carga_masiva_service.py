@@ -14,8 +14,8 @@ from dataclasses import dataclass, field, asdict
 import hashlib
 import re
 
-from services.database_service import read_table, insert_rows
-from services.activo_service import validar_duplicado, normalizar_nombre
+from services.database_service import insert_rows, count_rows
+from services.activo_service import claves_activos_evaluacion, generar_clave_activo
 
 
 # ============================================================================
@@ -71,6 +71,7 @@ class ResultadoCarga:
     timestamp: str = ""
     formato_origen: str = ""
     mensaje: str = ""
+    filas_por_segundo: float = 0.0
 
 
 # ============================================================================
@@ -319,14 +320,12 @@ def _procesar_lista_activos(activos_raw: List[Dict], eval_id: str,
     activos_a_insertar = []
     
     # Obtener siguiente número de activo
-    activos_existentes = read_table("INVENTARIO_ACTIVOS")
-    if activos_existentes.empty:
-        siguiente_num = 1
-    else:
-        activos_eval = activos_existentes[
-            activos_existentes["ID_Evaluacion"].astype(str) == str(eval_id)
-        ]
-        siguiente_num = len(activos_eval) + 1
+    siguiente_num = count_rows("INVENTARIO_ACTIVOS", {"ID_Evaluacion": eval_id}) + 1
+    
+    # Claves de los activos ya registrados (una sola consulta para todo el lote)
+    claves_existentes = claves_activos_evaluacion(eval_id)
+    claves_procesadas = set()
+    fecha_creacion = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
     # Validar y procesar cada activo
     for idx, activo_raw in enumerate(activos_raw, start=1):
@@ -337,30 +336,25 @@ def _procesar_lista_activos(activos_raw: List[Dict], eval_id: str,
             resultado.total_errores += 1
             continue
         
-        # Verificar duplicados
-        es_dup, msg_dup = validar_duplicado(
+        clave = generar_clave_activo(
             eval_id,
             activo_norm["Nombre_Activo"],
             activo_norm["Ubicacion"],
             activo_norm["Tipo_Servicio"]
         )
         
-        if es_dup:
+        # Verificar duplicados
+        if clave in claves_existentes:
             resultado.duplicados.append(f"Fila {idx}: {activo_norm['Nombre_Activo']}")
             resultado.total_duplicados += 1
             continue
         
         # También verificar duplicados internos (dentro del mismo archivo)
-        clave_interna = f"{normalizar_nombre(activo_norm['Nombre_Activo'])}_{normalizar_nombre(activo_norm['Ubicacion'])}_{normalizar_nombre(activo_norm['Tipo_Servicio'])}"
-        claves_ya_procesadas = [
-            f"{normalizar_nombre(a['Nombre_Activo'])}_{normalizar_nombre(a['Ubicacion'])}_{normalizar_nombre(a['Tipo_Servicio'])}"
-            for a in activos_a_insertar
-        ]
-        
-        if clave_interna in claves_ya_procesadas:
+        if clave in claves_procesadas:
             resultado.duplicados.append(f"Fila {idx}: {activo_norm['Nombre_Activo']} (duplicado interno)")
             resultado.total_duplicados += 1
             continue
+        claves_procesadas.add(clave)
         
         # Crear registro completo
         nuevo_id = f"ACT-{eval_id}-{str(siguiente_num).zfill(3)}"
@@ -378,7 +372,7 @@ def _procesar_lista_activos(activos_raw: List[Dict], eval_id: str,
             "ID_Host": activo_norm.get("ID_Host", ""),
             "Tipo_Dependencia": activo_norm.get("Tipo_Dependencia", "total"),
             "Estado": "Pendiente",
-            "Fecha_Creacion": dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            "Fecha_Creacion": fecha_creacion
         }
         
         activos_a_insertar.append(activo_completo)
@@ -388,8 +382,9 @@ def _procesar_lista_activos(activos_raw: List[Dict], eval_id: str,
     # Insertar en base de datos
     if activos_a_insertar:
         try:
-            insert_rows("INVENTARIO_ACTIVOS", activos_a_insertar)
-            resultado.total_insertados = len(activos_a_insertar)
+            escritura = insert_rows("INVENTARIO_ACTIVOS", activos_a_insertar)
+            resultado.total_insertados = escritura.filas
+            resultado.filas_por_segundo = escritura.filas_por_segundo
         except Exception as e:
             resultado.mensaje = f"❌ Error al insertar en base de datos: {str(e)}"
             resultado.exito = False
@@ -400,7 +395,10 @@ def _procesar_lista_activos(activos_raw: List[Dict], eval_id: str,
     
     partes_mensaje = []
     if resultado.total_insertados > 0:
-        partes_mensaje.append(f"✅ {resultado.total_insertados} activos insertados")
+        partes_mensaje.append(
+            f"✅ {resultado.total_insertados} activos insertados "
+            f"({resultado.filas_por_segundo:,.0f} filas/s)"
+        )
     if resultado.total_duplicados > 0:
         partes_mensaje.append(f"⚠️ {resultado.total_duplicados} duplicados omitidos")
     if resultado.total_errores > 0:
@@ -0,0 +1,226 @@
+"""
+Registro de catálogos en memoria - Proyecto TITA
+================================================
+Los catálogos MAGERIT/ISO y los JSON de knowledge_base/ son estáticos
+durante un análisis, pero cada servicio los volvía a leer (read_table +
+iterrows) en cada activo. Aquí se cargan una vez por proceso en estructuras
+indexadas y se sirven también los fragmentos de prompt ya construidos.
+
+Invalidación:
+- Base de datos: versión = (ruta de la BD, PRAGMA schema_version, versión de
+  CATALOGOS_VERSION). Recrear una tabla (seed_catalogos_magerit.py) cambia
+  schema_version; las cargas que editan filas llaman a
+  marcar_catalogos_modificados().
+- Archivos JSON: por fecha de modificación y tamaño.
+
+Los diccionarios devueltos son compartidos: tratarlos como solo lectura.
+
+Uso:
+    from services.catalogos_service import get_catalogos, fragmento_catalogo
+    catalogos = get_catalogos()
+    catalogos.amenazas["A.24"]["amenaza"]
+
+    @fragmento_catalogo()
+    def construir_contexto() -> str: ...
+"""
+import os
+import json
+import sqlite3
+import datetime as dt
+import functools
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from services import database_service as db
+
+
+TABLA_AMENAZAS = "CATALOGO_AMENAZAS_MAGERIT"
+TABLA_CONTROLES = "CATALOGO_CONTROLES_ISO27002"
+DIR_KNOWLEDGE_BASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "knowledge_base")
+
+
+@dataclass
+class Catalogos:
+    """Catálogos de la BD indexados por código"""
+    version: Tuple
+    amenazas: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    controles: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    amenazas_por_tipo: Dict[str, List[str]] = field(default_factory=dict)
+    controles_por_categoria: Dict[str, List[str]] = field(default_factory=dict)
+    # Filas completas en el orden de la tabla (knowledge_base_service)
+    registros_amenazas: List[Dict[str, Any]] = field(default_factory=list)
+    registros_controles: List[Dict[str, Any]] = field(default_factory=list)
+
+
+_lock = threading.RLock()
+_catalogos: Optional[Catalogos] = None
+_fragmentos: Dict[str, Tuple[Tuple, Any]] = {}
+_json: Dict[str, Tuple[Tuple, Any]] = {}
+_metricas = {"cargas_bd": 0, "cargas_json": 0, "fragmentos_construidos": 0}
+
+
+# ==================== VERSIONES ====================
+
+def version_bd() -> Tuple:
+    """Versión de los catálogos en la BD (una consulta barata, sin leer filas)"""
+    try:
+        with db.get_connection() as conn:
+            esquema = conn.execute("PRAGMA schema_version").fetchone()[0]
+            try:
+                versiones = tuple(tuple(fila) for fila in conn.execute(
+                    "SELECT Catalogo, Version FROM CATALOGOS_VERSION ORDER BY Catalogo"))
+            except sqlite3.OperationalError:
+                versiones = ()
+    except sqlite3.Error:
+        return (db.DB_PATH, None, ())
+    return (db.DB_PATH, esquema, versiones)
+
+
+def version_archivo(ruta: str) -> Tuple:
+    """(mtime, tamaño) del archivo o None si no existe"""
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return (ruta, None)
+    return (ruta, estado.st_mtime_ns, estado.st_size)
+
+
+def marcar_catalogos_modificados(*catalogos: str):
+    """Invalida el registro en todos los procesos tras editar filas de un catálogo"""
+    catalogos = catalogos or (TABLA_AMENAZAS, TABLA_CONTROLES)
+    ahora = dt.datetime.now().isoformat()
+    try:
+        with db.get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO CATALOGOS_VERSION (Catalogo, Version, Fecha_Modificacion) VALUES (?, 1, ?)
+                ON CONFLICT(Catalogo) DO UPDATE SET Version = Version + 1,
+                    Fecha_Modificacion = excluded.Fecha_Modificacion
+            ''', [(catalogo, ahora) for catalogo in catalogos])
+    except sqlite3.OperationalError:
+        # BD sin migrar: al menos este proceso deja de usar la copia vieja
+        pass
+    invalidar()
+
+
+def invalidar():
+    """Descarta todo lo memorizado en este proceso"""
+    global _catalogos
+    with _lock:
+        _catalogos = None
+        _fragmentos.clear()
+        _json.clear()
+
+
+# ==================== CARGA ====================
+
+def _registros(tabla: str) -> List[Dict[str, Any]]:
+    try:
+        df = db.read_table(tabla)
+    except Exception:
+        return []
+    if df is None or df.empty:
+        return []
+    # NaN → None para que .get(col, defecto) y los f-strings se comporten como antes
+    return df.astype(object).where(pd.notna(df), None).to_dict("records")
+
+
+def _cargar(version: Tuple) -> Catalogos:
+    catalogos = Catalogos(version=version,
+                          registros_amenazas=_registros(TABLA_AMENAZAS),
+                          registros_controles=_registros(TABLA_CONTROLES))
+    for fila in catalogos.registros_amenazas:
+        codigo = fila.get("codigo")
+        if codigo is None:
+            continue
+        catalogos.amenazas[codigo] = {
+            "amenaza": fila.get("amenaza"),
+            "tipo_amenaza": fila.get("tipo_amenaza"),
+            "dimension_afectada": fila.get("dimension_afectada") or "D",
+            "descripcion": fila.get("descripcion") or ""
+        }
+        catalogos.amenazas_por_tipo.setdefault(fila.get("tipo_amenaza") or "Otros", []).append(codigo)
+    for fila in catalogos.registros_controles:
+        codigo = fila.get("codigo")
+        if codigo is None:
+            continue
+        catalogos.controles[codigo] = {
+            "nombre": fila.get("nombre"),
+            "categoria": fila.get("categoria"),
+            "descripcion": fila.get("descripcion") or ""
+        }
+        catalogos.controles_por_categoria.setdefault(fila.get("categoria") or "Otros", []).append(codigo)
+    _metricas["cargas_bd"] += 1
+    return catalogos
+
+
+def get_catalogos() -> Catalogos:
+    """Catálogos vigentes; solo se recargan si cambió la versión de la BD"""
+    global _catalogos
+    version = version_bd()
+    with _lock:
+        if _catalogos is None or _catalogos.version != version:
+            _catalogos = _cargar(version)
+            # Los fragmentos dependen de los catálogos anteriores
+            _fragmentos.clear()
+        return _catalogos
+
+
+def cargar_json(ruta: str, defecto: Any = None) -> Any:
+    """Contenido de un JSON, releído solo si el archivo cambió"""
+    version = version_archivo(ruta)
+    with _lock:
+        memorizado = _json.get(ruta)
+        if memorizado is not None and memorizado[0] == version:
+            return memorizado[1]
+    if version[1] is None:
+        return defecto
+    with open(ruta, "r", encoding="utf-8") as f:
+        contenido = json.load(f)
+    with _lock:
+        _json[ruta] = (version, contenido)
+        _metricas["cargas_json"] += 1
+    return contenido
+
+
+def ruta_knowledge_base(nombre: str) -> str:
+    return os.path.join(DIR_KNOWLEDGE_BASE, nombre)
+
+
+# ==================== FRAGMENTOS DE PROMPT ====================
+
+def fragmento(nombre: str, construir: Callable[[], Any], archivos: Tuple[str, ...] = ()) -> Any:
+    """
+    Resultado memorizado de construir() mientras no cambien los catálogos de
+    la BD ni los archivos indicados.
+    """
+    version = (get_catalogos().version,) + tuple(version_archivo(ruta) for ruta in archivos)
+    with _lock:
+        memorizado = _fragmentos.get(nombre)
+        if memorizado is not None and memorizado[0] == version:
+            return memorizado[1]
+    valor = construir()
+    with _lock:
+        _fragmentos[nombre] = (version, valor)
+        _metricas["fragmentos_construidos"] += 1
+    return valor
+
+
+def fragmento_catalogo(*archivos: str):
+    """Decorador de funciones sin argumentos que construyen texto a partir de los catálogos"""
+    def decorador(funcion: Callable[[], Any]):
+        nombre = f"{funcion.__module__}.{funcion.__qualname__}"
+
+        @functools.wraps(funcion)
+        def envoltura():
+            return fragmento(nombre, funcion, archivos)
+        envoltura.sin_cache = funcion
+        return envoltura
+    return decorador
+
+
+def metricas_registro() -> Dict[str, int]:
+    with _lock:
+        return dict(_metricas, fragmentos_en_memoria=len(_fragmentos), json_en_memoria=len(_json))
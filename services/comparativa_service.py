@@ -2,12 +2,23 @@
 SERVICIO DE COMPARATIVA/REEVALUACIÓN
 =====================================
 Compara evaluaciones y detecta mejoras/deterioros.
+
+Tendencias sobre N evaluaciones:
+- RESUMEN_EVALUACIONES guarda un resumen de riesgo por evaluación con la
+  versión de datos con la que se calculó; solo se recalculan (en una
+  consulta agrupada) las evaluaciones cuyos datos cambiaron.
+- Los deltas entre evaluaciones consecutivas, globales y por activo, salen
+  de funciones de ventana (LAG / FIRST_VALUE) en una sola consulta.
 """
 import json
+import sqlite3
 import datetime as dt
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass
-from services.database_service import get_connection
+
+import pandas as pd
+
+from services.database_service import get_connection, write_transaction
 
 
 @dataclass 
@@ -38,111 +49,74 @@ def comparar_evaluaciones(eval_origen_id: str, eval_destino_id: str) -> Optional
     eval_destino: Evaluación actual (para comparar)
     """
     try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Obtener resultados de evaluación origen
-            cursor.execute('''
-                SELECT ID_Activo, Nombre_Activo, Riesgo_Promedio, Riesgo_Maximo,
-                       Riesgo_Inherente, Riesgo_Residual
-                FROM RESULTADOS_MAGERIT
-                WHERE ID_Evaluacion = ?
-            ''', [eval_origen_id])
-            
-            resultados_origen = {}
-            riesgos_origen = []
-            for row in cursor.fetchall():
-                resultados_origen[row[0]] = {
-                    "nombre": row[1],
-                    "riesgo_promedio": row[2] or row[4] or 0,
-                    "riesgo_maximo": row[3] or row[4] or 0,
-                    "riesgo_residual": row[5] or 0
-                }
-                riesgos_origen.append(row[2] or row[4] or 0)
-            
-            # Obtener resultados de evaluación destino
-            cursor.execute('''
-                SELECT ID_Activo, Nombre_Activo, Riesgo_Promedio, Riesgo_Maximo,
-                       Riesgo_Inherente, Riesgo_Residual
-                FROM RESULTADOS_MAGERIT
-                WHERE ID_Evaluacion = ?
-            ''', [eval_destino_id])
-            
-            resultados_destino = {}
-            riesgos_destino = []
-            for row in cursor.fetchall():
-                resultados_destino[row[0]] = {
-                    "nombre": row[1],
-                    "riesgo_promedio": row[2] or row[4] or 0,
-                    "riesgo_maximo": row[3] or row[4] or 0,
-                    "riesgo_residual": row[5] or 0
-                }
-                riesgos_destino.append(row[2] or row[4] or 0)
-            
-            # Calcular promedios y máximos
-            prom_origen = sum(riesgos_origen) / len(riesgos_origen) if riesgos_origen else 0
-            prom_destino = sum(riesgos_destino) / len(riesgos_destino) if riesgos_destino else 0
-            max_origen = max(riesgos_origen) if riesgos_origen else 0
-            max_destino = max(riesgos_destino) if riesgos_destino else 0
-            
-            # Comparar activos comunes
-            activos_comunes = set(resultados_origen.keys()) & set(resultados_destino.keys())
-            
-            mejoras = []
-            deterioros = []
-            sin_cambio = 0
-            
-            for activo_id in activos_comunes:
-                origen = resultados_origen[activo_id]
-                destino = resultados_destino[activo_id]
-                
-                delta = destino["riesgo_promedio"] - origen["riesgo_promedio"]
-                
-                if delta < -0.5:  # Mejora significativa
-                    mejoras.append({
-                        "id_activo": activo_id,
-                        "nombre": origen["nombre"],
-                        "riesgo_anterior": round(origen["riesgo_promedio"], 2),
-                        "riesgo_actual": round(destino["riesgo_promedio"], 2),
-                        "delta": round(delta, 2),
-                        "porcentaje": round((delta / origen["riesgo_promedio"]) * 100, 1) if origen["riesgo_promedio"] > 0 else 0
-                    })
-                elif delta > 0.5:  # Deterioro
-                    deterioros.append({
-                        "id_activo": activo_id,
-                        "nombre": origen["nombre"],
-                        "riesgo_anterior": round(origen["riesgo_promedio"], 2),
-                        "riesgo_actual": round(destino["riesgo_promedio"], 2),
-                        "delta": round(delta, 2),
-                        "porcentaje": round((delta / origen["riesgo_promedio"]) * 100, 1) if origen["riesgo_promedio"] > 0 else 0
-                    })
-                else:
-                    sin_cambio += 1
-            
-            # Crear objeto comparativa
-            comparativa = ComparativaEvaluacion(
-                eval_origen=eval_origen_id,
-                eval_destino=eval_destino_id,
-                fecha_comparacion=dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                total_activos_origen=len(resultados_origen),
-                total_activos_destino=len(resultados_destino),
-                riesgo_promedio_origen=round(prom_origen, 2),
-                riesgo_promedio_destino=round(prom_destino, 2),
-                delta_riesgo_promedio=round(prom_destino - prom_origen, 2),
-                riesgo_maximo_origen=round(max_origen, 2),
-                riesgo_maximo_destino=round(max_destino, 2),
-                delta_riesgo_maximo=round(max_destino - max_origen, 2),
-                activos_mejorados=len(mejoras),
-                activos_deteriorados=len(deterioros),
-                activos_sin_cambio=sin_cambio,
-                detalle_mejoras=mejoras,
-                detalle_deterioros=deterioros
-            )
-            
-            # Guardar en historial
-            guardar_comparativa(comparativa)
-            
-            return comparativa
+        actualizar_resumenes([eval_origen_id, eval_destino_id])
+        resumen = tendencia_evaluaciones([eval_origen_id, eval_destino_id]).set_index("ID_Evaluacion")
+        
+        def _global(eval_id: str, columna: str) -> float:
+            if eval_id not in resumen.index:
+                return 0
+            return float(resumen.at[eval_id, columna])
+        
+        prom_origen = _global(eval_origen_id, "Riesgo_Efectivo_Promedio")
+        prom_destino = _global(eval_destino_id, "Riesgo_Efectivo_Promedio")
+        max_origen = _global(eval_origen_id, "Riesgo_Efectivo_Maximo")
+        max_destino = _global(eval_destino_id, "Riesgo_Efectivo_Maximo")
+        
+        # Riesgo de cada activo común en ambas evaluaciones (última fila por activo)
+        activos = tendencia_activos([eval_origen_id, eval_destino_id])
+        origen = activos[activos["ID_Evaluacion"] == eval_origen_id].set_index("ID_Activo")
+        destino = activos[activos["ID_Evaluacion"] == eval_destino_id].set_index("ID_Activo")
+        comunes = origen[["Nombre_Activo", "Riesgo"]].join(
+            destino[["Riesgo"]], how="inner", lsuffix="_Anterior", rsuffix="_Actual"
+        )
+        comunes["Delta"] = comunes["Riesgo_Actual"] - comunes["Riesgo_Anterior"]
+        
+        mejoras = []
+        deterioros = []
+        for activo_id, nombre, anterior, actual, delta in zip(
+            comunes.index, comunes["Nombre_Activo"], comunes["Riesgo_Anterior"],
+            comunes["Riesgo_Actual"], comunes["Delta"]
+        ):
+            if -0.5 <= delta <= 0.5:
+                continue
+            detalle = {
+                "id_activo": activo_id,
+                "nombre": nombre,
+                "riesgo_anterior": round(float(anterior), 2),
+                "riesgo_actual": round(float(actual), 2),
+                "delta": round(float(delta), 2),
+                "porcentaje": round(float(delta / anterior) * 100, 1) if anterior > 0 else 0
+            }
+            # Mejora significativa (delta < -0.5) o deterioro (delta > 0.5)
+            (mejoras if delta < 0 else deterioros).append(detalle)
+        mejoras.sort(key=lambda d: d["delta"])
+        deterioros.sort(key=lambda d: -d["delta"])
+        sin_cambio = len(comunes) - len(mejoras) - len(deterioros)
+        
+        # Crear objeto comparativa
+        comparativa = ComparativaEvaluacion(
+            eval_origen=eval_origen_id,
+            eval_destino=eval_destino_id,
+            fecha_comparacion=dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            total_activos_origen=len(origen),
+            total_activos_destino=len(destino),
+            riesgo_promedio_origen=round(prom_origen, 2),
+            riesgo_promedio_destino=round(prom_destino, 2),
+            delta_riesgo_promedio=round(prom_destino - prom_origen, 2),
+            riesgo_maximo_origen=round(max_origen, 2),
+            riesgo_maximo_destino=round(max_destino, 2),
+            delta_riesgo_maximo=round(max_destino - max_origen, 2),
+            activos_mejorados=len(mejoras),
+            activos_deteriorados=len(deterioros),
+            activos_sin_cambio=sin_cambio,
+            detalle_mejoras=mejoras,
+            detalle_deterioros=deterioros
+        )
+        
+        # Guardar en historial
+        guardar_comparativa(comparativa)
+        
+        return comparativa
             
     except Exception as e:
         print(f"Error comparando evaluaciones: {e}")
@@ -218,31 +192,161 @@ def listar_historial_comparativas(eval_id: str = None) -> List[Dict]:
 
 
 def get_tendencia_riesgo(eval_ids: List[str]) -> List[Dict]:
-    """Obtiene la tendencia de riesgo a lo largo de varias evaluaciones"""
+    """
+    Obtiene la tendencia de riesgo a lo largo de varias evaluaciones (en el
+    orden de eval_ids), con el delta respecto a la evaluación anterior en el
+    tiempo dentro de la selección.
+    """
     tendencia = []
     try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            for eval_id in eval_ids:
-                cursor.execute('''
-                    SELECT e.Nombre, e.Fecha,
-                           AVG(r.Riesgo_Promedio), MAX(r.Riesgo_Maximo)
-                    FROM EVALUACIONES e
-                    LEFT JOIN RESULTADOS_MAGERIT r ON e.ID_Evaluacion = r.ID_Evaluacion
-                    WHERE e.ID_Evaluacion = ?
-                    GROUP BY e.ID_Evaluacion
-                ''', [eval_id])
-                
-                row = cursor.fetchone()
-                if row:
-                    tendencia.append({
-                        "evaluacion": row[0],
-                        "fecha": row[1],
-                        "riesgo_promedio": round(row[2] or 0, 2),
-                        "riesgo_maximo": round(row[3] or 0, 2)
-                    })
+        actualizar_resumenes(eval_ids)
+        resumen = tendencia_evaluaciones(eval_ids).set_index("ID_Evaluacion")
+        for eval_id in eval_ids:
+            if eval_id not in resumen.index:
+                continue
+            fila = resumen.loc[eval_id]
+            tendencia.append({
+                "evaluacion": fila["Evaluacion"],
+                "fecha": fila["Fecha"],
+                "riesgo_promedio": round(float(fila["Riesgo_Promedio"]), 2),
+                "riesgo_maximo": round(float(fila["Riesgo_Maximo"]), 2),
+                "delta_promedio": None if pd.isna(fila["Delta_Promedio"]) else round(float(fila["Delta_Promedio"]), 2),
+                "delta_maximo": None if pd.isna(fila["Delta_Maximo"]) else round(float(fila["Delta_Maximo"]), 2),
+                "activos": int(fila["Num_Activos"])
+            })
     except Exception as e:
         print(f"Error obteniendo tendencia: {e}")
     
     return tendencia
+
+
+# ==================== TENDENCIA MULTI-EVALUACIÓN ====================
+
+# Riesgo de un resultado MAGERIT tal como lo usa la comparativa:
+# Riesgo_Promedio, o Riesgo_Inherente si no hay, o 0
+RIESGO_EFECTIVO = "COALESCE(NULLIF(r.Riesgo_Promedio, 0), NULLIF(r.Riesgo_Inherente, 0), 0)"
+BLOQUE_IDS = 500  # evaluaciones por consulta (límite de variables SQL)
+
+
+def _filtro_ids(columna: str, eval_ids: Optional[List[str]]) -> Tuple[str, list]:
+    if eval_ids is None:
+        return "", []
+    return f"AND {columna} IN ({', '.join('?' * len(eval_ids))})", list(eval_ids)
+
+
+def _consulta(sql: str, params: list) -> pd.DataFrame:
+    try:
+        with get_connection() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+    except (sqlite3.Error, pd.errors.DatabaseError) as e:
+        print(f"Error consultando tendencia: {e}")
+        return pd.DataFrame()
+
+
+def actualizar_resumenes(eval_ids: List[str] = None) -> int:
+    """
+    Recalcula los resúmenes de RESUMEN_EVALUACIONES cuya versión de datos
+    quedó atrás (de todas las evaluaciones o solo de eval_ids). Sin cambios
+    es una sola consulta de lectura. Devuelve cuántos se recalcularon.
+    """
+    eval_ids = list(dict.fromkeys(eval_ids)) if eval_ids is not None else None
+    filtro, params = _filtro_ids("e.ID_Evaluacion", eval_ids)
+    with get_connection() as conn:
+        obsoletas = [fila[0] for fila in conn.execute(f'''
+            SELECT e.ID_Evaluacion
+            FROM EVALUACIONES e
+            LEFT JOIN VERSION_DATOS v ON v.ID_Evaluacion = e.ID_Evaluacion
+            LEFT JOIN RESUMEN_EVALUACIONES s ON s.ID_Evaluacion = e.ID_Evaluacion
+            WHERE (s.Version_Datos IS NULL OR s.Version_Datos != COALESCE(v.Version, 0)) {filtro}
+        ''', params).fetchall()]
+    if not obsoletas:
+        return 0
+    
+    # La versión se lee en la misma transacción que los datos que resume
+    with write_transaction() as conn:
+        for inicio in range(0, len(obsoletas), BLOQUE_IDS):
+            bloque = obsoletas[inicio:inicio + BLOQUE_IDS]
+            conn.execute(f'''
+                INSERT INTO RESUMEN_EVALUACIONES (
+                    ID_Evaluacion, Version_Datos, Num_Resultados, Num_Activos,
+                    Riesgo_Promedio, Riesgo_Maximo, Riesgo_Efectivo_Promedio, Riesgo_Efectivo_Maximo,
+                    Riesgo_Residual_Promedio, Fecha_Calculo
+                )
+                SELECT e.ID_Evaluacion, COALESCE(v.Version, 0), COUNT(r.ID_Activo), COUNT(DISTINCT r.ID_Activo),
+                       AVG(r.Riesgo_Promedio), MAX(r.Riesgo_Maximo),
+                       AVG(CASE WHEN r.ID_Evaluacion IS NOT NULL THEN {RIESGO_EFECTIVO} END),
+                       MAX(CASE WHEN r.ID_Evaluacion IS NOT NULL THEN {RIESGO_EFECTIVO} END),
+                       AVG(r.Riesgo_Residual), datetime('now')
+                FROM EVALUACIONES e
+                LEFT JOIN VERSION_DATOS v ON v.ID_Evaluacion = e.ID_Evaluacion
+                LEFT JOIN RESULTADOS_MAGERIT r ON r.ID_Evaluacion = e.ID_Evaluacion
+                WHERE e.ID_Evaluacion IN ({', '.join('?' * len(bloque))})
+                GROUP BY e.ID_Evaluacion
+                ON CONFLICT(ID_Evaluacion) DO UPDATE SET
+                    Version_Datos = excluded.Version_Datos,
+                    Num_Resultados = excluded.Num_Resultados,
+                    Num_Activos = excluded.Num_Activos,
+                    Riesgo_Promedio = excluded.Riesgo_Promedio,
+                    Riesgo_Maximo = excluded.Riesgo_Maximo,
+                    Riesgo_Efectivo_Promedio = excluded.Riesgo_Efectivo_Promedio,
+                    Riesgo_Efectivo_Maximo = excluded.Riesgo_Efectivo_Maximo,
+                    Riesgo_Residual_Promedio = excluded.Riesgo_Residual_Promedio,
+                    Fecha_Calculo = excluded.Fecha_Calculo
+            ''', bloque)
+    return len(obsoletas)
+
+
+def tendencia_evaluaciones(eval_ids: List[str] = None) -> pd.DataFrame:
+    """
+    Resúmenes de las evaluaciones (todas o eval_ids) en orden cronológico con
+    el delta de riesgo promedio y máximo respecto a la anterior de la serie.
+    Lee RESUMEN_EVALUACIONES: el coste no depende del número de resultados.
+    """
+    filtro, params = _filtro_ids("s.ID_Evaluacion", eval_ids)
+    return _consulta(f'''
+        WITH serie AS (
+            SELECT s.ID_Evaluacion, e.Nombre AS Evaluacion, e.Fecha, s.Num_Activos,
+                   COALESCE(s.Riesgo_Promedio, 0) AS Riesgo_Promedio,
+                   COALESCE(s.Riesgo_Maximo, 0) AS Riesgo_Maximo,
+                   COALESCE(s.Riesgo_Efectivo_Promedio, 0) AS Riesgo_Efectivo_Promedio,
+                   COALESCE(s.Riesgo_Efectivo_Maximo, 0) AS Riesgo_Efectivo_Maximo,
+                   COALESCE(s.Riesgo_Residual_Promedio, 0) AS Riesgo_Residual_Promedio
+            FROM RESUMEN_EVALUACIONES s
+            JOIN EVALUACIONES e ON e.ID_Evaluacion = s.ID_Evaluacion
+            WHERE 1 = 1 {filtro}
+        )
+        SELECT *,
+               Riesgo_Promedio - LAG(Riesgo_Promedio) OVER w AS Delta_Promedio,
+               Riesgo_Maximo - LAG(Riesgo_Maximo) OVER w AS Delta_Maximo,
+               Riesgo_Promedio - FIRST_VALUE(Riesgo_Promedio) OVER w AS Delta_Acumulado
+        FROM serie
+        WINDOW w AS (ORDER BY Fecha, ID_Evaluacion)
+        ORDER BY Fecha, ID_Evaluacion
+    ''', params)
+
+
+def tendencia_activos(eval_ids: List[str] = None) -> pd.DataFrame:
+    """
+    Riesgo de cada activo en cada evaluación (la última fila MAGERIT del
+    activo) en orden cronológico, con el delta respecto a su evaluación
+    anterior (LAG) y el acumulado desde la primera en que aparece.
+    """
+    filtro, params = _filtro_ids("r.ID_Evaluacion", eval_ids)
+    return _consulta(f'''
+        WITH ultimos AS (
+            SELECT r.ID_Evaluacion, r.ID_Activo, r.Nombre_Activo, e.Fecha,
+                   {RIESGO_EFECTIVO} AS Riesgo,
+                   COALESCE(r.Riesgo_Residual, 0) AS Riesgo_Residual,
+                   ROW_NUMBER() OVER (PARTITION BY r.ID_Evaluacion, r.ID_Activo ORDER BY r.rowid DESC) AS n
+            FROM RESULTADOS_MAGERIT r
+            LEFT JOIN EVALUACIONES e ON e.ID_Evaluacion = r.ID_Evaluacion
+            WHERE 1 = 1 {filtro}
+        )
+        SELECT ID_Evaluacion, ID_Activo, Nombre_Activo, Fecha, Riesgo, Riesgo_Residual,
+               Riesgo - LAG(Riesgo) OVER a AS Delta,
+               Riesgo - FIRST_VALUE(Riesgo) OVER a AS Delta_Acumulado
+        FROM ultimos
+        WHERE n = 1
+        WINDOW a AS (PARTITION BY ID_Activo ORDER BY Fecha, ID_Evaluacion)
+        ORDER BY ID_Activo, Fecha, ID_Evaluacion
+    ''', params)
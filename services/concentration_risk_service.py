@@ -14,8 +14,8 @@ import pandas as pd
 from typing import Dict, List, Tuple, Optional
 from dataclasses import dataclass, asdict, field
 from services.database_service import (
-    read_table, insert_rows, update_row, delete_row,
-    get_connection
+    insert_rows, update_row, delete_row, upsert_rows, query_rows,
+    get_connection, get_activo, get_activos_evaluacion
 )
 
 
@@ -97,16 +97,7 @@ def init_concentration_tables():
     with get_connection() as conn:
         cursor = conn.cursor()
         
-        # Agregar columnas a INVENTARIO_ACTIVOS si no existen
-        try:
-            cursor.execute("ALTER TABLE INVENTARIO_ACTIVOS ADD COLUMN ID_Host TEXT")
-        except:
-            pass  # Ya existe
-        
-        try:
-            cursor.execute("ALTER TABLE INVENTARIO_ACTIVOS ADD COLUMN Tipo_Dependencia TEXT DEFAULT 'total'")
-        except:
-            pass  # Ya existe
+        # ID_Host / Tipo_Dependencia de INVENTARIO_ACTIVOS: ver services/migracion_service.py
         
         # Tabla de resultados de concentración
         cursor.execute('''
@@ -147,8 +138,6 @@ def init_concentration_tables():
                 UNIQUE(ID_Evaluacion, ID_Activo)
             )
         ''')
-        
-        conn.commit()
 
 
 def asignar_host_a_vm(eval_id: str, id_vm: str, id_host: str, 
@@ -167,29 +156,21 @@ def asignar_host_a_vm(eval_id: str, id_vm: str, id_host: str,
     """
     try:
         # Validar que el host existe y es físico
-        activos = read_table("INVENTARIO_ACTIVOS")
-        
-        host = activos[
-            (activos["ID_Evaluacion"] == eval_id) &
-            (activos["ID_Activo"] == id_host)
-        ]
+        host = get_activo(eval_id, id_host)
         
-        if host.empty:
+        if host is None:
             return False, f"Host {id_host} no encontrado"
         
-        if host.iloc[0].get("Tipo_Activo") != "Servidor Físico":
+        if host.get("Tipo_Activo") != "Servidor Físico":
             return False, f"El activo {id_host} no es un Servidor Físico"
         
         # Validar que la VM existe y es virtual
-        vm = activos[
-            (activos["ID_Evaluacion"] == eval_id) &
-            (activos["ID_Activo"] == id_vm)
-        ]
+        vm = get_activo(eval_id, id_vm)
         
-        if vm.empty:
+        if vm is None:
             return False, f"VM {id_vm} no encontrada"
         
-        if vm.iloc[0].get("Tipo_Activo") != "Servidor Virtual":
+        if vm.get("Tipo_Activo") != "Servidor Virtual":
             return False, f"El activo {id_vm} no es un Servidor Virtual"
         
         # Asignar
@@ -207,29 +188,140 @@ def asignar_host_a_vm(eval_id: str, id_vm: str, id_host: str,
 
 def get_vms_de_host(eval_id: str, id_host: str) -> pd.DataFrame:
     """Obtiene todas las VMs que dependen de un host"""
-    activos = read_table("INVENTARIO_ACTIVOS")
-    
-    if activos.empty or "ID_Host" not in activos.columns:
-        return pd.DataFrame()
-    
-    return activos[
-        (activos["ID_Evaluacion"] == eval_id) &
-        (activos["ID_Host"] == id_host) &
-        (activos["Tipo_Activo"] == "Servidor Virtual")
-    ]
+    return get_activos_evaluacion(
+        eval_id, conditions={"ID_Host": id_host, "Tipo_Activo": "Servidor Virtual"}
+    )
 
 
 def get_hosts_evaluacion(eval_id: str) -> pd.DataFrame:
     """Obtiene todos los hosts físicos de una evaluación"""
-    activos = read_table("INVENTARIO_ACTIVOS")
-    
-    if activos.empty:
-        return pd.DataFrame()
-    
-    return activos[
-        (activos["ID_Evaluacion"] == eval_id) &
-        (activos["Tipo_Activo"] == "Servidor Físico")
-    ]
+    return get_activos_evaluacion(eval_id, conditions={"Tipo_Activo": "Servidor Físico"})
+
+
+# ==================== GRAFO DE DEPENDENCIAS ====================
+# Cada activo con ID_Host apunta al activo del que depende, a cualquier
+# profundidad (datacenter → host → VM → aplicación). El grafo se construye
+# una vez por evaluación con dos consultas y el blast radius, los SPOF y la
+# herencia se calculan en memoria: un recorrido en orden topológico inverso
+# (de las hojas hacia las raíces) y otro en orden directo.
+
+PESO_DEPENDENCIA = {"total": 1.0, "parcial": 0.5, "ninguna": 0.0}
+
+# RESULTADOS_MAGERIT no guarda probabilidad por activo: se usa el valor medio de la escala
+PROBABILIDAD_DEFAULT = 3.0
+
+
+@dataclass
+class NodoActivo:
+    """Activo del inventario con los datos que necesita el cálculo"""
+    id_activo: str
+    nombre: str
+    tipo: str
+    id_host: str  # ID_Host tal como está en el inventario ("" si no tiene)
+    tipo_dependencia: str
+    peso: float  # 1.0, 0.5, 0.0 según tipo
+    criticidad: int  # max(D, I, C)
+    riesgo_inherente: float
+
+
+@dataclass
+class GrafoDependencias:
+    """Grafo de dependencias de una evaluación como lista de adyacencia"""
+    id_evaluacion: str
+    nodos: Dict[str, NodoActivo]
+    padres: Dict[str, str]  # dependiente → activo del que depende
+    hijos: Dict[str, List[str]]  # activo → dependientes directos
+    orden: List[str]  # orden topológico: cada padre antes que sus dependientes
+    ciclos: List[str] = field(default_factory=list)  # activos cuya dependencia se ignoró por circular
+
+    def es_host(self, id_activo: str) -> bool:
+        """
+        Activos con resultado de concentración: servidores físicos y, para las
+        cadenas multinivel, cualquier activo con dependientes (antes solo los
+        servidores físicos)
+        """
+        return self.nodos[id_activo].tipo == "Servidor Físico" or id_activo in self.hijos
+
+
+def _numero(valor, defecto: float) -> float:
+    """Valor numérico de la BD; None, NaN y 0 usan el defecto"""
+    if valor is None or pd.isna(valor) or not valor:
+        return defecto
+    return float(valor)
+
+
+def _ordenar(nodos: Dict[str, NodoActivo]) -> Tuple[Dict[str, str], Dict[str, List[str]], List[str], List[str]]:
+    """Aristas válidas, lista de adyacencia y orden topológico; rompe los ciclos"""
+    padres = {id_activo: nodo.id_host for id_activo, nodo in nodos.items() if nodo.id_host in nodos}
+
+    # Cada activo tiene un único ID_Host, así que cada componente tiene a lo
+    # sumo un ciclo: se rompe quitando la arista donde el recorrido se cierra
+    ciclos = []
+    visitado = {}
+    for inicio in list(padres):
+        actual = inicio
+        while actual in padres and actual not in visitado:
+            visitado[actual] = inicio
+            actual = padres[actual]
+        if visitado.get(actual) == inicio and actual in padres:
+            ciclos.append(actual)
+            del padres[actual]
+
+    hijos: Dict[str, List[str]] = {}
+    for hijo, padre in padres.items():
+        hijos.setdefault(padre, []).append(hijo)
+
+    orden = [id_activo for id_activo in nodos if id_activo not in padres]
+    i = 0
+    while i < len(orden):
+        orden.extend(hijos.get(orden[i], ()))
+        i += 1
+    return padres, hijos, orden, ciclos
+
+
+def construir_grafo(eval_id: str) -> GrafoDependencias:
+    """
+    Construye el grafo de dependencias de una evaluación con dos consultas:
+    el inventario y el último resultado MAGERIT de cada activo.
+    """
+    activos = get_activos_evaluacion(
+        eval_id, columns=["ID_Activo", "Nombre_Activo", "Tipo_Activo", "ID_Host", "Tipo_Dependencia"]
+    )
+    # Orden ascendente: la última fila de cada activo es la más reciente
+    magerit = query_rows(
+        "RESULTADOS_MAGERIT", {"ID_Evaluacion": eval_id},
+        columns=["ID_Activo", "Impacto_D", "Impacto_I", "Impacto_C", "Riesgo_Inherente"],
+        order_by="Fecha_Evaluacion"
+    )
+    resultados = {}
+    if not magerit.empty:
+        for id_activo, d, i, c, riesgo in zip(
+            magerit["ID_Activo"].tolist(), magerit["Impacto_D"].tolist(), magerit["Impacto_I"].tolist(),
+            magerit["Impacto_C"].tolist(), magerit["Riesgo_Inherente"].tolist()
+        ):
+            criticidad = int(max(_numero(d, 3), _numero(i, 3), _numero(c, 3)))
+            resultados[id_activo] = (criticidad, _numero(riesgo, 0.0))
+
+    nodos = {}
+    for id_activo, nombre, tipo, id_host, tipo_dep in zip(
+        activos["ID_Activo"].tolist(), activos["Nombre_Activo"].tolist(), activos["Tipo_Activo"].tolist(),
+        activos["ID_Host"].tolist(), activos["Tipo_Dependencia"].tolist()
+    ):
+        criticidad, riesgo = resultados.get(id_activo, (3, 0.0))
+        tipo_dep = tipo_dep if isinstance(tipo_dep, str) else "total"
+        nodos[id_activo] = NodoActivo(
+            id_activo=id_activo,
+            nombre=nombre if isinstance(nombre, str) and nombre else id_activo,
+            tipo=tipo or "",
+            id_host=id_host if isinstance(id_host, str) else "",
+            tipo_dependencia=tipo_dep,
+            peso=PESO_DEPENDENCIA.get(tipo_dep, 1.0),
+            criticidad=criticidad,
+            riesgo_inherente=riesgo
+        )
+
+    padres, hijos, orden, ciclos = _ordenar(nodos)
+    return GrafoDependencias(eval_id, nodos, padres, hijos, orden, ciclos)
 
 
 # ==================== CÁLCULO DE BLAST RADIUS ====================
@@ -263,6 +355,98 @@ def obtener_criticidad_vm(eval_id: str, id_activo: str) -> int:
     return 3
 
 
+def calcular_concentracion_grafo(grafo: GrafoDependencias,
+                                 ids_host: List[str] = None) -> Dict[str, ResultadoConcentracion]:
+    """
+    Blast radius de todos los hosts del grafo en un recorrido de las hojas
+    hacia las raíces.
+    
+    Blast Radius = Σ Peso_Dependencia × (Criticidad + Blast_Radius) de cada
+    dependiente directo. Con un solo nivel (host → VM) es Σ(Criticidad_VM ×
+    Peso); en cadenas más largas el impacto de los niveles inferiores llega
+    atenuado por el producto de los pesos del camino.
+    
+    Args:
+        grafo: Grafo de la evaluación (construir_grafo)
+        ids_host: Activos a devolver (None = todos los de grafo.es_host)
+    """
+    blast: Dict[str, float] = {}
+    dependientes: Dict[str, int] = {}
+    vms: Dict[str, int] = {}  # solo Servidores Virtuales, como num_vms_dependientes original
+    criticas: Dict[str, List[Dict]] = {}
+
+    for id_activo in reversed(grafo.orden):
+        hijos = grafo.hijos.get(id_activo)
+        if not hijos:
+            continue
+        total, num, num_vms, lista = 0.0, 0, 0, []
+        for id_hijo in hijos:
+            hijo = grafo.nodos[id_hijo]
+            total += hijo.peso * (hijo.criticidad + blast.get(id_hijo, 0.0))
+            num += 1 + dependientes.get(id_hijo, 0)
+            num_vms += (hijo.tipo == "Servidor Virtual") + vms.get(id_hijo, 0)
+            if hijo.criticidad >= 4:
+                lista.append({
+                    "id": id_hijo,
+                    "nombre": hijo.nombre,
+                    "criticidad": hijo.criticidad,
+                    "dependencia": hijo.tipo_dependencia
+                })
+            lista.extend(criticas.get(id_hijo, ()))
+        blast[id_activo], dependientes[id_activo], criticas[id_activo] = total, num, lista
+        vms[id_activo] = num_vms
+
+    fecha = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if ids_host is None:
+        ids_host = [id_activo for id_activo in grafo.orden if grafo.es_host(id_activo)]
+
+    resultados = {}
+    for id_host in ids_host:
+        host = grafo.nodos[id_host]
+        if not dependientes.get(id_host):
+            # Sin dependientes, sin concentración
+            resultados[id_host] = ResultadoConcentracion(
+                id_evaluacion=grafo.id_evaluacion,
+                id_host=id_host,
+                nombre_host=host.nombre,
+                num_vms_dependientes=0,
+                blast_radius=0.0,
+                factor_concentracion=0,
+                impacto_d_original=3,
+                impacto_d_ajustado=3,
+                riesgo_original=0.0,
+                riesgo_ajustado=0.0,
+                vms_criticas=[],
+                es_spof=False,
+                fecha_calculo=fecha
+            )
+            continue
+
+        blast_radius = blast[id_host]
+        vms_criticas = criticas[id_host]
+        factor_concentracion = min(MAX_FACTOR_CONCENTRACION, int(blast_radius / UMBRAL_BLAST_RADIUS))
+        impacto_d_ajustado = min(5, host.criticidad + factor_concentracion)
+        num_vms = vms[id_host]
+
+        resultados[id_host] = ResultadoConcentracion(
+            id_evaluacion=grafo.id_evaluacion,
+            id_host=id_host,
+            nombre_host=host.nombre,
+            num_vms_dependientes=num_vms,
+            blast_radius=blast_radius,
+            factor_concentracion=factor_concentracion,
+            impacto_d_original=host.criticidad,
+            impacto_d_ajustado=impacto_d_ajustado,
+            riesgo_original=host.riesgo_inherente,
+            # Riesgo = Probabilidad × Impacto, recalculado con el impacto ajustado
+            riesgo_ajustado=PROBABILIDAD_DEFAULT * impacto_d_ajustado,
+            vms_criticas=vms_criticas,
+            es_spof=len(vms_criticas) >= 2 or (num_vms >= 3 and factor_concentracion >= 2),
+            fecha_calculo=fecha
+        )
+    return resultados
+
+
 def calcular_blast_radius(eval_id: str, id_host: str) -> ResultadoConcentracion:
     """
     Calcula el blast radius de un host físico
@@ -273,146 +457,95 @@ def calcular_blast_radius(eval_id: str, id_host: str) -> ResultadoConcentracion:
     - Criticidad = max(D, I, C) de cada VM
     - Peso = 1.0 (total), 0.5 (parcial), 0.0 (ninguna)
     """
-    # Obtener datos del host
-    activos = read_table("INVENTARIO_ACTIVOS")
-    host_data = activos[
-        (activos["ID_Evaluacion"] == eval_id) &
-        (activos["ID_Activo"] == id_host)
-    ]
-    
-    if host_data.empty:
+    grafo = construir_grafo(eval_id)
+    if id_host not in grafo.nodos:
         raise ValueError(f"Host {id_host} no encontrado")
-    
-    host = host_data.iloc[0]
-    nombre_host = host.get("Nombre_Activo", id_host)
-    
-    # Obtener VMs dependientes
-    vms = get_vms_de_host(eval_id, id_host)
-    
-    if vms.empty:
-        # Sin VMs, sin concentración
-        return ResultadoConcentracion(
-            id_evaluacion=eval_id,
-            id_host=id_host,
-            nombre_host=nombre_host,
-            num_vms_dependientes=0,
-            blast_radius=0.0,
-            factor_concentracion=0,
-            impacto_d_original=3,
-            impacto_d_ajustado=3,
-            riesgo_original=0.0,
-            riesgo_ajustado=0.0,
-            vms_criticas=[],
-            es_spof=False,
-            fecha_calculo=dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        )
-    
-    # Calcular blast radius
-    blast_radius = 0.0
-    vms_criticas = []
-    
-    peso_map = {"total": 1.0, "parcial": 0.5, "ninguna": 0.0}
-    
-    for _, vm in vms.iterrows():
-        id_vm = vm["ID_Activo"]
-        nombre_vm = vm.get("Nombre_Activo", id_vm)
-        tipo_dep = vm.get("Tipo_Dependencia", "total")
-        peso = peso_map.get(tipo_dep, 1.0)
-        
-        criticidad = obtener_criticidad_vm(eval_id, id_vm)
-        
-        aporte = criticidad * peso
-        blast_radius += aporte
-        
-        if criticidad >= 4:
-            vms_criticas.append({
-                "id": id_vm,
-                "nombre": nombre_vm,
-                "criticidad": criticidad,
-                "dependencia": tipo_dep
-            })
-    
-    # Calcular factor de concentración
-    factor_concentracion = min(
-        MAX_FACTOR_CONCENTRACION,
-        int(blast_radius / UMBRAL_BLAST_RADIUS)
-    )
-    
-    # Obtener impacto original del host
-    impacto_d_original = obtener_criticidad_vm(eval_id, id_host)
-    
-    # Calcular impacto ajustado
-    impacto_d_ajustado = min(5, impacto_d_original + factor_concentracion)
-    
-    # Determinar si es SPOF
-    es_spof = len(vms_criticas) >= 2 or (len(vms) >= 3 and factor_concentracion >= 2)
-    
-    # Obtener riesgo original del host
-    riesgo_original = _obtener_riesgo_activo(eval_id, id_host)
-    
-    # Calcular riesgo ajustado (recalcular con nuevo impacto)
-    # Riesgo = Probabilidad × Impacto
-    probabilidad_host = _obtener_probabilidad_activo(eval_id, id_host)
-    riesgo_ajustado = probabilidad_host * impacto_d_ajustado
-    
-    return ResultadoConcentracion(
-        id_evaluacion=eval_id,
-        id_host=id_host,
-        nombre_host=nombre_host,
-        num_vms_dependientes=len(vms),
-        blast_radius=blast_radius,
-        factor_concentracion=factor_concentracion,
-        impacto_d_original=impacto_d_original,
-        impacto_d_ajustado=impacto_d_ajustado,
-        riesgo_original=riesgo_original,
-        riesgo_ajustado=riesgo_ajustado,
-        vms_criticas=vms_criticas,
-        es_spof=es_spof,
-        fecha_calculo=dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    )
+    return calcular_concentracion_grafo(grafo, [id_host])[id_host]
 
 
-def _obtener_riesgo_activo(eval_id: str, id_activo: str) -> float:
-    """Obtiene el riesgo inherente de un activo desde RESULTADOS_MAGERIT"""
-    try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT Riesgo_Inherente 
-                FROM RESULTADOS_MAGERIT 
-                WHERE ID_Evaluacion = ? AND ID_Activo = ?
-                ORDER BY Fecha_Evaluacion DESC LIMIT 1
-            ''', [eval_id, id_activo])
-            
-            row = cursor.fetchone()
-            if row:
-                return float(row[0] or 0)
-    except:
-        pass
-    return 0.0
+# ==================== HERENCIA DE RIESGO ====================
 
+def calcular_herencia_grafo(grafo: GrafoDependencias,
+                            concentracion: Dict[str, ResultadoConcentracion] = None) -> List[RiesgoHeredado]:
+    """
+    Riesgo heredado de todos los activos dependientes en un recorrido de las
+    raíces hacia las hojas.
+    
+    Riesgo_Final = max(Riesgo_Propio, Riesgo_Padre × FACTOR_HERENCIA)
+    
+    El riesgo del padre es su riesgo ajustado por concentración (o el
+    inherente si no tiene) o, si es mayor, el que heredó a su vez: en
+    datacenter → host → VM el riesgo del datacenter llega a la VM atenuado.
+    Se devuelven todas las VMs y cualquier otro activo con ID_Host.
+    """
+    if concentracion is None:
+        concentracion = calcular_concentracion_grafo(grafo)
 
-def _obtener_probabilidad_activo(eval_id: str, id_activo: str) -> float:
-    """Obtiene la probabilidad de un activo"""
-    try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT Probabilidad 
-                FROM RESULTADOS_MAGERIT 
-                WHERE ID_Evaluacion = ? AND ID_Activo = ?
-                ORDER BY Fecha_Evaluacion DESC LIMIT 1
-            ''', [eval_id, id_activo])
-            
-            row = cursor.fetchone()
-            if row:
-                return float(row[0] or 3)
-    except:
-        pass
-    return 3.0
+    propagable: Dict[str, float] = {}
+    resultados = []
 
+    for id_activo in grafo.orden:
+        nodo = grafo.nodos[id_activo]
+        ajustado = concentracion[id_activo].riesgo_ajustado if id_activo in concentracion else 0.0
+        propio_base = ajustado or nodo.riesgo_inherente
+        id_padre = grafo.padres.get(id_activo)
+
+        if id_padre is None:
+            propagable[id_activo] = propio_base
+            if nodo.tipo != "Servidor Virtual" and not nodo.id_host:
+                continue
+            if not nodo.id_host:
+                nombre_host, justificacion = "(Sin host asignado)", "VM sin host asignado, usando riesgo propio"
+            elif id_activo in grafo.ciclos:
+                nombre_host = grafo.nodos[nodo.id_host].nombre
+                justificacion = "Dependencia circular ignorada, usando riesgo propio"
+            else:
+                nombre_host, justificacion = "(Host no encontrado)", "Host no encontrado, usando riesgo propio"
+            resultados.append(RiesgoHeredado(
+                id_activo=id_activo,
+                nombre_activo=nodo.nombre,
+                id_host=nodo.id_host,
+                nombre_host=nombre_host,
+                riesgo_vm_propio=nodo.riesgo_inherente,
+                riesgo_host=0.0,
+                riesgo_heredado=0.0,
+                riesgo_final=nodo.riesgo_inherente,
+                nivel_riesgo_final=_get_nivel_riesgo(nodo.riesgo_inherente),
+                ajuste_aplicado=False,
+                justificacion=justificacion
+            ))
+            continue
+
+        riesgo_propio = nodo.riesgo_inherente
+        riesgo_host = propagable[id_padre]
+        riesgo_heredado = riesgo_host * FACTOR_HERENCIA
+        propagable[id_activo] = max(propio_base, riesgo_heredado)
+
+        # El riesgo final es el máximo
+        if riesgo_heredado > riesgo_propio:
+            riesgo_final = riesgo_heredado
+            ajuste_aplicado = True
+            justificacion = f"Riesgo heredado del host ({riesgo_heredado:.1f}) supera riesgo propio ({riesgo_propio:.1f})"
+        else:
+            riesgo_final = riesgo_propio
+            ajuste_aplicado = False
+            justificacion = f"Riesgo propio ({riesgo_propio:.1f}) es mayor que heredado ({riesgo_heredado:.1f})"
+
+        resultados.append(RiesgoHeredado(
+            id_activo=id_activo,
+            nombre_activo=nodo.nombre,
+            id_host=id_padre,
+            nombre_host=grafo.nodos[id_padre].nombre,
+            riesgo_vm_propio=riesgo_propio,
+            riesgo_host=riesgo_host,
+            riesgo_heredado=riesgo_heredado,
+            riesgo_final=riesgo_final,
+            nivel_riesgo_final=_get_nivel_riesgo(riesgo_final),
+            ajuste_aplicado=ajuste_aplicado,
+            justificacion=justificacion
+        ))
+    return resultados
 
-# ==================== HERENCIA DE RIESGO ====================
 
 def calcular_riesgo_heredado(eval_id: str, id_vm: str) -> Optional[RiesgoHeredado]:
     """
@@ -420,119 +553,10 @@ def calcular_riesgo_heredado(eval_id: str, id_vm: str) -> Optional[RiesgoHeredad
     
     Riesgo_Final = max(Riesgo_VM_Propio, Riesgo_Host × FACTOR_HERENCIA)
     """
-    # Obtener datos de la VM
-    activos = read_table("INVENTARIO_ACTIVOS")
-    
-    vm_data = activos[
-        (activos["ID_Evaluacion"] == eval_id) &
-        (activos["ID_Activo"] == id_vm)
-    ]
-    
-    if vm_data.empty:
-        return None
-    
-    vm = vm_data.iloc[0]
-    
-    if vm.get("Tipo_Activo") != "Servidor Virtual":
+    grafo = construir_grafo(eval_id)
+    if id_vm not in grafo.nodos:
         return None
-    
-    id_host = vm.get("ID_Host")
-    
-    if not id_host or pd.isna(id_host):
-        # VM sin host asignado
-        riesgo_propio = _obtener_riesgo_activo(eval_id, id_vm)
-        return RiesgoHeredado(
-            id_activo=id_vm,
-            nombre_activo=vm.get("Nombre_Activo", id_vm),
-            id_host="",
-            nombre_host="(Sin host asignado)",
-            riesgo_vm_propio=riesgo_propio,
-            riesgo_host=0.0,
-            riesgo_heredado=0.0,
-            riesgo_final=riesgo_propio,
-            nivel_riesgo_final=_get_nivel_riesgo(riesgo_propio),
-            ajuste_aplicado=False,
-            justificacion="VM sin host asignado, usando riesgo propio"
-        )
-    
-    # Obtener datos del host
-    host_data = activos[
-        (activos["ID_Evaluacion"] == eval_id) &
-        (activos["ID_Activo"] == id_host)
-    ]
-    
-    if host_data.empty:
-        riesgo_propio = _obtener_riesgo_activo(eval_id, id_vm)
-        return RiesgoHeredado(
-            id_activo=id_vm,
-            nombre_activo=vm.get("Nombre_Activo", id_vm),
-            id_host=id_host,
-            nombre_host="(Host no encontrado)",
-            riesgo_vm_propio=riesgo_propio,
-            riesgo_host=0.0,
-            riesgo_heredado=0.0,
-            riesgo_final=riesgo_propio,
-            nivel_riesgo_final=_get_nivel_riesgo(riesgo_propio),
-            ajuste_aplicado=False,
-            justificacion="Host no encontrado, usando riesgo propio"
-        )
-    
-    host = host_data.iloc[0]
-    nombre_host = host.get("Nombre_Activo", id_host)
-    
-    # Obtener riesgos
-    riesgo_vm_propio = _obtener_riesgo_activo(eval_id, id_vm)
-    
-    # Para el host, usar el riesgo ajustado si existe
-    riesgo_host = _obtener_riesgo_ajustado_host(eval_id, id_host)
-    if riesgo_host == 0:
-        riesgo_host = _obtener_riesgo_activo(eval_id, id_host)
-    
-    # Calcular herencia
-    riesgo_heredado = riesgo_host * FACTOR_HERENCIA
-    
-    # El riesgo final es el máximo
-    if riesgo_heredado > riesgo_vm_propio:
-        riesgo_final = riesgo_heredado
-        ajuste_aplicado = True
-        justificacion = f"Riesgo heredado del host ({riesgo_heredado:.1f}) supera riesgo propio ({riesgo_vm_propio:.1f})"
-    else:
-        riesgo_final = riesgo_vm_propio
-        ajuste_aplicado = False
-        justificacion = f"Riesgo propio ({riesgo_vm_propio:.1f}) es mayor que heredado ({riesgo_heredado:.1f})"
-    
-    return RiesgoHeredado(
-        id_activo=id_vm,
-        nombre_activo=vm.get("Nombre_Activo", id_vm),
-        id_host=id_host,
-        nombre_host=nombre_host,
-        riesgo_vm_propio=riesgo_vm_propio,
-        riesgo_host=riesgo_host,
-        riesgo_heredado=riesgo_heredado,
-        riesgo_final=riesgo_final,
-        nivel_riesgo_final=_get_nivel_riesgo(riesgo_final),
-        ajuste_aplicado=ajuste_aplicado,
-        justificacion=justificacion
-    )
-
-
-def _obtener_riesgo_ajustado_host(eval_id: str, id_host: str) -> float:
-    """Obtiene el riesgo ajustado de un host desde RESULTADOS_CONCENTRACION"""
-    try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT Riesgo_Ajustado 
-                FROM RESULTADOS_CONCENTRACION 
-                WHERE ID_Evaluacion = ? AND ID_Host = ?
-            ''', [eval_id, id_host])
-            
-            row = cursor.fetchone()
-            if row:
-                return float(row[0] or 0)
-    except:
-        pass
-    return 0.0
+    return next((r for r in calcular_herencia_grafo(grafo) if r.id_activo == id_vm), None)
 
 
 def _get_nivel_riesgo(valor: float) -> str:
@@ -551,203 +575,81 @@ def _get_nivel_riesgo(valor: float) -> str:
 
 # ==================== FUNCIONES PRINCIPALES ====================
 
-def calcular_concentracion_evaluacion(eval_id: str) -> List[ResultadoConcentracion]:
+def calcular_concentracion_evaluacion(eval_id: str,
+                                      grafo: GrafoDependencias = None) -> List[ResultadoConcentracion]:
     """
     Calcula el riesgo por concentración para todos los hosts de una evaluación
     
     Proceso:
-    1. Obtener todos los hosts físicos
-    2. Para cada host, calcular blast radius
-    3. Guardar resultados
+    1. Construir el grafo de dependencias (o reutilizar el recibido)
+    2. Calcular el blast radius de todos los hosts en memoria
+    3. Guardar resultados en una sola escritura en bloque
     """
     # Inicializar tablas si no existen
     init_concentration_tables()
-    
-    resultados = []
-    hosts = get_hosts_evaluacion(eval_id)
-    
-    if hosts.empty:
-        return resultados
-    
-    for _, host in hosts.iterrows():
-        id_host = host["ID_Activo"]
-        
-        try:
-            resultado = calcular_blast_radius(eval_id, id_host)
-            resultados.append(resultado)
-            
-            # Guardar en BD
-            _guardar_resultado_concentracion(resultado)
-        
-        except Exception as e:
-            print(f"Error calculando concentración para {id_host}: {e}")
-    
+
+    grafo = grafo or construir_grafo(eval_id)
+    resultados = list(calcular_concentracion_grafo(grafo).values())
+    _guardar_resultados_concentracion(resultados)
     return resultados
 
 
-def calcular_herencia_evaluacion(eval_id: str) -> List[RiesgoHeredado]:
+def calcular_herencia_evaluacion(eval_id: str,
+                                 grafo: GrafoDependencias = None) -> List[RiesgoHeredado]:
     """
-    Calcula el riesgo heredado para todas las VMs de una evaluación
-    
-    Debe ejecutarse DESPUÉS de calcular_concentracion_evaluacion
+    Calcula el riesgo heredado para todas las VMs (y demás activos
+    dependientes) de una evaluación. El riesgo ajustado de los hosts se
+    recalcula en memoria con el mismo grafo.
     """
-    resultados = []
-    activos = read_table("INVENTARIO_ACTIVOS")
-    
-    if activos.empty:
-        return resultados
-    
-    vms = activos[
-        (activos["ID_Evaluacion"] == eval_id) &
-        (activos["Tipo_Activo"] == "Servidor Virtual")
-    ]
-    
-    for _, vm in vms.iterrows():
-        id_vm = vm["ID_Activo"]
-        
-        try:
-            resultado = calcular_riesgo_heredado(eval_id, id_vm)
-            if resultado:
-                resultados.append(resultado)
-                _guardar_riesgo_heredado(eval_id, resultado)
-        
-        except Exception as e:
-            print(f"Error calculando herencia para {id_vm}: {e}")
-    
-    return resultados
-
+    init_concentration_tables()
 
-def _guardar_resultado_concentracion(resultado: ResultadoConcentracion):
-    """Guarda o actualiza el resultado de concentración"""
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Verificar si existe
-        cursor.execute('''
-            SELECT id FROM RESULTADOS_CONCENTRACION 
-            WHERE ID_Evaluacion = ? AND ID_Host = ?
-        ''', [resultado.id_evaluacion, resultado.id_host])
-        
-        exists = cursor.fetchone()
-        
-        if exists:
-            cursor.execute('''
-                UPDATE RESULTADOS_CONCENTRACION SET
-                    Nombre_Host = ?,
-                    Num_VMs_Dependientes = ?,
-                    Blast_Radius = ?,
-                    Factor_Concentracion = ?,
-                    Impacto_D_Original = ?,
-                    Impacto_D_Ajustado = ?,
-                    Riesgo_Original = ?,
-                    Riesgo_Ajustado = ?,
-                    VMs_Criticas = ?,
-                    Es_SPOF = ?,
-                    Fecha_Calculo = ?
-                WHERE ID_Evaluacion = ? AND ID_Host = ?
-            ''', [
-                resultado.nombre_host,
-                resultado.num_vms_dependientes,
-                resultado.blast_radius,
-                resultado.factor_concentracion,
-                resultado.impacto_d_original,
-                resultado.impacto_d_ajustado,
-                resultado.riesgo_original,
-                resultado.riesgo_ajustado,
-                json.dumps(resultado.vms_criticas, ensure_ascii=False),
-                1 if resultado.es_spof else 0,
-                resultado.fecha_calculo,
-                resultado.id_evaluacion,
-                resultado.id_host
-            ])
-        else:
-            cursor.execute('''
-                INSERT INTO RESULTADOS_CONCENTRACION 
-                (ID_Evaluacion, ID_Host, Nombre_Host, Num_VMs_Dependientes,
-                 Blast_Radius, Factor_Concentracion, Impacto_D_Original,
-                 Impacto_D_Ajustado, Riesgo_Original, Riesgo_Ajustado,
-                 VMs_Criticas, Es_SPOF, Fecha_Calculo)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', [
-                resultado.id_evaluacion,
-                resultado.id_host,
-                resultado.nombre_host,
-                resultado.num_vms_dependientes,
-                resultado.blast_radius,
-                resultado.factor_concentracion,
-                resultado.impacto_d_original,
-                resultado.impacto_d_ajustado,
-                resultado.riesgo_original,
-                resultado.riesgo_ajustado,
-                json.dumps(resultado.vms_criticas, ensure_ascii=False),
-                1 if resultado.es_spof else 0,
-                resultado.fecha_calculo
-            ])
-        
-        conn.commit()
+    grafo = grafo or construir_grafo(eval_id)
+    resultados = calcular_herencia_grafo(grafo)
+    _guardar_riesgos_heredados(eval_id, resultados)
+    return resultados
 
 
-def _guardar_riesgo_heredado(eval_id: str, resultado: RiesgoHeredado):
-    """Guarda o actualiza el riesgo heredado de una VM"""
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id FROM RIESGO_HEREDADO 
-            WHERE ID_Evaluacion = ? AND ID_Activo = ?
-        ''', [eval_id, resultado.id_activo])
-        
-        exists = cursor.fetchone()
-        fecha = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        if exists:
-            cursor.execute('''
-                UPDATE RIESGO_HEREDADO SET
-                    ID_Host = ?,
-                    Riesgo_VM_Propio = ?,
-                    Riesgo_Host = ?,
-                    Riesgo_Heredado = ?,
-                    Riesgo_Final = ?,
-                    Nivel_Riesgo_Final = ?,
-                    Ajuste_Aplicado = ?,
-                    Justificacion = ?,
-                    Fecha_Calculo = ?
-                WHERE ID_Evaluacion = ? AND ID_Activo = ?
-            ''', [
-                resultado.id_host,
-                resultado.riesgo_vm_propio,
-                resultado.riesgo_host,
-                resultado.riesgo_heredado,
-                resultado.riesgo_final,
-                resultado.nivel_riesgo_final,
-                1 if resultado.ajuste_aplicado else 0,
-                resultado.justificacion,
-                fecha,
-                eval_id,
-                resultado.id_activo
-            ])
-        else:
-            cursor.execute('''
-                INSERT INTO RIESGO_HEREDADO 
-                (ID_Evaluacion, ID_Activo, ID_Host, Riesgo_VM_Propio,
-                 Riesgo_Host, Riesgo_Heredado, Riesgo_Final,
-                 Nivel_Riesgo_Final, Ajuste_Aplicado, Justificacion, Fecha_Calculo)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', [
-                eval_id,
-                resultado.id_activo,
-                resultado.id_host,
-                resultado.riesgo_vm_propio,
-                resultado.riesgo_host,
-                resultado.riesgo_heredado,
-                resultado.riesgo_final,
-                resultado.nivel_riesgo_final,
-                1 if resultado.ajuste_aplicado else 0,
-                resultado.justificacion,
-                fecha
-            ])
-        
-        conn.commit()
+def _guardar_resultados_concentracion(resultados: List[ResultadoConcentracion]):
+    """Guarda o actualiza los resultados de concentración en bloque"""
+    if not resultados:
+        return
+    filas = [{
+        "ID_Evaluacion": r.id_evaluacion,
+        "ID_Host": r.id_host,
+        "Nombre_Host": r.nombre_host,
+        "Num_VMs_Dependientes": r.num_vms_dependientes,
+        "Blast_Radius": r.blast_radius,
+        "Factor_Concentracion": r.factor_concentracion,
+        "Impacto_D_Original": r.impacto_d_original,
+        "Impacto_D_Ajustado": r.impacto_d_ajustado,
+        "Riesgo_Original": r.riesgo_original,
+        "Riesgo_Ajustado": r.riesgo_ajustado,
+        "VMs_Criticas": json.dumps(r.vms_criticas, ensure_ascii=False),
+        "Es_SPOF": 1 if r.es_spof else 0,
+        "Fecha_Calculo": r.fecha_calculo
+    } for r in resultados]
+    upsert_rows("RESULTADOS_CONCENTRACION", filas, key_columns=["ID_Evaluacion", "ID_Host"])
+
+
+def _guardar_riesgos_heredados(eval_id: str, resultados: List[RiesgoHeredado]):
+    """Guarda o actualiza el riesgo heredado de los activos en bloque"""
+    if not resultados:
+        return
+    fecha = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    filas = [{
+        "ID_Evaluacion": eval_id,
+        "ID_Activo": r.id_activo,
+        "ID_Host": r.id_host,
+        "Riesgo_VM_Propio": r.riesgo_vm_propio,
+        "Riesgo_Host": r.riesgo_host,
+        "Riesgo_Heredado": r.riesgo_heredado,
+        "Riesgo_Final": r.riesgo_final,
+        "Nivel_Riesgo_Final": r.nivel_riesgo_final,
+        "Ajuste_Aplicado": 1 if r.ajuste_aplicado else 0,
+        "Justificacion": r.justificacion,
+        "Fecha_Calculo": fecha
+    } for r in resultados]
+    upsert_rows("RIESGO_HEREDADO", filas, key_columns=["ID_Evaluacion", "ID_Activo"])
 
 
 # ==================== CONSULTAS ====================
@@ -18,9 +18,11 @@ Cada tipo de activo tiene aproximadamente 21 preguntas:
 - 4 preguntas de BIA
 """
 import datetime as dt
+import numpy as np
 import pandas as pd
 from typing import Dict, List, Optional, Tuple
-from services.database_service import read_table, insert_rows, get_connection
+from services.database_service import read_table, insert_rows, upsert_row, get_connection, write_transaction
+from services.recalculo_incremental_service import marcar_sucio
 
 
 # ==================== BANCOS DE PREGUNTAS POR TIPO ====================
@@ -1089,43 +1091,19 @@ def guardar_respuestas_dic(id_evaluacion: str, id_activo: str, tipo_activo: str,
     """Guarda las respuestas del cuestionario DIC y calcula los valores."""
     import json
     resultado = procesar_cuestionario_dic(tipo_activo, respuestas)
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        try:
-            columnas_nuevas = ["Respuestas_JSON TEXT", "RTO_Valor INTEGER", "RTO_Tiempo TEXT", "RTO_Nivel TEXT",
-                              "RPO_Valor INTEGER", "RPO_Tiempo TEXT", "RPO_Nivel TEXT", "BIA_Valor INTEGER", "BIA_Nivel TEXT"]
-            for col in columnas_nuevas:
-                try:
-                    cursor.execute(f"ALTER TABLE IDENTIFICACION_VALORACION ADD COLUMN {col}")
-                    conn.commit()
-                except:
-                    pass
-            cursor.execute("SELECT id FROM IDENTIFICACION_VALORACION WHERE ID_Evaluacion = ? AND ID_Activo = ?",
-                          (id_evaluacion, id_activo))
-            existente = cursor.fetchone()
-            if existente:
-                cursor.execute("""UPDATE IDENTIFICACION_VALORACION SET D = ?, Valor_D = ?, I = ?, Valor_I = ?,
-                    C = ?, Valor_C = ?, Criticidad = ?, Criticidad_Nivel = ?, RTO_Valor = ?, RTO_Tiempo = ?, RTO_Nivel = ?,
-                    RPO_Valor = ?, RPO_Tiempo = ?, RPO_Nivel = ?, BIA_Valor = ?, BIA_Nivel = ?, Respuestas_JSON = ?,
-                    Fecha_Valoracion = ? WHERE ID_Evaluacion = ? AND ID_Activo = ?""",
-                    (resultado["D"], resultado["Valor_D"], resultado["I"], resultado["Valor_I"],
-                     resultado["C"], resultado["Valor_C"], resultado["Criticidad"], resultado["Criticidad_Nivel"],
-                     resultado["RTO_Valor"], resultado["RTO_Tiempo"], resultado["RTO_Nivel"],
-                     resultado["RPO_Valor"], resultado["RPO_Tiempo"], resultado["RPO_Nivel"],
-                     resultado["BIA_Valor"], resultado["BIA_Nivel"], json.dumps(respuestas),
-                     resultado["Fecha_Calculo"], id_evaluacion, id_activo))
-            else:
-                cursor.execute("""INSERT INTO IDENTIFICACION_VALORACION (ID_Evaluacion, ID_Activo, Nombre_Activo,
-                    D, Valor_D, I, Valor_I, C, Valor_C, Criticidad, Criticidad_Nivel, RTO_Valor, RTO_Tiempo, RTO_Nivel,
-                    RPO_Valor, RPO_Tiempo, RPO_Nivel, BIA_Valor, BIA_Nivel, Respuestas_JSON, Fecha_Valoracion)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (id_evaluacion, id_activo, "", resultado["D"], resultado["Valor_D"], resultado["I"], resultado["Valor_I"],
-                     resultado["C"], resultado["Valor_C"], resultado["Criticidad"], resultado["Criticidad_Nivel"],
-                     resultado["RTO_Valor"], resultado["RTO_Tiempo"], resultado["RTO_Nivel"],
-                     resultado["RPO_Valor"], resultado["RPO_Tiempo"], resultado["RPO_Nivel"],
-                     resultado["BIA_Valor"], resultado["BIA_Nivel"], json.dumps(respuestas), resultado["Fecha_Calculo"]))
-        except Exception as e:
-            raise e
+    # Las columnas RTO/RPO/BIA y Respuestas_JSON las crea la migración v2 (migracion_service)
+    campos = ["D", "Valor_D", "I", "Valor_I", "C", "Valor_C", "Criticidad", "Criticidad_Nivel",
+              "RTO_Valor", "RTO_Tiempo", "RTO_Nivel", "RPO_Valor", "RPO_Tiempo", "RPO_Nivel",
+              "BIA_Valor", "BIA_Nivel"]
+    fila = {"ID_Evaluacion": id_evaluacion, "ID_Activo": id_activo, "Nombre_Activo": ""}
+    fila.update({campo: resultado[campo] for campo in campos})
+    fila["Respuestas_JSON"] = json.dumps(respuestas)
+    fila["Fecha_Valoracion"] = resultado["Fecha_Calculo"]
+    # Nombre_Activo solo se fija al insertar; no se sobrescribe en re-valoraciones
+    with write_transaction():
+        upsert_row("IDENTIFICACION_VALORACION", fila, ["ID_Evaluacion", "ID_Activo"],
+                   update_columns=campos + ["Respuestas_JSON", "Fecha_Valoracion"])
+        marcar_sucio(id_evaluacion, "IDENTIFICACION_VALORACION", [id_activo])
     return resultado
 
 
@@ -1351,3 +1329,72 @@ def calcular_frecuencia_todas_amenazas(id_evaluacion: str, id_activo: str) -> Li
             })
         
         return resultados
+
+
+def _discretizar_frecuencias(valores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Mapea frecuencias continuas a los valores discretos MAGERIT (valor, nivel)"""
+    condiciones = [valores >= 2.5, valores >= 1.5, valores >= 0.5]
+    return (
+        np.select(condiciones, [3.0, 2.0, 1.0], default=0.1),
+        np.select(condiciones, ["Alta", "Media", "Baja"], default="Nula"),
+    )
+
+
+def calcular_frecuencias_evaluacion(id_evaluacion: str, ids_activos: List[str] = None) -> pd.DataFrame:
+    """
+    Calcula la frecuencia de todas las amenazas de una evaluación en una pasada.
+    
+    Aplica las mismas reglas que calcular_frecuencia_desde_cuestionario y
+    calcular_frecuencia_todas_amenazas, pero con una sola consulta
+    (VULNERABILIDADES_AMENAZAS ⟕ IDENTIFICACION_VALORACION) y operaciones por columnas.
+    
+    Args:
+        id_evaluacion: ID de la evaluación
+        ids_activos: Limitar a estos activos (None = todos)
+    
+    Returns:
+        DataFrame con: id_va, ID_Activo, Nombre_Activo, Cod_Amenaza, Amenaza,
+        Impacto, Frecuencia, Frecuencia_Nivel
+    """
+    query = """
+        SELECT va.id AS id_va, va.ID_Activo, va.Nombre_Activo, va.Cod_Amenaza, va.Amenaza,
+               va.Impacto, iv.Criticidad, iv.ID_Activo IS NOT NULL AS Valorado
+        FROM VULNERABILIDADES_AMENAZAS va
+        LEFT JOIN IDENTIFICACION_VALORACION iv
+            ON iv.ID_Evaluacion = va.ID_Evaluacion AND iv.ID_Activo = va.ID_Activo
+        WHERE va.ID_Evaluacion = ?
+    """
+    params = [id_evaluacion]
+    if ids_activos is not None:
+        ids_activos = list(ids_activos)
+        if not ids_activos:
+            query += " AND 0"
+        else:
+            query += f" AND va.ID_Activo IN ({', '.join('?' for _ in ids_activos)})"
+            params.extend(ids_activos)
+    query += " ORDER BY va.ID_Activo, va.id"
+    
+    with get_connection() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    
+    # Frecuencia base del activo según criticidad (sin valoración → Media)
+    criticidad = pd.to_numeric(df["Criticidad"], errors="coerce").fillna(0).to_numpy()
+    freq_activo = np.select([criticidad >= 3, criticidad == 2, criticidad == 1], [2.5, 1.5, 0.5], default=1.0)
+    freq_activo, _ = _discretizar_frecuencias(np.clip(freq_activo, 0.1, 3.0))
+    freq_base = np.where(df["Valorado"].to_numpy(dtype=bool), freq_activo, 2.0)
+    
+    # Ajuste por tipo de amenaza
+    cod = df["Cod_Amenaza"].fillna("").astype(str)
+    freq_ajustada = np.select(
+        [cod.str.startswith("A.").to_numpy(), cod.str.startswith("N.").to_numpy(),
+         cod.str.startswith("I.").to_numpy()],
+        [np.minimum(3.0, freq_base + 0.5), np.maximum(0.1, freq_base - 0.5), np.maximum(0.1, freq_base - 0.2)],
+        default=freq_base
+    )
+    frecuencia, nivel = _discretizar_frecuencias(freq_ajustada)
+    
+    df["Cod_Amenaza"] = cod
+    df["Impacto"] = pd.to_numeric(df["Impacto"], errors="coerce").fillna(0.0)
+    df["Frecuencia"] = frecuencia
+    df["Frecuencia_Nivel"] = nivel
+    return df.drop(columns=["Criticidad", "Valorado"])
@@ -4,7 +4,9 @@ Servicio de cuestionarios estáticos según tipo de activo - Versión SQLite
 import datetime as dt
 import pandas as pd
 from typing import List, Dict
-from services.database_service import read_table, insert_rows, delete_row
+from services.database_service import (
+    read_table, insert_rows, delete_row, query_rows, count_rows, get_respuestas
+)
 
 
 # Configuración - Máximo 21 preguntas por cuestionario (nuevo formato oficial)
@@ -49,15 +51,8 @@ def generar_cuestionario(eval_id: str, activo: Dict, model: str = "llama3") -> t
     tipo_activo = activo.get("Tipo_Activo", "Servidor Físico")
     
     # Verificar si ya existe cuestionario
-    cuestionarios_existentes = read_table("CUESTIONARIOS")
-    if not cuestionarios_existentes.empty:
-        ya_existe = not cuestionarios_existentes[
-            (cuestionarios_existentes["ID_Evaluacion"].astype(str) == str(eval_id)) &
-            (cuestionarios_existentes["ID_Activo"].astype(str) == str(activo_id))
-        ].empty
-        
-        if ya_existe:
-            return False, "⚠️ Este activo ya tiene un cuestionario generado", 0
+    if count_rows("CUESTIONARIOS", {"ID_Evaluacion": eval_id, "ID_Activo": activo_id}) > 0:
+        return False, "⚠️ Este activo ya tiene un cuestionario generado", 0
     
     # Generar timestamp de versión
     fecha_version = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -104,20 +99,7 @@ def get_cuestionario(eval_id: str, activo_id: str, fecha_version: str = None) ->
     Obtiene el cuestionario de un activo
     Si no se especifica versión, devuelve la más reciente
     """
-    cuestionarios = read_table("CUESTIONARIOS")
-    
-    if cuestionarios.empty:
-        return pd.DataFrame()
-    
-    # Verificar que existan las columnas necesarias
-    if "ID_Evaluacion" not in cuestionarios.columns or "ID_Activo" not in cuestionarios.columns:
-        return pd.DataFrame()
-    
-    # Filtrar por evaluación y activo
-    filtrado = cuestionarios[
-        (cuestionarios["ID_Evaluacion"].astype(str) == str(eval_id)) &
-        (cuestionarios["ID_Activo"].astype(str) == str(activo_id))
-    ]
+    filtrado = query_rows("CUESTIONARIOS", {"ID_Evaluacion": eval_id, "ID_Activo": activo_id})
     
     if filtrado.empty:
         return pd.DataFrame()
@@ -135,15 +117,11 @@ def get_cuestionario(eval_id: str, activo_id: str, fecha_version: str = None) ->
 
 def get_versiones_cuestionario(eval_id: str, activo_id: str) -> List[str]:
     """Obtiene todas las versiones de cuestionario de un activo"""
-    cuestionarios = read_table("CUESTIONARIOS")
-    
-    if cuestionarios.empty:
-        return []
-    
-    filtrado = cuestionarios[
-        (cuestionarios["ID_Evaluacion"].astype(str) == str(eval_id)) &
-        (cuestionarios["ID_Activo"].astype(str) == str(activo_id))
-    ]
+    filtrado = query_rows(
+        "CUESTIONARIOS",
+        {"ID_Evaluacion": eval_id, "ID_Activo": activo_id},
+        columns=["Fecha_Version"]
+    )
     
     if filtrado.empty:
         return []
@@ -158,17 +136,7 @@ def verificar_respuestas_existentes(eval_id: str, activo_id: str) -> bool:
     Returns:
         bool: True si ya existen respuestas, False si no
     """
-    respuestas = read_table("RESPUESTAS")
-    
-    if respuestas.empty:
-        return False
-    
-    existentes = respuestas[
-        (respuestas["ID_Evaluacion"].astype(str) == str(eval_id)) &
-        (respuestas["ID_Activo"].astype(str) == str(activo_id))
-    ]
-    
-    return not existentes.empty
+    return count_rows("RESPUESTAS", {"ID_Evaluacion": eval_id, "ID_Activo": activo_id}) > 0
 
 
 def guardar_respuestas(eval_id: str, activo_id: str, fecha_cuestionario: str, respuestas: List[Dict]) -> bool:
@@ -209,24 +177,6 @@ def guardar_respuestas(eval_id: str, activo_id: str, fecha_cuestionario: str, re
     return True
 
 
-def get_respuestas(eval_id: str, activo_id: str, fecha_cuestionario: str = None) -> pd.DataFrame:
-    """Obtiene las respuestas guardadas de un cuestionario"""
-    respuestas = read_table("RESPUESTAS")
-    
-    if respuestas.empty:
-        return pd.DataFrame()
-    
-    filtrado = respuestas[
-        (respuestas["ID_Evaluacion"].astype(str) == str(eval_id)) &
-        (respuestas["ID_Activo"].astype(str) == str(activo_id))
-    ]
-    
-    if fecha_cuestionario:
-        filtrado = filtrado[filtrado["Fecha_Cuestionario"].astype(str) == str(fecha_cuestionario)]
-    
-    return filtrado
-
-
 def verificar_cuestionario_completo(eval_id: str, activo_id: str, fecha_cuestionario: str = None) -> bool:
     """
     Verifica si un cuestionario está completo
@@ -263,14 +213,7 @@ def invalidar_analisis_ia(eval_id: str, activo_id: str) -> bool:
     """
     try:
         # Verificar si existe análisis
-        analisis = read_table("ANALISIS_RIESGO")
-        if analisis.empty:
-            return False
-        
-        existe = not analisis[
-            (analisis["ID_Evaluacion"].astype(str) == str(eval_id)) &
-            (analisis["ID_Activo"].astype(str) == str(activo_id))
-        ].empty
+        existe = count_rows("ANALISIS_RIESGO", {"ID_Evaluacion": eval_id, "ID_Activo": activo_id}) > 0
         
         if existe:
             delete_row("ANALISIS_RIESGO", {
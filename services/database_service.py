@@ -5,217 +5,349 @@ SQLite maneja concurrencia, transacciones ACID y no se corrompe
 import sqlite3
 import pandas as pd
 import datetime as dt
+import logging
 import os
 import threading
-from typing import List, Dict, Any, Optional
+import time
+import weakref
+from typing import List, Dict, Any, Optional, Tuple
 from contextlib import contextmanager
+from dataclasses import dataclass
 
 DB_PATH = "tita_database.db"
 
-# Lock global para operaciones de escritura
-_db_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+# Lock global para operaciones de escritura (reentrante: write_transaction()
+# puede envolver varias llamadas a insert_rows/update_row/...)
+_db_lock = threading.RLock()
+
+# ==================== POOL DE CONEXIONES ====================
+# Streamlit ejecuta cada sesión en su propio hilo: cada hilo reutiliza una
+# conexión persistente en lugar de abrir/cerrar una por cada lectura o escritura.
+# En modo WAL los lectores no se bloquean mientras otro hilo escribe.
+
+PRAGMAS_CONEXION = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",     # Seguro con WAL; evita fsync en cada commit
+    "cache_size": -20000,        # ~20 MB de caché de páginas por conexión
+    "mmap_size": 268435456,      # 256 MB de lectura mapeada en memoria
+    "temp_store": "MEMORY",
+    "busy_timeout": 30000,       # ms (equivalente al timeout=30 anterior)
+}
+
+_local = threading.local()
+_pool_lock = threading.Lock()
+# (hilo, conexión) de todas las conexiones abiertas; Streamlit crea un hilo nuevo
+# por cada rerun, así que las conexiones de hilos terminados se cierran al abrir otra.
+_conexiones_pool: List[Tuple["weakref.ref[threading.Thread]", sqlite3.Connection]] = []
+# Se incrementa en close_connections(): las conexiones de otros hilos con una
+# generación anterior ya están cerradas y se reabren en su siguiente uso.
+_generacion_pool = 0
+
+
+def _abrir_conexion(db_path: str) -> sqlite3.Connection:
+    """Abre una conexión nueva y aplica los PRAGMAs de rendimiento"""
+    # check_same_thread=False solo para poder cerrarla desde otro hilo;
+    # cada conexión se usa exclusivamente desde el hilo que la creó.
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    for pragma, valor in PRAGMAS_CONEXION.items():
+        conn.execute(f"PRAGMA {pragma}={valor}")
+    
+    huerfanas = []
+    with _pool_lock:
+        vivas = []
+        for ref_hilo, otra in _conexiones_pool:
+            hilo = ref_hilo()
+            if hilo is None or not hilo.is_alive():
+                huerfanas.append(otra)
+            else:
+                vivas.append((ref_hilo, otra))
+        vivas.append((weakref.ref(threading.current_thread()), conn))
+        _conexiones_pool[:] = vivas
+    for otra in huerfanas:
+        _cerrar(otra)
+    return conn
+
+
+def _conexion_hilo() -> sqlite3.Connection:
+    """Obtiene (o crea) la conexión persistente del hilo actual"""
+    conn = getattr(_local, "conn", None)
+    vigente = getattr(_local, "generacion", None) == _generacion_pool
+    if conn is not None and vigente and getattr(_local, "db_path", None) == DB_PATH:
+        return conn
+    if conn is not None and vigente:
+        # DB_PATH cambió (scripts de inicialización / pruebas): descartar la anterior
+        with _pool_lock:
+            _conexiones_pool[:] = [(h, c) for h, c in _conexiones_pool if c is not conn]
+        _cerrar(conn)
+    # Una conexión de una generación anterior ya la cerró close_connections()
+    _local.generacion = _generacion_pool
+    _local.conn = _abrir_conexion(DB_PATH)
+    _local.db_path = DB_PATH
+    if conn is None or vigente:
+        _local.profundidad = 0
+    return _local.conn
+
+
+def _cerrar(conn: sqlite3.Connection):
+    """Cierra una conexión ignorando errores (p.ej. ya cerrada)"""
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def close_connections():
+    """
+    Cierra todas las conexiones del pool.
+    
+    Necesario antes de borrar o reemplazar el archivo de la base de datos
+    (p.ej. init_sqlite.py). Las siguientes llamadas a get_connection()
+    abrirán conexiones nuevas, también en los demás hilos (trabajos en
+    segundo plano, monitor de Ollama, ...).
+    """
+    global _generacion_pool
+    with _pool_lock:
+        conexiones = [conn for _, conn in _conexiones_pool]
+        _conexiones_pool.clear()
+        _generacion_pool += 1
+    for conn in conexiones:
+        _cerrar(conn)
+    _local.__dict__.clear()
 
 
 @contextmanager
 def get_connection():
-    """Context manager para conexiones a la base de datos"""
-    conn = sqlite3.connect(DB_PATH, timeout=30)
-    conn.row_factory = sqlite3.Row
+    """
+    Context manager para conexiones a la base de datos.
+    
+    Reutiliza la conexión persistente del hilo. Los bloques anidados comparten
+    la misma conexión y transacción: solo el bloque más externo hace commit
+    (o rollback si hubo una excepción).
+    """
+    conn = _conexion_hilo()
+    if _local.profundidad == 0:
+        conn.row_factory = sqlite3.Row
+    _local.profundidad += 1
     try:
         yield conn
-        conn.commit()
+        if _local.profundidad == 1:
+            conn.commit()
     except Exception as e:
-        conn.rollback()
+        if _local.profundidad == 1:
+            conn.rollback()
         raise e
     finally:
-        conn.close()
+        _local.profundidad -= 1
+
+
+@contextmanager
+def write_transaction():
+    """
+    Transacción de escritura que agrupa varias operaciones.
+    
+    Mantiene el lock de escritura durante toda la transacción, de modo que los
+    helpers llamados dentro (insert_rows, delete_rows, ...) no compiten con
+    escritores de otros hilos a mitad de la transacción.
+    """
+    with _db_lock:
+        with get_connection() as conn:
+            yield conn
 
 
 def init_database():
-    """Inicializa la base de datos con todas las tablas"""
+    """Inicializa la base de datos con todas las tablas y aplica las migraciones pendientes"""
+    from services.migracion_service import aplicar_migraciones
     with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        # EVALUACIONES
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS EVALUACIONES (
-                ID_Evaluacion TEXT PRIMARY KEY,
-                Nombre TEXT NOT NULL,
-                Fecha TEXT,
-                Estado TEXT DEFAULT 'Activa',
-                Descripcion TEXT
-            )
-        ''')
-        
-        # INVENTARIO_ACTIVOS
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS INVENTARIO_ACTIVOS (
-                ID_Activo TEXT PRIMARY KEY,
-                ID_Evaluacion TEXT,
-                Nombre_Activo TEXT NOT NULL,
-                Tipo_Activo TEXT,
-                Ubicacion TEXT,
-                Propietario TEXT,
-                Tipo_Servicio TEXT,
-                App_Critica TEXT,
-                Estado TEXT DEFAULT 'Pendiente',
-                Fecha_Creacion TEXT,
-                FOREIGN KEY (ID_Evaluacion) REFERENCES EVALUACIONES(ID_Evaluacion)
-            )
-        ''')
-        
-        # CRITERIOS_MAGERIT
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS CRITERIOS_MAGERIT (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                Dimension TEXT,
-                "Nivel(1-5)" INTEGER,
-                Descripcion TEXT,
-                Ejemplo TEXT
-            )
-        ''')
-        
-        # CATALOGO_AMENAZAS_MAGERIT
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS CATALOGO_AMENAZAS_MAGERIT (
-                Cod_MAGERIT TEXT PRIMARY KEY,
-                Categoria TEXT,
-                Amenaza TEXT,
-                Descripcion TEXT,
-                "Dimension(D/I/C)" TEXT,
-                "Severidad_Base(1-5)" INTEGER
-            )
-        ''')
-        
-        # CATALOGO_ISO27002_2022
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS CATALOGO_ISO27002_2022 (
-                Control TEXT PRIMARY KEY,
-                Nombre TEXT,
-                Dominio TEXT,
-                Descripcion TEXT
-            )
-        ''')
-        
-        # BANCO_PREGUNTAS_FISICAS
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS BANCO_PREGUNTAS_FISICAS (
-                ID_Pregunta TEXT PRIMARY KEY,
-                Tipo_Activo TEXT,
-                Bloque TEXT,
-                Dimension TEXT,
-                Pregunta TEXT,
-                Opcion_1 TEXT,
-                Opcion_2 TEXT,
-                Opcion_3 TEXT,
-                Opcion_4 TEXT,
-                Peso INTEGER
-            )
-        ''')
-        
-        # BANCO_PREGUNTAS_VIRTUALES
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS BANCO_PREGUNTAS_VIRTUALES (
-                ID_Pregunta TEXT PRIMARY KEY,
-                Tipo_Activo TEXT,
-                Bloque TEXT,
-                Dimension TEXT,
-                Pregunta TEXT,
-                Opcion_1 TEXT,
-                Opcion_2 TEXT,
-                Opcion_3 TEXT,
-                Opcion_4 TEXT,
-                Peso INTEGER
-            )
-        ''')
-        
-        # CUESTIONARIOS
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS CUESTIONARIOS (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ID_Evaluacion TEXT,
-                ID_Activo TEXT,
-                Fecha_Version TEXT,
-                ID_Pregunta TEXT,
-                Bloque TEXT,
-                Dimension TEXT,
-                Pregunta TEXT,
-                Opcion_1 TEXT,
-                Opcion_2 TEXT,
-                Opcion_3 TEXT,
-                Opcion_4 TEXT,
-                Peso INTEGER,
-                FOREIGN KEY (ID_Evaluacion) REFERENCES EVALUACIONES(ID_Evaluacion),
-                FOREIGN KEY (ID_Activo) REFERENCES INVENTARIO_ACTIVOS(ID_Activo)
-            )
-        ''')
-        
-        # RESPUESTAS
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS RESPUESTAS (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ID_Evaluacion TEXT,
-                ID_Activo TEXT,
-                Fecha_Cuestionario TEXT,
-                ID_Pregunta TEXT,
-                Bloque TEXT,
-                Pregunta TEXT,
-                Respuesta TEXT,
-                Valor_Numerico INTEGER,
-                Peso INTEGER,
-                Dimension TEXT,
-                Fecha TEXT,
-                FOREIGN KEY (ID_Evaluacion) REFERENCES EVALUACIONES(ID_Evaluacion),
-                FOREIGN KEY (ID_Activo) REFERENCES INVENTARIO_ACTIVOS(ID_Activo)
-            )
-        ''')
-        
-        # IMPACTO_ACTIVOS
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS IMPACTO_ACTIVOS (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ID_Evaluacion TEXT,
-                ID_Activo TEXT,
-                Fecha TEXT,
-                Impacto_D INTEGER,
-                Impacto_I INTEGER,
-                Impacto_C INTEGER,
-                Justificacion_D TEXT,
-                Justificacion_I TEXT,
-                Justificacion_C TEXT,
-                FOREIGN KEY (ID_Evaluacion) REFERENCES EVALUACIONES(ID_Evaluacion),
-                FOREIGN KEY (ID_Activo) REFERENCES INVENTARIO_ACTIVOS(ID_Activo),
-                UNIQUE(ID_Evaluacion, ID_Activo)
-            )
-        ''')
-        
-        # ANALISIS_RIESGO
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ANALISIS_RIESGO (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ID_Evaluacion TEXT,
-                ID_Activo TEXT,
-                Fecha TEXT,
-                Tipo_Activo TEXT,
-                Nombre_Activo TEXT,
-                Probabilidad REAL,
-                Impacto REAL,
-                Riesgo_Inherente REAL,
-                Nivel_Riesgo TEXT,
-                Recomendaciones TEXT,
-                Estado TEXT,
-                Modelo_IA TEXT,
-                FOREIGN KEY (ID_Evaluacion) REFERENCES EVALUACIONES(ID_Evaluacion),
-                FOREIGN KEY (ID_Activo) REFERENCES INVENTARIO_ACTIVOS(ID_Activo)
-            )
-        ''')
-        
-        # Crear índices para mejor rendimiento
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_activos_eval ON INVENTARIO_ACTIVOS(ID_Evaluacion)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cuestionarios_eval_activo ON CUESTIONARIOS(ID_Evaluacion, ID_Activo)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_respuestas_eval_activo ON RESPUESTAS(ID_Evaluacion, ID_Activo)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_impacto_eval_activo ON IMPACTO_ACTIVOS(ID_Evaluacion, ID_Activo)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_analisis_eval_activo ON ANALISIS_RIESGO(ID_Evaluacion, ID_Activo)')
+        crear_tablas_base(conn)
+    aplicar_migraciones()
+
+
+def crear_tablas_base(conn: sqlite3.Connection):
+    """Crea las tablas principales (evaluaciones, activos, catálogos, cuestionarios)"""
+    cursor = conn.cursor()
+    
+    # EVALUACIONES
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS EVALUACIONES (
+            ID_Evaluacion TEXT PRIMARY KEY,
+            Nombre TEXT NOT NULL,
+            Fecha TEXT,
+            Estado TEXT DEFAULT 'Activa',
+            Descripcion TEXT
+        )
+    ''')
+    
+    # INVENTARIO_ACTIVOS
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS INVENTARIO_ACTIVOS (
+            ID_Activo TEXT PRIMARY KEY,
+            ID_Evaluacion TEXT,
+            Nombre_Activo TEXT NOT NULL,
+            Tipo_Activo TEXT,
+            Ubicacion TEXT,
+            Propietario TEXT,
+            Tipo_Servicio TEXT,
+            App_Critica TEXT,
+            Estado TEXT DEFAULT 'Pendiente',
+            Fecha_Creacion TEXT,
+            FOREIGN KEY (ID_Evaluacion) REFERENCES EVALUACIONES(ID_Evaluacion)
+        )
+    ''')
+    
+    # CRITERIOS_MAGERIT
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS CRITERIOS_MAGERIT (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            Dimension TEXT,
+            "Nivel(1-5)" INTEGER,
+            Descripcion TEXT,
+            Ejemplo TEXT
+        )
+    ''')
+    
+    # CATALOGO_AMENAZAS_MAGERIT
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS CATALOGO_AMENAZAS_MAGERIT (
+            Cod_MAGERIT TEXT PRIMARY KEY,
+            Categoria TEXT,
+            Amenaza TEXT,
+            Descripcion TEXT,
+            "Dimension(D/I/C)" TEXT,
+            "Severidad_Base(1-5)" INTEGER
+        )
+    ''')
+    
+    # CATALOGO_ISO27002_2022
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS CATALOGO_ISO27002_2022 (
+            Control TEXT PRIMARY KEY,
+            Nombre TEXT,
+            Dominio TEXT,
+            Descripcion TEXT
+        )
+    ''')
+    
+    # BANCO_PREGUNTAS_FISICAS
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS BANCO_PREGUNTAS_FISICAS (
+            ID_Pregunta TEXT PRIMARY KEY,
+            Tipo_Activo TEXT,
+            Bloque TEXT,
+            Dimension TEXT,
+            Pregunta TEXT,
+            Opcion_1 TEXT,
+            Opcion_2 TEXT,
+            Opcion_3 TEXT,
+            Opcion_4 TEXT,
+            Peso INTEGER
+        )
+    ''')
+    
+    # BANCO_PREGUNTAS_VIRTUALES
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS BANCO_PREGUNTAS_VIRTUALES (
+            ID_Pregunta TEXT PRIMARY KEY,
+            Tipo_Activo TEXT,
+            Bloque TEXT,
+            Dimension TEXT,
+            Pregunta TEXT,
+            Opcion_1 TEXT,
+            Opcion_2 TEXT,
+            Opcion_3 TEXT,
+            Opcion_4 TEXT,
+            Peso INTEGER
+        )
+    ''')
+    
+    # CUESTIONARIOS
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS CUESTIONARIOS (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Evaluacion TEXT,
+            ID_Activo TEXT,
+            Fecha_Version TEXT,
+            ID_Pregunta TEXT,
+            Bloque TEXT,
+            Dimension TEXT,
+            Pregunta TEXT,
+            Opcion_1 TEXT,
+            Opcion_2 TEXT,
+            Opcion_3 TEXT,
+            Opcion_4 TEXT,
+            Peso INTEGER,
+            FOREIGN KEY (ID_Evaluacion) REFERENCES EVALUACIONES(ID_Evaluacion),
+            FOREIGN KEY (ID_Activo) REFERENCES INVENTARIO_ACTIVOS(ID_Activo)
+        )
+    ''')
+    
+    # RESPUESTAS
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS RESPUESTAS (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Evaluacion TEXT,
+            ID_Activo TEXT,
+            Fecha_Cuestionario TEXT,
+            ID_Pregunta TEXT,
+            Bloque TEXT,
+            Pregunta TEXT,
+            Respuesta TEXT,
+            Valor_Numerico INTEGER,
+            Peso INTEGER,
+            Dimension TEXT,
+            Fecha TEXT,
+            FOREIGN KEY (ID_Evaluacion) REFERENCES EVALUACIONES(ID_Evaluacion),
+            FOREIGN KEY (ID_Activo) REFERENCES INVENTARIO_ACTIVOS(ID_Activo)
+        )
+    ''')
+    
+    # IMPACTO_ACTIVOS
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS IMPACTO_ACTIVOS (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Evaluacion TEXT,
+            ID_Activo TEXT,
+            Fecha TEXT,
+            Impacto_D INTEGER,
+            Impacto_I INTEGER,
+            Impacto_C INTEGER,
+            Justificacion_D TEXT,
+            Justificacion_I TEXT,
+            Justificacion_C TEXT,
+            FOREIGN KEY (ID_Evaluacion) REFERENCES EVALUACIONES(ID_Evaluacion),
+            FOREIGN KEY (ID_Activo) REFERENCES INVENTARIO_ACTIVOS(ID_Activo),
+            UNIQUE(ID_Evaluacion, ID_Activo)
+        )
+    ''')
+    
+    # ANALISIS_RIESGO
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ANALISIS_RIESGO (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Evaluacion TEXT,
+            ID_Activo TEXT,
+            Fecha TEXT,
+            Tipo_Activo TEXT,
+            Nombre_Activo TEXT,
+            Probabilidad REAL,
+            Impacto REAL,
+            Riesgo_Inherente REAL,
+            Nivel_Riesgo TEXT,
+            Recomendaciones TEXT,
+            Estado TEXT,
+            Modelo_IA TEXT,
+            FOREIGN KEY (ID_Evaluacion) REFERENCES EVALUACIONES(ID_Evaluacion),
+            FOREIGN KEY (ID_Activo) REFERENCES INVENTARIO_ACTIVOS(ID_Activo)
+        )
+    ''')
+    
+    # Crear índices para mejor rendimiento
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activos_eval ON INVENTARIO_ACTIVOS(ID_Evaluacion)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cuestionarios_eval_activo ON CUESTIONARIOS(ID_Evaluacion, ID_Activo)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_respuestas_eval_activo ON RESPUESTAS(ID_Evaluacion, ID_Activo)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_impacto_eval_activo ON IMPACTO_ACTIVOS(ID_Evaluacion, ID_Activo)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_analisis_eval_activo ON ANALISIS_RIESGO(ID_Evaluacion, ID_Activo)')
 
 
 def read_table(table_name: str) -> pd.DataFrame:
@@ -238,18 +370,16 @@ def insert_row(table_name: str, data: Dict[str, Any]):
             conn.execute(query, list(data.values()))
 
 
-def insert_rows(table_name: str, rows: List[Dict[str, Any]]):
-    """Inserta múltiples filas en una tabla"""
-    if not rows:
-        return
+def insert_rows(table_name: str, rows: List[Dict[str, Any]],
+                chunk_size: int = None) -> "ResultadoEscritura":
+    """
+    Inserta múltiples filas en una tabla con executemany.
     
-    with _db_lock:
-        with get_connection() as conn:
-            columns = ', '.join([f'"{k}"' for k in rows[0].keys()])
-            placeholders = ', '.join(['?' for _ in rows[0]])
-            query = f'INSERT INTO "{table_name}" ({columns}) VALUES ({placeholders})'
-            for row in rows:
-                conn.execute(query, list(row.values()))
+    Las filas se escriben en transacciones de chunk_size filas (si la llamada
+    está anidada dentro de otro get_connection(), todo queda en la transacción
+    externa). Devuelve un ResultadoEscritura con filas/segundo.
+    """
+    return _escribir_en_bloque(table_name, rows, chunk_size=chunk_size)
 
 
 def update_row(table_name: str, updates: Dict[str, Any], conditions: Dict[str, Any]):
@@ -285,23 +415,101 @@ def delete_row(table_name: str, conditions: Dict[str, Any]):
 
 
 def delete_rows(table_name: str, conditions: Dict[str, Any]):
-    """Elimina filas que cumplan las condiciones"""
+    """Elimina filas que cumplan las condiciones (listas/tuplas/sets → IN)"""
+    if not conditions:
+        raise ValueError("delete_rows requiere al menos una condición")
     with _db_lock:
         with get_connection() as conn:
-            where_clause = ' AND '.join([f'"{k}" = ?' for k in conditions.keys()])
-            query = f'DELETE FROM "{table_name}" WHERE {where_clause}'
-            conn.execute(query, list(conditions.values()))
+            where_clause, params = _where(conditions)
+            conn.execute(f'DELETE FROM "{table_name}"{where_clause}', params)
+
+
+def _where(conditions: Optional[Dict[str, Any]]) -> Tuple[str, list]:
+    """Construye la cláusula WHERE parametrizada (listas/tuplas/sets → IN)"""
+    if not conditions:
+        return "", []
+    partes = []
+    params = []
+    for columna, valor in conditions.items():
+        if isinstance(valor, (list, tuple, set)):
+            valores = list(valor)
+            if not valores:
+                partes.append("0")
+                continue
+            partes.append(f'"{columna}" IN ({", ".join("?" for _ in valores)})')
+            params.extend(valores)
+        else:
+            partes.append(f'"{columna}" = ?')
+            params.append(valor)
+    return " WHERE " + " AND ".join(partes), params
+
+
+def _tabla_inexistente(error: Exception, table_name: str) -> bool:
+    """True si el error es solo que la tabla aún no existe (base sin migrar); se registra en el log"""
+    if "no such table" not in str(error):
+        return False
+    logger.warning("Tabla %s no disponible: %s", table_name, error)
+    return True
 
 
-def query_rows(table_name: str, conditions: Dict[str, Any] = None) -> pd.DataFrame:
-    """Consulta filas con condiciones opcionales"""
+def query_rows(table_name: str, conditions: Dict[str, Any] = None,
+               columns: List[str] = None, order_by: str = None,
+               limit: int = None) -> pd.DataFrame:
+    """
+    Consulta filas con condiciones opcionales.
+    
+    El filtro (WHERE), la proyección de columnas, el orden y el límite se
+    resuelven en SQLite, así que solo viajan a pandas las filas necesarias.
+    
+    Args:
+        table_name: Nombre de la tabla
+        conditions: {columna: valor} (igualdad) o {columna: [valores]} (IN)
+        columns: Columnas a devolver (None = todas)
+        order_by: Expresión ORDER BY (p.ej. 'Fecha_Version DESC')
+        limit: Número máximo de filas
+    
+    Si la tabla no existe devuelve un DataFrame vacío; cualquier otro error
+    (columna inexistente, base bloqueada, ...) se propaga.
+    """
+    where, params = _where(conditions)
+    select = ', '.join(f'"{c}"' for c in columns) if columns else '*'
+    query = f'SELECT {select} FROM "{table_name}"{where}'
+    if order_by:
+        query += f' ORDER BY {order_by}'
+    if limit:
+        query += f' LIMIT {int(limit)}'
     with get_connection() as conn:
-        if conditions:
-            where_clause = ' AND '.join([f'"{k}" = ?' for k in conditions.keys()])
-            query = f'SELECT * FROM "{table_name}" WHERE {where_clause}'
-            return pd.read_sql_query(query, conn, params=list(conditions.values()))
-        else:
-            return pd.read_sql_query(f'SELECT * FROM "{table_name}"', conn)
+        try:
+            return pd.read_sql_query(query, conn, params=params)
+        except (sqlite3.OperationalError, pd.errors.DatabaseError) as e:
+            if not _tabla_inexistente(e, table_name):
+                raise
+            return pd.DataFrame(columns=columns or [])
+
+
+def query_one(table_name: str, conditions: Dict[str, Any],
+              columns: List[str] = None) -> Optional[Dict[str, Any]]:
+    """Devuelve la primera fila que cumple las condiciones como dict (o None, también si la tabla no existe)"""
+    where, params = _where(conditions)
+    select = ', '.join(f'"{c}"' for c in columns) if columns else '*'
+    with get_connection() as conn:
+        try:
+            row = conn.execute(f'SELECT {select} FROM "{table_name}"{where} LIMIT 1', params).fetchone()
+        except sqlite3.OperationalError as e:
+            if not _tabla_inexistente(e, table_name):
+                raise
+            return None
+    return dict(row) if row else None
+
+
+def count_rows(table_name: str, conditions: Dict[str, Any] = None) -> int:
+    """Cuenta filas que cumplen las condiciones (0 si la tabla no existe)"""
+    where, params = _where(conditions)
+    with get_connection() as conn:
+        try:
+            return conn.execute(f'SELECT COUNT(*) FROM "{table_name}"{where}', params).fetchone()[0]
+        except sqlite3.Error:
+            return 0
 
 
 def row_exists(table_name: str, conditions: Dict[str, Any]) -> bool:
@@ -313,7 +521,8 @@ def row_exists(table_name: str, conditions: Dict[str, Any]) -> bool:
         return result[0] > 0
 
 
-def upsert_row(table_name: str, data: Dict[str, Any], key_columns: List[str]):
+def upsert_row(table_name: str, data: Dict[str, Any], key_columns: List[str],
+               update_columns: List[str] = None):
     """
     Inserta o actualiza una fila basándose en las columnas clave
     
@@ -321,13 +530,172 @@ def upsert_row(table_name: str, data: Dict[str, Any], key_columns: List[str]):
         table_name: Nombre de la tabla
         data: Diccionario con todos los datos
         key_columns: Lista de columnas que forman la clave única
+        update_columns: Columnas a actualizar si la fila existe (None = todas menos la clave)
     """
-    conditions = {col: data[col] for col in key_columns if col in data}
-    if row_exists(table_name, conditions):
-        updates = {k: v for k, v in data.items() if k not in key_columns}
-        update_row(table_name, updates, conditions)
-    else:
-        insert_row(table_name, data)
+    upsert_rows(table_name, [data], key_columns, update_columns)
+
+
+def upsert_rows(table_name: str, rows: List[Dict[str, Any]], key_columns: List[str],
+                update_columns: List[str] = None, chunk_size: int = None) -> "ResultadoEscritura":
+    """
+    Inserta o actualiza múltiples filas con INSERT ... ON CONFLICT DO UPDATE.
+    
+    Requiere un índice UNIQUE/PRIMARY KEY sobre key_columns. Si la tabla no lo
+    tiene, se usa UPDATE + INSERT de las filas no actualizadas en la misma
+    transacción.
+    """
+    return _escribir_en_bloque(table_name, rows, key_columns, update_columns, chunk_size)
+
+
+# ==================== ESCRITURA EN BLOQUE ====================
+# executemany + transacciones por bloques: una carga de miles de filas cuesta
+# unos pocos commits en lugar de uno por fila.
+
+BULK_CHUNK_SIZE = 5000
+
+
+@dataclass
+class ResultadoEscritura:
+    """Resumen de una escritura en bloque"""
+    tabla: str
+    filas: int = 0
+    transacciones: int = 0
+    segundos: float = 0.0
+
+    @property
+    def filas_por_segundo(self) -> float:
+        return self.filas / self.segundos if self.segundos > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.tabla}: {self.filas} filas en {self.segundos:.2f} s ({self.filas_por_segundo:,.0f} filas/s)"
+
+
+def _sql_insert(table_name: str, columnas: List[str]) -> str:
+    cols = ', '.join(f'"{c}"' for c in columnas)
+    return f'INSERT INTO "{table_name}" ({cols}) VALUES ({", ".join("?" for _ in columnas)})'
+
+
+def _sql_upsert(table_name: str, columnas: List[str], key_columns: List[str],
+                actualizar: List[str]) -> str:
+    query = _sql_insert(table_name, columnas)
+    conflicto = ', '.join(f'"{c}"' for c in key_columns)
+    if not actualizar:
+        return f'{query} ON CONFLICT ({conflicto}) DO NOTHING'
+    set_clause = ', '.join(f'"{c}" = excluded."{c}"' for c in actualizar)
+    return f'{query} ON CONFLICT ({conflicto}) DO UPDATE SET {set_clause}'
+
+
+def _upsert_sin_indice(conn: sqlite3.Connection, table_name: str, columnas: List[str],
+                       filas: List[tuple], key_columns: List[str], actualizar: List[str]):
+    """UPDATE + INSERT de las filas no actualizadas (tablas sin índice único sobre la clave)"""
+    pos = {c: i for i, c in enumerate(columnas)}
+    where = ' AND '.join(f'"{c}" = ?' for c in key_columns)
+    insertar = _sql_insert(table_name, columnas)
+    for fila in filas:
+        clave = [fila[pos[c]] for c in key_columns]
+        if actualizar:
+            set_clause = ', '.join(f'"{c}" = ?' for c in actualizar)
+            cur = conn.execute(f'UPDATE "{table_name}" SET {set_clause} WHERE {where}',
+                               [fila[pos[c]] for c in actualizar] + clave)
+            if cur.rowcount:
+                continue
+        elif conn.execute(f'SELECT 1 FROM "{table_name}" WHERE {where} LIMIT 1', clave).fetchone():
+            continue
+        conn.execute(insertar, fila)
+
+
+def _escribir_en_bloque(table_name: str, rows: List[Dict[str, Any]],
+                        key_columns: List[str] = None, update_columns: List[str] = None,
+                        chunk_size: int = None) -> ResultadoEscritura:
+    """
+    Agrupa las filas por conjunto de columnas y las escribe con executemany,
+    haciendo commit cada chunk_size filas. Con key_columns hace upsert.
+    """
+    resultado = ResultadoEscritura(tabla=table_name)
+    if not rows:
+        return resultado
+    chunk_size = chunk_size or BULK_CHUNK_SIZE
+
+    grupos: Dict[Tuple[str, ...], List[tuple]] = {}
+    for row in rows:
+        grupos.setdefault(tuple(row.keys()), []).append(tuple(row.values()))
+
+    t0 = time.perf_counter()
+    for columnas, filas in grupos.items():
+        columnas = list(columnas)
+        if key_columns:
+            actualizar = [c for c in (update_columns or columnas)
+                          if c in columnas and c not in key_columns]
+            query = _sql_upsert(table_name, columnas, key_columns, actualizar)
+        else:
+            query = _sql_insert(table_name, columnas)
+        for inicio in range(0, len(filas), chunk_size):
+            bloque = filas[inicio:inicio + chunk_size]
+            with _db_lock:
+                with get_connection() as conn:
+                    try:
+                        conn.executemany(query, bloque)
+                    except sqlite3.OperationalError as e:
+                        if not key_columns or "ON CONFLICT" not in str(e):
+                            raise
+                        _upsert_sin_indice(conn, table_name, columnas, bloque, key_columns, actualizar)
+            resultado.filas += len(bloque)
+            resultado.transacciones += 1
+    resultado.segundos = time.perf_counter() - t0
+    return resultado
+
+
+# ==================== CONSULTAS TIPADAS ====================
+# Accesos por evaluación/activo usados en los caminos calientes. Cuestan
+# O(filas del activo) gracias a los índices (ID_Evaluacion, ID_Activo),
+# en lugar de leer la tabla completa y filtrar en pandas.
+
+def get_evaluacion(eval_id: str) -> Optional[Dict[str, Any]]:
+    """Obtiene el registro de una evaluación"""
+    return query_one("EVALUACIONES", {"ID_Evaluacion": eval_id})
+
+
+def get_activo(eval_id: str, id_activo: str) -> Optional[Dict[str, Any]]:
+    """Obtiene los datos de un activo específico de una evaluación"""
+    return query_one("INVENTARIO_ACTIVOS", {"ID_Evaluacion": eval_id, "ID_Activo": id_activo})
+
+
+def get_activos_evaluacion(eval_id: str, columns: List[str] = None,
+                           conditions: Dict[str, Any] = None) -> pd.DataFrame:
+    """
+    Obtiene los activos de una evaluación
+    
+    Args:
+        eval_id: ID de la evaluación
+        columns: Columnas a proyectar (None = todas)
+        conditions: Filtros adicionales (p.ej. {"ID_Host": id_host})
+    """
+    filtros = {"ID_Evaluacion": eval_id}
+    if conditions:
+        filtros.update(conditions)
+    return query_rows("INVENTARIO_ACTIVOS", filtros, columns=columns)
+
+
+def get_respuestas(eval_id: str, id_activo: str, fecha_cuestionario: str = None) -> pd.DataFrame:
+    """Obtiene las respuestas del cuestionario de un activo"""
+    filtros = {"ID_Evaluacion": eval_id, "ID_Activo": id_activo}
+    if fecha_cuestionario:
+        filtros["Fecha_Cuestionario"] = fecha_cuestionario
+    return query_rows("RESPUESTAS", filtros)
+
+
+def get_respuestas_evaluacion(eval_id: str, columns: List[str] = None) -> pd.DataFrame:
+    """Obtiene todas las respuestas de una evaluación"""
+    return query_rows("RESPUESTAS", {"ID_Evaluacion": eval_id}, columns=columns)
+
+
+def get_resultados_magerit_evaluacion(eval_id: str, columns: List[str] = None,
+                                      id_activo: str = None) -> pd.DataFrame:
+    """Obtiene los resultados MAGERIT de una evaluación (opcionalmente de un activo)"""
+    filtros = {"ID_Evaluacion": eval_id}
+    if id_activo:
+        filtros["ID_Activo"] = id_activo
+    return query_rows("RESULTADOS_MAGERIT", filtros, columns=columns)
 
 
 # ==================== FUNCIONES DE COMPATIBILIDAD CON EXCEL SERVICE ====================
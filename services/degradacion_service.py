@@ -8,9 +8,13 @@ Implementa el concepto de DEGRADACIÓN según Marco Teórico MAGERIT:
 """
 import json
 import datetime as dt
+from functools import lru_cache
 from typing import Dict, List, Tuple, Optional, Any
 from dataclasses import dataclass, asdict
-from services.database_service import get_connection
+
+import pandas as pd
+
+from services.database_service import get_connection, query_rows, upsert_rows
 
 
 # =============================================================================
@@ -126,6 +130,39 @@ AJUSTE_TIPO_ACTIVO = {
 }
 
 
+AJUSTE_NEUTRO = {"d": 1.0, "i": 1.0, "c": 1.0}
+BASE_GENERICA = {"d": 0.5, "i": 0.5, "c": 0.5, "desc": "Genérico"}
+
+
+def clave_base_motor(codigo_amenaza: str) -> Optional[str]:
+    """Clave de DEGRADACION_MAGERIT usada para un código (o None = base genérica)"""
+    if codigo_amenaza in DEGRADACION_MAGERIT:
+        return codigo_amenaza
+    # Buscar categoría genérica (N.*, I.*, E.*, A.*)
+    categoria = codigo_amenaza[0] + ".*" if codigo_amenaza else "E.*"
+    return categoria if categoria in DEGRADACION_MAGERIT else None
+
+
+def base_motor(codigo_amenaza: str) -> Dict:
+    """Valores base D/I/C del catálogo MAGERIT para un código de amenaza"""
+    clave = clave_base_motor(codigo_amenaza)
+    return DEGRADACION_MAGERIT[clave] if clave else BASE_GENERICA
+
+
+@lru_cache(maxsize=1024)
+def clase_tipo_activo(tipo_activo: str) -> str:
+    """
+    Clave de AJUSTE_TIPO_ACTIVO que aplica a un tipo de activo (la primera
+    contenida en el texto, en minúsculas) o "" si ninguna. Los tipos de una
+    evaluación son pocos: el recorrido por subcadenas se hace una vez por tipo.
+    """
+    tipo_lower = tipo_activo.lower() if tipo_activo else ""
+    for tipo_key in AJUSTE_TIPO_ACTIVO:
+        if tipo_key in tipo_lower:
+            return tipo_key
+    return ""
+
+
 def obtener_degradacion_motor(
     codigo_amenaza: str,
     tipo_activo: str = "",
@@ -149,26 +186,14 @@ def obtener_degradacion_motor(
         Valores normalizados entre 0.0 y 1.0
     """
     # 1. Obtener valores base del catálogo MAGERIT
-    if codigo_amenaza in DEGRADACION_MAGERIT:
-        base = DEGRADACION_MAGERIT[codigo_amenaza]
-    else:
-        # Buscar categoría genérica (N.*, I.*, E.*, A.*)
-        categoria = codigo_amenaza[0] + ".*" if codigo_amenaza else "E.*"
-        base = DEGRADACION_MAGERIT.get(categoria, {"d": 0.5, "i": 0.5, "c": 0.5, "desc": "Genérico"})
+    base = base_motor(codigo_amenaza)
     
     deg_d = base["d"]
     deg_i = base["i"]
     deg_c = base["c"]
-    desc_amenaza = base["desc"]
     
     # 2. Aplicar ajuste por tipo de activo
-    tipo_lower = tipo_activo.lower() if tipo_activo else ""
-    ajuste = {"d": 1.0, "i": 1.0, "c": 1.0}
-    
-    for tipo_key, multiplicadores in AJUSTE_TIPO_ACTIVO.items():
-        if tipo_key in tipo_lower:
-            ajuste = multiplicadores
-            break
+    ajuste = AJUSTE_TIPO_ACTIVO.get(clase_tipo_activo(tipo_activo), AJUSTE_NEUTRO)
     
     deg_d = deg_d * ajuste["d"]
     deg_i = deg_i * ajuste["i"]
@@ -185,14 +210,16 @@ def obtener_degradacion_motor(
     deg_i = min(1.0, max(0.0, round(deg_i, 2)))
     deg_c = min(1.0, max(0.0, round(deg_c, 2)))
     
-    # 5. Construir justificación
-    justificacion = (
-        f"Motor MAGERIT v3: {desc_amenaza}. "
+    return deg_d, deg_i, deg_c, justificacion_motor(base, tipo_activo, criticidad)
+
+
+def justificacion_motor(base: Dict, tipo_activo: str, criticidad) -> str:
+    """Texto de justificación del motor para una fila base de DEGRADACION_MAGERIT"""
+    return (
+        f"Motor MAGERIT v3: {base['desc']}. "
         f"Base: D={base['d']:.0%}, I={base['i']:.0%}, C={base['c']:.0%}. "
         f"Ajuste tipo activo '{tipo_activo}' y criticidad {criticidad}."
     )
-    
-    return deg_d, deg_i, deg_c, justificacion
 
 
 def calcular_degradacion_amenazas(
@@ -211,17 +238,18 @@ def calcular_degradacion_amenazas(
     Returns:
         Lista de amenazas con degradaciones actualizadas por el motor
     """
-    for amenaza in amenazas:
-        codigo = amenaza.get("codigo_amenaza", "")
-        deg_d, deg_i, deg_c, justificacion = obtener_degradacion_motor(
-            codigo, tipo_activo, criticidad
-        )
-        
+    # Import diferido: la matriz se construye con este mismo módulo
+    from services.matriz_degradacion_service import degradaciones_motor
+    
+    codigos = [amenaza.get("codigo_amenaza", "") for amenaza in amenazas]
+    valores = degradaciones_motor(codigos, [tipo_activo] * len(codigos), [criticidad] * len(codigos))
+    
+    for amenaza, codigo, (deg_d, deg_i, deg_c) in zip(amenazas, codigos, valores.tolist()):
         # Actualizar valores (en escala 0-100 para compatibilidad)
         amenaza["degradacion_d"] = int(deg_d * 100)
         amenaza["degradacion_i"] = int(deg_i * 100)
         amenaza["degradacion_c"] = int(deg_c * 100)
-        amenaza["justificacion_motor"] = justificacion
+        amenaza["justificacion_motor"] = justificacion_motor(base_motor(codigo), tipo_activo, criticidad)
         amenaza["fuente_degradacion"] = "MOTOR_MAGERIT"
     
     return amenazas
@@ -354,6 +382,46 @@ def eliminar_degradacion(eval_id: str, activo_id: str, codigo_amenaza: str) -> b
         return False
 
 
+COLUMNAS_DEGRADACION = ["ID_Activo", "Codigo_Amenaza", "Degradacion_D", "Degradacion_I",
+                        "Degradacion_C", "Justificacion", "Fuente"]
+
+
+def cargar_degradaciones(eval_id: str, activos: List[str] = None) -> pd.DataFrame:
+    """
+    Degradaciones registradas de una evaluación (opcionalmente solo de unos
+    activos) en una única consulta, en lugar de un SELECT por amenaza.
+    """
+    condiciones = {"ID_Evaluacion": eval_id}
+    if activos is not None:
+        activos = list(activos)
+        if not activos:
+            return pd.DataFrame(columns=COLUMNAS_DEGRADACION)
+        condiciones["ID_Activo"] = activos
+    return query_rows("DEGRADACION_AMENAZAS", condiciones, columns=COLUMNAS_DEGRADACION)
+
+
+def guardar_degradaciones(degradaciones: List[DegradacionAmenaza]) -> int:
+    """Guarda o actualiza varias degradaciones en una sola transacción"""
+    fecha = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    filas = [
+        {
+            "ID_Evaluacion": deg.id_evaluacion,
+            "ID_Activo": deg.id_activo,
+            "Codigo_Amenaza": deg.codigo_amenaza,
+            "Degradacion_D": deg.degradacion_d,
+            "Degradacion_I": deg.degradacion_i,
+            "Degradacion_C": deg.degradacion_c,
+            "Justificacion": deg.justificacion,
+            "Fuente": deg.fuente,
+            "Fecha_Registro": fecha,
+        }
+        for deg in degradaciones
+    ]
+    if not filas:
+        return 0
+    return upsert_rows("DEGRADACION_AMENAZAS", filas, ["ID_Evaluacion", "ID_Activo", "Codigo_Amenaza"])
+
+
 # =============================================================================
 # CÁLCULOS CON DEGRADACIÓN (FÓRMULAS CORRECTAS MAGERIT)
 # =============================================================================
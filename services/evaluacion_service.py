@@ -3,7 +3,10 @@ Servicio de gestión de evaluaciones - Versión SQLite
 """
 import datetime as dt
 import pandas as pd
-from services.database_service import read_table, insert_rows, update_row, get_connection
+from services.database_service import (
+    read_table, insert_rows, update_row, get_connection,
+    query_rows, get_activos_evaluacion
+)
 
 
 def crear_evaluacion(nombre: str, descripcion: str, responsable: str, 
@@ -20,7 +23,7 @@ def crear_evaluacion(nombre: str, descripcion: str, responsable: str,
     Returns:
         ID de la nueva evaluación
     """
-    evals = read_table("EVALUACIONES")
+    evals = query_rows("EVALUACIONES", columns=["ID_Evaluacion"])
     
     # Generar ID único
     if evals.empty:
@@ -60,19 +63,15 @@ def copiar_activos_evaluacion(origen_id: str, destino_id: str):
     Copia los activos de una evaluación a otra (solo metadatos, sin respuestas)
     Genera nuevos IDs únicos para evitar conflictos de UNIQUE constraint
     """
-    activos = read_table("INVENTARIO_ACTIVOS")
-    if activos.empty:
-        return
-    
-    # Filtrar activos de la evaluación origen
-    activos_origen = activos[activos["ID_Evaluacion"].astype(str) == str(origen_id)]
+    activos_origen = get_activos_evaluacion(origen_id)
     
     if activos_origen.empty:
         return
     
     # Obtener el máximo número de activo existente para generar nuevos IDs
+    ids_existentes = query_rows("INVENTARIO_ACTIVOS", columns=["ID_Activo"])
     max_num = 0
-    for activo_id in activos["ID_Activo"].dropna():
+    for activo_id in ids_existentes["ID_Activo"].dropna():
         try:
             # Formato: ACT-EVA-XXX-YYY
             partes = str(activo_id).split("-")
@@ -170,6 +169,8 @@ def eliminar_evaluacion(eval_id: str) -> bool:
                 "RESULTADOS_MAGERIT",
                 "RESULTADOS_MADUREZ",
                 "RESULTADOS_CONCENTRACION",
+                "RESULTADOS_PROPAGACION",
+                "RESUMEN_EVALUACIONES",
                 "RESPUESTAS",
                 "SALVAGUARDAS",
                 "IDENTIFICACION_VALORACION",
@@ -230,11 +231,7 @@ def actualizar_estado_evaluacion(eval_id: str, nuevo_estado: str):
 
 def get_activos_por_evaluacion(eval_id: str) -> pd.DataFrame:
     """Obtiene todos los activos de una evaluación"""
-    activos = read_table("INVENTARIO_ACTIVOS")
-    if activos.empty:
-        return pd.DataFrame()
-    
-    return activos[activos["ID_Evaluacion"].astype(str) == str(eval_id)]
+    return get_activos_evaluacion(eval_id)
 
 
 def get_estadisticas_evaluacion(eval_id: str) -> dict:
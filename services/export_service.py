@@ -8,7 +8,7 @@ import os
 from datetime import datetime
 from typing import Dict, Optional, Tuple
 import pandas as pd
-from services.database_service import read_table
+from services.database_service import get_activos_evaluacion, get_resultados_magerit_evaluacion
 from services.ia_advanced_service import (
     obtener_amenazas_evaluacion,
     obtener_controles_evaluacion,
@@ -478,23 +478,19 @@ def generar_datos_powerbi(eval_id: str) -> Tuple[bool, Dict[str, pd.DataFrame],
         datasets = {}
         
         # 1. Tabla de Activos
-        activos = read_table("INVENTARIO_ACTIVOS")
-        if not activos.empty and "ID_Evaluacion" in activos.columns:
-            activos_eval = activos[activos["ID_Evaluacion"] == eval_id].copy()
+        activos_eval = get_activos_evaluacion(eval_id)
+        if not activos_eval.empty:
             datasets["Activos"] = activos_eval
         
         # 2. Tabla de Resultados MAGERIT
-        resultados = read_table("RESULTADOS_MAGERIT")
-        if not resultados.empty:
-            col_eval = "ID_Evaluacion" if "ID_Evaluacion" in resultados.columns else "id_evaluacion"
-            if col_eval in resultados.columns:
-                resultados_eval = resultados[resultados[col_eval] == eval_id].copy()
-                # Limpiar columnas JSON para Power BI
-                if "Amenazas_JSON" in resultados_eval.columns:
-                    resultados_eval = resultados_eval.drop(columns=["Amenazas_JSON"])
-                if "Controles_JSON" in resultados_eval.columns:
-                    resultados_eval = resultados_eval.drop(columns=["Controles_JSON"])
-                datasets["Resultados_MAGERIT"] = resultados_eval
+        resultados_eval = get_resultados_magerit_evaluacion(eval_id)
+        if not resultados_eval.empty:
+            # Limpiar columnas JSON para Power BI
+            if "Amenazas_JSON" in resultados_eval.columns:
+                resultados_eval = resultados_eval.drop(columns=["Amenazas_JSON"])
+            if "Controles_JSON" in resultados_eval.columns:
+                resultados_eval = resultados_eval.drop(columns=["Controles_JSON"])
+            datasets["Resultados_MAGERIT"] = resultados_eval
         
         # 3. Tabla de Amenazas (desagregada)
         amenazas = obtener_amenazas_evaluacion(eval_id)
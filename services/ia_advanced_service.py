@@ -11,17 +11,27 @@ Funcionalidades adicionales de IA usando Ollama LOCAL:
 IMPORTANTE: Todo funciona 100% offline con Ollama local.
 """
 import json
-import requests
-from typing import Dict, List, Optional, Tuple
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from dataclasses import dataclass, asdict
 from datetime import datetime
 import pandas as pd
-from services.database_service import read_table, insert_rows, query_rows, delete_rows
+from services.database_service import (
+    read_table, insert_rows, query_rows, delete_rows,
+    get_activo, get_activos_evaluacion, get_resultados_magerit_evaluacion
+)
+from services.ollama_client import get_cliente, OllamaError, invalidar_ultima_respuesta
+from services.telemetria_llm_service import etiquetar_origen, registrar_fallback
+from services.catalogos_service import get_catalogos
+from services.version_datos_service import clave_version
+from services.salida_estructurada import (
+    formato, extraer_json, ESQUEMA_PLAN_TRATAMIENTO, ESQUEMA_RESUMEN_EJECUTIVO, ESQUEMA_PREDICCION,
+    ESQUEMA_PRIORIZACION
+)
 
 
 # ==================== CONFIGURACIÓN ====================
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
 MODELO_DEFAULT = "llama3.2:1b"
 TIMEOUT = 60  # Más tiempo para respuestas largas
 
@@ -144,22 +154,9 @@ def obtener_amenazas_evaluacion(eval_id: str) -> pd.DataFrame:
     Extrae las amenazas de una evaluación desde RESULTADOS_MAGERIT.Amenazas_JSON.
     Retorna un DataFrame con las amenazas desagregadas.
     """
-    resultados = read_table("RESULTADOS_MAGERIT")
-    if resultados.empty:
-        return pd.DataFrame()
-    
-    # Normalizar nombre de columna (puede ser ID_Evaluacion o id_evaluacion)
-    col_eval = None
-    for c in ["ID_Evaluacion", "id_evaluacion"]:
-        if c in resultados.columns:
-            col_eval = c
-            break
-    
-    if not col_eval:
-        return pd.DataFrame()
-    
-    # Filtrar por evaluación
-    resultados_eval = resultados[resultados[col_eval] == eval_id]
+    resultados_eval = get_resultados_magerit_evaluacion(
+        eval_id, columns=["ID_Activo", "Nombre_Activo", "Amenazas_JSON"]
+    )
     if resultados_eval.empty:
         return pd.DataFrame()
     
@@ -281,70 +278,48 @@ def llamar_ollama_avanzado(
     prompt: str,
     modelo: str = None,
     max_tokens: int = 3000,
-    temperature: float = 0.4
+    temperature: float = 0.4,
+    esquema: Dict = None,
+    system: str = None
 ) -> Tuple[bool, str]:
     """
     Llama a Ollama con configuración para respuestas largas.
+    Con esquema, la respuesta es JSON con esa forma (salida estructurada).
     
     Returns:
         (éxito: bool, respuesta: str)
     """
     modelo_usar = modelo or MODELO_DEFAULT
+    opciones = {"temperature": temperature, "num_predict": max_tokens}
     
     try:
-        response = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": modelo_usar,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": temperature,
-                    "num_predict": max_tokens
-                }
-            },
-            timeout=TIMEOUT
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            return True, data.get("response", "")
-        else:
-            return False, f"Error HTTP {response.status_code}"
-    
-    except requests.exceptions.Timeout:
-        return False, "Timeout: La IA tardó demasiado en responder"
-    except requests.exceptions.ConnectionError:
-        return False, "Error: Ollama no está disponible en localhost:11434"
-    except Exception as e:
-        return False, f"Error: {str(e)}"
+        return True, get_cliente().generar(prompt, modelo_usar, opciones, timeout=TIMEOUT, system=system,
+                                           formato=formato(esquema) if esquema else None).texto
+    except OllamaError as e:
+        return False, _mensaje_error_ollama(e)
 
 
-def extraer_json_seguro(texto: str) -> Optional[Dict]:
-    """Extrae JSON de una respuesta de texto, manejando errores."""
-    import re
-    
-    # Buscar bloque JSON
-    patterns = [
-        r'```json\s*([\s\S]*?)\s*```',
-        r'```\s*([\s\S]*?)\s*```',
-        r'\{[\s\S]*\}'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, texto)
-        if match:
-            json_str = match.group(1) if '```' in pattern else match.group(0)
-            try:
-                return json.loads(json_str.strip())
-            except:
-                continue
-    
-    return None
+def _mensaje_error_ollama(e: OllamaError) -> str:
+    if e.tipo == "timeout":
+        return "Timeout: La IA tardó demasiado en responder"
+    if e.tipo in ("conexion", "circuito"):
+        return "Error: Ollama no está disponible en localhost:11434"
+    if e.tipo == "http":
+        return f"Error HTTP {e.status}"
+    return f"Error: {str(e)}"
+
+
+def extraer_json_seguro(texto: str, origen: str = "ia_avanzada") -> Optional[Dict]:
+    """Extrae JSON de una respuesta de texto, manejando errores; si no hay JSON la respuesta sale del cache."""
+    datos = extraer_json(texto, dict, origen=origen)
+    if datos is None:
+        invalidar_ultima_respuesta()
+    return datos
 
 
 # ==================== 1. GENERADOR DE PLANES DE TRATAMIENTO ====================
 
+@etiquetar_origen("plan_tratamiento")
 def generar_plan_tratamiento(
     eval_id: str,
     activo_id: str,
@@ -364,11 +339,9 @@ def generar_plan_tratamiento(
         (éxito, plan, mensaje)
     """
     # Obtener datos del activo
-    activos = read_table("INVENTARIO_ACTIVOS")
-    activo = activos[activos["ID_Activo"] == activo_id]
-    if activo.empty:
+    activo = get_activo(eval_id, activo_id)
+    if activo is None:
         return False, None, f"Activo {activo_id} no encontrado"
-    activo = activo.iloc[0]
     
     # Obtener datos de la amenaza
     amenazas = read_table("CATALOGO_AMENAZAS_MAGERIT")
@@ -378,17 +351,7 @@ def generar_plan_tratamiento(
     amenaza = amenaza.iloc[0]
     
     # Obtener resultado de evaluación si existe
-    resultados = read_table("RESULTADOS_MAGERIT")
-    resultado = pd.DataFrame()
-    if not resultados.empty:
-        # Normalizar nombres de columnas (pueden ser ID_Evaluacion o id_evaluacion)
-        col_eval = "ID_Evaluacion" if "ID_Evaluacion" in resultados.columns else "id_evaluacion"
-        col_activo = "ID_Activo" if "ID_Activo" in resultados.columns else "id_activo"
-        if col_eval in resultados.columns and col_activo in resultados.columns:
-            resultado = resultados[
-                (resultados[col_eval] == eval_id) &
-                (resultados[col_activo] == activo_id)
-            ]
+    resultado = get_resultados_magerit_evaluacion(eval_id, id_activo=activo_id)
     nivel_riesgo = "ALTO"
     if not resultado.empty:
         nivel_riesgo = resultado.iloc[0].get("Nivel_Riesgo", resultado.iloc[0].get("nivel_riesgo_inherente", "ALTO"))
@@ -430,7 +393,7 @@ Responde ÚNICAMENTE con un JSON válido con esta estructura exacta:
 Las acciones deben ser específicas, prácticas y alineadas con ISO 27002.
 Incluye al menos 2 acciones por plazo."""
 
-    exito, respuesta = llamar_ollama_avanzado(prompt, modelo, max_tokens=2000)
+    exito, respuesta = llamar_ollama_avanzado(prompt, modelo, max_tokens=2000, esquema=ESQUEMA_PLAN_TRATAMIENTO)
     
     if not exito:
         # Generar plan heurístico si IA falla
@@ -438,7 +401,7 @@ Incluye al menos 2 acciones por plazo."""
         return True, plan, "Plan generado con método heurístico (IA no disponible)"
     
     # Parsear respuesta
-    datos = extraer_json_seguro(respuesta)
+    datos = extraer_json_seguro(respuesta, "plan_tratamiento")
     if not datos:
         plan = _generar_plan_heuristico(activo, amenaza, nivel_riesgo, codigo_amenaza, eval_id, activo_id)
         return True, plan, "Plan generado con método heurístico (respuesta IA inválida)"
@@ -465,6 +428,7 @@ Incluye al menos 2 acciones por plazo."""
 
 def _generar_plan_heuristico(activo, amenaza, nivel_riesgo, codigo_amenaza, eval_id, activo_id) -> PlanTratamiento:
     """Genera un plan de tratamiento usando reglas heurísticas cuando IA falla."""
+    registrar_fallback()
     
     # Mapeo de acciones por tipo de amenaza
     acciones_por_tipo = {
@@ -514,8 +478,15 @@ def _generar_plan_heuristico(activo, amenaza, nivel_riesgo, codigo_amenaza, eval
     )
 
 
-def generar_planes_evaluacion(eval_id: str, modelo: str = None) -> List[PlanTratamiento]:
-    """Genera planes de tratamiento para todos los riesgos ALTO y CRÍTICO de una evaluación."""
+def generar_planes_evaluacion(
+    eval_id: str,
+    modelo: str = None,
+    progreso: Optional[Callable[[int, int], None]] = None
+) -> List[PlanTratamiento]:
+    """
+    Genera planes de tratamiento para todos los riesgos ALTO y CRÍTICO de una evaluación.
+    progreso, si se indica, recibe (planes consultados, total) antes de cada consulta y al final.
+    """
     planes = []
     
     # Obtener amenazas desde RESULTADOS_MAGERIT.Amenazas_JSON
@@ -533,7 +504,10 @@ def generar_planes_evaluacion(eval_id: str, modelo: str = None) -> List[PlanTrat
         amenazas_eval["nivel_riesgo"].isin(["ALTO", "CRÍTICO", "CRITICO"])
     ]
     
-    for _, row in amenazas_criticas.iterrows():
+    total = len(amenazas_criticas)
+    for hechos, (_, row) in enumerate(amenazas_criticas.iterrows()):
+        if progreso:
+            progreso(hechos, total)
         exito, plan, _ = generar_plan_tratamiento(
             eval_id,
             row["id_activo"],
@@ -543,11 +517,52 @@ def generar_planes_evaluacion(eval_id: str, modelo: str = None) -> List[PlanTrat
         if exito and plan:
             planes.append(plan)
     
+    if progreso:
+        progreso(total, total)
     return planes
 
 
 # ==================== 2. CHATBOT CONSULTOR MAGERIT ====================
 
+SISTEMA_CHATBOT = """Eres TITA-Advisor, un asistente experto en seguridad de la información, metodología MAGERIT v3 e ISO 27002.
+Tu rol es ayudar al usuario a entender los resultados de su evaluación de riesgos y dar recomendaciones prácticas.
+
+=== DATOS REALES DE LA EVALUACIÓN ===
+{contexto}
+
+=== INSTRUCCIONES PARA RESPONDER ===
+1. SIEMPRE usa los datos reales de la evaluación mostrados arriba para responder
+2. Si preguntan por activos críticos, usa la lista de "ACTIVOS MÁS CRÍTICOS"
+3. Si preguntan por amenazas, usa "AMENAZAS MÁS FRECUENTES"
+4. Si preguntan por distribución de riesgos, usa "DISTRIBUCIÓN DE RIESGOS"
+5. Responde en español de forma clara y profesional
+6. Usa viñetas (•) para listas
+7. Da recomendaciones específicas basadas en los datos
+8. Si no tienes información suficiente, indícalo claramente"""
+
+MAX_TOKENS_CHATBOT = 1500
+
+
+def _prompt_chatbot(eval_id: str, pregunta: str, historial: List[Dict]) -> Tuple[str, str]:
+    """
+    (system, prompt) del chatbot. El system (instrucciones + datos de la
+    evaluación) es idéntico entre mensajes mientras los datos no cambien, así
+    Ollama reutiliza ese prefijo del KV cache y solo evalúa historial y pregunta.
+    """
+    historial_texto = ""
+    for msg in historial[-6:]:  # Últimos 6 mensajes para no exceder contexto
+        rol = "Usuario" if msg.get("rol") == "user" else "Asistente"
+        historial_texto += f"{rol}: {msg.get('contenido', '')}\n"
+    prompt = f"""=== HISTORIAL DE CONVERSACIÓN ===
+{historial_texto}
+=== PREGUNTA DEL USUARIO ===
+{pregunta}
+
+RESPUESTA (usa los datos de la evaluación):"""
+    return SISTEMA_CHATBOT.format(contexto=contexto_evaluacion(eval_id)), prompt
+
+
+@etiquetar_origen("chatbot")
 def consultar_chatbot_magerit(
     eval_id: str,
     pregunta: str,
@@ -567,41 +582,10 @@ def consultar_chatbot_magerit(
         (éxito, respuesta, historial_actualizado)
     """
     historial = historial or []
+    sistema, prompt = _prompt_chatbot(eval_id, pregunta, historial)
     
-    # Cargar contexto de la evaluación
-    contexto = _construir_contexto_evaluacion(eval_id)
-    
-    # Construir historial de conversación
-    historial_texto = ""
-    for msg in historial[-6:]:  # Últimos 6 mensajes para no exceder contexto
-        rol = "Usuario" if msg.get("rol") == "user" else "Asistente"
-        historial_texto += f"{rol}: {msg.get('contenido', '')}\n"
-    
-    prompt = f"""Eres TITA-Advisor, un asistente experto en seguridad de la información, metodología MAGERIT v3 e ISO 27002.
-Tu rol es ayudar al usuario a entender los resultados de su evaluación de riesgos y dar recomendaciones prácticas.
-
-=== DATOS REALES DE LA EVALUACIÓN ===
-{contexto}
-
-=== HISTORIAL DE CONVERSACIÓN ===
-{historial_texto}
-
-=== PREGUNTA DEL USUARIO ===
-{pregunta}
-
-=== INSTRUCCIONES PARA RESPONDER ===
-1. SIEMPRE usa los datos reales de la evaluación mostrados arriba para responder
-2. Si preguntan por activos críticos, usa la lista de "ACTIVOS MÁS CRÍTICOS"
-3. Si preguntan por amenazas, usa "AMENAZAS MÁS FRECUENTES"
-4. Si preguntan por distribución de riesgos, usa "DISTRIBUCIÓN DE RIESGOS"
-5. Responde en español de forma clara y profesional
-6. Usa viñetas (•) para listas
-7. Da recomendaciones específicas basadas en los datos
-8. Si no tienes información suficiente, indícalo claramente
-
-RESPUESTA (usa los datos de arriba):"""
-
-    exito, respuesta = llamar_ollama_avanzado(prompt, modelo, max_tokens=1500, temperature=0.3)
+    exito, respuesta = llamar_ollama_avanzado(prompt, modelo, max_tokens=MAX_TOKENS_CHATBOT, temperature=0.3,
+                                              system=sistema)
     
     if not exito:
         respuesta = _respuesta_chatbot_fallback(pregunta, eval_id)
@@ -613,23 +597,82 @@ RESPUESTA (usa los datos de arriba):"""
     return True, respuesta, historial
 
 
+@etiquetar_origen("chatbot")
+def consultar_chatbot_magerit_stream(
+    eval_id: str,
+    pregunta: str,
+    historial: List[Dict],
+    modelo: str = None
+) -> Iterator[str]:
+    """
+    Igual que consultar_chatbot_magerit, pero entrega la respuesta fragmento a
+    fragmento a medida que la genera Ollama (para st.write_stream).
+    
+    Al agotarse el iterador, la pregunta y la respuesta completa quedan
+    agregadas a historial. Si Ollama falla antes del primer fragmento se
+    entrega la respuesta heurística.
+    """
+    sistema, prompt = _prompt_chatbot(eval_id, pregunta, historial)
+    opciones = {"temperature": 0.3, "num_predict": MAX_TOKENS_CHATBOT}
+    fragmentos: List[str] = []
+    try:
+        for fragmento in get_cliente().generar_stream(prompt, modelo or MODELO_DEFAULT, opciones,
+                                                      timeout=TIMEOUT, system=sistema):
+            fragmentos.append(fragmento)
+            yield fragmento
+    except OllamaError as e:
+        if fragmentos:
+            cierre = f"\n\n_(respuesta interrumpida: {_mensaje_error_ollama(e)})_"
+        else:
+            cierre = _respuesta_chatbot_fallback(pregunta, eval_id)
+        fragmentos.append(cierre)
+        yield cierre
+    
+    historial.append({"rol": "user", "contenido": pregunta})
+    historial.append({"rol": "assistant", "contenido": "".join(fragmentos)})
+
+
+# ==================== CONTEXTO DEL CHATBOT (CACHE POR VERSIÓN DE DATOS) ====================
+# El contexto se reconstruye solo cuando cambian los datos de la evaluación
+# (VERSION_DATOS, mantenida por triggers) o los catálogos; cada mensaje del
+# chat cuesta dos consultas de versión en lugar de releer y reparsear todo.
+
+_contextos: Dict[str, Tuple[tuple, str]] = {}
+_lock_contextos = threading.Lock()
+_metricas_contexto = {"aciertos": 0, "construcciones": 0}
+
+
+def contexto_evaluacion(eval_id: str) -> str:
+    """Contexto de la evaluación para el chatbot, memorizado por versión de datos"""
+    version = (clave_version(eval_id), get_catalogos().version)
+    with _lock_contextos:
+        guardado = _contextos.get(eval_id)
+        if guardado is not None and guardado[0] == version:
+            _metricas_contexto["aciertos"] += 1
+            return guardado[1]
+    contexto = _construir_contexto_evaluacion(eval_id)
+    with _lock_contextos:
+        _contextos[eval_id] = (version, contexto)
+        _metricas_contexto["construcciones"] += 1
+    return contexto
+
+
+def metricas_contexto_chatbot() -> Dict[str, int]:
+    """Aciertos y reconstrucciones del contexto memorizado del chatbot"""
+    with _lock_contextos:
+        return dict(_metricas_contexto, evaluaciones=len(_contextos))
+
+
 def _construir_contexto_evaluacion(eval_id: str) -> str:
     """Construye el contexto de la evaluación para el chatbot."""
     
-    # Obtener evaluación
-    evaluaciones = read_table("EVALUACIONES")
-    
     # Obtener activos
-    activos = read_table("INVENTARIO_ACTIVOS")
-    activos_eval = pd.DataFrame()
-    if not activos.empty and "ID_Evaluacion" in activos.columns:
-        activos_eval = activos[activos["ID_Evaluacion"] == eval_id]
+    activos_eval = get_activos_evaluacion(eval_id, columns=["ID_Activo"])
     
     # Obtener resultados MAGERIT
-    resultados = read_table("RESULTADOS_MAGERIT")
-    resultados_eval = pd.DataFrame()
-    if not resultados.empty and "id_evaluacion" in resultados.columns:
-        resultados_eval = resultados[resultados["id_evaluacion"] == eval_id]
+    resultados_eval = get_resultados_magerit_evaluacion(
+        eval_id, columns=["ID_Activo", "Nombre_Activo", "Riesgo_Inherente", "Nivel_Riesgo"]
+    )
     
     # Obtener amenazas desde JSON de RESULTADOS_MAGERIT
     amenazas_eval = obtener_amenazas_evaluacion(eval_id)
@@ -676,10 +719,9 @@ DISTRIBUCIÓN DE RIESGOS (por nivel):
     if not amenazas_eval.empty and "codigo" in amenazas_eval.columns:
         contexto += "\nAMENAZAS MÁS FRECUENTES:\n"
         frecuentes = amenazas_eval["codigo"].value_counts().head(5)
-        catalogo = read_table("CATALOGO_AMENAZAS_MAGERIT")
+        catalogo = get_catalogos().amenazas
         for codigo, count in frecuentes.items():
-            nombre = catalogo[catalogo["codigo"] == codigo]["amenaza"].values
-            nombre = nombre[0] if len(nombre) > 0 else codigo
+            nombre = (catalogo.get(codigo) or {}).get("amenaza") or codigo
             contexto += f"- [{codigo}] {nombre}: {count} activos afectados\n"
     
     return contexto
@@ -687,15 +729,11 @@ DISTRIBUCIÓN DE RIESGOS (por nivel):
 
 def _respuesta_chatbot_fallback(pregunta: str, eval_id: str) -> str:
     """Genera respuesta de fallback cuando la IA no está disponible."""
+    registrar_fallback()
     pregunta_lower = pregunta.lower()
     
     # Obtener datos básicos
-    resultados = read_table("RESULTADOS_MAGERIT")
-    resultados_eval = pd.DataFrame()
-    if not resultados.empty:
-        col_eval = "ID_Evaluacion" if "ID_Evaluacion" in resultados.columns else "id_evaluacion"
-        if col_eval in resultados.columns:
-            resultados_eval = resultados[resultados[col_eval] == eval_id]
+    resultados_eval = get_resultados_magerit_evaluacion(eval_id)
     
     if "crítico" in pregunta_lower or "critico" in pregunta_lower or "más riesgo" in pregunta_lower:
         col_riesgo = "Riesgo_Inherente" if "Riesgo_Inherente" in resultados_eval.columns else "riesgo_inherente_global"
@@ -718,6 +756,7 @@ def _respuesta_chatbot_fallback(pregunta: str, eval_id: str) -> str:
 
 # ==================== 3. RESUMEN EJECUTIVO AUTOMÁTICO ====================
 
+@etiquetar_origen("resumen_ejecutivo")
 def generar_resumen_ejecutivo(
     eval_id: str,
     modelo: str = None
@@ -729,17 +768,9 @@ def generar_resumen_ejecutivo(
         (éxito, resumen, mensaje)
     """
     # Recopilar datos de la evaluación
-    activos = read_table("INVENTARIO_ACTIVOS")
-    activos_eval = pd.DataFrame()
-    if not activos.empty and "ID_Evaluacion" in activos.columns:
-        activos_eval = activos[activos["ID_Evaluacion"] == eval_id]
-    
-    resultados = read_table("RESULTADOS_MAGERIT")
-    resultados_eval = pd.DataFrame()
-    if not resultados.empty:
-        col_eval = "ID_Evaluacion" if "ID_Evaluacion" in resultados.columns else "id_evaluacion"
-        if col_eval in resultados.columns:
-            resultados_eval = resultados[resultados[col_eval] == eval_id]
+    activos_eval = get_activos_evaluacion(eval_id)
+    
+    resultados_eval = get_resultados_magerit_evaluacion(eval_id)
     
     # Obtener amenazas desde JSON de RESULTADOS_MAGERIT
     amenazas_eval = obtener_amenazas_evaluacion(eval_id)
@@ -817,10 +848,10 @@ IMPORTANTE:
 
 Sé específico, profesional y orientado a la acción."""
 
-    exito, respuesta = llamar_ollama_avanzado(prompt, modelo, max_tokens=1500)
+    exito, respuesta = llamar_ollama_avanzado(prompt, modelo, max_tokens=1500, esquema=ESQUEMA_RESUMEN_EJECUTIVO)
     
     if exito:
-        datos = extraer_json_seguro(respuesta)
+        datos = extraer_json_seguro(respuesta, "resumen_ejecutivo")
         if datos:
             resumen = ResumenEjecutivo(
                 id_evaluacion=eval_id,
@@ -845,6 +876,7 @@ Sé específico, profesional y orientado a la acción."""
 
 def _generar_resumen_heuristico(eval_id, total_activos, total_amenazas, distribucion, activos_criticos) -> ResumenEjecutivo:
     """Genera resumen ejecutivo usando reglas heurísticas."""
+    registrar_fallback()
     
     # Calcular hallazgos basados en datos
     hallazgos = []
@@ -885,6 +917,7 @@ def _generar_resumen_heuristico(eval_id, total_activos, total_amenazas, distribu
 
 # ==================== 4. PREDICCIÓN DE RIESGO FUTURO ====================
 
+@etiquetar_origen("prediccion")
 def generar_prediccion_riesgo(
     eval_id: str,
     meses_proyeccion: int = 6,
@@ -897,12 +930,7 @@ def generar_prediccion_riesgo(
         (éxito, predicción, mensaje)
     """
     # Obtener datos actuales
-    resultados = read_table("RESULTADOS_MAGERIT")
-    resultados_eval = pd.DataFrame()
-    if not resultados.empty:
-        col_eval = "ID_Evaluacion" if "ID_Evaluacion" in resultados.columns else "id_evaluacion"
-        if col_eval in resultados.columns:
-            resultados_eval = resultados[resultados[col_eval] == eval_id]
+    resultados_eval = get_resultados_magerit_evaluacion(eval_id)
     
     if resultados_eval.empty:
         return False, None, "No hay resultados para generar predicción. Ejecuta primero la evaluación MAGERIT."
@@ -956,10 +984,10 @@ Responde ÚNICAMENTE con un JSON válido:
 
 Basa la proyección en tendencias realistas de ciberseguridad."""
 
-    exito, respuesta = llamar_ollama_avanzado(prompt, modelo, max_tokens=1500)
+    exito, respuesta = llamar_ollama_avanzado(prompt, modelo, max_tokens=1500, esquema=ESQUEMA_PREDICCION)
     
     if exito:
-        datos = extraer_json_seguro(respuesta)
+        datos = extraer_json_seguro(respuesta, "prediccion")
         if datos:
             prediccion = PrediccionRiesgo(
                 id_evaluacion=eval_id,
@@ -981,6 +1009,7 @@ Basa la proyección en tendencias realistas de ciberseguridad."""
 
 def _generar_prediccion_heuristica(eval_id, riesgo_actual, riesgo_residual, meses) -> PrediccionRiesgo:
     """Genera predicción usando modelo heurístico simple."""
+    registrar_fallback()
     
     # Modelo simple: sin controles el riesgo crece 10% mensual
     # Con controles se reduce hacia el residual
@@ -1048,17 +1077,9 @@ def obtener_controles_evaluacion(eval_id: str) -> pd.DataFrame:
     Extrae los controles recomendados de una evaluación desde RESULTADOS_MAGERIT.
     Los controles están dentro de cada amenaza en el campo Amenazas_JSON.
     """
-    resultados = read_table("RESULTADOS_MAGERIT")
-    if resultados.empty:
-        return pd.DataFrame()
-    
-    # Normalizar nombre de columna
-    col_eval = "ID_Evaluacion" if "ID_Evaluacion" in resultados.columns else "id_evaluacion"
-    if col_eval not in resultados.columns:
-        return pd.DataFrame()
-    
-    # Filtrar por evaluación
-    resultados_eval = resultados[resultados[col_eval] == eval_id]
+    resultados_eval = get_resultados_magerit_evaluacion(
+        eval_id, columns=["ID_Activo", "Nombre_Activo", "Amenazas_JSON"]
+    )
     if resultados_eval.empty:
         return pd.DataFrame()
     
@@ -1093,6 +1114,7 @@ def obtener_controles_evaluacion(eval_id: str) -> pd.DataFrame:
     return pd.DataFrame(controles_list)
 
 
+@etiquetar_origen("priorizacion_controles")
 def generar_priorizacion_controles(
     eval_id: str,
     modelo: str = None
@@ -1168,13 +1190,13 @@ Responde ÚNICAMENTE con un JSON:
 
 Ordena de mayor a menor ROI."""
 
-    exito, respuesta = llamar_ollama_avanzado(prompt, modelo, max_tokens=2000)
+    exito, respuesta = llamar_ollama_avanzado(prompt, modelo, max_tokens=2000, esquema=ESQUEMA_PRIORIZACION)
     
     controles_priorizados = []
     datos_ia = {}
     
     if exito:
-        datos = extraer_json_seguro(respuesta)
+        datos = extraer_json_seguro(respuesta, "priorizacion_controles")
         if datos and "controles_priorizados" in datos:
             for cp in datos["controles_priorizados"]:
                 datos_ia[cp.get("codigo", "")] = cp
@@ -1256,15 +1278,11 @@ def _calcular_roi_heuristico(num_amenazas: int) -> int:
 # ==================== VERIFICACIÓN DE DISPONIBILIDAD ====================
 
 def verificar_ia_disponible() -> Tuple[bool, str]:
-    """Verifica si Ollama está disponible."""
-    try:
-        response = requests.get(
-            "http://localhost:11434/api/tags",
-            timeout=5
-        )
-        if response.status_code == 200:
-            modelos = response.json().get("models", [])
-            return True, f"Ollama disponible con {len(modelos)} modelos"
+    """Verifica si Ollama está disponible (estado cacheado del monitor)."""
+    from services.ollama_monitor import estado_ollama
+    estado = estado_ollama()
+    if estado.disponible:
+        return True, f"Ollama disponible con {len(estado.modelos)} modelos"
+    if estado.mensaje.startswith("Error HTTP"):
         return False, "Ollama no responde correctamente"
-    except:
-        return False, "Ollama no está disponible en localhost:11434"
+    return False, "Ollama no está disponible en localhost:11434"
@@ -5,63 +5,64 @@ Carga TODOS los catálogos y conocimiento del proyecto
 para alimentar la IA con información completa.
 """
 
-import json
 from pathlib import Path
 from typing import Dict, List
-from services.database_service import read_table
+from services.catalogos_service import get_catalogos, cargar_json, fragmento_catalogo
 
 # Directorio de conocimiento
 KNOWLEDGE_DIR = Path("c:/capston_riesgos/knowledge_base")
 
+ARCHIVO_AMENAZAS = str(KNOWLEDGE_DIR / "amenazas_magerit_completo.json")
+ARCHIVO_CONTROLES = str(KNOWLEDGE_DIR / "controles_iso27002_completo.json")
+
+
 def cargar_catalogo_completo_amenazas() -> Dict:
-    """Carga el catálogo completo de amenazas desde JSON"""
+    """Carga el catálogo completo de amenazas desde JSON (releído solo si cambia)"""
     try:
-        json_path = KNOWLEDGE_DIR / "amenazas_magerit_completo.json"
-        if json_path.exists():
-            with open(json_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        catalogo = cargar_json(ARCHIVO_AMENAZAS)
+        if catalogo is not None:
+            return catalogo
     except:
         pass
     
-    # Fallback: cargar desde base de datos
-    amenazas_df = read_table("CATALOGO_AMENAZAS_MAGERIT")
-    catalogo = {}
-    for _, row in amenazas_df.iterrows():
-        catalogo[row['codigo']] = {
-            'amenaza': row['amenaza'],
-            'tipo': row['tipo_amenaza'],
-            'descripcion': row.get('descripcion', ''),
-            'dimension': row.get('dimension_afectada', 'D')
+    # Fallback: catálogo de la base de datos (registro en memoria)
+    return {
+        codigo: {
+            'amenaza': info['amenaza'],
+            'tipo': info['tipo_amenaza'],
+            'descripcion': info['descripcion'],
+            'dimension': info['dimension_afectada']
         }
-    return catalogo
+        for codigo, info in get_catalogos().amenazas.items()
+    }
 
 
 def cargar_catalogo_completo_controles() -> Dict:
-    """Carga el catálogo completo de controles ISO 27002 desde JSON"""
+    """Carga el catálogo completo de controles ISO 27002 desde JSON (releído solo si cambia)"""
     try:
-        json_path = KNOWLEDGE_DIR / "controles_iso27002_completo.json"
-        if json_path.exists():
-            with open(json_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        catalogo = cargar_json(ARCHIVO_CONTROLES)
+        if catalogo is not None:
+            return catalogo
     except:
         pass
     
-    # Fallback: cargar desde base de datos
-    controles_df = read_table("CATALOGO_CONTROLES_ISO27002")
-    catalogo = {}
-    for _, row in controles_df.iterrows():
-        catalogo[row['codigo']] = {
-            'nombre': row['nombre'],
-            'categoria': row['categoria'],
-            'descripcion': row.get('descripcion', '')
+    # Fallback: catálogo de la base de datos (registro en memoria)
+    return {
+        codigo: {
+            'nombre': info['nombre'],
+            'categoria': info['categoria'],
+            'descripcion': info['descripcion']
         }
-    return catalogo
+        for codigo, info in get_catalogos().controles.items()
+    }
 
 
+@fragmento_catalogo(ARCHIVO_AMENAZAS, ARCHIVO_CONTROLES)
 def construir_contexto_completo_ia() -> str:
     """
     Construye el contexto COMPLETO para la IA con TODA la información disponible.
-    Este es el contexto más rico y detallado posible.
+    Este es el contexto más rico y detallado posible. Se memoriza hasta que
+    cambien los catálogos de la BD o los JSON.
     """
     amenazas = cargar_catalogo_completo_amenazas()
     controles = cargar_catalogo_completo_controles()
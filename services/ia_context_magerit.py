@@ -13,7 +13,7 @@ La IA usa este contexto para:
 """
 
 from typing import Dict, List, Tuple
-from services.database_service import read_table
+from services.catalogos_service import get_catalogos, fragmento_catalogo
 
 
 # ==================== CONTEXTO MAGERIT v3 ====================
@@ -383,44 +383,40 @@ DEGRADACION_TIPICA = {
 
 # ==================== FUNCIÓN PARA OBTENER CONTEXTO COMPLETO ====================
 
+@fragmento_catalogo()
 def get_contexto_completo_ia() -> str:
     """
     Genera el contexto completo para la IA incluyendo todos los catálogos.
+    Memorizado en el registro de catálogos: solo se reconstruye si cambian.
     """
-    # Cargar catálogos de la base de datos
-    amenazas_df = read_table("CATALOGO_AMENAZAS_MAGERIT")
-    controles_df = read_table("CATALOGO_CONTROLES_ISO27002")
+    catalogos = get_catalogos()
     
     # Construir lista de amenazas
     amenazas_texto = "\n## CATÁLOGO COMPLETO DE AMENAZAS MAGERIT v3:\n"
     amenazas_texto += "DEBES usar SOLO estos códigos de amenaza:\n\n"
     
-    if not amenazas_df.empty:
-        for tipo in ["N", "I", "E", "A"]:
-            amenazas_tipo = amenazas_df[amenazas_df["codigo"].str.startswith(tipo)]
-            if not amenazas_tipo.empty:
-                tipo_nombre = {
-                    "N": "[N] DESASTRES NATURALES",
-                    "I": "[I] ORIGEN INDUSTRIAL", 
-                    "E": "[E] ERRORES NO INTENCIONADOS",
-                    "A": "[A] ATAQUES INTENCIONADOS"
-                }.get(tipo, tipo)
-                amenazas_texto += f"\n### {tipo_nombre}:\n"
-                for _, row in amenazas_tipo.iterrows():
-                    dim = row.get("dimension_afectada", "D")
-                    amenazas_texto += f"- **{row['codigo']}**: {row['amenaza']} [afecta: {dim}]\n"
+    for tipo in ["N", "I", "E", "A"]:
+        codigos_tipo = [codigo for codigo in catalogos.amenazas if str(codigo).startswith(tipo)]
+        if codigos_tipo:
+            tipo_nombre = {
+                "N": "[N] DESASTRES NATURALES",
+                "I": "[I] ORIGEN INDUSTRIAL", 
+                "E": "[E] ERRORES NO INTENCIONADOS",
+                "A": "[A] ATAQUES INTENCIONADOS"
+            }.get(tipo, tipo)
+            amenazas_texto += f"\n### {tipo_nombre}:\n"
+            for codigo in codigos_tipo:
+                info = catalogos.amenazas[codigo]
+                amenazas_texto += f"- **{codigo}**: {info['amenaza']} [afecta: {info['dimension_afectada']}]\n"
     
     # Construir lista de controles
     controles_texto = "\n## CATÁLOGO COMPLETO DE CONTROLES ISO 27002:2022:\n"
     controles_texto += "DEBES usar SOLO estos códigos de control:\n\n"
     
-    if not controles_df.empty:
-        categorias = controles_df["categoria"].unique()
-        for cat in sorted(categorias):
-            controles_cat = controles_df[controles_df["categoria"] == cat]
-            controles_texto += f"\n### {cat}:\n"
-            for _, row in controles_cat.iterrows():
-                controles_texto += f"- **{row['codigo']}**: {row['nombre']}\n"
+    for cat in sorted(catalogos.controles_por_categoria):
+        controles_texto += f"\n### {cat}:\n"
+        for codigo in catalogos.controles_por_categoria[cat]:
+            controles_texto += f"- **{codigo}**: {catalogos.controles[codigo]['nombre']}\n"
     
     # Construir catálogo de vulnerabilidades
     vulnerabilidades_texto = "\n## CATÁLOGO DE VULNERABILIDADES POR TIPO DE ACTIVO:\n"
@@ -574,49 +570,24 @@ def construir_contexto_vulnerabilidades(tipo_activo: str) -> str:
 
 # ==================== PROMPT MEJORADO PARA IA ====================
 
-def construir_prompt_experto(
-    activo_nombre: str,
-    activo_tipo: str,
-    criticidad: int,
-    valoracion_d: int,
-    valoracion_i: int,
-    valoracion_c: int
-) -> str:
+@fragmento_catalogo()
+def construir_sistema_experto() -> str:
     """
-    Construye un prompt optimizado para que la IA identifique amenazas y vulnerabilidades.
+    Prefijo fijo del prompt experto (rol, catálogo, tarea, formato y reglas).
+    Igual para todos los activos: Ollama lo reutiliza de su KV cache.
     """
-    # Obtener amenazas sugeridas para el tipo
-    amenazas_sugeridas = get_amenazas_para_tipo_activo(activo_tipo)
-    
-    # Obtener contexto de catálogos
-    amenazas_df = read_table("CATALOGO_AMENAZAS_MAGERIT")
-    
     # Construir lista de amenazas del catálogo
     lista_amenazas = ""
-    if not amenazas_df.empty:
-        for _, row in amenazas_df.iterrows():
-            lista_amenazas += f"- {row['codigo']}: {row['amenaza']}\n"
-    
-    # Obtener contexto de vulnerabilidades
-    contexto_vulns = construir_contexto_vulnerabilidades(activo_tipo)
+    for codigo, info in get_catalogos().amenazas.items():
+        lista_amenazas += f"- {codigo}: {info['amenaza']}\n"
     
-    prompt = f"""Eres un experto certificado en MAGERIT v3 e ISO 27002:2022.
-
-## ACTIVO A ANALIZAR:
-- **Nombre**: {activo_nombre}
-- **Tipo**: {activo_tipo}
-- **Criticidad**: {criticidad}/4
-- **Valoración D/I/C**: D={valoracion_d}, I={valoracion_i}, C={valoracion_c}
-
-## AMENAZAS SUGERIDAS PARA ESTE TIPO DE ACTIVO:
-{', '.join(amenazas_sugeridas)}
+    return f"""Eres un experto certificado en MAGERIT v3 e ISO 27002:2022.
 
 ## CATÁLOGO COMPLETO DE AMENAZAS (USA SOLO ESTOS CÓDIGOS):
 {lista_amenazas}
 
-{contexto_vulns}
-
 ## TU TAREA:
+Para cada activo que se te indique:
 1. Selecciona 4-6 amenazas RELEVANTES para este activo específico
 2. Para cada amenaza, identifica la vulnerabilidad específica que la hace posible
 3. Usa el catálogo de vulnerabilidades como referencia para describir debilidades concretas
@@ -644,10 +615,54 @@ def construir_prompt_experto(
 1. USA SOLO códigos de amenaza del catálogo proporcionado
 2. Describe vulnerabilidades ESPECÍFICAS y TÉCNICAS (no genéricas)
 3. Degradaciones: 0-100, siendo 100 destrucción total
-4. Ajusta degradación según la criticidad ({criticidad}/4)
+4. Ajusta degradación según la criticidad del activo (escala 0-4)
 5. Prioriza dimensión con mayor valoración
 6. Relaciona amenazas con vulnerabilidades concretas del catálogo
 
-Responde SOLO con el JSON, sin explicaciones adicionales:"""
+Responde SOLO con el JSON, sin explicaciones adicionales."""
 
-    return prompt
+
+def construir_consulta_experto(
+    activo_nombre: str,
+    activo_tipo: str,
+    criticidad: int,
+    valoracion_d: int,
+    valoracion_i: int,
+    valoracion_c: int
+) -> str:
+    """Parte variable del prompt experto: el activo y sus referencias por tipo"""
+    # Obtener amenazas sugeridas para el tipo
+    amenazas_sugeridas = get_amenazas_para_tipo_activo(activo_tipo)
+    
+    # Obtener contexto de vulnerabilidades
+    contexto_vulns = construir_contexto_vulnerabilidades(activo_tipo)
+    
+    return f"""## ACTIVO A ANALIZAR:
+- **Nombre**: {activo_nombre}
+- **Tipo**: {activo_tipo}
+- **Criticidad**: {criticidad}/4
+- **Valoración D/I/C**: D={valoracion_d}, I={valoracion_i}, C={valoracion_c}
+
+## AMENAZAS SUGERIDAS PARA ESTE TIPO DE ACTIVO:
+{', '.join(amenazas_sugeridas)}
+
+{contexto_vulns}
+
+Responde SOLO con el JSON:"""
+
+
+def construir_prompt_experto(
+    activo_nombre: str,
+    activo_tipo: str,
+    criticidad: int,
+    valoracion_d: int,
+    valoracion_i: int,
+    valoracion_c: int
+) -> str:
+    """
+    Construye un prompt optimizado para que la IA identifique amenazas y vulnerabilidades.
+    Es el prefijo fijo (construir_sistema_experto) seguido de la consulta del activo.
+    """
+    return construir_sistema_experto() + "\n\n" + construir_consulta_experto(
+        activo_nombre, activo_tipo, criticidad, valoracion_d, valoracion_i, valoracion_c
+    )
@@ -19,8 +19,8 @@ import socket
 import datetime as dt
 from typing import Dict, List, Tuple, Optional, Any
 from dataclasses import dataclass, asdict
-import requests
 from services.database_service import get_connection, read_table
+from services.ollama_client import get_cliente, OllamaError
 
 
 # ==================== CONFIGURACIÓN ====================
@@ -93,13 +93,27 @@ def generate_nonce() -> str:
 
 # ==================== VALIDACIÓN A.1: OLLAMA LOCAL ====================
 
-def verificar_ollama_local() -> Tuple[bool, str, List[str], str]:
+def verificar_ollama_local(desde_monitor: bool = False) -> Tuple[bool, str, List[str], str]:
     """
     Verifica que Ollama esté corriendo localmente.
     
+    Args:
+        desde_monitor: Usar el estado cacheado del monitor de salud (para
+            indicadores de la UI) en lugar de sondear los endpoints. La
+            validación A.1 siempre sondea.
+    
     Returns:
         (es_local: bool, endpoint: str, modelos: List[str], error: str)
     """
+    if desde_monitor:
+        from urllib.parse import urlparse
+        from services.ollama_client import OLLAMA_HOST
+        from services.ollama_monitor import estado_ollama
+        if urlparse(OLLAMA_HOST).hostname in ["localhost", "127.0.0.1", "::1"]:
+            estado = estado_ollama()
+            if estado.disponible:
+                return True, OLLAMA_HOST, estado.modelos, ""
+            return False, "", [], "No se pudo conectar con Ollama local"
     for endpoint in OLLAMA_LOCAL_ENDPOINTS:
         try:
             # Verificar que el endpoint sea local
@@ -111,17 +125,10 @@ def verificar_ollama_local() -> Tuple[bool, str, List[str], str]:
                 continue  # No es local, saltar
             
             # Intentar conectar
-            response = requests.get(
-                f"{endpoint}/api/tags",
-                timeout=TIMEOUT_VALIDATION
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                modelos = [m["name"] for m in data.get("models", [])]
-                return True, endpoint, modelos, ""
+            modelos = get_cliente(endpoint).listar_modelos(timeout=TIMEOUT_VALIDATION)
+            return True, endpoint, modelos, ""
         
-        except requests.exceptions.ConnectionError:
+        except OllamaError:
             continue
         except Exception as e:
             continue
@@ -139,29 +146,21 @@ def ejecutar_llamada_real(endpoint: str, modelo: str, prompt: str) -> Tuple[bool
     try:
         start_time = time.time()
         
-        response = requests.post(
-            f"{endpoint}/api/generate",
-            json={
-                "model": modelo,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.1,
-                    "num_predict": 500
-                }
-            },
-            timeout=TIMEOUT_VALIDATION * 2
+        # Sin cache ni reintentos: la prueba debe medir una inferencia real
+        respuesta = get_cliente(endpoint).generar(
+            prompt, modelo, {"temperature": 0.1, "num_predict": 500},
+            timeout=TIMEOUT_VALIDATION * 2, max_intentos=1, usar_cache=False
         )
         
         end_time = time.time()
         latency_ms = (end_time - start_time) * 1000
         
-        if response.status_code == 200:
-            resultado = response.json()
-            return True, resultado.get("response", ""), latency_ms, ""
-        else:
-            return False, "", 0, f"Error HTTP {response.status_code}"
+        return True, respuesta.texto, latency_ms, ""
     
+    except OllamaError as e:
+        if e.tipo == "http":
+            return False, "", 0, f"Error HTTP {e.status}"
+        return False, "", 0, str(e)
     except Exception as e:
         return False, "", 0, str(e)
 
@@ -391,23 +390,11 @@ def ejecutar_prueba_variabilidad(endpoint: str, modelo: str) -> Tuple[bool, Dict
     for modo, config in resultados.items():
         for _ in range(2):  # 2 intentos por modo
             try:
-                response = requests.post(
-                    f"{endpoint}/api/generate",
-                    json={
-                        "model": modelo,
-                        "prompt": prompt_base,
-                        "stream": False,
-                        "options": {
-                            "temperature": config["temp"],
-                            "num_predict": 50
-                        }
-                    },
-                    timeout=30
+                respuesta = get_cliente(endpoint).generar(
+                    prompt_base, modelo, {"temperature": config["temp"], "num_predict": 50},
+                    timeout=30, max_intentos=1, usar_cache=False
                 )
-                
-                if response.status_code == 200:
-                    resp_text = response.json().get("response", "")
-                    config["respuestas"].append(resp_text)
+                config["respuestas"].append(respuesta.texto)
             except:
                 pass
     
@@ -15,6 +15,7 @@ import datetime as dt
 from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass
 from services.database_service import read_table, get_connection
+from services.catalogos_service import get_catalogos, fragmento_catalogo
 
 
 # ==================== MODELOS ====================
@@ -34,27 +35,13 @@ class KnowledgeContext:
 # ==================== CARGA DE CATÁLOGOS ====================
 
 def cargar_catalogo_amenazas() -> List[Dict]:
-    """Carga todas las amenazas MAGERIT desde BD"""
-    try:
-        amenazas = read_table("CATALOGO_AMENAZAS_MAGERIT")
-        if amenazas is not None and not amenazas.empty:
-            return amenazas.to_dict('records')
-        return []
-    except Exception as e:
-        print(f"Error cargando amenazas: {e}")
-        return []
+    """Todas las amenazas MAGERIT (filas de la BD, desde el registro en memoria)"""
+    return list(get_catalogos().registros_amenazas)
 
 
 def cargar_catalogo_controles() -> List[Dict]:
-    """Carga todos los controles ISO 27002 desde BD"""
-    try:
-        controles = read_table("CATALOGO_CONTROLES_ISO27002")
-        if controles is not None and not controles.empty:
-            return controles.to_dict('records')
-        return []
-    except Exception as e:
-        print(f"Error cargando controles: {e}")
-        return []
+    """Todos los controles ISO 27002 (filas de la BD, desde el registro en memoria)"""
+    return list(get_catalogos().registros_controles)
 
 
 def cargar_criterios_dic() -> Dict[str, List[Dict]]:
@@ -133,8 +120,9 @@ Este sistema es para trabajo de titulación. Las evaluaciones deben ser:
 - Reproducibles y auditables"""
 
 
+@fragmento_catalogo()
 def generar_system_prompt_con_catalogos() -> str:
-    """Genera el system prompt completo con catálogos embebidos"""
+    """Genera el system prompt completo con catálogos embebidos (memorizado)"""
     amenazas = cargar_catalogo_amenazas()
     controles = cargar_catalogo_controles()
     
@@ -575,14 +563,12 @@ def obtener_resumen_catalogos() -> Dict:
 
 def validar_codigo_amenaza(codigo: str) -> bool:
     """Verifica que un código de amenaza exista en el catálogo"""
-    amenazas = cargar_catalogo_amenazas()
-    return any(a.get("codigo") == codigo for a in amenazas)
+    return codigo in get_catalogos().amenazas
 
 
 def validar_codigo_control(codigo: str) -> bool:
     """Verifica que un código de control exista en el catálogo"""
-    controles = cargar_catalogo_controles()
-    return any(c.get("codigo") == codigo for c in controles)
+    return codigo in get_catalogos().controles
 
 
 def validar_respuesta_ia_contra_catalogos(respuesta: Dict) -> Tuple[bool, List[str]]:
@@ -0,0 +1,218 @@
+"""
+Cache persistente de respuestas de la IA local - Proyecto TITA
+
+Todas las llamadas a Ollama pasan por aquí antes de generar: si el mismo
+modelo ya respondió al mismo prompt con las mismas opciones (temperatura,
+num_predict, ...), se devuelve la respuesta guardada sin inferencia. Las
+entradas viven en la tabla LLM_CACHE de la base SQLite del proyecto, con
+expiración por antigüedad (TTL) y expulsión LRU por número de entradas y
+tamaño total.
+
+Uso:
+    from services.llm_cache_service import con_cache
+    exito, texto = con_cache(modelo, prompt, {"temperature": 0.3}, lambda: llamar(...))
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from services.database_service import get_connection, write_transaction
+
+
+# ==================== CONFIGURACIÓN ====================
+
+CACHE_HABILITADA = os.environ.get("TITA_LLM_CACHE", "1") != "0"
+CACHE_TTL_SEGUNDOS = float(os.environ.get("TITA_LLM_CACHE_TTL_HORAS") or 24 * 7) * 3600
+CACHE_MAX_ENTRADAS = 5000
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+EVICCION_CADA = 50  # escrituras entre pasadas de limpieza
+
+_metricas = {"aciertos": 0, "fallos": 0, "escrituras": 0, "expulsadas": 0}
+_metricas_lock = threading.Lock()
+
+# Aciertos aún no volcados a LLM_CACHE: clave -> (último acceso, número de aciertos).
+# Una lectura no toma el lock de escritura; la posición LRU se actualiza en la
+# siguiente escritura o limpieza.
+_accesos_pendientes: Dict[str, Tuple[float, int]] = {}
+
+
+def _contar(metrica: str, n: int = 1):
+    with _metricas_lock:
+        _metricas[metrica] += n
+
+
+# ==================== CLAVES ====================
+
+def hash_prompt(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def clave_cache(modelo: str, prompt: str, opciones: Optional[Dict[str, Any]] = None) -> str:
+    """Clave estable de (modelo, prompt, opciones de muestreo)"""
+    contenido = json.dumps({"modelo": modelo, "prompt": hash_prompt(prompt), "opciones": opciones or {}},
+                           sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+# ==================== LECTURA / ESCRITURA ====================
+
+def obtener(modelo: str, prompt: str, opciones: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Respuesta cacheada vigente o None; un acierto renueva (en diferido) su posición LRU"""
+    if not CACHE_HABILITADA:
+        return None
+    clave = clave_cache(modelo, prompt, opciones)
+    ahora = time.time()
+    try:
+        with get_connection() as conn:
+            fila = conn.execute("SELECT Respuesta, Fecha_Creacion FROM LLM_CACHE WHERE Clave = ?",
+                                (clave,)).fetchone()
+    except sqlite3.OperationalError:
+        # Base sin migrar o bloqueada: el cache nunca debe impedir la llamada real
+        fila = None
+    if fila is not None and ahora - fila[1] <= CACHE_TTL_SEGUNDOS:
+        with _metricas_lock:
+            _, aciertos = _accesos_pendientes.get(clave, (0.0, 0))
+            _accesos_pendientes[clave] = (ahora, aciertos + 1)
+        _contar("aciertos")
+        return fila[0]
+    _contar("fallos")
+    return None
+
+
+def _volcar_accesos(conn: sqlite3.Connection):
+    """Aplica a LLM_CACHE los aciertos pendientes (dentro de una transacción de escritura)"""
+    with _metricas_lock:
+        pendientes = list(_accesos_pendientes.items())
+        _accesos_pendientes.clear()
+    if pendientes:
+        conn.executemany("UPDATE LLM_CACHE SET Fecha_Acceso = MAX(Fecha_Acceso, ?), Aciertos = Aciertos + ? "
+                         "WHERE Clave = ?", [(ahora, n, clave) for clave, (ahora, n) in pendientes])
+
+
+def guardar(modelo: str, prompt: str, respuesta: str, opciones: Optional[Dict[str, Any]] = None) -> bool:
+    """Guarda (o reemplaza) una respuesta; cada EVICCION_CADA escrituras aplica TTL y LRU"""
+    if not CACHE_HABILITADA or not respuesta:
+        return False
+    ahora = time.time()
+    opciones = opciones or {}
+    try:
+        with write_transaction() as conn:
+            _volcar_accesos(conn)
+            conn.execute('''
+                INSERT INTO LLM_CACHE (Clave, Modelo, Prompt_Hash, Temperatura, Opciones, Respuesta,
+                                       Bytes, Fecha_Creacion, Fecha_Acceso, Aciertos)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+                ON CONFLICT(Clave) DO UPDATE SET Respuesta = excluded.Respuesta, Bytes = excluded.Bytes,
+                    Fecha_Creacion = excluded.Fecha_Creacion, Fecha_Acceso = excluded.Fecha_Acceso
+            ''', (clave_cache(modelo, prompt, opciones), modelo, hash_prompt(prompt),
+                  opciones.get("temperature"), json.dumps(opciones, sort_keys=True), respuesta,
+                  len(respuesta.encode("utf-8")), ahora, ahora))
+    except sqlite3.OperationalError:
+        return False
+    _contar("escrituras")
+    if _metricas["escrituras"] % EVICCION_CADA == 0:
+        limpiar_cache()
+    return True
+
+
+def invalidar(modelo: str, prompt: str, opciones: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Elimina una respuesta guardada, p.ej. porque no se pudo parsear o no pasó
+    la validación: la siguiente llamada vuelve a inferir en lugar de repetirla.
+    """
+    clave = clave_cache(modelo, prompt, opciones)
+    with _metricas_lock:
+        _accesos_pendientes.pop(clave, None)
+    try:
+        with write_transaction() as conn:
+            return conn.execute("DELETE FROM LLM_CACHE WHERE Clave = ?", (clave,)).rowcount > 0
+    except sqlite3.OperationalError:
+        return False
+
+
+def con_cache(
+    modelo: str,
+    prompt: str,
+    opciones: Optional[Dict[str, Any]],
+    generar: Callable[[], Tuple[bool, str]]
+) -> Tuple[bool, str]:
+    """
+    Lectura a través del cache: devuelve la respuesta guardada o llama a
+    generar() y guarda el resultado si tuvo éxito.
+    """
+    respuesta = obtener(modelo, prompt, opciones)
+    if respuesta is not None:
+        return True, respuesta
+    exito, respuesta = generar()
+    if exito:
+        guardar(modelo, prompt, respuesta, opciones)
+    return exito, respuesta
+
+
+# ==================== MANTENIMIENTO ====================
+
+def limpiar_cache(max_entradas: int = None, max_bytes: int = None) -> int:
+    """
+    Borra las entradas vencidas y, si se supera el límite de entradas o de
+    bytes, las menos usadas recientemente.
+
+    Returns:
+        Número de entradas expulsadas
+    """
+    max_entradas = CACHE_MAX_ENTRADAS if max_entradas is None else max_entradas
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    try:
+        with write_transaction() as conn:
+            _volcar_accesos(conn)
+            borradas = conn.execute("DELETE FROM LLM_CACHE WHERE Fecha_Creacion < ?",
+                                    (time.time() - CACHE_TTL_SEGUNDOS,)).rowcount
+            # Acumulado por recencia: se conservan las más recientes que caben en ambos límites
+            borradas += conn.execute('''
+                DELETE FROM LLM_CACHE WHERE Clave IN (
+                    SELECT Clave FROM (
+                        SELECT Clave,
+                               ROW_NUMBER() OVER (ORDER BY Fecha_Acceso DESC) AS n,
+                               SUM(Bytes) OVER (ORDER BY Fecha_Acceso DESC ROWS UNBOUNDED PRECEDING) AS acumulado
+                        FROM LLM_CACHE
+                    ) WHERE n > ? OR acumulado > ?
+                )
+            ''', (max_entradas, max_bytes)).rowcount
+    except sqlite3.OperationalError:
+        return 0
+    _contar("expulsadas", borradas)
+    return borradas
+
+
+def vaciar_cache() -> int:
+    """Elimina todas las entradas"""
+    with _metricas_lock:
+        _accesos_pendientes.clear()
+    with write_transaction() as conn:
+        return conn.execute("DELETE FROM LLM_CACHE").rowcount
+
+
+def metricas_cache() -> Dict[str, Any]:
+    """Aciertos/fallos del proceso y tamaño actual del cache"""
+    with _metricas_lock:
+        metricas = dict(_metricas)
+    consultas = metricas["aciertos"] + metricas["fallos"]
+    metricas["tasa_aciertos"] = metricas["aciertos"] / consultas if consultas else 0.0
+    try:
+        with get_connection() as conn:
+            entradas, total_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(Bytes), 0) FROM LLM_CACHE").fetchone()
+    except sqlite3.OperationalError:
+        entradas, total_bytes = 0, 0
+    metricas["entradas"] = entradas
+    metricas["bytes"] = total_bytes
+    return metricas
+
+
+def reiniciar_metricas():
+    with _metricas_lock:
+        for metrica in _metricas:
+            _metricas[metrica] = 0
@@ -13,19 +13,21 @@ Todo con trazabilidad completa guardada en SQLite.
 """
 import json
 import datetime as dt
+import numpy as np
 import pandas as pd
 from typing import Dict, List, Tuple, Optional, Any
 from dataclasses import dataclass, asdict
 from services.database_service import (
     read_table, insert_rows, update_row, delete_row,
-    query_rows, get_connection
+    get_connection, write_transaction, get_activo, get_respuestas,
+    get_activos_evaluacion, get_respuestas_evaluacion, get_resultados_magerit_evaluacion
 )
 from services.degradacion_service import (
-    obtener_degradacion, obtener_degradaciones_activo, guardar_degradacion,
-    sugerir_degradacion_ia, DegradacionAmenaza,
+    obtener_degradaciones_activo, DegradacionAmenaza,
     calcular_impacto_con_degradacion, calcular_riesgo_activo_dual,
     calcular_riesgo_objetivo, supera_limite, obtener_limite_evaluacion
 )
+from services.matriz_degradacion_service import resolver_degradaciones
 
 
 # ==================== MODELOS DE DATOS ====================
@@ -598,22 +600,16 @@ def evaluar_activo_magerit(
         ResultadoEvaluacionMagerit con todos los cálculos
     """
     # 1. Obtener datos del activo
-    activos = read_table("INVENTARIO_ACTIVOS")
-    activo = activos[activos["ID_Activo"] == activo_id]
+    activo = get_activo(eval_id, activo_id)
     
-    if activo.empty:
+    if activo is None:
         raise ValueError(f"Activo {activo_id} no encontrado")
     
-    activo = activo.iloc[0]
     nombre_activo = activo.get("Nombre_Activo", "")
     tipo_activo = activo.get("Tipo_Activo", "")
     
     # 2. Obtener respuestas del cuestionario
-    respuestas = read_table("RESPUESTAS")
-    respuestas_activo = respuestas[
-        (respuestas["ID_Evaluacion"] == eval_id) &
-        (respuestas["ID_Activo"] == activo_id)
-    ]
+    respuestas_activo = get_respuestas(eval_id, activo_id)
     
     # 3. Calcular impacto DIC desde respuestas
     impacto = calcular_impacto_desde_respuestas(respuestas_activo)
@@ -638,6 +634,22 @@ def evaluar_activo_magerit(
     # Calcular CRITICIDAD del activo (MAGERIT): MAX(D, I, C)
     criticidad_activo = impacto.impacto_global  # Ya es max(D, I, C)
     
+    # Obtener o sugerir DEGRADACIÓN de todas las amenazas válidas de una vez
+    # (una consulta y, si faltan, un único guardado de las sugerencias)
+    tipos_amenaza = (catalogo_amenazas.drop_duplicates("codigo").set_index("codigo")["tipo_amenaza"]
+                     if not catalogo_amenazas.empty else pd.Series(dtype=object))
+    codigos_activo = [a.get("codigo", "") for a in amenazas_ia if a.get("codigo", "") in codigos_validos]
+    degradaciones = resolver_degradaciones(eval_id, pd.DataFrame({
+        "ID_Activo": activo_id,
+        "codigo": codigos_activo,
+        "Tipo_Activo": tipo_activo,
+        "tipo_amenaza": [tipos_amenaza.get(c, "") for c in codigos_activo],
+    }, columns=["ID_Activo", "codigo", "Tipo_Activo", "tipo_amenaza"]))
+    degradacion_maxima = dict(zip(
+        degradaciones["codigo"],
+        degradaciones[["Degradacion_D", "Degradacion_I", "Degradacion_C"]].astype(float).max(axis=1)
+    ))
+    
     for amenaza_data in amenazas_ia:
         codigo = amenaza_data.get("codigo", "")
         
@@ -647,25 +659,10 @@ def evaluar_activo_magerit(
         
         # Obtener info de la amenaza del catálogo
         amenaza_info = catalogo_amenazas[catalogo_amenazas["codigo"] == codigo].iloc[0]
-        tipo_amenaza = amenaza_info.get("tipo_amenaza", "")
-        
-        # Obtener o sugerir DEGRADACIÓN para esta amenaza
-        degradacion = obtener_degradacion(eval_id, activo_id, codigo)
-        if degradacion is None:
-            # Sugerir degradación por IA si no existe manual
-            degradacion = sugerir_degradacion_ia(
-                tipo_activo=tipo_activo,
-                codigo_amenaza=codigo,
-                tipo_amenaza=tipo_amenaza
-            )
-            degradacion.id_evaluacion = eval_id
-            degradacion.id_activo = activo_id
-            # Guardar sugerencia automáticamente
-            guardar_degradacion(degradacion)
         
         # FÓRMULA CORRECTA MAGERIT:
         # IMPACTO = CRITICIDAD × MAX(Deg_D, Deg_I, Deg_C)
-        impacto_amenaza = round(criticidad_activo * degradacion.degradacion_maxima, 2)
+        impacto_amenaza = round(criticidad_activo * degradacion_maxima[codigo], 2)
         
         # Determinar dimensión afectada (para registro)
         dimension = amenaza_data.get("dimension", "D").upper()
@@ -775,105 +772,417 @@ def evaluar_activo_magerit(
     return resultado
 
 
+# ==================== MOTOR POR LOTES (EVALUACIÓN COMPLETA) ====================
+# Mismas fórmulas que evaluar_activo_magerit, pero cargando respuestas,
+# degradaciones y catálogos una sola vez y operando por columnas sobre todos
+# los pares (activo, amenaza) de la evaluación.
+
+def _a_entero(serie: pd.Series, defecto: int) -> pd.Series:
+    """Equivalente vectorizado de safe_int()"""
+    return pd.to_numeric(serie, errors="coerce").fillna(defecto).astype(int)
+
+
+def _niveles_riesgo(valores: np.ndarray) -> np.ndarray:
+    """get_nivel_riesgo() vectorizado"""
+    return np.select(
+        [valores >= 20, valores >= 12, valores >= 6, valores >= 3],
+        ["CRITICO", "ALTO", "MEDIO", "BAJO"],
+        default="MUY BAJO"
+    )
+
+
+def _tratamientos(niveles: np.ndarray, efectividad: np.ndarray) -> np.ndarray:
+    """get_tratamiento_sugerido() vectorizado"""
+    return np.select(
+        [np.isin(niveles, ["CRITICO", "CRÍTICO", "ALTO"]),
+         (niveles == "MEDIO") & (efectividad >= 0.7),
+         niveles == "MEDIO",
+         niveles == "BAJO"],
+        ["mitigar", "aceptar", "mitigar", "monitorear"],
+        default="aceptar"
+    )
+
+
+def _redondear(valores) -> List[float]:
+    """round(x, 2) de Python elemento a elemento (np.round difiere en algunos empates)"""
+    return [round(float(v), 2) for v in valores]
+
+
+def _registros(df: pd.DataFrame) -> List[Dict]:
+    """Equivalente a df.to_dict("records") convirtiendo por columnas (mucho más rápido)"""
+    columnas = list(df.columns)
+    return [dict(zip(columnas, fila)) for fila in zip(*(df[c].tolist() for c in columnas))]
+
+
+def _impactos_por_activo(respuestas: pd.DataFrame) -> Dict[str, ImpactoDIC]:
+    """calcular_impacto_desde_respuestas() para todos los activos a la vez"""
+    if respuestas.empty:
+        return {}
+    
+    id_pregunta = respuestas["ID_Pregunta"].astype(str).str.upper()
+    df = pd.DataFrame({
+        "ID_Activo": respuestas["ID_Activo"].astype(str),
+        "dim": respuestas["Dimension"].astype(str).str.upper(),
+        "valor": _a_entero(respuestas["Valor_Numerico"], 2),
+        "peso": _a_entero(respuestas["Peso"], 3),
+    })
+    # Solo bloque A (impacto directo); PV-A05 es un control
+    es_bloque_a = id_pregunta.str.contains("-A0", regex=False) | id_pregunta.str.contains("-A-0", regex=False)
+    es_control_a05 = id_pregunta.str.contains("A05", regex=False) & id_pregunta.str.contains("PV", regex=False)
+    df = df[es_bloque_a & ~es_control_a05 & df["dim"].isin(["D", "I", "C"])].copy()
+    
+    df["magerit"] = df["valor"].map(ESCALA_MAGERIT).fillna(df["valor"]).astype(int)
+    df["ponderado"] = df["magerit"] * df["peso"]
+    df["critico"] = (df["magerit"] >= 5).astype(int)
+    g = df.groupby(["ID_Activo", "dim"]).agg(
+        max_valor=("magerit", "max"),
+        suma_ponderada=("ponderado", "sum"),
+        suma_pesos=("peso", "sum"),
+        suma_valores=("magerit", "sum"),
+        n=("magerit", "size"),
+        criticos=("critico", "sum"),
+    ).reset_index()
+    
+    suma_pesos = g["suma_pesos"].to_numpy(dtype=float)
+    promedio = np.where(
+        suma_pesos > 0,
+        g["suma_ponderada"].to_numpy() / np.where(suma_pesos > 0, suma_pesos, 1),
+        g["suma_valores"].to_numpy() / g["n"].to_numpy()
+    )
+    max_valor = g["max_valor"].to_numpy()
+    hibrido = (max_valor * 0.6) + (promedio * 0.4)
+    redondeado = np.rint(hibrido).astype(int)
+    proporcion = g["criticos"].to_numpy() / g["n"].to_numpy()
+    final = np.where(
+        (proporcion >= 0.7) & (max_valor >= 5), 5,
+        np.where((proporcion >= 0.5) & (max_valor >= 5), np.maximum(redondeado, 4), redondeado)
+    )
+    g["impacto"] = np.clip(final, 1, 5)
+    g["justificacion"] = [
+        f"MAX={m}, Prom={p:.1f}, Híbrido={h:.1f}, {n} resp"
+        for m, p, h, n in zip(max_valor.tolist(), promedio.tolist(), hibrido.tolist(), g["n"].tolist())
+    ]
+    
+    por_dimension = {
+        (a, d): (int(v), j)
+        for a, d, v, j in zip(g["ID_Activo"], g["dim"], g["impacto"], g["justificacion"])
+    }
+    impactos = {}
+    for activo_id in respuestas["ID_Activo"].astype(str).unique():
+        d, i, c = (por_dimension.get((activo_id, dim), (3, "Sin datos suficientes")) for dim in "DIC")
+        impactos[activo_id] = ImpactoDIC(d[0], i[0], c[0], d[1], i[1], c[1])
+    return impactos
+
+
+def _controles_por_activo(respuestas: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """
+    identificar_controles_existentes() para todos los activos a la vez.
+    
+    Returns:
+        (DataFrame [ID_Activo, control] de controles implementados o parciales,
+         efectividad base por activo)
+    """
+    vacio = pd.DataFrame(columns=["ID_Activo", "control"])
+    if respuestas.empty:
+        return vacio, {}
+    
+    df = pd.DataFrame({
+        "ID_Activo": respuestas["ID_Activo"].astype(str),
+        "codigo": respuestas["ID_Pregunta"].astype(str).str.split("-").str[-1],
+        "valor": _a_entero(respuestas["Valor_Numerico"], 1),
+    })
+    df = df[df["codigo"].isin(MAPEO_PREGUNTAS_CONTROLES.keys())].copy()
+    if df.empty:
+        return vacio, {}
+    
+    # Suma secuencial como en el cálculo individual (mean() usa suma compensada)
+    sumas: Dict[str, List[float]] = {}
+    for activo_id, valor in zip(df["ID_Activo"].tolist(), df["valor"].tolist()):
+        sumas.setdefault(activo_id, []).append((valor - 1) / 3.0)
+    efectividad = {a: sum(v) / len(v) for a, v in sumas.items()}
+    
+    # Un control cuenta con el mejor nivel alcanzado en cualquiera de sus preguntas
+    df["control"] = df["codigo"].map(MAPEO_PREGUNTAS_CONTROLES)
+    mejor = df.explode("control").groupby(["ID_Activo", "control"])["valor"].max().reset_index()
+    existentes = mejor.loc[mejor["valor"] >= 2, ["ID_Activo", "control"]]
+    return existentes.sort_values(["ID_Activo", "control"]).reset_index(drop=True), efectividad
+
+
+def _analisis_desde_resultados(eval_id: str) -> Dict[str, Dict]:
+    """Reconstruye las amenazas/probabilidad ya analizadas (RESULTADOS_MAGERIT) para recalcular"""
+    guardados = get_resultados_magerit_evaluacion(
+        eval_id, columns=["ID_Activo", "Amenazas_JSON", "Observaciones", "Modelo_IA"]
+    )
+    analisis = {}
+    for fila in guardados.itertuples(index=False):
+        amenazas = json.loads(fila.Amenazas_JSON) if fila.Amenazas_JSON else []
+        analisis[str(fila.ID_Activo)] = {
+            "amenazas": [{
+                "codigo": a.get("codigo", ""),
+                "dimension": a.get("dimension", "D"),
+                "controles_iso_recomendados": [
+                    {"control": c.get("codigo", ""), "prioridad": c.get("prioridad", "Media"),
+                     "motivo": c.get("motivo", "")}
+                    for c in a.get("controles_recomendados", [])
+                ],
+            } for a in amenazas],
+            "probabilidad": amenazas[0].get("probabilidad", 3) if amenazas else 3,
+            "observaciones": fila.Observaciones or "",
+            "modelo": fila.Modelo_IA or "manual",
+        }
+    return analisis
+
+
+def evaluar_evaluacion_magerit(
+    eval_id: str,
+    analisis: Dict[str, Dict] = None,
+    modelo_ia: str = "manual"
+) -> Dict[str, ResultadoEvaluacionMagerit]:
+    """
+    Ejecuta la evaluación MAGERIT de todos los activos de una evaluación.
+    
+    Produce los mismos ResultadoEvaluacionMagerit que evaluar_activo_magerit,
+    pero con una sola lectura de respuestas, degradaciones y catálogos, y los
+    cálculos de impacto/riesgo por columnas sobre todos los pares (activo, amenaza).
+    Las degradaciones sugeridas que falten se guardan en un único bloque.
+    
+    Args:
+        eval_id: ID de la evaluación
+        analisis: {id_activo: {"amenazas": [...], "probabilidad": int,
+                   "observaciones": str, "modelo": str}} con el formato que usa
+                   evaluar_activo_magerit. Si es None se recalculan las amenazas
+                   ya guardadas en RESULTADOS_MAGERIT.
+        modelo_ia: Modelo por defecto si el análisis de un activo no lo indica
+    
+    Returns:
+        {id_activo: ResultadoEvaluacionMagerit}
+    """
+    if analisis is None:
+        analisis = _analisis_desde_resultados(eval_id)
+    if not analisis:
+        return {}
+    
+    # 1. Carga única de datos
+    activos = get_activos_evaluacion(eval_id, columns=["ID_Activo", "Nombre_Activo", "Tipo_Activo"])
+    activos["ID_Activo"] = activos["ID_Activo"].astype(str)
+    activos = activos[activos["ID_Activo"].isin(analisis.keys())].set_index("ID_Activo")
+    faltantes = set(analisis) - set(activos.index)
+    if faltantes:
+        print(f"Activos no encontrados en {eval_id}: {', '.join(sorted(faltantes))}")
+    
+    respuestas = get_respuestas_evaluacion(eval_id, columns=["ID_Activo", "ID_Pregunta", "Dimension",
+                                                             "Valor_Numerico", "Peso"])
+    respuestas = respuestas[respuestas["ID_Activo"].astype(str).isin(activos.index)]
+    impactos = _impactos_por_activo(respuestas)
+    controles_activo, efectividad_base = _controles_por_activo(respuestas)
+    
+    catalogo_amenazas = read_table("CATALOGO_AMENAZAS_MAGERIT")
+    info_amenazas = (catalogo_amenazas.set_index("codigo")[["amenaza", "tipo_amenaza"]]
+                     if not catalogo_amenazas.empty else pd.DataFrame(columns=["amenaza", "tipo_amenaza"]))
+    catalogo_controles = read_table("CATALOGO_CONTROLES_ISO27002")
+    info_controles = ({} if catalogo_controles.empty else
+                      catalogo_controles.drop_duplicates("codigo").set_index("codigo")[["nombre", "categoria"]]
+                      .to_dict("index"))
+    
+    # 2. Pares (activo, amenaza) válidos
+    filas = []
+    for activo_id in activos.index:
+        datos = analisis[activo_id]
+        for orden, amenaza_data in enumerate(datos.get("amenazas", [])):
+            filas.append({
+                "ID_Activo": activo_id,
+                "orden": orden,
+                "codigo": amenaza_data.get("codigo", ""),
+                "dimension": amenaza_data.get("dimension", "D").upper(),
+                "justificacion": amenaza_data.get("justificacion", ""),
+                "recomendados": amenaza_data.get("controles_iso_recomendados", []),
+                "probabilidad": datos.get("probabilidad", 3),
+            })
+    pares = pd.DataFrame(filas, columns=["ID_Activo", "orden", "codigo", "dimension", "justificacion",
+                                         "recomendados", "probabilidad"])
+    pares = pares[pares["codigo"].isin(info_amenazas.index)].reset_index(drop=True)
+    pares = pares.join(info_amenazas, on="codigo")
+    pares["Tipo_Activo"] = pares["ID_Activo"].map(activos["Tipo_Activo"]).fillna("")
+    
+    # 3. Degradaciones: registradas o sugeridas (las sugeridas se guardan en bloque)
+    pares = resolver_degradaciones(eval_id, pares)
+    
+    # 4. Impacto y riesgo inherente: IMPACTO = CRITICIDAD × MAX(Deg), RIESGO = FRECUENCIA × IMPACTO
+    criticidad = pares["ID_Activo"].map(
+        {a: imp.impacto_global for a, imp in impactos.items()}
+    ).fillna(3).to_numpy()
+    deg_max = pares[["Degradacion_D", "Degradacion_I", "Degradacion_C"]].astype(float).max(axis=1).to_numpy()
+    pares["impacto"] = _redondear(criticidad * deg_max)
+    pares["riesgo_inherente"] = _redondear(pares["probabilidad"].to_numpy() * pares["impacto"].to_numpy())
+    inherente = pares["riesgo_inherente"].to_numpy(dtype=float)
+    pares["nivel_riesgo"] = _niveles_riesgo(inherente)
+    
+    # 5. Riesgo residual: cobertura de controles existentes sobre los requeridos
+    requeridos = pares[["ID_Activo", "codigo"]].copy()
+    requeridos["control"] = requeridos["codigo"].map(MAPEO_AMENAZAS_CONTROLES)
+    requeridos = requeridos.reset_index().explode("control").dropna(subset=["control"])
+    requeridos = requeridos.merge(controles_activo.assign(existe=True), on=["ID_Activo", "control"], how="left")
+    requeridos["existe"] = requeridos["existe"].fillna(False).astype(bool)
+    cubiertos: Dict[int, List[str]] = {}
+    existe = requeridos["existe"].to_numpy()
+    for idx, control in zip(requeridos["index"].to_numpy()[existe].tolist(),
+                            requeridos["control"].to_numpy()[existe].tolist()):
+        cubiertos.setdefault(idx, []).append(control)
+    
+    n_req = requeridos.groupby("index")["control"].nunique().reindex(pares.index, fill_value=0).to_numpy()
+    n_cub = np.array([len(set(cubiertos.get(i, []))) for i in pares.index], dtype=int)
+    cobertura = np.divide(n_cub, n_req, out=np.zeros(len(pares)), where=n_req > 0)
+    efectividad = cobertura * pares["ID_Activo"].map(efectividad_base).fillna(0.0).to_numpy()
+    residual = np.where(n_req > 0, np.maximum(1.0, inherente * (1 - (efectividad * 0.8))), inherente)
+    pares["efectividad"] = efectividad
+    pares["riesgo_residual"] = residual
+    pares["nivel_riesgo_residual"] = _niveles_riesgo(residual)
+    pares["tratamiento"] = _tratamientos(pares["nivel_riesgo_residual"].to_numpy(), efectividad)
+    pares["controles_existentes"] = [cubiertos.get(i, []) for i in pares.index]
+    
+    # 6. Objetos de resultado por activo
+    fecha_evaluacion = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    amenazas_por_activo: Dict[str, List[AmenazaIdentificada]] = {a: [] for a in activos.index}
+    recomendados_por_activo: Dict[str, List[Dict]] = {a: [] for a in activos.index}
+    inherentes_por_activo: Dict[str, List[float]] = {a: [] for a in activos.index}
+    residuales_por_activo: Dict[str, List[float]] = {a: [] for a in activos.index}
+    for par in _registros(pares):  # ya ordenados por activo y orden de la IA
+        controles_rec = []
+        for ctrl in par["recomendados"]:
+            codigo_ctrl = ctrl.get("control", "")
+            if codigo_ctrl in info_controles:
+                rec = {
+                    "codigo": codigo_ctrl,
+                    "nombre": info_controles[codigo_ctrl]["nombre"],
+                    "categoria": info_controles[codigo_ctrl]["categoria"],
+                    "prioridad": ctrl.get("prioridad", "Media"),
+                    "motivo": ctrl.get("motivo", "")
+                }
+                controles_rec.append(rec)
+                recomendados_por_activo[par["ID_Activo"]].append({**rec, "amenaza_origen": par["codigo"]})
+        amenazas_por_activo[par["ID_Activo"]].append(AmenazaIdentificada(
+            codigo=par["codigo"],
+            amenaza=par["amenaza"],
+            tipo_amenaza=par["tipo_amenaza"],
+            dimension_afectada=par["dimension"],
+            probabilidad=par["probabilidad"],
+            impacto=par["impacto"],
+            riesgo_inherente=par["riesgo_inherente"],
+            nivel_riesgo=par["nivel_riesgo"],
+            justificacion=par["justificacion"],
+            controles_existentes=par["controles_existentes"],
+            efectividad_controles=float(par["efectividad"]),
+            riesgo_residual=round(float(par["riesgo_residual"]), 2),
+            nivel_riesgo_residual=par["nivel_riesgo_residual"],
+            controles_recomendados=controles_rec,
+            tratamiento=par["tratamiento"]
+        ))
+        inherentes_por_activo[par["ID_Activo"]].append(par["riesgo_inherente"])
+        residuales_por_activo[par["ID_Activo"]].append(float(par["riesgo_residual"]))
+    
+    controles_lista: Dict[str, List[str]] = {}
+    for activo_id, control in zip(controles_activo["ID_Activo"].tolist(), controles_activo["control"].tolist()):
+        controles_lista.setdefault(activo_id, []).append(control)
+    
+    resultados = {}
+    for activo_id, activo in activos.to_dict("index").items():
+        inh = calcular_riesgo_activo_dual(inherentes_por_activo[activo_id])["promedio"]
+        res = round(calcular_riesgo_activo_dual(residuales_por_activo[activo_id])["promedio"], 2)
+        resultados[activo_id] = ResultadoEvaluacionMagerit(
+            id_evaluacion=eval_id,
+            id_activo=activo_id,
+            nombre_activo=activo.get("Nombre_Activo", ""),
+            tipo_activo=activo.get("Tipo_Activo", ""),
+            fecha_evaluacion=fecha_evaluacion,
+            impacto=impactos.get(activo_id, ImpactoDIC(3, 3, 3, "Sin respuestas", "Sin respuestas", "Sin respuestas")),
+            amenazas=amenazas_por_activo[activo_id],
+            riesgo_inherente_global=inh,
+            nivel_riesgo_inherente_global=get_nivel_riesgo(inh),
+            riesgo_residual_global=res,
+            nivel_riesgo_residual_global=get_nivel_riesgo(res),
+            controles_existentes_global=controles_lista.get(activo_id, []),
+            controles_recomendados_global=recomendados_por_activo[activo_id],
+            observaciones=analisis[activo_id].get("observaciones", ""),
+            modelo_ia=analisis[activo_id].get("modelo", modelo_ia)
+        )
+    return resultados
+
+
+def _fila_resultado_magerit(resultado: ResultadoEvaluacionMagerit, limite: float) -> Dict:
+    """Convierte un resultado en la fila de RESULTADOS_MAGERIT (con campos extendidos)"""
+    # Preparar amenazas como JSON
+    amenazas_json = json.dumps([{
+        "codigo": a.codigo,
+        "amenaza": a.amenaza,
+        "tipo_amenaza": a.tipo_amenaza,
+        "dimension": a.dimension_afectada,
+        "probabilidad": a.probabilidad,
+        "impacto": a.impacto,
+        "riesgo_inherente": a.riesgo_inherente,
+        "nivel_riesgo": a.nivel_riesgo,
+        "riesgo_residual": a.riesgo_residual,
+        "tratamiento": a.tratamiento,
+        "controles_recomendados": a.controles_recomendados
+    } for a in resultado.amenazas], ensure_ascii=False)
+    
+    # Calcular valores adicionales para Marco Teórico MAGERIT
+    riesgo_promedio = resultado.riesgo_residual_global  # Ya es promedio
+    riesgos_amenazas = [a.riesgo_residual for a in resultado.amenazas]
+    
+    return {
+        "ID_Evaluacion": resultado.id_evaluacion,
+        "ID_Activo": resultado.id_activo,
+        "Nombre_Activo": resultado.nombre_activo,
+        "Impacto_D": resultado.impacto.disponibilidad,
+        "Impacto_I": resultado.impacto.integridad,
+        "Impacto_C": resultado.impacto.confidencialidad,
+        "Riesgo_Inherente": resultado.riesgo_inherente_global,
+        "Riesgo_Residual": resultado.riesgo_residual_global,
+        "Nivel_Riesgo": resultado.nivel_riesgo_inherente_global,
+        "Amenazas_JSON": amenazas_json,
+        "Controles_JSON": json.dumps(resultado.controles_existentes_global, ensure_ascii=False),
+        "Observaciones": resultado.observaciones,
+        "Modelo_IA": resultado.modelo_ia,
+        "Fecha_Evaluacion": resultado.fecha_evaluacion,
+        "Criticidad": resultado.impacto.impacto_global,  # MAX(D, I, C)
+        "Riesgo_Promedio": riesgo_promedio,
+        "Riesgo_Maximo": max(riesgos_amenazas) if riesgos_amenazas else 0,
+        "Riesgo_Objetivo": calcular_riesgo_objetivo(riesgo_promedio, 0.5),
+        "Supera_Limite": 1 if supera_limite(riesgo_promedio, limite) else 0,
+    }
+
+
+def guardar_resultados_magerit(resultados: List[ResultadoEvaluacionMagerit]) -> int:
+    """
+    Guarda varios resultados MAGERIT en una sola transacción
+    (reemplaza el resultado anterior de cada activo).
+    
+    Returns:
+        Número de resultados guardados
+    """
+    if not resultados:
+        return 0
+    
+    # La tabla RESULTADOS_MAGERIT (con columnas extendidas) la crea migracion_service
+    limites = {e: obtener_limite_evaluacion(e) for e in {r.id_evaluacion for r in resultados}}
+    filas = [_fila_resultado_magerit(r, limites[r.id_evaluacion]) for r in resultados]
+    
+    with write_transaction() as conn:
+        conn.executemany(
+            'DELETE FROM RESULTADOS_MAGERIT WHERE ID_Evaluacion = ? AND ID_Activo = ?',
+            [(r.id_evaluacion, r.id_activo) for r in resultados]
+        )
+        insert_rows("RESULTADOS_MAGERIT", filas)
+    return len(filas)
+
+
 def guardar_resultado_magerit(resultado: ResultadoEvaluacionMagerit) -> bool:
     """
     Guarda el resultado de la evaluación MAGERIT en SQLite.
     Usa la tabla RESULTADOS_MAGERIT existente.
     """
     try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Verificar que la tabla RESULTADOS_MAGERIT existe (debería existir desde init)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS RESULTADOS_MAGERIT (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ID_Evaluacion TEXT,
-                    ID_Activo TEXT,
-                    Nombre_Activo TEXT,
-                    Impacto_D INTEGER,
-                    Impacto_I INTEGER,
-                    Impacto_C INTEGER,
-                    Riesgo_Inherente REAL,
-                    Riesgo_Residual REAL,
-                    Nivel_Riesgo TEXT,
-                    Amenazas_JSON TEXT,
-                    Controles_JSON TEXT,
-                    Observaciones TEXT,
-                    Modelo_IA TEXT,
-                    Fecha_Evaluacion TEXT
-                )
-            ''')
-            
-            # Eliminar resultados anteriores para este activo
-            cursor.execute(
-                'DELETE FROM RESULTADOS_MAGERIT WHERE ID_Evaluacion = ? AND ID_Activo = ?',
-                [resultado.id_evaluacion, resultado.id_activo]
-            )
-            
-            # Preparar amenazas como JSON
-            amenazas_json = json.dumps([{
-                "codigo": a.codigo,
-                "amenaza": a.amenaza,
-                "tipo_amenaza": a.tipo_amenaza,
-                "dimension": a.dimension_afectada,
-                "probabilidad": a.probabilidad,
-                "impacto": a.impacto,
-                "riesgo_inherente": a.riesgo_inherente,
-                "nivel_riesgo": a.nivel_riesgo,
-                "riesgo_residual": a.riesgo_residual,
-                "tratamiento": a.tratamiento,
-                "controles_recomendados": a.controles_recomendados
-            } for a in resultado.amenazas], ensure_ascii=False)
-            
-            # Preparar controles como JSON
-            controles_json = json.dumps(resultado.controles_existentes_global, ensure_ascii=False)
-            
-            # Insertar resultado con campos extendidos para Marco Teórico MAGERIT
-            # Calcular valores adicionales
-            criticidad = resultado.impacto.impacto_global  # MAX(D, I, C)
-            riesgo_promedio = resultado.riesgo_residual_global  # Ya es promedio
-            
-            # Calcular máximo de los riesgos individuales
-            riesgos_amenazas = [a.riesgo_residual for a in resultado.amenazas]
-            riesgo_maximo = max(riesgos_amenazas) if riesgos_amenazas else 0
-            
-            # Calcular objetivo y límite
-            limite = obtener_limite_evaluacion(resultado.id_evaluacion)
-            riesgo_objetivo = calcular_riesgo_objetivo(riesgo_promedio, 0.5)
-            sobre_limite = 1 if supera_limite(riesgo_promedio, limite) else 0
-            
-            cursor.execute('''
-                INSERT INTO RESULTADOS_MAGERIT (
-                    ID_Evaluacion, ID_Activo, Nombre_Activo,
-                    Impacto_D, Impacto_I, Impacto_C,
-                    Riesgo_Inherente, Riesgo_Residual, Nivel_Riesgo,
-                    Amenazas_JSON, Controles_JSON, Observaciones, Modelo_IA, Fecha_Evaluacion,
-                    Criticidad, Riesgo_Promedio, Riesgo_Maximo, Riesgo_Objetivo, Supera_Limite
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', [
-                resultado.id_evaluacion,
-                resultado.id_activo,
-                resultado.nombre_activo,
-                resultado.impacto.disponibilidad,
-                resultado.impacto.integridad,
-                resultado.impacto.confidencialidad,
-                resultado.riesgo_inherente_global,
-                resultado.riesgo_residual_global,
-                resultado.nivel_riesgo_inherente_global,
-                amenazas_json,
-                controles_json,
-                resultado.observaciones,
-                resultado.modelo_ia,
-                resultado.fecha_evaluacion,
-                criticidad,
-                riesgo_promedio,
-                riesgo_maximo,
-                riesgo_objetivo,
-                sobre_limite
-            ])
-        
-        return True
+        return guardar_resultados_magerit([resultado]) == 1
     
     except Exception as e:
         print(f"Error guardando resultado MAGERIT: {e}")
@@ -0,0 +1,156 @@
+"""
+Matriz de degradación MAGERIT - Proyecto TITA
+=============================================
+El motor de degradación (obtener_degradacion_motor) depende solo de tres
+cosas: la fila base del catálogo DEGRADACION_MAGERIT que corresponde al
+código de amenaza, la clave de AJUSTE_TIPO_ACTIVO que corresponde al tipo
+de activo y la criticidad. Todas las combinaciones caben en una matriz
+pequeña (filas base × clases de activo × criticidad 0-5 × D/I/C) que se
+calcula una vez con el propio motor, así que los valores son idénticos; a
+partir de ahí resolver miles de pares (activo, amenaza) es indexar arrays.
+
+- degradaciones_motor(codigos, tipos, criticidades): array (n, 3) D/I/C
+- resolver_degradaciones(eval_id, pares): degradaciones registradas en
+  DEGRADACION_AMENAZAS (una consulta) o sugeridas (una sugerencia por
+  combinación tipo de activo/amenaza), guardando las nuevas en un bloque
+
+Uso:
+    from services.matriz_degradacion_service import resolver_degradaciones
+    pares = resolver_degradaciones(eval_id, pares)  # añade Degradacion_D/I/C
+"""
+import datetime as dt
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Sequence
+
+import numpy as np
+import pandas as pd
+
+from services.database_service import upsert_rows
+from services.degradacion_service import (
+    DEGRADACION_MAGERIT, AJUSTE_TIPO_ACTIVO,
+    clave_base_motor, clase_tipo_activo, obtener_degradacion_motor,
+    cargar_degradaciones, sugerir_degradacion_ia
+)
+
+
+CRITICIDAD_MAXIMA = 5
+CODIGO_GENERICO = "?"  # sin fila propia ni de categoría: base genérica del motor
+MAX_ACTIVOS_FILTRO = 500  # más activos: se carga la evaluación entera (límite de variables SQL)
+
+
+@dataclass
+class MatrizDegradacion:
+    """Degradaciones del motor precalculadas"""
+    filas: Dict[str, int]     # clave de DEGRADACION_MAGERIT ("" = genérica) -> índice
+    clases: Dict[str, int]    # clave de AJUSTE_TIPO_ACTIVO ("" = sin ajuste) -> índice
+    valores: np.ndarray       # (filas, clases, criticidad 0..5, 3)
+
+
+@lru_cache(maxsize=1)
+def matriz_degradacion() -> MatrizDegradacion:
+    """Construye (una vez por proceso) la matriz con el motor escalar"""
+    claves_base = list(DEGRADACION_MAGERIT) + [""]
+    # Algunas claves de ajuste nunca se alcanzan (otra anterior es subcadena suya)
+    clases = sorted({clase_tipo_activo(clave) for clave in AJUSTE_TIPO_ACTIVO} | {""})
+    valores = np.empty((len(claves_base), len(clases), CRITICIDAD_MAXIMA + 1, 3))
+    for i, clave in enumerate(claves_base):
+        codigo = clave or CODIGO_GENERICO
+        for j, clase in enumerate(clases):
+            for criticidad in range(CRITICIDAD_MAXIMA + 1):
+                valores[i, j, criticidad] = obtener_degradacion_motor(codigo, clase, criticidad)[:3]
+    return MatrizDegradacion(
+        filas={clave: i for i, clave in enumerate(claves_base)},
+        clases={clase: j for j, clase in enumerate(clases)},
+        valores=valores,
+    )
+
+
+def _texto(valor) -> str:
+    return valor if isinstance(valor, str) else ""
+
+
+def degradaciones_motor(
+    codigos: Sequence[str],
+    tipos_activo: Sequence[str],
+    criticidades: Sequence[float]
+) -> np.ndarray:
+    """
+    Degradación D/I/C del motor para n amenazas a la vez (array (n, 3), 0-1).
+    Equivale a llamar obtener_degradacion_motor por elemento; las criticidades
+    no enteras o fuera de 0-5 se resuelven con el motor escalar.
+    """
+    matriz = matriz_degradacion()
+    codigos = [_texto(c) for c in codigos]
+    tipos = [_texto(t) for t in tipos_activo]
+    n = len(codigos)
+    if n == 0:
+        return np.empty((0, 3))
+
+    # Los mapeos por texto se hacen una vez por valor distinto
+    fila_por_codigo = {c: matriz.filas[clave_base_motor(c) or ""] for c in set(codigos)}
+    clase_por_tipo = {t: matriz.clases[clase_tipo_activo(t)] for t in set(tipos)}
+    filas = np.fromiter((fila_por_codigo[c] for c in codigos), dtype=np.intp, count=n)
+    clases = np.fromiter((clase_por_tipo[t] for t in tipos), dtype=np.intp, count=n)
+
+    criticidad = np.asarray(criticidades, dtype=float)
+    enteras = (criticidad == np.round(criticidad)) & (criticidad >= 0) & (criticidad <= CRITICIDAD_MAXIMA)
+
+    resultado = np.empty((n, 3))
+    resultado[enteras] = matriz.valores[filas[enteras], clases[enteras], criticidad[enteras].astype(np.intp)]
+    for i in np.flatnonzero(~enteras):
+        resultado[i] = obtener_degradacion_motor(codigos[i], tipos[i], criticidades[i])[:3]
+    return resultado
+
+
+# ==================== RESOLUCIÓN POR EVALUACIÓN ====================
+
+@lru_cache(maxsize=4096)
+def _sugerencia(tipo_activo: str, codigo: str, tipo_amenaza: str):
+    sugerida = sugerir_degradacion_ia(tipo_activo=tipo_activo, codigo_amenaza=codigo, tipo_amenaza=tipo_amenaza)
+    return (sugerida.degradacion_d, sugerida.degradacion_i, sugerida.degradacion_c,
+            sugerida.justificacion, sugerida.fuente)
+
+
+def resolver_degradaciones(eval_id: str, pares: pd.DataFrame, guardar: bool = True) -> pd.DataFrame:
+    """
+    Añade Degradacion_D/I/C a los pares (activo, amenaza) de una evaluación.
+
+    pares necesita las columnas ID_Activo, codigo, Tipo_Activo y tipo_amenaza.
+    Se usan las degradaciones registradas (una consulta para todos los activos);
+    las que faltan se sugieren una vez por combinación (tipo de activo, amenaza)
+    y, si guardar, se registran todas con un único upsert.
+    """
+    pares = pares.drop(columns=["Degradacion_D", "Degradacion_I", "Degradacion_C"], errors="ignore")
+    if pares.empty:
+        return pares.assign(Degradacion_D=pd.Series(dtype=float), Degradacion_I=pd.Series(dtype=float),
+                            Degradacion_C=pd.Series(dtype=float))
+
+    activos = pares["ID_Activo"].unique().tolist()
+    registradas = cargar_degradaciones(eval_id, activos if len(activos) <= MAX_ACTIVOS_FILTRO else None)
+    registradas = (registradas[["ID_Activo", "Codigo_Amenaza", "Degradacion_D", "Degradacion_I", "Degradacion_C"]]
+                   .rename(columns={"Codigo_Amenaza": "codigo"}))
+    pares = pares.merge(registradas, on=["ID_Activo", "codigo"], how="left")
+
+    sin_degradacion = pares["Degradacion_D"].isna().to_numpy()
+    if not sin_degradacion.any():
+        return pares
+
+    claves = ["Tipo_Activo", "codigo", "tipo_amenaza"]
+    faltantes = pares.loc[sin_degradacion, claves].fillna("")
+    sugerencias = [_sugerencia(t, c, ta) for t, c, ta in zip(
+        faltantes["Tipo_Activo"], faltantes["codigo"], faltantes["tipo_amenaza"])]
+    for posicion, dim in enumerate("DIC"):
+        pares.loc[sin_degradacion, f"Degradacion_{dim}"] = [s[posicion] for s in sugerencias]
+
+    if guardar:
+        nuevas = pares.loc[sin_degradacion, ["ID_Activo", "codigo", "Degradacion_D", "Degradacion_I",
+                                            "Degradacion_C"]].rename(columns={"codigo": "Codigo_Amenaza"})
+        nuevas["Justificacion"] = [s[3] for s in sugerencias]
+        nuevas["Fuente"] = [s[4] for s in sugerencias]
+        nuevas = nuevas.drop_duplicates(["ID_Activo", "Codigo_Amenaza"])
+        nuevas.insert(0, "ID_Evaluacion", eval_id)
+        nuevas["Fecha_Registro"] = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        upsert_rows("DEGRADACION_AMENAZAS", nuevas.to_dict("records"),
+                    ["ID_Evaluacion", "ID_Activo", "Codigo_Amenaza"])
+    return pares
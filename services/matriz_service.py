@@ -18,11 +18,17 @@ Escalas:
 - Riesgo: Frecuencia × Impacto
 """
 import sqlite3
+import time
 import pandas as pd
 import datetime as dt
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable
 from dataclasses import dataclass
-from services.database_service import get_connection, DB_PATH
+from services.database_service import (
+    get_connection, write_transaction, insert_rows, upsert_rows, delete_rows, query_rows,
+    ResultadoEscritura, BULK_CHUNK_SIZE, DB_PATH
+)
+from services.cuestionario_dic_service import calcular_frecuencias_evaluacion
+from services.recalculo_incremental_service import marcar_sucio
 
 # ==================== CONSTANTES (ESCALAS) ====================
 
@@ -81,6 +87,16 @@ LIMITE_RIESGO = 7.0
 FACTOR_REDUCCION = 0.5
 
 
+def _filtro_activos(ids_activos: Optional[List[str]], alias: str = "") -> Tuple[str, list]:
+    """Cláusula ' AND ID_Activo IN (...)' para limitar un recálculo a ciertos activos"""
+    if ids_activos is None:
+        return "", []
+    ids_activos = list(ids_activos)
+    if not ids_activos:
+        return " AND 0", []
+    return f" AND {alias}ID_Activo IN ({', '.join('?' for _ in ids_activos)})", ids_activos
+
+
 # ==================== INICIALIZACIÓN ====================
 
 def init_matriz_tables():
@@ -225,8 +241,6 @@ def init_matriz_tables():
             )
         ''')
         
-        conn.commit()
-        
     # Poblar criterios de referencia si no existen
     _poblar_criterios_referencia()
 
@@ -276,7 +290,6 @@ def _poblar_criterios_referencia():
                 VALUES (?, ?, ?, ?)
             ''', ("Frecuencia", item["nivel"], item["valor"], item["descripcion"]))
         
-        conn.commit()
 
 
 # ==================== CRITERIOS DE VALORACIÓN ====================
@@ -395,7 +408,7 @@ def guardar_valoracion_dic(
                 dt.datetime.now().isoformat()
             ))
         
-        conn.commit()
+        marcar_sucio(id_evaluacion, "IDENTIFICACION_VALORACION", [id_activo])
     
     return True
 
@@ -467,10 +480,60 @@ def agregar_vulnerabilidad_amenaza(
             deg_d, deg_i, deg_c, impacto,
             dt.datetime.now().isoformat()
         ))
-        conn.commit()
+        marcar_sucio(id_evaluacion, "VULNERABILIDADES_AMENAZAS", [id_activo])
         return cursor.lastrowid
 
 
+def agregar_vulnerabilidades_amenazas(
+    id_evaluacion: str,
+    id_activo: str,
+    nombre_activo: str,
+    amenazas: List[Dict],
+    reemplazar: bool = False
+) -> ResultadoEscritura:
+    """
+    Agrega en bloque las vulnerabilidades-amenazas de un activo.
+    
+    Cada elemento de amenazas usa las claves de agregar_vulnerabilidad_amenaza
+    (vulnerabilidad, amenaza, cod_amenaza, cod_vulnerabilidad, deg_d, deg_i, deg_c).
+    La criticidad se lee una sola vez y, con reemplazar=True, el borrado de las
+    amenazas previas y la inserción ocurren en la misma transacción.
+    """
+    valoracion = get_valoracion_activo(id_evaluacion, id_activo)
+    criticidad = valoracion["Criticidad"] if valoracion else 0
+    fecha = dt.datetime.now().isoformat()
+    
+    filas = []
+    for am in amenazas:
+        deg_d = am.get("deg_d", 0.0)
+        deg_i = am.get("deg_i", 0.0)
+        deg_c = am.get("deg_c", 0.0)
+        filas.append({
+            "ID_Evaluacion": id_evaluacion,
+            "ID_Activo": id_activo,
+            "Nombre_Activo": nombre_activo,
+            "Criticidad": criticidad,
+            "Vulnerabilidad": am.get("vulnerabilidad", ""),
+            "Cod_Vulnerabilidad": am.get("cod_vulnerabilidad", ""),
+            "Amenaza": am.get("amenaza", ""),
+            "Cod_Amenaza": am.get("cod_amenaza", ""),
+            "Degradacion_D": deg_d,
+            "Degradacion_I": deg_i,
+            "Degradacion_C": deg_c,
+            "Impacto": criticidad * max(deg_d, deg_i, deg_c),
+            "Fecha_Registro": fecha
+        })
+    
+    with write_transaction() as conn:
+        if reemplazar:
+            conn.execute(
+                "DELETE FROM VULNERABILIDADES_AMENAZAS WHERE ID_Evaluacion = ? AND ID_Activo = ?",
+                (id_evaluacion, id_activo)
+            )
+        marcar_sucio(id_evaluacion, "VULNERABILIDADES_AMENAZAS", [id_activo])
+        return insert_rows("VULNERABILIDADES_AMENAZAS", filas)
+
+
 def actualizar_vulnerabilidad_amenaza(
     id_va: int,
     vulnerabilidad: str = None,
@@ -510,7 +573,7 @@ def actualizar_vulnerabilidad_amenaza(
             WHERE id = ?
         ''', (vulnerabilidad, amenaza, deg_d, deg_i, deg_c, impacto, id_va))
         
-        conn.commit()
+        marcar_sucio(current["ID_Evaluacion"], "VULNERABILIDADES_AMENAZAS", [current["ID_Activo"]])
     return True
 
 
@@ -518,9 +581,36 @@ def eliminar_vulnerabilidad_amenaza(id_va: int) -> bool:
     """Elimina una vulnerabilidad-amenaza"""
     with get_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute("SELECT ID_Evaluacion, ID_Activo FROM VULNERABILIDADES_AMENAZAS WHERE id = ?", (id_va,))
+        row = cursor.fetchone()
+        if not row:
+            return False
         cursor.execute("DELETE FROM VULNERABILIDADES_AMENAZAS WHERE id = ?", (id_va,))
-        conn.commit()
-        return cursor.rowcount > 0
+        marcar_sucio(row["ID_Evaluacion"], "VULNERABILIDADES_AMENAZAS", [row["ID_Activo"]])
+        return True
+
+
+def actualizar_impactos_vulnerabilidades(id_evaluacion: str, ids_activos: List[str] = None) -> int:
+    """
+    Propaga la criticidad vigente (IDENTIFICACION_VALORACION) a Criticidad e
+    Impacto = CRITICIDAD × MAX(Deg_D, Deg_I, Deg_C) de las amenazas de esos activos.
+    
+    Returns:
+        Número de amenazas actualizadas
+    """
+    criticidad = """COALESCE((SELECT iv.Criticidad FROM IDENTIFICACION_VALORACION iv
+                              WHERE iv.ID_Evaluacion = VULNERABILIDADES_AMENAZAS.ID_Evaluacion
+                                AND iv.ID_Activo = VULNERABILIDADES_AMENAZAS.ID_Activo), 0)"""
+    filtro, params = _filtro_activos(ids_activos)
+    with write_transaction() as conn:
+        cursor = conn.execute(f'''
+            UPDATE VULNERABILIDADES_AMENAZAS SET
+                Criticidad = {criticidad},
+                Impacto = {criticidad} * MAX(COALESCE(Degradacion_D, 0), COALESCE(Degradacion_I, 0),
+                                             COALESCE(Degradacion_C, 0))
+            WHERE ID_Evaluacion = ?{filtro}
+        ''', [id_evaluacion] + params)
+        return cursor.rowcount
 
 
 def get_vulnerabilidades_activo(id_evaluacion: str, id_activo: str) -> pd.DataFrame:
@@ -604,10 +694,109 @@ def calcular_riesgo_amenaza(
                 dt.datetime.now().isoformat()
             ))
         
-        conn.commit()
+        marcar_sucio(id_evaluacion, "RIESGO_AMENAZA", [id_activo])
         return riesgo
 
 
+@dataclass
+class ResultadoRecalculoRiesgos:
+    """Resumen de un recálculo en bloque de RIESGO_AMENAZA"""
+    id_evaluacion: str
+    riesgos: int = 0
+    activos: int = 0
+    segundos_calculo: float = 0.0
+    segundos_escritura: float = 0.0
+
+    @property
+    def segundos(self) -> float:
+        return self.segundos_calculo + self.segundos_escritura
+
+    @property
+    def riesgos_por_segundo(self) -> float:
+        return self.riesgos / self.segundos if self.segundos > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.riesgos} riesgos de {self.activos} activos en {self.segundos:.2f} s "
+                f"({self.riesgos_por_segundo:,.0f} riesgos/s)")
+
+
+def recalcular_riesgos_evaluacion(
+    id_evaluacion: str,
+    ids_activos: List[str] = None,
+    reemplazar: bool = False,
+    progreso: Callable[[int, int], None] = None,
+    chunk_size: int = None
+) -> ResultadoRecalculoRiesgos:
+    """
+    Calcula frecuencia y riesgo (Frecuencia × Impacto) de todas las amenazas
+    de una evaluación en una sola pasada y guarda RIESGO_AMENAZA con un upsert
+    transaccional, en lugar de calcular_riesgo_amenaza amenaza por amenaza.
+    
+    Args:
+        id_evaluacion: ID de la evaluación
+        ids_activos: Limitar a estos activos (None = todos)
+        reemplazar: Elimina además los riesgos de esos activos cuya amenaza ya no existe
+        progreso: Callback (riesgos_guardados, total) al terminar el cálculo y tras
+            confirmar cada bloque; se llama fuera de la transacción para no
+            retener el lock de escritura mientras la UI se actualiza
+        chunk_size: Filas por bloque de escritura (una transacción por bloque)
+    """
+    resultado = ResultadoRecalculoRiesgos(id_evaluacion=id_evaluacion)
+    
+    t0 = time.perf_counter()
+    frecuencias = calcular_frecuencias_evaluacion(id_evaluacion, ids_activos)
+    fecha = dt.datetime.now().isoformat()
+    filas = [{
+        "ID_Evaluacion": id_evaluacion,
+        "ID_Activo": id_activo,
+        "Nombre_Activo": nombre,
+        "ID_Vulnerabilidad_Amenaza": id_va,
+        "Amenaza": amenaza,
+        "Frecuencia": frecuencia,
+        "Frecuencia_Nivel": nivel,
+        "Impacto": impacto,
+        "Riesgo": frecuencia * impacto,
+        "Fecha_Calculo": fecha
+    } for id_activo, nombre, id_va, amenaza, frecuencia, nivel, impacto in zip(
+        frecuencias["ID_Activo"].tolist(), frecuencias["Nombre_Activo"].tolist(),
+        frecuencias["id_va"].tolist(), frecuencias["Amenaza"].tolist(),
+        frecuencias["Frecuencia"].tolist(), frecuencias["Frecuencia_Nivel"].tolist(),
+        frecuencias["Impacto"].tolist()
+    )]
+    resultado.riesgos = len(filas)
+    resultado.activos = frecuencias["ID_Activo"].nunique()
+    resultado.segundos_calculo = time.perf_counter() - t0
+    if progreso:
+        progreso(0, len(filas))
+    
+    t0 = time.perf_counter()
+    chunk_size = chunk_size or BULK_CHUNK_SIZE
+    for inicio in range(0, len(filas), chunk_size):
+        bloque = filas[inicio:inicio + chunk_size]
+        # El upsert por fila es idempotente: cada bloque se confirma por separado
+        with write_transaction():
+            upsert_rows(
+                "RIESGO_AMENAZA", bloque, ["ID_Vulnerabilidad_Amenaza"],
+                update_columns=["Frecuencia", "Frecuencia_Nivel", "Impacto", "Riesgo", "Fecha_Calculo"]
+            )
+            marcar_sucio(id_evaluacion, "RIESGO_AMENAZA", {fila["ID_Activo"] for fila in bloque})
+        if progreso:
+            progreso(inicio + len(bloque), len(filas))
+    if reemplazar:
+        # Tras el upsert solo quedan por borrar los riesgos de amenazas eliminadas
+        filtros = {"ID_Evaluacion": id_evaluacion}
+        if ids_activos is not None:
+            filtros["ID_Activo"] = list(ids_activos)
+        with write_transaction():
+            existentes = query_rows("RIESGO_AMENAZA", filtros, columns=["id", "ID_Activo", "ID_Vulnerabilidad_Amenaza"])
+            obsoletos = existentes[~existentes["ID_Vulnerabilidad_Amenaza"].isin(frecuencias["id_va"].tolist())]
+            if not obsoletos.empty:
+                delete_rows("RIESGO_AMENAZA", {"id": obsoletos["id"].tolist()})
+                marcar_sucio(id_evaluacion, "RIESGO_AMENAZA", set(obsoletos["ID_Activo"]))
+    resultado.segundos_escritura = time.perf_counter() - t0
+    return resultado
+
+
 def get_riesgos_activo(id_evaluacion: str, id_activo: str) -> pd.DataFrame:
     """Obtiene todos los riesgos calculados de un activo"""
     query = """
@@ -653,6 +842,17 @@ def get_riesgos_evaluacion(id_evaluacion: str) -> pd.DataFrame:
 
 # ==================== MAPA DE RIESGOS ====================
 
+def _zona_riesgo(riesgo_val: float) -> str:
+    """Zona del mapa de riesgos según el valor de riesgo"""
+    if riesgo_val >= 6:
+        return "Crítico"
+    elif riesgo_val >= 4:
+        return "Alto"
+    elif riesgo_val >= 2:
+        return "Medio"
+    return "Bajo"
+
+
 def generar_mapa_riesgos(id_evaluacion: str) -> pd.DataFrame:
     """Genera el mapa de riesgos (Impacto vs Frecuencia) para visualización"""
     with get_connection() as conn:
@@ -670,17 +870,7 @@ def generar_mapa_riesgos(id_evaluacion: str) -> pd.DataFrame:
         # Generar nuevo mapa
         for idx, row in riesgos.iterrows():
             riesgo_id = f"R{idx + 1}"
-            
-            # Determinar zona de riesgo
-            riesgo_val = row["Riesgo"]
-            if riesgo_val >= 6:
-                zona = "Crítico"
-            elif riesgo_val >= 4:
-                zona = "Alto"
-            elif riesgo_val >= 2:
-                zona = "Medio"
-            else:
-                zona = "Bajo"
+            zona = _zona_riesgo(row["Riesgo"])
             
             cursor.execute('''
                 INSERT INTO MAPA_RIESGOS 
@@ -693,12 +883,57 @@ def generar_mapa_riesgos(id_evaluacion: str) -> pd.DataFrame:
                 dt.datetime.now().isoformat()
             ))
         
-        conn.commit()
     
     # Retornar el mapa generado
     return get_mapa_riesgos(id_evaluacion)
 
 
+def actualizar_mapa_riesgos(id_evaluacion: str, ids_activos: List[str]) -> int:
+    """
+    Reemplaza en MAPA_RIESGOS solo las filas de esos activos y renumera los
+    Riesgo_ID (mismo orden que generar_mapa_riesgos: riesgo descendente).
+    
+    Returns:
+        Número de filas del mapa regeneradas
+    """
+    filtro, params = _filtro_activos(ids_activos, alias="r.")
+    query = f"""
+        SELECT r.ID_Activo, r.Nombre_Activo, r.Impacto, r.Frecuencia, r.Amenaza, r.Riesgo
+        FROM RIESGO_AMENAZA r
+        JOIN VULNERABILIDADES_AMENAZAS va ON r.ID_Vulnerabilidad_Amenaza = va.id
+        WHERE r.ID_Evaluacion = ?{filtro}
+    """
+    fecha = dt.datetime.now().isoformat()
+    with write_transaction() as conn:
+        filas = [{
+            "ID_Evaluacion": id_evaluacion,
+            "Riesgo_ID": "",
+            "ID_Activo": row["ID_Activo"],
+            "Nombre_Activo": row["Nombre_Activo"],
+            "Impacto": row["Impacto"],
+            "Frecuencia": row["Frecuencia"],
+            "Descripcion_Amenaza": row["Amenaza"],
+            "Zona_Riesgo": _zona_riesgo(row["Riesgo"]),
+            "Fecha_Registro": fecha
+        } for row in conn.execute(query, [id_evaluacion] + params).fetchall()]
+        
+        filtro_mapa, params_mapa = _filtro_activos(ids_activos)
+        conn.execute(f"DELETE FROM MAPA_RIESGOS WHERE ID_Evaluacion = ?{filtro_mapa}", [id_evaluacion] + params_mapa)
+        insert_rows("MAPA_RIESGOS", filas)
+        
+        # Solo se reescriben los Riesgo_ID que cambian de posición
+        conn.execute('''
+            WITH orden AS (
+                SELECT id, 'R' || ROW_NUMBER() OVER (ORDER BY Impacto * Frecuencia DESC, id) AS nuevo_id
+                FROM MAPA_RIESGOS WHERE ID_Evaluacion = ?
+            )
+            UPDATE MAPA_RIESGOS SET Riesgo_ID = orden.nuevo_id
+            FROM orden
+            WHERE MAPA_RIESGOS.id = orden.id AND MAPA_RIESGOS.Riesgo_ID != orden.nuevo_id
+        ''', (id_evaluacion,))
+    return len(filas)
+
+
 def get_mapa_riesgos(id_evaluacion: str) -> pd.DataFrame:
     """Obtiene el mapa de riesgos de una evaluación"""
     query = """
@@ -733,13 +968,7 @@ def calcular_riesgo_activo(id_evaluacion: str, id_activo: str) -> Dict:
     
     riesgo_actual = riesgos["Riesgo"].mean()
     riesgo_objetivo = riesgo_actual * FACTOR_REDUCCION
-    
-    if riesgo_actual > LIMITE_RIESGO:
-        estado = "Tratamiento Urgente"
-    elif riesgo_actual > LIMITE_RIESGO * 0.7:
-        estado = "Atención Requerida"
-    else:
-        estado = "Aceptable"
+    estado = _estado_riesgo_activo(riesgo_actual)
     
     # Guardar en BD
     with get_connection() as conn:
@@ -783,7 +1012,7 @@ def calcular_riesgo_activo(id_evaluacion: str, id_activo: str) -> Dict:
                 dt.datetime.now().isoformat()
             ))
         
-        conn.commit()
+        marcar_sucio(id_evaluacion, "RIESGO_ACTIVOS", [id_activo])
     
     return {
         "riesgo_actual": riesgo_actual,
@@ -806,17 +1035,64 @@ def get_riesgos_activos_evaluacion(id_evaluacion: str) -> pd.DataFrame:
     return df
 
 
+def _estado_riesgo_activo(riesgo_actual: float) -> str:
+    if riesgo_actual > LIMITE_RIESGO:
+        return "Tratamiento Urgente"
+    elif riesgo_actual > LIMITE_RIESGO * 0.7:
+        return "Atención Requerida"
+    return "Aceptable"
+
+
+def actualizar_riesgos_activos(id_evaluacion: str, ids_activos: List[str] = None) -> int:
+    """
+    Versión por conjuntos de calcular_riesgo_activo: agrega en SQL los riesgos
+    de esos activos y guarda RIESGO_ACTIVOS con un único upsert. Los activos
+    que ya no tienen riesgos pierden su fila agregada.
+    
+    Returns:
+        Número de activos agregados
+    """
+    filtro, params = _filtro_activos(ids_activos, alias="r.")
+    query = f"""
+        SELECT r.ID_Activo,
+               COALESCE((SELECT a.Nombre_Activo FROM INVENTARIO_ACTIVOS a
+                         WHERE a.ID_Activo = r.ID_Activo AND a.ID_Evaluacion = ?), '') AS Nombre_Activo,
+               AVG(r.Riesgo) AS Riesgo_Actual,
+               COUNT(*) AS Num_Amenazas
+        FROM RIESGO_AMENAZA r
+        JOIN VULNERABILIDADES_AMENAZAS va ON r.ID_Vulnerabilidad_Amenaza = va.id
+        WHERE r.ID_Evaluacion = ?{filtro}
+        GROUP BY r.ID_Activo
+    """
+    fecha = dt.datetime.now().isoformat()
+    with write_transaction() as conn:
+        filas = [{
+            "ID_Evaluacion": id_evaluacion,
+            "ID_Activo": row["ID_Activo"],
+            "Nombre_Activo": row["Nombre_Activo"],
+            "Riesgo_Actual": row["Riesgo_Actual"],
+            "Riesgo_Objetivo": row["Riesgo_Actual"] * FACTOR_REDUCCION,
+            "Limite": LIMITE_RIESGO,
+            "Estado": _estado_riesgo_activo(row["Riesgo_Actual"]),
+            "Num_Amenazas": row["Num_Amenazas"],
+            "Fecha_Calculo": fecha
+        } for row in conn.execute(query, [id_evaluacion, id_evaluacion] + params).fetchall()]
+        
+        if ids_activos is not None:
+            sin_riesgos = set(ids_activos) - {f["ID_Activo"] for f in filas}
+            if sin_riesgos:
+                delete_rows("RIESGO_ACTIVOS", {"ID_Evaluacion": id_evaluacion, "ID_Activo": list(sin_riesgos)})
+        upsert_rows("RIESGO_ACTIVOS", filas, ["ID_Evaluacion", "ID_Activo"])
+        marcar_sucio(id_evaluacion, "RIESGO_ACTIVOS", [f["ID_Activo"] for f in filas])
+    return len(filas)
+
+
 def recalcular_todos_riesgos_activos(id_evaluacion: str) -> int:
     """Recalcula el riesgo de todos los activos de una evaluación"""
-    # Obtener todos los activos con valoración
+    # Activos con valoración
     valoraciones = get_valoraciones_evaluacion(id_evaluacion)
-    
-    count = 0
-    for _, val in valoraciones.iterrows():
-        calcular_riesgo_activo(id_evaluacion, val["ID_Activo"])
-        count += 1
-    
-    return count
+    actualizar_riesgos_activos(id_evaluacion, valoraciones["ID_Activo"].tolist())
+    return len(valoraciones)
 
 
 # ==================== SALVAGUARDAS ====================
@@ -848,10 +1124,48 @@ def agregar_salvaguarda(
             "Pendiente", responsable, fecha_limite,
             dt.datetime.now().isoformat()
         ))
-        conn.commit()
         return cursor.lastrowid
 
 
+def guardar_salvaguardas_sugeridas(id_evaluacion: str, sugeridas: pd.DataFrame,
+                                   id_activo: str = None) -> int:
+    """
+    Persiste en una sola transacción el resultado de sugerir_salvaguardas_batch.
+
+    Sustituye las sugerencias automáticas previas de la evaluación (o del
+    activo) que siguen pendientes; las registradas a mano (Origen NULL) y las
+    que el usuario ya cambió de estado (p.ej. Implementada) se conservan, y
+    no se vuelven a insertar como pendientes.
+    """
+    fecha = dt.datetime.now().isoformat()
+    filas = [
+        {"ID_Evaluacion": id_evaluacion, "ID_Activo": activo, "Nombre_Activo": nombre, "Riesgo_ID": str(riesgo_id),
+         "Vulnerabilidad": vulnerabilidad, "Amenaza": amenaza, "Salvaguarda": salvaguarda, "Control_ISO": control,
+         "Prioridad": "Alta" if riesgo >= 6 else "Media" if riesgo >= 4 else "Baja", "Estado": "Pendiente",
+         "Origen": "ia" if generado == "✅" else "heuristica", "Fecha_Registro": fecha}
+        for activo, nombre, riesgo_id, vulnerabilidad, amenaza, salvaguarda, control, riesgo, generado in zip(
+            *(sugeridas[c].tolist() for c in ("ID_Activo", "Nombre_Activo", "id", "Vulnerabilidad", "Amenaza",
+                                              "Salvaguarda_Sugerida", "Control_ISO", "Riesgo", "Generado_IA")))
+    ]
+    condiciones = {"ID_Evaluacion": id_evaluacion}
+    if id_activo:
+        condiciones["ID_Activo"] = id_activo
+    filtro = "".join(f" AND {columna} = ?" for columna in condiciones)
+    params = list(condiciones.values())
+    with write_transaction() as conn:
+        conn.execute(f"""
+            DELETE FROM SALVAGUARDAS
+            WHERE Origen IS NOT NULL AND COALESCE(Estado, 'Pendiente') = 'Pendiente'{filtro}
+        """, params)
+        conservadas = {tuple(fila) for fila in conn.execute(f"""
+            SELECT ID_Activo, Riesgo_ID, Amenaza, Salvaguarda FROM SALVAGUARDAS
+            WHERE Origen IS NOT NULL{filtro}
+        """, params)}
+        filas = [f for f in filas
+                 if (f["ID_Activo"], f["Riesgo_ID"], f["Amenaza"], f["Salvaguarda"]) not in conservadas]
+        return insert_rows("SALVAGUARDAS", filas).filas
+
+
 def actualizar_estado_salvaguarda(id_salvaguarda: int, estado: str) -> bool:
     """Actualiza el estado de una salvaguarda"""
     with get_connection() as conn:
@@ -859,7 +1173,6 @@ def actualizar_estado_salvaguarda(id_salvaguarda: int, estado: str) -> bool:
         cursor.execute('''
             UPDATE SALVAGUARDAS SET Estado = ? WHERE id = ?
         ''', (estado, id_salvaguarda))
-        conn.commit()
         return cursor.rowcount > 0
 
 
@@ -868,7 +1181,6 @@ def eliminar_salvaguarda(id_salvaguarda: int) -> bool:
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM SALVAGUARDAS WHERE id = ?", (id_salvaguarda,))
-        conn.commit()
         return cursor.rowcount > 0
 
 
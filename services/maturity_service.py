@@ -16,10 +16,12 @@ Niveles de Madurez (basado en CMMI/ISO):
 5 - Optimizado: Mejora continua, controles automatizados
 """
 import json
+import sqlite3
 import pandas as pd
 from typing import Dict, List, Tuple, Optional
 from dataclasses import dataclass, asdict
-from services.database_service import read_table, get_connection
+from services.database_service import read_table, get_connection, query_rows, write_transaction
+from services.version_datos_service import version_evaluacion
 
 
 # ==================== MODELOS DE DATOS ====================
@@ -346,6 +348,117 @@ def analizar_controles_desde_respuestas(respuestas: pd.DataFrame) -> Dict:
 
 # ==================== CÁLCULO DE MADUREZ ====================
 
+# Agregados de la evaluación de los que se deriva la madurez, en el orden de
+# sus columnas en RESULTADOS_MADUREZ (snapshot de la migración v14)
+COLUMNAS_AGREGADOS = {
+    "total_activos": "Total_Activos",
+    "activos_valorados": "Activos_Valorados",
+    "total_riesgos": "Total_Riesgos",
+    "riesgos_altos": "Riesgos_Altos",
+    "riesgos_medios": "Riesgos_Medios",
+    "riesgos_bajos": "Riesgos_Bajos",
+    "riesgo_promedio": "Riesgo_Promedio",
+    "riesgo_maximo": "Riesgo_Maximo",
+    "total_salvaguardas": "Total_Salvaguardas",
+    "salvaguardas_implementadas": "Salvaguardas_Implementadas",
+}
+
+
+@dataclass
+class AgregadosMadurez:
+    """Conteos de la evaluación usados por ambas fórmulas de madurez (Tab 9 y Tab 10)"""
+    total_activos: int
+    activos_valorados: int
+    total_riesgos: int
+    riesgos_altos: int      # >= 6
+    riesgos_medios: int     # 4-5.99
+    riesgos_bajos: int      # < 4
+    riesgo_promedio: float
+    riesgo_maximo: float
+    total_salvaguardas: int
+    salvaguardas_implementadas: int
+
+
+def calcular_agregados_madurez(eval_id: str) -> AgregadosMadurez:
+    """
+    Todos los agregados en una consulta: conteos, riesgos por nivel (CASE),
+    promedio y máximo de RIESGO_AMENAZA y salvaguardas implementadas.
+    """
+    with get_connection() as conn:
+        fila = conn.execute('''
+            SELECT
+                (SELECT COUNT(*) FROM INVENTARIO_ACTIVOS WHERE ID_Evaluacion = :eval),
+                (SELECT COUNT(*) FROM IDENTIFICACION_VALORACION WHERE ID_Evaluacion = :eval),
+                r.total, r.altos, r.medios, r.bajos, r.promedio, r.maximo,
+                s.total, s.implementadas
+            FROM (
+                SELECT COUNT(*) AS total,
+                       COALESCE(SUM(CASE WHEN COALESCE(Riesgo, 0) >= 6 THEN 1 ELSE 0 END), 0) AS altos,
+                       COALESCE(SUM(CASE WHEN COALESCE(Riesgo, 0) >= 4
+                                          AND COALESCE(Riesgo, 0) < 6 THEN 1 ELSE 0 END), 0) AS medios,
+                       COALESCE(SUM(CASE WHEN COALESCE(Riesgo, 0) < 4 THEN 1 ELSE 0 END), 0) AS bajos,
+                       COALESCE(AVG(COALESCE(Riesgo, 0)), 0) AS promedio,
+                       COALESCE(MAX(Riesgo), 0) AS maximo
+                FROM RIESGO_AMENAZA WHERE ID_Evaluacion = :eval
+            ) r, (
+                SELECT COUNT(*) AS total,
+                       COALESCE(SUM(CASE WHEN instr(lower(COALESCE(Estado, '')), 'implementada') > 0
+                                         THEN 1 ELSE 0 END), 0) AS implementadas
+                FROM SALVAGUARDAS WHERE ID_Evaluacion = :eval
+            ) s
+        ''', {"eval": eval_id}).fetchone()
+    return AgregadosMadurez(*fila)
+
+
+def _snapshot_vigente(eval_id: str, version: int) -> Optional[AgregadosMadurez]:
+    """Agregados guardados en RESULTADOS_MADUREZ si se calcularon con esta versión de datos"""
+    if version < 0:
+        return None
+    try:
+        with get_connection() as conn:
+            fila = conn.execute(
+                f"SELECT {', '.join(COLUMNAS_AGREGADOS.values())} FROM RESULTADOS_MADUREZ "
+                "WHERE ID_Evaluacion = ? AND Version_Datos = ?",
+                [eval_id, version]
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    if fila is None or any(valor is None for valor in fila):
+        return None
+    return AgregadosMadurez(*fila)
+
+
+def _guardar_snapshot(eval_id: str, agregados: AgregadosMadurez, version: int):
+    """Actualiza los agregados del resultado guardado (sin crear uno: el resultado lo guarda la UI)"""
+    if version < 0:
+        return
+    asignaciones = ", ".join(f"{columna} = ?" for columna in COLUMNAS_AGREGADOS.values())
+    try:
+        with write_transaction() as conn:
+            conn.execute(
+                f"UPDATE RESULTADOS_MADUREZ SET {asignaciones}, Version_Datos = ? WHERE ID_Evaluacion = ?",
+                [*asdict(agregados).values(), version, eval_id]
+            )
+    except sqlite3.Error:
+        return
+
+
+def obtener_agregados_madurez(eval_id: str) -> Tuple[AgregadosMadurez, int]:
+    """
+    Agregados de la evaluación y versión de datos con la que corresponden.
+    Se leen del snapshot de RESULTADOS_MADUREZ si la versión no cambió; si
+    no, se recalculan (una consulta) y se actualiza el snapshot.
+    """
+    # La versión se lee antes de agregar: una escritura intermedia deja el
+    # snapshot con una versión vieja y fuerza otro cálculo, nunca al revés
+    version = version_evaluacion(eval_id)
+    agregados = _snapshot_vigente(eval_id, version)
+    if agregados is None:
+        agregados = calcular_agregados_madurez(eval_id)
+        _guardar_snapshot(eval_id, agregados, version)
+    return agregados, version
+
+
 def calcular_madurez_evaluacion(eval_id: str, considerar_salvaguardas: bool = False) -> Optional[ResultadoMadurez]:
     """
     Calcula el nivel de madurez de gestión de riesgos basado en datos REALES.
@@ -356,6 +469,34 @@ def calcular_madurez_evaluacion(eval_id: str, considerar_salvaguardas: bool = Fa
         * False (default) = Madurez ACTUAL/INHERENTE (Tab 9) - solo riesgos identificados
         * True = Madurez CON CONTROLES (Tab 10) - considera salvaguardas implementadas
     
+    Los agregados salen de obtener_agregados_madurez(): mientras los datos de
+    la evaluación no cambien, los renders del dashboard no consultan las tablas.
+    
+    Returns:
+        ResultadoMadurez o None si no hay datos suficientes
+    """
+    try:
+        agregados, version = obtener_agregados_madurez(eval_id)
+        resultado = puntuar_madurez(eval_id, agregados, considerar_salvaguardas)
+        if resultado is not None:
+            resultado.agregados = agregados
+            resultado.version_datos = version
+        return resultado
+    except Exception as e:
+        print(f"Error calculando madurez: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def puntuar_madurez(
+    eval_id: str,
+    agregados: AgregadosMadurez,
+    considerar_salvaguardas: bool = False
+) -> Optional[ResultadoMadurez]:
+    """
+    Puntuación y nivel de madurez a partir de los agregados.
+    
     FÓRMULA Tab 9 (sin salvaguardas - estado actual):
     - 60% -> Nivel de riesgo (% de riesgos en zona BAJA vs ALTA)
     - 40% -> Riesgo máximo/promedio (severidad del peor caso)
@@ -364,217 +505,154 @@ def calcular_madurez_evaluacion(eval_id: str, considerar_salvaguardas: bool = Fa
     - 40% -> Nivel de riesgo controlado
     - 35% -> Salvaguardas implementadas
     - 25% -> Riesgo residual bajo
-    
-    Returns:
-        ResultadoMadurez o None si no hay datos suficientes
     """
-    try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # 1. Total de activos en la evaluación
-            cursor.execute(
-                "SELECT COUNT(*) FROM INVENTARIO_ACTIVOS WHERE ID_Evaluacion = ?",
-                [eval_id]
-            )
-            total_activos = cursor.fetchone()[0]
-            
-            if total_activos == 0:
-                return None
-            
-            # 2. Activos con valoración DIC completa
-            cursor.execute(
-                "SELECT COUNT(*) FROM IDENTIFICACION_VALORACION WHERE ID_Evaluacion = ?",
-                [eval_id]
-            )
-            activos_valorados = cursor.fetchone()[0]
-            
-            # 3. Total de riesgos y distribución por nivel
-            cursor.execute(
-                "SELECT Riesgo FROM RIESGO_AMENAZA WHERE ID_Evaluacion = ?",
-                [eval_id]
-            )
-            riesgos_rows = cursor.fetchall()
-            total_riesgos = len(riesgos_rows)
-            
-            if total_riesgos == 0:
-                # Sin riesgos identificados = madurez muy baja
-                return ResultadoMadurez(
-                    id_evaluacion=eval_id,
-                    puntuacion_total=10.0,
-                    nivel_madurez=1,
-                    nombre_nivel="Inicial",
-                    dominio_organizacional=0,
-                    dominio_personas=0,
-                    dominio_fisico=0,
-                    dominio_tecnologico=0,
-                    pct_controles_implementados=0,
-                    pct_controles_medidos=0,
-                    pct_riesgos_criticos_mitigados=0,
-                    pct_activos_evaluados=0,
-                    total_controles_posibles=total_activos,
-                    controles_implementados=0,
-                    controles_parciales=0,
-                    controles_no_implementados=total_activos
-                )
-            
-            # Clasificar riesgos por nivel
-            riesgos_altos = 0      # >= 6
-            riesgos_medios = 0     # 4-5.99
-            riesgos_bajos = 0      # < 4
-            suma_riesgos = 0
-            
-            for row in riesgos_rows:
-                riesgo = row[0] or 0
-                suma_riesgos += riesgo
-                if riesgo >= 6:
-                    riesgos_altos += 1
-                elif riesgo >= 4:
-                    riesgos_medios += 1
-                else:
-                    riesgos_bajos += 1
-            
-            riesgo_promedio = suma_riesgos / total_riesgos if total_riesgos > 0 else 0
-            
-            # 4. Salvaguardas y su estado de implementación
-            cursor.execute(
-                "SELECT Estado FROM SALVAGUARDAS WHERE ID_Evaluacion = ?",
-                [eval_id]
-            )
-            salvaguardas_rows = cursor.fetchall()
-            total_salvaguardas = len(salvaguardas_rows)
-            
-            salvaguardas_implementadas = 0
-            for row in salvaguardas_rows:
-                estado = row[0] or ""
-                if "Implementada" in estado or "implementada" in estado.lower():
-                    salvaguardas_implementadas += 1
-            
-            # ===== OBTENER RIESGO MÁXIMO =====
-            cursor.execute(
-                "SELECT MAX(Riesgo) FROM RIESGO_AMENAZA WHERE ID_Evaluacion = ?",
-                [eval_id]
-            )
-            riesgo_maximo = cursor.fetchone()[0] or 0
-            
-            # ===== CÁLCULO DE COMPONENTES (DIFERENTE SEGÚN MODO) =====
-            
-            if not considerar_salvaguardas:
-                # ========================================
-                # TAB 9: MADUREZ ACTUAL/INHERENTE
-                # Solo considera los riesgos, NO las salvaguardas
-                # Representa el estado ANTES de aplicar controles
-                # ========================================
-                
-                # Componente 1 (60%): Distribución de riesgos
-                # Penalización severa por riesgos ALTOS
-                if riesgos_altos > 0:
-                    proporcion_altos = riesgos_altos / total_riesgos
-                    # Cada riesgo ALTO resta mucho - 25% altos = 0 puntos
-                    factor_penalizacion = max(0, 1 - (proporcion_altos * 4))
-                    pct_riesgos_controlados = (riesgos_bajos / total_riesgos * 100) * factor_penalizacion
-                else:
-                    pct_riesgos_controlados = (riesgos_bajos / total_riesgos * 100) if total_riesgos > 0 else 0
-                
-                # Componente 2 (40%): Severidad del riesgo (usar máximo)
-                riesgo_efectivo = riesgo_maximo * 0.8 + riesgo_promedio * 0.2
-                pct_riesgo_bajo = max(0, (10 - riesgo_efectivo) / 10 * 100)
-                
-                # Puntuación SIN salvaguardas
-                puntuacion = (
-                    pct_riesgos_controlados * 0.60 +
-                    pct_riesgo_bajo * 0.40
-                )
-                
-                # Para el resultado, salvaguardas se reporta como 0 (no consideradas)
-                pct_salvaguardas_impl = 0
-                pct_control_ajustado = pct_riesgos_controlados
-                pct_riesgo_residual_bajo = pct_riesgo_bajo
-                
-            else:
-                # ========================================
-                # TAB 10: MADUREZ CON CONTROLES APLICADOS
-                # Considera salvaguardas implementadas
-                # Representa el estado DESPUÉS de aplicar controles
-                # ========================================
-                
-                # Componente 1 (40%): Nivel de riesgo controlado
-                if riesgos_altos > 0:
-                    proporcion_altos = riesgos_altos / total_riesgos
-                    factor_penalizacion = max(0, 1 - (proporcion_altos * 4))
-                    pct_control_ajustado = (riesgos_bajos / total_riesgos * 100) * factor_penalizacion
-                else:
-                    pct_control_ajustado = (riesgos_bajos / total_riesgos * 100) if total_riesgos > 0 else 0
-                
-                # Componente 2 (35%): Salvaguardas IMPLEMENTADAS
-                pct_salvaguardas_impl = (salvaguardas_implementadas / total_salvaguardas * 100) if total_salvaguardas > 0 else 0
-                
-                # Componente 3 (25%): Riesgo residual bajo
-                riesgo_efectivo = riesgo_maximo * 0.8 + riesgo_promedio * 0.2
-                pct_riesgo_residual_bajo = max(0, (10 - riesgo_efectivo) / 10 * 100)
-                
-                # Puntuación CON salvaguardas
-                puntuacion = (
-                    pct_control_ajustado * 0.40 +
-                    pct_salvaguardas_impl * 0.35 +
-                    pct_riesgo_residual_bajo * 0.25
-                )
-            
-            # ===== DETERMINAR NIVEL DE MADUREZ =====
-            if puntuacion >= 80:
-                nivel = 5
-                nombre_nivel = "Optimizado"
-            elif puntuacion >= 60:
-                nivel = 4
-                nombre_nivel = "Gestionado"
-            elif puntuacion >= 40:
-                nivel = 3
-                nombre_nivel = "Definido"
-            elif puntuacion >= 20:
-                nivel = 2
-                nombre_nivel = "Básico"
-            else:
-                nivel = 1
-                nombre_nivel = "Inicial"
-            
-            # ===== CREAR RESULTADO =====
-            resultado = ResultadoMadurez(
-                id_evaluacion=eval_id,
-                puntuacion_total=round(puntuacion, 1),
-                nivel_madurez=nivel,
-                nombre_nivel=nombre_nivel,
-                dominio_organizacional=0,
-                dominio_personas=0,
-                dominio_fisico=0,
-                dominio_tecnologico=0,
-                pct_controles_implementados=round(pct_salvaguardas_impl, 1),
-                pct_controles_medidos=round(pct_control_ajustado, 1),
-                pct_riesgos_criticos_mitigados=round(pct_riesgo_residual_bajo, 1),
-                pct_activos_evaluados=round((activos_valorados / total_activos * 100) if total_activos > 0 else 0, 1),
-                total_controles_posibles=total_riesgos,
-                controles_implementados=salvaguardas_implementadas,
-                controles_parciales=riesgos_altos,
-                controles_no_implementados=total_salvaguardas - salvaguardas_implementadas
-            )
-            
-            # Agregar datos adicionales para UI
-            resultado.riesgos_altos = riesgos_altos
-            resultado.riesgos_medios = riesgos_medios
-            resultado.riesgos_bajos = riesgos_bajos
-            resultado.total_riesgos = total_riesgos
-            resultado.total_salvaguardas = total_salvaguardas
-            resultado.salvaguardas_implementadas = salvaguardas_implementadas
-            resultado.riesgo_promedio = round(riesgo_promedio, 2)
-            resultado.riesgo_maximo = riesgo_maximo
-            resultado.modo_calculo = "inherente" if not considerar_salvaguardas else "con_controles"
-            
-            return resultado
+    total_activos = agregados.total_activos
+    activos_valorados = agregados.activos_valorados
+    total_riesgos = agregados.total_riesgos
+    riesgos_altos = agregados.riesgos_altos
+    riesgos_medios = agregados.riesgos_medios
+    riesgos_bajos = agregados.riesgos_bajos
+    riesgo_promedio = agregados.riesgo_promedio
+    riesgo_maximo = agregados.riesgo_maximo
+    total_salvaguardas = agregados.total_salvaguardas
+    salvaguardas_implementadas = agregados.salvaguardas_implementadas
     
-    except Exception as e:
-        print(f"Error calculando madurez: {e}")
-        import traceback
-        traceback.print_exc()
+    if total_activos == 0:
         return None
+    
+    if total_riesgos == 0:
+        # Sin riesgos identificados = madurez muy baja
+        return ResultadoMadurez(
+            id_evaluacion=eval_id,
+            puntuacion_total=10.0,
+            nivel_madurez=1,
+            nombre_nivel="Inicial",
+            dominio_organizacional=0,
+            dominio_personas=0,
+            dominio_fisico=0,
+            dominio_tecnologico=0,
+            pct_controles_implementados=0,
+            pct_controles_medidos=0,
+            pct_riesgos_criticos_mitigados=0,
+            pct_activos_evaluados=0,
+            total_controles_posibles=total_activos,
+            controles_implementados=0,
+            controles_parciales=0,
+            controles_no_implementados=total_activos
+        )
+    
+    # ===== CÁLCULO DE COMPONENTES (DIFERENTE SEGÚN MODO) =====
+    
+    if not considerar_salvaguardas:
+        # ========================================
+        # TAB 9: MADUREZ ACTUAL/INHERENTE
+        # Solo considera los riesgos, NO las salvaguardas
+        # Representa el estado ANTES de aplicar controles
+        # ========================================
+        
+        # Componente 1 (60%): Distribución de riesgos
+        # Penalización severa por riesgos ALTOS
+        if riesgos_altos > 0:
+            proporcion_altos = riesgos_altos / total_riesgos
+            # Cada riesgo ALTO resta mucho - 25% altos = 0 puntos
+            factor_penalizacion = max(0, 1 - (proporcion_altos * 4))
+            pct_riesgos_controlados = (riesgos_bajos / total_riesgos * 100) * factor_penalizacion
+        else:
+            pct_riesgos_controlados = (riesgos_bajos / total_riesgos * 100) if total_riesgos > 0 else 0
+        
+        # Componente 2 (40%): Severidad del riesgo (usar máximo)
+        riesgo_efectivo = riesgo_maximo * 0.8 + riesgo_promedio * 0.2
+        pct_riesgo_bajo = max(0, (10 - riesgo_efectivo) / 10 * 100)
+        
+        # Puntuación SIN salvaguardas
+        puntuacion = (
+            pct_riesgos_controlados * 0.60 +
+            pct_riesgo_bajo * 0.40
+        )
+        
+        # Para el resultado, salvaguardas se reporta como 0 (no consideradas)
+        pct_salvaguardas_impl = 0
+        pct_control_ajustado = pct_riesgos_controlados
+        pct_riesgo_residual_bajo = pct_riesgo_bajo
+        
+    else:
+        # ========================================
+        # TAB 10: MADUREZ CON CONTROLES APLICADOS
+        # Considera salvaguardas implementadas
+        # Representa el estado DESPUÉS de aplicar controles
+        # ========================================
+        
+        # Componente 1 (40%): Nivel de riesgo controlado
+        if riesgos_altos > 0:
+            proporcion_altos = riesgos_altos / total_riesgos
+            factor_penalizacion = max(0, 1 - (proporcion_altos * 4))
+            pct_control_ajustado = (riesgos_bajos / total_riesgos * 100) * factor_penalizacion
+        else:
+            pct_control_ajustado = (riesgos_bajos / total_riesgos * 100) if total_riesgos > 0 else 0
+        
+        # Componente 2 (35%): Salvaguardas IMPLEMENTADAS
+        pct_salvaguardas_impl = (salvaguardas_implementadas / total_salvaguardas * 100) if total_salvaguardas > 0 else 0
+        
+        # Componente 3 (25%): Riesgo residual bajo
+        riesgo_efectivo = riesgo_maximo * 0.8 + riesgo_promedio * 0.2
+        pct_riesgo_residual_bajo = max(0, (10 - riesgo_efectivo) / 10 * 100)
+        
+        # Puntuación CON salvaguardas
+        puntuacion = (
+            pct_control_ajustado * 0.40 +
+            pct_salvaguardas_impl * 0.35 +
+            pct_riesgo_residual_bajo * 0.25
+        )
+    
+    # ===== DETERMINAR NIVEL DE MADUREZ =====
+    if puntuacion >= 80:
+        nivel = 5
+        nombre_nivel = "Optimizado"
+    elif puntuacion >= 60:
+        nivel = 4
+        nombre_nivel = "Gestionado"
+    elif puntuacion >= 40:
+        nivel = 3
+        nombre_nivel = "Definido"
+    elif puntuacion >= 20:
+        nivel = 2
+        nombre_nivel = "Básico"
+    else:
+        nivel = 1
+        nombre_nivel = "Inicial"
+    
+    # ===== CREAR RESULTADO =====
+    resultado = ResultadoMadurez(
+        id_evaluacion=eval_id,
+        puntuacion_total=round(puntuacion, 1),
+        nivel_madurez=nivel,
+        nombre_nivel=nombre_nivel,
+        dominio_organizacional=0,
+        dominio_personas=0,
+        dominio_fisico=0,
+        dominio_tecnologico=0,
+        pct_controles_implementados=round(pct_salvaguardas_impl, 1),
+        pct_controles_medidos=round(pct_control_ajustado, 1),
+        pct_riesgos_criticos_mitigados=round(pct_riesgo_residual_bajo, 1),
+        pct_activos_evaluados=round((activos_valorados / total_activos * 100) if total_activos > 0 else 0, 1),
+        total_controles_posibles=total_riesgos,
+        controles_implementados=salvaguardas_implementadas,
+        controles_parciales=riesgos_altos,
+        controles_no_implementados=total_salvaguardas - salvaguardas_implementadas
+    )
+    
+    # Agregar datos adicionales para UI
+    resultado.riesgos_altos = riesgos_altos
+    resultado.riesgos_medios = riesgos_medios
+    resultado.riesgos_bajos = riesgos_bajos
+    resultado.total_riesgos = total_riesgos
+    resultado.total_salvaguardas = total_salvaguardas
+    resultado.salvaguardas_implementadas = salvaguardas_implementadas
+    resultado.riesgo_promedio = round(riesgo_promedio, 2)
+    resultado.riesgo_maximo = riesgo_maximo
+    resultado.modo_calculo = "inherente" if not considerar_salvaguardas else "con_controles"
+    
+    return resultado
 
 
 def guardar_madurez(resultado) -> bool:
@@ -619,41 +697,27 @@ def guardar_madurez(resultado) -> bool:
             controles_parc = resultado.controles_parciales
             controles_no_impl = resultado.controles_no_implementados
         
+        # Snapshot de agregados (solo si el resultado viene de calcular_madurez_evaluacion)
+        agregados = None if isinstance(resultado, dict) else getattr(resultado, "agregados", None)
+        snapshot = {
+            "Modo_Calculo": None if isinstance(resultado, dict) else getattr(resultado, "modo_calculo", None),
+            "Version_Datos": getattr(resultado, "version_datos", None) if agregados else None,
+        }
+        for campo, columna in COLUMNAS_AGREGADOS.items():
+            snapshot[columna] = getattr(agregados, campo) if agregados else None
+        
         with get_connection() as conn:
             cursor = conn.cursor()
             
-            # Crear tabla si no existe
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS RESULTADOS_MADUREZ (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ID_Evaluacion TEXT UNIQUE,
-                    Puntuacion_Total REAL,
-                    Nivel_Madurez INTEGER,
-                    Nombre_Nivel TEXT,
-                    Dominio_Organizacional REAL,
-                    Dominio_Personas REAL,
-                    Dominio_Fisico REAL,
-                    Dominio_Tecnologico REAL,
-                    Pct_Controles_Implementados REAL,
-                    Pct_Controles_Medidos REAL,
-                    Pct_Riesgos_Mitigados REAL,
-                    Pct_Activos_Evaluados REAL,
-                    Controles_Implementados INTEGER,
-                    Controles_Parciales INTEGER,
-                    Controles_No_Implementados INTEGER,
-                    Fecha_Calculo TEXT
-                )
-            ''')
-            
             # Insertar o reemplazar
-            cursor.execute('''
+            cursor.execute(f'''
                 INSERT OR REPLACE INTO RESULTADOS_MADUREZ (
                     ID_Evaluacion, Puntuacion_Total, Nivel_Madurez, Nombre_Nivel,
                     Dominio_Organizacional, Dominio_Personas, Dominio_Fisico, Dominio_Tecnologico,
                     Pct_Controles_Implementados, Pct_Controles_Medidos, Pct_Riesgos_Mitigados,
                     Pct_Activos_Evaluados, Controles_Implementados, Controles_Parciales,
-                    Controles_No_Implementados, Fecha_Calculo
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+                    Controles_No_Implementados, Fecha_Calculo, {", ".join(snapshot)}
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'), {", ".join("?" * len(snapshot))})
             ''', [
                 id_evaluacion,
                 puntuacion_total,
@@ -669,7 +733,8 @@ def guardar_madurez(resultado) -> bool:
                 pct_activos_eval,
                 controles_impl,
                 controles_parc,
-                controles_no_impl
+                controles_no_impl,
+                *snapshot.values()
             ])
         
         return True
@@ -801,21 +866,10 @@ def get_controles_existentes_detallados(eval_id: str, activo_id: str = None) ->
             "por_dominio": {dominio: [{controles}]}
         }
     """
-    respuestas = read_table("RESPUESTAS")
-    
-    if respuestas.empty:
-        return {
-            "controles": [],
-            "resumen": {"implementados": 0, "parciales": 0, "no_implementados": 0},
-            "por_dominio": {}
-        }
-    
-    # Filtrar respuestas
-    filtro = respuestas["ID_Evaluacion"].astype(str) == str(eval_id)
+    filtros = {"ID_Evaluacion": eval_id}
     if activo_id:
-        filtro = filtro & (respuestas["ID_Activo"].astype(str) == str(activo_id))
-    
-    respuestas_filtradas = respuestas[filtro]
+        filtros["ID_Activo"] = activo_id
+    respuestas_filtradas = query_rows("RESPUESTAS", filtros)
     
     if respuestas_filtradas.empty:
         return {
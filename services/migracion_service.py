@@ -0,0 +1,538 @@
+"""
+Migraciones versionadas del esquema SQLite - Proyecto TITA
+
+Cada migración se aplica una sola vez y queda registrada en SCHEMA_VERSION.
+Sustituye al patrón "try: ALTER TABLE ... except: pass" repartido por los
+servicios: las columnas añadidas y los índices se declaran aquí, en orden.
+
+Uso:
+    from services.migracion_service import aplicar_migraciones
+    aplicar_migraciones()   # idempotente; al día cuesta una consulta
+"""
+import datetime as dt
+import logging
+import sqlite3
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+from services.database_service import get_connection, write_transaction
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Migracion:
+    """Paso de migración del esquema"""
+    version: int
+    descripcion: str
+    aplicar: Callable[[sqlite3.Connection], None]
+
+
+# ==================== HELPERS DE ESQUEMA ====================
+
+def tabla_existe(conn: sqlite3.Connection, tabla: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabla,)
+    ).fetchone() is not None
+
+
+def columnas_tabla(conn: sqlite3.Connection, tabla: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{tabla}")').fetchall()]
+
+
+def asegurar_columnas(conn: sqlite3.Connection, tabla: str, columnas: Dict[str, str]):
+    """Agrega las columnas que falten ({nombre: 'TIPO [DEFAULT ...]'})"""
+    existentes = set(columnas_tabla(conn, tabla))
+    for nombre, definicion in columnas.items():
+        if nombre not in existentes:
+            conn.execute(f'ALTER TABLE "{tabla}" ADD COLUMN "{nombre}" {definicion}')
+
+
+def crear_triggers_version(conn: sqlite3.Connection, tabla: str):
+    """Triggers que incrementan VERSION_DATOS de la evaluación en cada escritura de la tabla"""
+    for operacion, fila in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_version_{tabla.lower()}_{operacion.lower()}
+            AFTER {operacion} ON "{tabla}"
+            WHEN {fila}.ID_Evaluacion IS NOT NULL
+            BEGIN
+                INSERT INTO VERSION_DATOS (ID_Evaluacion, Version) VALUES ({fila}.ID_Evaluacion, 1)
+                ON CONFLICT(ID_Evaluacion) DO UPDATE SET Version = Version + 1;
+            END
+        ''')
+
+
+def _indice_unico_existe(conn: sqlite3.Connection, tabla: str, columnas: List[str]) -> bool:
+    """True si ya hay un índice UNIQUE/PK exactamente sobre esas columnas"""
+    for idx in conn.execute(f'PRAGMA index_list("{tabla}")').fetchall():
+        if not idx[2]:  # unique
+            continue
+        cols = [row[2] for row in conn.execute(f'PRAGMA index_info("{idx[1]}")').fetchall()]
+        if cols == columnas:
+            return True
+    return False
+
+
+def crear_indice(conn: sqlite3.Connection, nombre: str, tabla: str,
+                 columnas: List[str], unico: bool = False):
+    """Crea un índice (si es UNIQUE y la tabla ya lo garantiza, no duplica)"""
+    if unico and _indice_unico_existe(conn, tabla, columnas):
+        return
+    cols = ", ".join(f'"{c}"' for c in columnas)
+    conn.execute(
+        f'CREATE {"UNIQUE " if unico else ""}INDEX IF NOT EXISTS {nombre} ON "{tabla}" ({cols})'
+    )
+
+
+def _eliminar_duplicados(conn: sqlite3.Connection, tabla: str, columnas: List[str]):
+    """Conserva la fila más reciente (mayor id) por cada clave antes de un índice UNIQUE"""
+    cols = ", ".join(f'"{c}"' for c in columnas)
+    no_nulas = " AND ".join(f'"{c}" IS NOT NULL' for c in columnas)
+    eliminadas = conn.execute(f'''
+        DELETE FROM "{tabla}"
+        WHERE {no_nulas}
+          AND id NOT IN (SELECT MAX(id) FROM "{tabla}" WHERE {no_nulas} GROUP BY {cols})
+    ''').rowcount
+    if eliminadas:
+        logger.warning("Migración: %d filas duplicadas eliminadas de %s (clave %s)",
+                       eliminadas, tabla, ", ".join(columnas))
+
+
+# ==================== MIGRACIONES ====================
+
+def _v1_tablas(conn: sqlite3.Connection):
+    """Tablas que antes se creaban bajo demanda en cada servicio"""
+    from services.database_service import crear_tablas_base
+    from services.matriz_service import init_matriz_tables
+    from services.concentration_risk_service import init_concentration_tables
+
+    crear_tablas_base(conn)
+    init_matriz_tables()
+    init_concentration_tables()
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS RESULTADOS_MAGERIT (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Evaluacion TEXT,
+            ID_Activo TEXT,
+            Nombre_Activo TEXT,
+            Impacto_D INTEGER,
+            Impacto_I INTEGER,
+            Impacto_C INTEGER,
+            Riesgo_Inherente REAL,
+            Riesgo_Residual REAL,
+            Nivel_Riesgo TEXT,
+            Amenazas_JSON TEXT,
+            Controles_JSON TEXT,
+            Observaciones TEXT,
+            Modelo_IA TEXT,
+            Fecha_Evaluacion TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS DEGRADACION_AMENAZAS (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Evaluacion TEXT NOT NULL,
+            ID_Activo TEXT NOT NULL,
+            Codigo_Amenaza TEXT NOT NULL,
+            Degradacion_D REAL DEFAULT 0.5,
+            Degradacion_I REAL DEFAULT 0.5,
+            Degradacion_C REAL DEFAULT 0.5,
+            Justificacion TEXT,
+            Fuente TEXT DEFAULT 'manual',
+            Fecha_Registro TEXT,
+            UNIQUE(ID_Evaluacion, ID_Activo, Codigo_Amenaza)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS AUDITORIA_CAMBIOS (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            Tabla_Afectada TEXT NOT NULL,
+            ID_Registro TEXT,
+            Tipo_Operacion TEXT NOT NULL,
+            Valores_JSON TEXT,
+            Usuario TEXT DEFAULT 'sistema',
+            Fecha_Hora TEXT NOT NULL
+        )
+    ''')
+
+
+def _v2_columnas(conn: sqlite3.Connection):
+    """Columnas agregadas con ALTER TABLE a lo largo del proyecto"""
+    asegurar_columnas(conn, "EVALUACIONES", {
+        "Fecha_Creacion": "TEXT",
+        "Responsable": "TEXT",
+        "Origen_Re_Evaluacion": "TEXT",
+        "Limite_Riesgo": "REAL DEFAULT 7.0",
+        "Factor_Objetivo": "REAL DEFAULT 0.5",
+    })
+    asegurar_columnas(conn, "INVENTARIO_ACTIVOS", {
+        "RTO": "TEXT", "RPO": "TEXT", "BIA": "TEXT",
+        "Descripcion": "TEXT",
+        "Criticidad": "TEXT",
+        "ID_Host": "TEXT",
+        "Tipo_Dependencia": "TEXT DEFAULT 'total'",
+        "Ubicacion_Fisica": "TEXT",
+        "Ubicacion_Logica": "TEXT",
+        "Host_Fisico": "TEXT",
+        "Servicio_Aplicacion": "TEXT",
+        "Nivel_Exposicion": "TEXT DEFAULT 'Interno'",
+        "Dependencias_JSON": "TEXT",
+        "Criticidad_Negocio": "TEXT DEFAULT 'Media'",
+        "Fecha_Alta": "TEXT",
+        "Ultima_Modificacion": "TEXT",
+    })
+    asegurar_columnas(conn, "IDENTIFICACION_VALORACION", {
+        "Respuestas_JSON": "TEXT",
+        "RTO_Valor": "INTEGER", "RTO_Tiempo": "TEXT", "RTO_Nivel": "TEXT",
+        "RPO_Valor": "INTEGER", "RPO_Tiempo": "TEXT", "RPO_Nivel": "TEXT",
+        "BIA_Valor": "INTEGER", "BIA_Nivel": "TEXT",
+    })
+    asegurar_columnas(conn, "VULNERABILIDADES_AMENAZAS", {
+        "Cod_Vulnerabilidad": "TEXT",
+    })
+    asegurar_columnas(conn, "RESULTADOS_MAGERIT", {
+        "Criticidad": "INTEGER DEFAULT 3",
+        "Riesgo_Promedio": "REAL",
+        "Riesgo_Maximo": "REAL",
+        "Riesgo_Objetivo": "REAL",
+        "Supera_Limite": "INTEGER DEFAULT 0",
+    })
+
+
+def _v3_indices_matriz(conn: sqlite3.Connection):
+    """Índices compuestos/únicos de las tablas de la matriz (consultas por evaluación/activo)"""
+    crear_indice(conn, "idx_va_eval_activo", "VULNERABILIDADES_AMENAZAS", ["ID_Evaluacion", "ID_Activo"])
+
+    # Un riesgo por vulnerabilidad-amenaza (calcular_riesgo_amenaza busca por esta columna)
+    _eliminar_duplicados(conn, "RIESGO_AMENAZA", ["ID_Vulnerabilidad_Amenaza"])
+    crear_indice(conn, "uq_riesgo_amenaza_va", "RIESGO_AMENAZA", ["ID_Vulnerabilidad_Amenaza"], unico=True)
+    crear_indice(conn, "idx_riesgo_amenaza_eval_activo", "RIESGO_AMENAZA", ["ID_Evaluacion", "ID_Activo"])
+
+    crear_indice(conn, "idx_salvaguardas_eval_activo", "SALVAGUARDAS", ["ID_Evaluacion", "ID_Activo"])
+    crear_indice(conn, "idx_mapa_riesgos_eval", "MAPA_RIESGOS", ["ID_Evaluacion"])
+
+    for tabla in ("IDENTIFICACION_VALORACION", "RIESGO_ACTIVOS"):
+        _eliminar_duplicados(conn, tabla, ["ID_Evaluacion", "ID_Activo"])
+        crear_indice(conn, f"uq_{tabla.lower()}_eval_activo", tabla, ["ID_Evaluacion", "ID_Activo"], unico=True)
+
+    # El índice compuesto cubre también las consultas solo por ID_Evaluacion
+    crear_indice(conn, "idx_resultados_eval_activo", "RESULTADOS_MAGERIT", ["ID_Evaluacion", "ID_Activo"])
+    conn.execute("DROP INDEX IF EXISTS idx_resultados_eval")
+
+    _eliminar_duplicados(conn, "DEGRADACION_AMENAZAS", ["ID_Evaluacion", "ID_Activo", "Codigo_Amenaza"])
+    crear_indice(conn, "uq_degradacion_eval_activo_amenaza", "DEGRADACION_AMENAZAS",
+                 ["ID_Evaluacion", "ID_Activo", "Codigo_Amenaza"], unico=True)
+    conn.execute("DROP INDEX IF EXISTS idx_degradacion_eval")
+
+    crear_indice(conn, "idx_auditoria_tabla_registro", "AUDITORIA_CAMBIOS", ["Tabla_Afectada", "ID_Registro"])
+    crear_indice(conn, "idx_auditoria_fecha", "AUDITORIA_CAMBIOS", ["Fecha_Hora"])
+
+
+def _v4_cambios_pendientes(conn: sqlite3.Connection):
+    """Claves sucias del recálculo incremental (recalculo_incremental_service)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS CAMBIOS_PENDIENTES (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Evaluacion TEXT NOT NULL,
+            Tabla TEXT NOT NULL,
+            ID_Activo TEXT NOT NULL,
+            Fecha_Marca TEXT,
+            UNIQUE(ID_Evaluacion, Tabla, ID_Activo)
+        )
+    ''')
+    # El mapa se reemplaza por activo; el índice compuesto cubre también las consultas por evaluación
+    crear_indice(conn, "idx_mapa_riesgos_eval_activo", "MAPA_RIESGOS", ["ID_Evaluacion", "ID_Activo"])
+    conn.execute("DROP INDEX IF EXISTS idx_mapa_riesgos_eval")
+
+
+def _v5_analisis_masivo(conn: sqlite3.Connection):
+    """Tareas por activo del análisis masivo con IA (analisis_masivo_service)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ANALISIS_MASIVO_TAREAS (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Lote TEXT NOT NULL,
+            ID_Evaluacion TEXT NOT NULL,
+            ID_Activo TEXT NOT NULL,
+            Orden INTEGER NOT NULL,
+            Estado TEXT DEFAULT 'pendiente',
+            Intentos INTEGER DEFAULT 0,
+            Num_Amenazas INTEGER DEFAULT 0,
+            Mensaje TEXT,
+            Segundos REAL,
+            Fecha_Actualizacion TEXT,
+            UNIQUE(ID_Lote, ID_Activo)
+        )
+    ''')
+    crear_indice(conn, "idx_analisis_masivo_eval_estado", "ANALISIS_MASIVO_TAREAS", ["ID_Evaluacion", "Estado"])
+
+
+def _v6_trabajos(conn: sqlite3.Connection):
+    """Cola de trabajos en segundo plano (trabajos_service)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS TRABAJOS (
+            ID_Trabajo TEXT PRIMARY KEY,
+            Tipo TEXT NOT NULL,
+            ID_Evaluacion TEXT,
+            Parametros TEXT,
+            Estado TEXT DEFAULT 'encolado',
+            Progreso REAL DEFAULT 0,
+            Mensaje TEXT,
+            Resultado TEXT,
+            Cancelar INTEGER DEFAULT 0,
+            Usuario TEXT,
+            Worker TEXT,
+            Fecha_Creacion TEXT,
+            Fecha_Inicio TEXT,
+            Fecha_Latido TEXT,
+            Fecha_Fin TEXT
+        )
+    ''')
+    crear_indice(conn, "idx_trabajos_estado", "TRABAJOS", ["Estado", "Fecha_Creacion"])
+    crear_indice(conn, "idx_trabajos_eval_tipo", "TRABAJOS", ["ID_Evaluacion", "Tipo"])
+
+
+def _v7_llm_cache(conn: sqlite3.Connection):
+    """Cache persistente de respuestas de la IA (llm_cache_service)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS LLM_CACHE (
+            Clave TEXT PRIMARY KEY,
+            Modelo TEXT NOT NULL,
+            Prompt_Hash TEXT NOT NULL,
+            Temperatura REAL,
+            Opciones TEXT,
+            Respuesta TEXT NOT NULL,
+            Bytes INTEGER DEFAULT 0,
+            Fecha_Creacion REAL,
+            Fecha_Acceso REAL,
+            Aciertos INTEGER DEFAULT 0
+        )
+    ''')
+    crear_indice(conn, "idx_llm_cache_acceso", "LLM_CACHE", ["Fecha_Acceso"])
+    crear_indice(conn, "idx_llm_cache_creacion", "LLM_CACHE", ["Fecha_Creacion"])
+
+
+def _v8_catalogos_version(conn: sqlite3.Connection):
+    """Versión de los catálogos para invalidar el registro en memoria (catalogos_service)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS CATALOGOS_VERSION (
+            Catalogo TEXT PRIMARY KEY,
+            Version INTEGER NOT NULL DEFAULT 1,
+            Fecha_Modificacion TEXT
+        )
+    ''')
+
+
+def _v9_telemetria_llm(conn: sqlite3.Connection):
+    """Telemetría de inferencia por llamada a la IA (telemetria_llm_service)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS TELEMETRIA_LLM (
+            ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Fecha TEXT NOT NULL,
+            Origen TEXT,
+            Ruta TEXT,
+            Modelo TEXT,
+            Exito INTEGER DEFAULT 1,
+            Desde_Cache INTEGER DEFAULT 0,
+            Fallback INTEGER DEFAULT 0,
+            Intentos INTEGER DEFAULT 1,
+            Tokens_Prompt INTEGER DEFAULT 0,
+            Tokens_Respuesta INTEGER DEFAULT 0,
+            Tokens_Por_Segundo REAL,
+            Segundos_Total REAL,
+            Espera_Cola_s REAL,
+            Carga_s REAL,
+            Prompt_Eval_s REAL,
+            Eval_s REAL,
+            Primer_Token_s REAL,
+            Error TEXT
+        )
+    ''')
+    crear_indice(conn, "idx_telemetria_llm_fecha", "TELEMETRIA_LLM", ["Fecha"])
+    crear_indice(conn, "idx_telemetria_llm_modelo", "TELEMETRIA_LLM", ["Modelo", "Fecha"])
+
+
+def _v10_ruta_rapida(conn: sqlite3.Connection):
+    """Ruta rápida heurística configurable por evaluación y ruta usada por cada tarea"""
+    asegurar_columnas(conn, "EVALUACIONES", {
+        "Modo_Rapido_IA": "INTEGER DEFAULT 0",
+        "Umbral_Confianza_IA": "REAL",
+    })
+    asegurar_columnas(conn, "ANALISIS_MASIVO_TAREAS", {"Ruta": "TEXT"})
+
+
+def _v11_salvaguardas_sugeridas(conn: sqlite3.Connection):
+    """Control ISO y origen (ia/heuristica) de las salvaguardas sugeridas en batch"""
+    asegurar_columnas(conn, "SALVAGUARDAS", {"Control_ISO": "TEXT", "Origen": "TEXT"})
+
+
+def _v12_version_datos(conn: sqlite3.Connection):
+    """Contador de cambios por evaluación mantenido por triggers (version_datos_service)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS VERSION_DATOS (
+            ID_Evaluacion TEXT PRIMARY KEY,
+            Version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for tabla in ("EVALUACIONES", "INVENTARIO_ACTIVOS", "IDENTIFICACION_VALORACION", "RESPUESTAS",
+                  "VULNERABILIDADES_AMENAZAS", "RIESGO_AMENAZA", "RIESGO_ACTIVOS", "RESULTADOS_MAGERIT",
+                  "SALVAGUARDAS", "DEGRADACION_AMENAZAS"):
+        if tabla_existe(conn, tabla):
+            crear_triggers_version(conn, tabla)
+
+
+def _v13_resultados_propagacion(conn: sqlite3.Connection):
+    """Resultados de la simulación Monte Carlo de propagación (simulacion_propagacion_service)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS RESULTADOS_PROPAGACION (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Evaluacion TEXT NOT NULL,
+            ID_Activo TEXT NOT NULL,
+            Nombre_Activo TEXT,
+            ID_Host TEXT,
+            Nivel INTEGER DEFAULT 0,
+            Frecuencia_Anual REAL,
+            Prob_Fallo_Propio REAL,
+            Prob_Afectado REAL,
+            Perdida_Esperada REAL,
+            Perdida_Propia REAL,
+            Perdida_Heredada REAL,
+            Impacto_P50 REAL,
+            Impacto_P95 REAL,
+            Impacto_P99 REAL,
+            Num_Dependientes INTEGER DEFAULT 0,
+            Perdida_Dependientes REAL,
+            Perdida_Dependientes_P95 REAL,
+            Fuente_Frecuencia TEXT,
+            Ensayos INTEGER,
+            Fecha_Calculo TEXT,
+            UNIQUE(ID_Evaluacion, ID_Activo)
+        )
+    ''')
+
+
+def _v14_snapshot_madurez(conn: sqlite3.Connection):
+    """RESULTADOS_MADUREZ con los agregados de la madurez y la versión de datos (maturity_service)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS RESULTADOS_MADUREZ (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_Evaluacion TEXT UNIQUE,
+            Puntuacion_Total REAL,
+            Nivel_Madurez INTEGER,
+            Nombre_Nivel TEXT,
+            Dominio_Organizacional REAL,
+            Dominio_Personas REAL,
+            Dominio_Fisico REAL,
+            Dominio_Tecnologico REAL,
+            Pct_Controles_Implementados REAL,
+            Pct_Controles_Medidos REAL,
+            Pct_Riesgos_Mitigados REAL,
+            Pct_Activos_Evaluados REAL,
+            Controles_Implementados INTEGER,
+            Controles_Parciales INTEGER,
+            Controles_No_Implementados INTEGER,
+            Fecha_Calculo TEXT
+        )
+    ''')
+    asegurar_columnas(conn, "RESULTADOS_MADUREZ", {
+        "Modo_Calculo": "TEXT",
+        "Version_Datos": "INTEGER",
+        "Total_Activos": "INTEGER",
+        "Activos_Valorados": "INTEGER",
+        "Total_Riesgos": "INTEGER",
+        "Riesgos_Altos": "INTEGER",
+        "Riesgos_Medios": "INTEGER",
+        "Riesgos_Bajos": "INTEGER",
+        "Riesgo_Promedio": "REAL",
+        "Riesgo_Maximo": "REAL",
+        "Total_Salvaguardas": "INTEGER",
+        "Salvaguardas_Implementadas": "INTEGER",
+    })
+
+
+def _v15_resumen_evaluaciones(conn: sqlite3.Connection):
+    """Resumen de riesgo por evaluación para tendencias multi-evaluación (comparativa_service)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS RESUMEN_EVALUACIONES (
+            ID_Evaluacion TEXT PRIMARY KEY,
+            Version_Datos INTEGER,
+            Num_Resultados INTEGER DEFAULT 0,
+            Num_Activos INTEGER DEFAULT 0,
+            Riesgo_Promedio REAL,
+            Riesgo_Maximo REAL,
+            Riesgo_Efectivo_Promedio REAL,
+            Riesgo_Efectivo_Maximo REAL,
+            Riesgo_Residual_Promedio REAL,
+            Fecha_Calculo TEXT
+        )
+    ''')
+
+
+MIGRACIONES: List[Migracion] = [
+    Migracion(1, "Tablas base y de la matriz", _v1_tablas),
+    Migracion(2, "Columnas agregadas (antes ALTER TABLE ad hoc)", _v2_columnas),
+    Migracion(3, "Índices compuestos y únicos de la matriz", _v3_indices_matriz),
+    Migracion(4, "Marcas de recálculo incremental", _v4_cambios_pendientes),
+    Migracion(5, "Tareas reanudables del análisis masivo con IA", _v5_analisis_masivo),
+    Migracion(6, "Cola de trabajos en segundo plano", _v6_trabajos),
+    Migracion(7, "Cache persistente de respuestas de la IA", _v7_llm_cache),
+    Migracion(8, "Versión de catálogos para el registro en memoria", _v8_catalogos_version),
+    Migracion(9, "Telemetría de inferencia de la IA", _v9_telemetria_llm),
+    Migracion(10, "Ruta rápida heurística por evaluación", _v10_ruta_rapida),
+    Migracion(11, "Salvaguardas sugeridas con control ISO y origen", _v11_salvaguardas_sugeridas),
+    Migracion(12, "Versión de datos por evaluación (triggers)", _v12_version_datos),
+    Migracion(13, "Resultados de la simulación de propagación", _v13_resultados_propagacion),
+    Migracion(14, "Snapshot de agregados de madurez por versión de datos", _v14_snapshot_madurez),
+    Migracion(15, "Resumen de riesgo por evaluación para tendencias", _v15_resumen_evaluaciones),
+]
+
+VERSION_ESQUEMA = MIGRACIONES[-1].version
+
+
+# ==================== API ====================
+
+def version_actual() -> int:
+    """Versión del esquema registrada en la base de datos (0 si nunca se migró)"""
+    with get_connection() as conn:
+        if not tabla_existe(conn, "SCHEMA_VERSION"):
+            return 0
+        return conn.execute("SELECT COALESCE(MAX(Version), 0) FROM SCHEMA_VERSION").fetchone()[0]
+
+
+def aplicar_migraciones(hasta: int = None) -> List[int]:
+    """
+    Aplica en orden las migraciones pendientes.
+
+    Cada migración corre en su propia transacción explícita (BEGIN) junto con
+    el registro en SCHEMA_VERSION: si falla, la base queda en la versión
+    anterior. Sin el BEGIN, sqlite3 ejecuta el DDL en modo autocommit.
+
+    Returns:
+        Versiones aplicadas en esta llamada
+    """
+    objetivo = hasta or VERSION_ESQUEMA
+    if version_actual() >= objetivo:
+        return []
+
+    aplicadas = []
+    with write_transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS SCHEMA_VERSION (
+                Version INTEGER PRIMARY KEY,
+                Descripcion TEXT,
+                Fecha_Aplicacion TEXT
+            )
+        ''')
+    for migracion in MIGRACIONES:
+        if migracion.version > objetivo or migracion.version <= version_actual():
+            continue
+        with write_transaction() as conn:
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            migracion.aplicar(conn)
+            conn.execute(
+                "INSERT INTO SCHEMA_VERSION (Version, Descripcion, Fecha_Aplicacion) VALUES (?, ?, ?)",
+                (migracion.version, migracion.descripcion, dt.datetime.now().isoformat())
+            )
+        aplicadas.append(migracion.version)
+    return aplicadas
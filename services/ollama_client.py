@@ -0,0 +1,501 @@
+"""
+Cliente único de Ollama - Proyecto TITA
+=======================================
+Todas las llamadas a la IA local pasan por OllamaClient:
+- requests.Session con pool de conexiones HTTP (keep-alive)
+- keep_alive de Ollama para que el modelo siga cargado entre llamadas
+- Entrega de tokens en streaming (la UI puede mostrar la salida parcial)
+- Política común de reintentos con backoff exponencial y jitter
+- Circuit breaker: tras varios fallos seguidos se falla rápido (y los
+  servicios usan su fallback heurístico) hasta que Ollama se recupera
+- Cache persistente de respuestas (llm_cache_service); si el llamador no
+  puede usar una respuesta (JSON inválido, validación fallida) la retira
+  con invalidar_ultima_respuesta() para que la siguiente llamada infiera
+- Telemetría de cada llamada: tokens, tokens/s, esperas (telemetria_llm_service)
+
+Uso:
+    from services.ollama_client import get_cliente, generar_texto
+    exito, texto = generar_texto(prompt, "llama3.2:1b", {"temperature": 0.3})
+    for fragmento in get_cliente().generar_stream(prompt, modelo):
+        ...
+    get_cliente().chat([{"role": "system", "content": prefijo_fijo},
+                        {"role": "user", "content": consulta}], modelo)
+"""
+import os
+import json
+import time
+import contextvars
+import random
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import llm_cache_service, telemetria_llm_service
+
+logger = logging.getLogger(__name__)
+
+# (modelo, prompt, opciones) de cache de la última respuesta obtenida en este
+# contexto (hilo o tarea): la usa invalidar_ultima_respuesta()
+_ultima_respuesta: contextvars.ContextVar = contextvars.ContextVar("ultima_respuesta_ollama", default=None)
+
+
+# ==================== CONFIGURACIÓN ====================
+
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST_URL", "http://localhost:11434")
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+TIMEOUT_CONEXION = 3.05  # segundos para abrir la conexión TCP
+TIMEOUT_DEFAULT = 90  # segundos de lectura por defecto
+POOL_CONEXIONES = max(4, 2 * int(os.environ.get("OLLAMA_NUM_PARALLEL") or 4))
+
+
+class OllamaError(Exception):
+    """Error de una llamada a Ollama; tipo: conexion, timeout, http, respuesta o circuito"""
+
+    def __init__(self, mensaje: str, tipo: str = "respuesta", status: int = None):
+        super().__init__(mensaje)
+        self.tipo = tipo
+        self.status = status
+
+    @property
+    def reintentable(self) -> bool:
+        return self.tipo in ("conexion", "timeout") or (self.status is not None and
+                                                         (self.status >= 500 or self.status == 429))
+
+
+class CircuitoAbierto(OllamaError):
+    """Ollama falló demasiadas veces seguidas: no se intenta hasta el enfriamiento"""
+
+    def __init__(self, segundos_restantes: float):
+        super().__init__(f"Ollama no disponible (circuito abierto, reintento en {segundos_restantes:.0f} s)",
+                         tipo="circuito")
+
+
+@dataclass
+class PoliticaReintentos:
+    """Reintentos con espera exponencial acotada y jitter"""
+    max_intentos: int = 3
+    espera_base: float = 1.0
+    espera_max: float = 8.0
+    jitter: float = 0.25
+
+    def espera(self, intento: int) -> float:
+        base = min(self.espera_max, self.espera_base * 2 ** intento)
+        return base * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+class CircuitBreaker:
+    """
+    cerrado → (umbral_fallos fallos seguidos) → abierto → (enfriamiento) →
+    semiabierto: deja pasar una llamada de prueba; si funciona se cierra.
+    """
+
+    def __init__(self, umbral_fallos: int = 5, enfriamiento: float = 30.0):
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self.fallos = 0
+        self.abierto_desde: Optional[float] = None
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            if self.abierto_desde is None:
+                return "cerrado"
+            if time.monotonic() - self.abierto_desde >= self.enfriamiento:
+                return "semiabierto"
+            return "abierto"
+
+    def permitir(self):
+        """Lanza CircuitoAbierto si la llamada no debe intentarse"""
+        with self._lock:
+            if self.abierto_desde is None:
+                return
+            transcurrido = time.monotonic() - self.abierto_desde
+            if transcurrido < self.enfriamiento or self._prueba_en_curso:
+                raise CircuitoAbierto(max(0.0, self.enfriamiento - transcurrido))
+            self._prueba_en_curso = True
+
+    def registrar_exito(self):
+        with self._lock:
+            self.fallos = 0
+            self.abierto_desde = None
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self.fallos += 1
+            self._prueba_en_curso = False
+            if self.fallos >= self.umbral_fallos or self.abierto_desde is not None:
+                self.abierto_desde = time.monotonic()
+
+
+@dataclass
+class RespuestaOllama:
+    """Respuesta completa de /api/generate"""
+    texto: str
+    modelo: str
+    desde_cache: bool = False
+    segundos: float = 0.0
+    primer_token_s: Optional[float] = None
+    tokens_prompt: int = 0
+    tokens_respuesta: int = 0
+    intentos: int = 1
+    datos: Dict[str, Any] = field(default_factory=dict)
+
+
+# ==================== CLIENTE ====================
+
+class OllamaClient:
+    """Cliente HTTP compartido de Ollama (seguro entre hilos)"""
+
+    def __init__(self, host: str = OLLAMA_HOST, keep_alive: Optional[str] = KEEP_ALIVE,
+                 politica: PoliticaReintentos = None, circuito: CircuitBreaker = None,
+                 usar_cache: bool = True):
+        self.host = host.rstrip("/")
+        self.keep_alive = keep_alive
+        self.politica = politica or PoliticaReintentos()
+        self.circuito = circuito or CircuitBreaker()
+        self.usar_cache = usar_cache
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=POOL_CONEXIONES, pool_maxsize=POOL_CONEXIONES)
+        self.session.mount("http://", adaptador)
+        self.session.mount("https://", adaptador)
+
+    # ---------- HTTP ----------
+
+    def _post(self, ruta: str, payload: Dict, timeout: float, stream: bool = False) -> requests.Response:
+        """Una petición, con errores traducidos a OllamaError"""
+        try:
+            respuesta = self.session.post(f"{self.host}{ruta}", json=payload,
+                                          timeout=(TIMEOUT_CONEXION, timeout), stream=stream)
+        except requests.exceptions.Timeout:
+            raise OllamaError(f"Timeout después de {timeout} segundos", tipo="timeout")
+        except requests.exceptions.ConnectionError:
+            raise OllamaError(f"No se pudo conectar con Ollama en {self.host}", tipo="conexion")
+        if respuesta.status_code != 200:
+            texto = respuesta.text[:200]
+            respuesta.close()
+            raise OllamaError(f"Error HTTP {respuesta.status_code}: {texto}", tipo="http",
+                              status=respuesta.status_code)
+        return respuesta
+
+    def _con_reintentos(self, llamada: Callable[[], Any], max_intentos: int = None,
+                        al_error_conexion: Callable[[], Any] = None) -> Tuple[Any, int]:
+        """Ejecuta llamada() con la política de reintentos y el circuit breaker"""
+        max_intentos = max_intentos or self.politica.max_intentos
+        ultimo_error: Optional[OllamaError] = None
+        for intento in range(max_intentos):
+            self.circuito.permitir()
+            try:
+                resultado = llamada()
+            except OllamaError as e:
+                ultimo_error = e
+                if not e.reintentable:
+                    # El servidor respondió: el error es de la petición, no de disponibilidad
+                    self.circuito.registrar_exito()
+                    raise
+                self.circuito.registrar_fallo()
+                logger.warning(f"⚠️ Ollama intento {intento + 1}/{max_intentos}: {e}")
+                if e.tipo == "conexion" and al_error_conexion is not None:
+                    al_error_conexion()
+                if intento < max_intentos - 1:
+                    time.sleep(self.politica.espera(intento))
+                continue
+            except Exception:
+                self.circuito.registrar_fallo()
+                raise
+            self.circuito.registrar_exito()
+            return resultado, intento + 1
+        raise ultimo_error
+
+    def _payload(self, modelo: str, opciones: Optional[Dict], formato: Any = None, **campos) -> Dict:
+        payload = {"model": modelo, **campos, "options": opciones or {}}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        if formato:
+            payload["format"] = formato
+        return payload
+
+    @staticmethod
+    def _opciones_cache(opciones: Optional[Dict], system: str, formato: Any) -> Dict:
+        clave = dict(opciones or {})
+        if system:
+            clave["_system"] = system
+        if formato:
+            clave["_format"] = formato
+        return clave
+
+    @staticmethod
+    def _fragmento(datos: Dict) -> str:
+        """Texto de una línea de /api/generate ("response") o de /api/chat ("message")"""
+        if "message" in datos:
+            return (datos.get("message") or {}).get("content", "")
+        return datos.get("response", "")
+
+    # ---------- API ----------
+
+    def generar(
+        self,
+        prompt: str,
+        modelo: str,
+        opciones: Optional[Dict[str, Any]] = None,
+        timeout: float = TIMEOUT_DEFAULT,
+        max_intentos: int = None,
+        usar_cache: bool = None,
+        system: str = None,
+        formato: Any = None,
+        al_token: Callable[[str], None] = None,
+        al_error_conexion: Callable[[], Any] = None
+    ) -> RespuestaOllama:
+        """
+        Genera la respuesta completa de /api/generate.
+
+        Con al_token, la respuesta se pide en streaming y cada fragmento se
+        entrega a medida que llega (solo se reintenta si aún no llegó ninguno).
+
+        Raises:
+            OllamaError: si se agotan los reintentos o el circuito está abierto
+        """
+        campos = {"prompt": prompt}
+        if system:
+            campos["system"] = system
+        return self._ejecutar("/api/generate", self._payload(modelo, opciones, formato, **campos), modelo,
+                              prompt, self._opciones_cache(opciones, system, formato), timeout,
+                              max_intentos, usar_cache, al_token, al_error_conexion)
+
+    def chat(
+        self,
+        mensajes: List[Dict[str, str]],
+        modelo: str,
+        opciones: Optional[Dict[str, Any]] = None,
+        timeout: float = TIMEOUT_DEFAULT,
+        max_intentos: int = None,
+        usar_cache: bool = None,
+        formato: Any = None,
+        al_token: Callable[[str], None] = None,
+        al_error_conexion: Callable[[], Any] = None
+    ) -> RespuestaOllama:
+        """
+        Genera la respuesta de /api/chat para una lista de mensajes
+        [{"role": "system"|"user"|"assistant", "content": ...}].
+
+        Con un mensaje system idéntico byte a byte entre llamadas y el modelo
+        cargado (keep_alive), Ollama reutiliza del KV cache los tokens del
+        prefijo común y solo evalúa la parte nueva de cada consulta.
+        """
+        clave_prompt = json.dumps(mensajes, ensure_ascii=False, sort_keys=True)
+        opciones_cache = self._opciones_cache(opciones, None, formato)
+        opciones_cache["_api"] = "chat"
+        return self._ejecutar("/api/chat", self._payload(modelo, opciones, formato, messages=mensajes), modelo,
+                              clave_prompt, opciones_cache, timeout, max_intentos, usar_cache,
+                              al_token, al_error_conexion)
+
+    def _ejecutar(self, ruta: str, payload: Dict, modelo: str, clave_prompt: str, opciones_cache: Dict,
+                  timeout: float, max_intentos: Optional[int], usar_cache: Optional[bool],
+                  al_token: Optional[Callable[[str], None]],
+                  al_error_conexion: Optional[Callable[[], Any]]) -> RespuestaOllama:
+        """Cache, llamada (completa o en streaming), métricas y telemetría comunes a generate y chat"""
+        usar_cache = self.usar_cache if usar_cache is None else usar_cache
+        _ultima_respuesta.set((modelo, clave_prompt, opciones_cache) if usar_cache else None)
+        if usar_cache:
+            texto = llm_cache_service.obtener(modelo, clave_prompt, opciones_cache)
+            if texto is not None:
+                if al_token:
+                    al_token(texto)
+                telemetria_llm_service.registrar_llamada(modelo, ruta, 0.0, desde_cache=True, intentos=0)
+                return RespuestaOllama(texto=texto, modelo=modelo, desde_cache=True)
+
+        inicio = time.perf_counter()
+        payload["stream"] = al_token is not None
+        try:
+            if al_token is None:
+                def llamada():
+                    respuesta = self._post(ruta, payload, timeout)
+                    try:
+                        return respuesta.json()
+                    except ValueError:
+                        raise OllamaError("Respuesta de Ollama no es JSON válido")
+                datos, intentos = self._con_reintentos(llamada, max_intentos, al_error_conexion)
+                resultado = RespuestaOllama(texto=self._fragmento(datos), modelo=modelo, intentos=intentos,
+                                            datos=datos)
+            else:
+                resultado = self._ejecutar_stream(ruta, payload, modelo, timeout, max_intentos,
+                                                  al_token, al_error_conexion)
+        except OllamaError as e:
+            telemetria_llm_service.registrar_llamada(modelo, ruta, time.perf_counter() - inicio,
+                                                     intentos=max_intentos or self.politica.max_intentos,
+                                                     error=f"{e.tipo}: {e}"[:200])
+            raise
+        resultado.segundos = time.perf_counter() - inicio
+        telemetria_llm_service.registrar_llamada(modelo, ruta, resultado.segundos, resultado.datos,
+                                                 intentos=resultado.intentos,
+                                                 primer_token_s=resultado.primer_token_s)
+        resultado.tokens_prompt = int(resultado.datos.get("prompt_eval_count") or 0)
+        resultado.tokens_respuesta = int(resultado.datos.get("eval_count") or 0)
+        if usar_cache:
+            llm_cache_service.guardar(modelo, clave_prompt, resultado.texto, opciones_cache)
+        return resultado
+
+    def _ejecutar_stream(self, ruta, payload, modelo, timeout, max_intentos,
+                         al_token, al_error_conexion) -> RespuestaOllama:
+        fragmentos: List[str] = []
+        final: Dict[str, Any] = {}
+        inicio = time.perf_counter()
+        primer_token: List[float] = []
+
+        def llamada():
+            respuesta = self._post(ruta, payload, timeout, stream=True)
+            with respuesta:
+                try:
+                    for linea in respuesta.iter_lines():
+                        if not linea:
+                            continue
+                        try:
+                            datos = json.loads(linea)
+                        except ValueError:
+                            datos = None
+                        if not isinstance(datos, dict):
+                            raise OllamaError("Fragmento de streaming de Ollama no es JSON válido")
+                        if datos.get("error"):
+                            raise OllamaError(datos["error"])
+                        fragmento = self._fragmento(datos)
+                        if fragmento:
+                            if not primer_token:
+                                primer_token.append(time.perf_counter() - inicio)
+                            fragmentos.append(fragmento)
+                            al_token(fragmento)
+                        if datos.get("done"):
+                            final.update(datos)
+                except requests.exceptions.RequestException as e:
+                    # Con salida parcial ya entregada, reintentar duplicaría texto en la UI
+                    raise OllamaError(f"Streaming interrumpido: {e}", tipo="respuesta" if fragmentos else "timeout")
+
+        _, intentos = self._con_reintentos(llamada, max_intentos, al_error_conexion)
+        return RespuestaOllama(texto="".join(fragmentos), modelo=modelo, intentos=intentos, datos=final,
+                               primer_token_s=primer_token[0] if primer_token else None)
+
+    def generar_stream(self, prompt: str, modelo: str, opciones: Optional[Dict[str, Any]] = None,
+                       timeout: float = TIMEOUT_DEFAULT, **kwargs) -> Iterator[str]:
+        """
+        Iterador de fragmentos de texto (p. ej. para st.write_stream).
+
+        La generación corre en un hilo; los fragmentos se entregan a medida
+        que llegan. Al terminar, la respuesta completa queda en el cache.
+        """
+        import queue
+        cola: "queue.Queue" = queue.Queue()
+        # El hilo hereda el contexto (origen de la telemetría)
+        contexto = contextvars.copy_context()
+        fin = object()
+
+        def producir():
+            try:
+                self.generar(prompt, modelo, opciones, timeout=timeout, al_token=cola.put, **kwargs)
+            except OllamaError as e:
+                cola.put(e)
+            except Exception as e:
+                # Sin esto el hilo moriría en silencio y el iterador terminaría como si la respuesta estuviera completa
+                cola.put(OllamaError(f"{type(e).__name__}: {e}"))
+            finally:
+                cola.put(fin)
+
+        threading.Thread(target=contexto.run, args=(producir,), name="ollama_stream", daemon=True).start()
+        while True:
+            elemento = cola.get()
+            if elemento is fin:
+                return
+            if isinstance(elemento, OllamaError):
+                raise elemento
+            yield elemento
+
+    def listar_modelos(self, timeout: float = 3) -> List[str]:
+        """Modelos instalados (/api/tags); no usa reintentos"""
+        try:
+            respuesta = self.session.get(f"{self.host}/api/tags", timeout=(TIMEOUT_CONEXION, timeout))
+        except requests.exceptions.Timeout:
+            raise OllamaError("Timeout al conectar con Ollama", tipo="timeout")
+        except requests.exceptions.ConnectionError:
+            raise OllamaError("Ollama no está corriendo", tipo="conexion")
+        if respuesta.status_code != 200:
+            raise OllamaError(f"Error HTTP {respuesta.status_code}", tipo="http", status=respuesta.status_code)
+        self.circuito.registrar_exito()
+        return [m.get("name", "") for m in respuesta.json().get("models", [])]
+
+    def modelos_cargados(self, timeout: float = 3) -> List[str]:
+        """Modelos en memoria ahora mismo (/api/ps); lista vacía si no se puede consultar"""
+        try:
+            respuesta = self.session.get(f"{self.host}/api/ps", timeout=(TIMEOUT_CONEXION, timeout))
+            if respuesta.status_code != 200:
+                return []
+            return [m.get("name", "") for m in respuesta.json().get("models", [])]
+        except (requests.exceptions.RequestException, ValueError):
+            return []
+
+    def disponible(self, timeout: float = 3) -> bool:
+        try:
+            self.listar_modelos(timeout)
+            return True
+        except OllamaError:
+            return False
+
+    def precargar(self, modelo: str, timeout: float = TIMEOUT_DEFAULT) -> bool:
+        """Carga el modelo en memoria (prompt vacío) para que la primera llamada real no pague la carga"""
+        try:
+            self._post("/api/generate", {"model": modelo, "keep_alive": self.keep_alive}, timeout).close()
+            return True
+        except OllamaError:
+            return False
+
+    def liberar(self, modelo: str) -> bool:
+        """Descarga el modelo de memoria (keep_alive = 0)"""
+        try:
+            self._post("/api/generate", {"model": modelo, "keep_alive": 0}, TIMEOUT_DEFAULT).close()
+            return True
+        except OllamaError:
+            return False
+
+
+# ==================== INSTANCIAS COMPARTIDAS ====================
+
+_clientes: Dict[str, OllamaClient] = {}
+_clientes_lock = threading.Lock()
+
+
+def get_cliente(host: str = None) -> OllamaClient:
+    """Cliente compartido por host (un pool de conexiones y un circuito por servidor)"""
+    host = (host or OLLAMA_HOST).rstrip("/")
+    with _clientes_lock:
+        if host not in _clientes:
+            _clientes[host] = OllamaClient(host)
+        return _clientes[host]
+
+
+def invalidar_ultima_respuesta() -> bool:
+    """
+    Retira del cache la última respuesta obtenida en este contexto. Los
+    servicios la llaman cuando la respuesta no se pudo parsear o no pasó la
+    validación: sin esto se repetiría la misma respuesta inválida durante
+    todo el TTL y los reintentos nunca volverían a inferir.
+    """
+    clave = _ultima_respuesta.get()
+    if clave is None:
+        return False
+    _ultima_respuesta.set(None)
+    return llm_cache_service.invalidar(*clave)
+
+
+def generar_texto(prompt: str, modelo: str, opciones: Optional[Dict[str, Any]] = None,
+                  **kwargs) -> Tuple[bool, str]:
+    """
+    Atajo con la convención de los servicios: (éxito, texto_o_error).
+    Acepta los mismos argumentos con nombre que OllamaClient.generar.
+    """
+    try:
+        return True, get_cliente().generar(prompt, modelo, opciones, **kwargs).texto
+    except OllamaError as e:
+        return False, str(e)
@@ -13,26 +13,33 @@ La validación garantiza que solo se usen códigos del catálogo.
 IMPORTANTE: Las DEGRADACIONES D/I/C se calculan por MOTOR (no IA)
 usando el módulo degradacion_service.py con el catálogo MAGERIT v3.
 """
+import os
 import json
-import re
-import requests
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
 import pandas as pd
-from services.database_service import read_table
+from services.database_service import get_activo, get_respuestas, get_evaluacion, update_row
+from services.ollama_client import generar_texto, invalidar_ultima_respuesta
+from services.catalogos_service import get_catalogos, cargar_json, ruta_knowledge_base, fragmento
+from services.telemetria_llm_service import etiquetar_origen, registrar_fallback
+from services.salida_estructurada import (
+    formato, extraer_json, esquema_amenazas, esquema_grupo, esquema_evaluacion_magerit, esquema_salvaguarda
+)
 
 # Importar motor de degradación MAGERIT
 from services.degradacion_service import (
-    obtener_degradacion_motor,
+    base_motor,
+    justificacion_motor,
     calcular_degradacion_amenazas,
     DEGRADACION_MAGERIT
 )
+from services.matriz_degradacion_service import degradaciones_motor
 
 # Importar contexto de entrenamiento MAGERIT
 from services.ia_context_magerit import (
     get_contexto_completo_ia,
     get_amenazas_para_tipo_activo,
     get_controles_para_amenaza,
-    construir_prompt_experto,
     MAPEO_AMENAZA_CONTROL,
     AMENAZAS_POR_TIPO_ACTIVO,
     DEGRADACION_TIPICA
@@ -44,7 +51,6 @@ from services.ia_context_enriquecido import get_contexto_completo_ia as get_cont
 
 # ==================== CONFIGURACIÓN ====================
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
 MODELO_DEFAULT = "llama3.2:1b"  # Usar modelo pequeño por defecto (más rápido)
 TIMEOUT = 30  # Reducido a 30 segundos para fallar rápido
 
@@ -139,50 +145,23 @@ def get_contexto_aplicacion_critica(nombre_app: str) -> Dict:
 # ==================== CARGA DE CATÁLOGOS ====================
 
 def get_catalogo_amenazas() -> Dict[str, Dict]:
-    """Carga el catálogo de amenazas MAGERIT desde SQLite"""
-    try:
-        df = read_table("CATALOGO_AMENAZAS_MAGERIT")
-        catalogo = {}
-        for _, row in df.iterrows():
-            codigo = row["codigo"]
-            catalogo[codigo] = {
-                "amenaza": row["amenaza"],
-                "tipo_amenaza": row["tipo_amenaza"],
-                "dimension_afectada": row.get("dimension_afectada", "D"),
-                "descripcion": row.get("descripcion", "")
-            }
-        return catalogo
-    except:
-        return {}
+    """Catálogo de amenazas MAGERIT (registro en memoria, recargado si cambia la BD)"""
+    return dict(get_catalogos().amenazas)
 
 
 def get_catalogo_controles() -> Dict[str, Dict]:
-    """Carga el catálogo de controles ISO 27002 desde SQLite"""
-    try:
-        df = read_table("CATALOGO_CONTROLES_ISO27002")
-        catalogo = {}
-        for _, row in df.iterrows():
-            codigo = row["codigo"]
-            catalogo[codigo] = {
-                "nombre": row["nombre"],
-                "categoria": row["categoria"]
-            }
-        return catalogo
-    except:
-        return {}
+    """Catálogo de controles ISO 27002 (registro en memoria, recargado si cambia la BD)"""
+    return dict(get_catalogos().controles)
 
 
 def get_catalogo_vulnerabilidades() -> Dict[str, Dict]:
     """
     Carga el catálogo de vulnerabilidades MAGERIT desde JSON.
     Retorna un diccionario con todas las vulnerabilidades organizadas por tipo de activo.
+    El archivo solo se vuelve a leer si cambia.
     """
     try:
-        import os
-        ruta_json = os.path.join(os.path.dirname(__file__), "..", "knowledge_base", "vulnerabilidades_magerit.json")
-        with open(ruta_json, "r", encoding="utf-8") as f:
-            catalogo = json.load(f)
-        return catalogo
+        return cargar_json(ruta_knowledge_base("vulnerabilidades_magerit.json"), {})
     except Exception as e:
         print(f"Error cargando catálogo de vulnerabilidades: {e}")
         return {}
@@ -380,6 +359,15 @@ Responde SOLO con el JSON, sin texto adicional:"""
 # ==================== ESCALA INTERNA MAGERIT v3 (CALIBRADA) ====================
 ESCALA_MAGERIT = {1: 1, 2: 2, 3: 3, 4: 5}  # CALIBRADO: 3→3 en lugar de 3→4
 
+def es_pregunta_control(id_pregunta: str) -> bool:
+    """
+    True si la pregunta pertenece a los bloques de control (B, C, D, E).
+    Formatos: PF-B01, PV-B01, B-001, B01, etc.
+    """
+    id_pregunta = str(id_pregunta or "").upper()
+    return any(f"-{bloque}0" in id_pregunta or f"-{bloque}-0" in id_pregunta for bloque in "BCDE")
+
+
 def calcular_probabilidad_desde_respuestas(respuestas: pd.DataFrame) -> int:
     """
     Calcula la probabilidad MAGERIT (1-5) basándose en las respuestas del cuestionario.
@@ -408,18 +396,8 @@ def calcular_probabilidad_desde_respuestas(respuestas: pd.DataFrame) -> int:
     valores_control = []
     
     for _, resp in respuestas.iterrows():
-        id_pregunta = str(resp.get("ID_Pregunta", "")).upper()
         valor = int(resp.get("Valor_Numerico", 2))
-        
-        # Detectar si es pregunta de control (B, C, D, E)
-        # Formatos: PF-B01, PV-B01, B-001, B01, etc.
-        es_control = False
-        for bloque in ['B', 'C', 'D', 'E']:
-            if f"-{bloque}0" in id_pregunta or f"-{bloque}-0" in id_pregunta:
-                es_control = True
-                break
-        
-        if es_control:
+        if es_pregunta_control(resp.get("ID_Pregunta", "")):
             valores_control.append(valor)
     
     # Si no hay preguntas de control, usar probabilidad media
@@ -446,6 +424,21 @@ def calcular_probabilidad_desde_respuestas(respuestas: pd.DataFrame) -> int:
     return probabilidad
 
 
+# Mapeo de tipos de activo a amenazas típicas (ordenadas por criticidad)
+AMENAZAS_EVALUACION_POR_TIPO = {
+    "servidor": ["A.24", "A.11", "A.8", "A.5", "A.6", "E.2", "I.5"],
+    "físico": ["A.24", "A.11", "A.8", "A.5", "A.25", "I.5", "N.1"],
+    "virtual": ["A.24", "A.11", "A.8", "A.5", "A.6", "E.2", "I.9"],
+    "base de datos": ["A.5", "A.6", "A.11", "A.15", "A.19", "E.1", "E.2"],
+    "aplicación": ["A.5", "A.6", "A.8", "A.22", "E.1", "E.21"],
+    "red": ["A.5", "A.9", "A.14", "A.24", "I.8", "E.9"],
+    "usuario": ["A.30", "E.1", "E.2", "E.7", "E.15"],
+    "documento": ["A.11", "A.15", "A.19", "E.1", "E.2"],
+    "equipo": ["N.1", "N.2", "I.5", "A.25", "E.23"],
+    "software": ["A.5", "A.6", "A.8", "A.22", "E.20", "E.21"],
+}
+
+
 def generar_evaluacion_heuristica(
     activo: pd.Series,
     respuestas: pd.DataFrame,
@@ -462,20 +455,6 @@ def generar_evaluacion_heuristica(
     """
     tipo_activo = str(activo.get("Tipo_Activo", "")).lower()
     
-    # Mapeo de tipos de activo a amenazas típicas (ordenadas por criticidad)
-    AMENAZAS_POR_TIPO = {
-        "servidor": ["A.24", "A.11", "A.8", "A.5", "A.6", "E.2", "I.5"],
-        "físico": ["A.24", "A.11", "A.8", "A.5", "A.25", "I.5", "N.1"],
-        "virtual": ["A.24", "A.11", "A.8", "A.5", "A.6", "E.2", "I.9"],
-        "base de datos": ["A.5", "A.6", "A.11", "A.15", "A.19", "E.1", "E.2"],
-        "aplicación": ["A.5", "A.6", "A.8", "A.22", "E.1", "E.21"],
-        "red": ["A.5", "A.9", "A.14", "A.24", "I.8", "E.9"],
-        "usuario": ["A.30", "E.1", "E.2", "E.7", "E.15"],
-        "documento": ["A.11", "A.15", "A.19", "E.1", "E.2"],
-        "equipo": ["N.1", "N.2", "I.5", "A.25", "E.23"],
-        "software": ["A.5", "A.6", "A.8", "A.22", "E.20", "E.21"],
-    }
-    
     # Mapeo de amenazas a controles típicos con prioridad
     CONTROLES_POR_AMENAZA = {
         "A.5": [("5.15", "Alta"), ("5.16", "Alta"), ("8.5", "Media")],
@@ -493,7 +472,7 @@ def generar_evaluacion_heuristica(
     
     # Determinar amenazas aplicables
     amenazas_aplicables = []
-    for key, codigos in AMENAZAS_POR_TIPO.items():
+    for key, codigos in AMENAZAS_EVALUACION_POR_TIPO.items():
         if key in tipo_activo:
             amenazas_aplicables = codigos
             break
@@ -543,87 +522,29 @@ def generar_evaluacion_heuristica(
 
 # ==================== LLAMADA A OLLAMA ====================
 
-def llamar_ollama(prompt: str, modelo: str = None) -> Tuple[bool, str]:
+def llamar_ollama(prompt: str, modelo: str = None, system: str = None, esquema: Dict = None) -> Tuple[bool, str]:
     """
     Llama a Ollama y obtiene la respuesta.
     CON REINTENTOS AUTOMÁTICOS Y RECUPERACIÓN para garantizar 100% disponibilidad.
     
+    Con system (prefijo fijo del prompt) la llamada va por /api/chat y el
+    prefijo se reutiliza entre activos. Con esquema, Ollama genera JSON
+    restringido a esa forma (salida estructurada).
+    
     Returns:
         (éxito: bool, respuesta_o_error: str)
     """
     # Usar el sistema de reintentos automáticos del monitor
-    return llamar_ollama_con_reintentos(prompt, modelo or MODELO_DEFAULT)
-    modelo_usar = modelo or MODELO_DEFAULT
-    
-    try:
-        response = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": modelo_usar,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.3,  # Más determinista
-                    "num_predict": 2000
-                }
-            },
-            timeout=TIMEOUT
-        )
-        
-        if response.status_code == 200:
-            resultado = response.json()
-            return True, resultado.get("response", "")
-        else:
-            return False, f"Error HTTP {response.status_code}: {response.text}"
-    
-    except requests.exceptions.ConnectionError:
-        return False, "No se pudo conectar con Ollama. Verifica que esté ejecutándose."
-    except requests.exceptions.Timeout:
-        return False, f"Timeout después de {TIMEOUT} segundos"
-    except Exception as e:
-        return False, f"Error inesperado: {str(e)}"
+    return llamar_ollama_con_reintentos(prompt, modelo or MODELO_DEFAULT, system=system,
+                                        formato=formato(esquema) if esquema else None)
 
 
 # ==================== PARSING Y VALIDACIÓN ====================
 
 def extraer_json_de_respuesta(respuesta: str) -> Optional[str]:
-    """Extrae el bloque JSON de la respuesta de la IA"""
-    
-    # Intentar extraer JSON entre ```json y ```
-    match = re.search(r'```json\s*([\s\S]*?)\s*```', respuesta)
-    if match:
-        return match.group(1).strip()
-    
-    # Intentar extraer JSON entre ``` y ```
-    match = re.search(r'```\s*([\s\S]*?)\s*```', respuesta)
-    if match:
-        contenido = match.group(1).strip()
-        # Verificar si es JSON válido
-        if contenido.startswith('{'):
-            return contenido
-    
-    # Manejar caso donde IA retorna JavaScript: const request = {...};
-    match = re.search(r'(?:const|let|var)\s+\w+\s*=\s*(\{[\s\S]*?\});', respuesta)
-    if match:
-        return match.group(1).strip()
-    
-    # Intentar encontrar objeto JSON directo (el primer { hasta el último })
-    match = re.search(r'(\{[\s\S]*\})', respuesta)
-    if match:
-        json_str = match.group(1).strip()
-        # Limpiar posibles caracteres extra al final
-        # Encontrar el cierre correcto del JSON
-        depth = 0
-        for i, char in enumerate(json_str):
-            if char == '{':
-                depth += 1
-            elif char == '}':
-                depth -= 1
-                if depth == 0:
-                    return json_str[:i+1]
-        return json_str
-    
-    return None
+    """Extrae el bloque JSON (objeto) de la respuesta de la IA"""
+    datos = extraer_json(respuesta, dict)
+    return json.dumps(datos, ensure_ascii=False) if datos is not None else None
 
 
 def validar_respuesta_ia(
@@ -737,6 +658,7 @@ def validar_respuesta_ia(
 
 # ==================== FUNCIÓN PRINCIPAL ====================
 
+@etiquetar_origen("evaluacion_magerit")
 def analizar_activo_con_ia(
     eval_id: str,
     activo_id: str,
@@ -765,25 +687,36 @@ def analizar_activo_con_ia(
         return False, {}, "Error: Catálogo de controles no cargado. Ejecute seed_catalogos_magerit.py"
     
     # 2. Obtener datos del activo
-    activos = read_table("INVENTARIO_ACTIVOS")
-    activo = activos[activos["ID_Activo"] == activo_id]
-    if activo.empty:
+    activo = get_activo(eval_id, activo_id)
+    if activo is None:
         return False, {}, f"Activo {activo_id} no encontrado"
-    activo = activo.iloc[0]
     
     # 3. Obtener respuestas del cuestionario
-    respuestas = read_table("RESPUESTAS")
-    respuestas_activo = respuestas[
-        (respuestas["ID_Evaluacion"] == eval_id) &
-        (respuestas["ID_Activo"] == activo_id)
-    ]
+    respuestas_activo = get_respuestas(eval_id, activo_id)
+    
+    # Ruta rápida: si el motor heurístico basta, no se llama a la IA
+    modo_rapido, umbral = get_modo_rapido(eval_id)
+    if modo_rapido:
+        confianza = confianza_heuristica(activo.get("Tipo_Activo", ""),
+                                         contar_respuestas_control(respuestas_activo),
+                                         tipos=AMENAZAS_EVALUACION_POR_TIPO)
+        if confianza >= umbral:
+            resultado = generar_evaluacion_heuristica(
+                activo, respuestas_activo, catalogo_amenazas, catalogo_controles
+            )
+            resultado["modelo_ia"] = "heurístico (ruta rápida)"
+            resultado["errores_validacion"] = []
+            resultado["confianza_heuristica"] = confianza
+            return True, resultado, (f"Ruta rápida heurística: {len(resultado['amenazas'])} amenazas "
+                                     f"identificadas sin IA (confianza {confianza:.2f})")
     
     # 4. Construir contexto y prompt
     contexto = construir_contexto_activo(activo, respuestas_activo)
     prompt = construir_prompt_magerit(contexto, catalogo_amenazas, catalogo_controles)
     
     # 5. Llamar a Ollama
-    exito, respuesta_texto = llamar_ollama(prompt, modelo_usar)
+    exito, respuesta_texto = llamar_ollama(
+        prompt, modelo_usar, esquema=esquema_evaluacion_magerit(catalogo_amenazas, catalogo_controles))
     
     usa_fallback = False
     respuesta_limpia = None
@@ -793,25 +726,24 @@ def analizar_activo_con_ia(
         # La IA falló, usar fallback heurístico
         usa_fallback = True
     else:
-        # 6. Extraer JSON
-        json_texto = extraer_json_de_respuesta(respuesta_texto)
-        if not json_texto:
+        # 6. Extraer JSON (salida estructurada: normalmente ya es el JSON completo)
+        respuesta_json = extraer_json(respuesta_texto, dict, origen="evaluacion_magerit")
+        if respuesta_json is None:
             usa_fallback = True
         else:
-            # 7. Parsear JSON
-            try:
-                respuesta_json = json.loads(json_texto)
-                # 8. Validar contra catálogos
-                es_valido, respuesta_limpia, errores = validar_respuesta_ia(
-                    respuesta_json, catalogo_amenazas, catalogo_controles
-                )
-                if not es_valido:
-                    usa_fallback = True
-            except json.JSONDecodeError:
+            # 7. Validar contra catálogos
+            es_valido, respuesta_limpia, errores = validar_respuesta_ia(
+                respuesta_json, catalogo_amenazas, catalogo_controles
+            )
+            if not es_valido:
                 usa_fallback = True
+        if usa_fallback:
+            # Respuesta no utilizable: que la próxima llamada vuelva a inferir
+            invalidar_ultima_respuesta()
     
     # Si la IA falló, usar evaluación heurística
     if usa_fallback:
+        registrar_fallback("respuesta IA no utilizable", modelo_usar)
         respuesta_limpia = generar_evaluacion_heuristica(
             activo, respuestas_activo, catalogo_amenazas, catalogo_controles
         )
@@ -886,20 +818,19 @@ def crear_evaluacion_manual(
 
 # ==================== ANÁLISIS DE AMENAZAS POR CRITICIDAD (IA) ====================
 
-def construir_prompt_amenazas_criticidad(
-    activo_info: Dict,
-    valoracion: Dict,
-    catalogo_amenazas: Dict[str, Dict]
-) -> str:
+def construir_sistema_amenazas_criticidad(catalogo_amenazas: Dict[str, Dict] = None) -> str:
     """
-    Construye el prompt para identificar amenazas/vulnerabilidades basándose en la criticidad.
-    MEJORADO: Usa el contexto de entrenamiento MAGERIT completo.
+    Prefijo fijo del análisis por criticidad: rol, contexto MAGERIT,
+    catálogo, degradaciones típicas, tarea y formato de respuesta.
+
+    No depende del activo, así que es idéntico byte a byte en todas las
+    llamadas (mientras no cambien los catálogos) y Ollama reutiliza su
+    KV cache en lugar de re-evaluar miles de tokens por activo. Sin
+    catálogo explícito se usa el del registro y el texto queda memorizado.
     """
-    tipo_activo = str(activo_info.get("Tipo_Activo", "")).lower()
-    
-    # Obtener amenazas típicas para este tipo de activo del contexto de entrenamiento
-    amenazas_tipicas = get_amenazas_para_tipo_activo(tipo_activo)
-    amenazas_tipicas_texto = "\n".join([f"  - {a}" for a in amenazas_tipicas])
+    if catalogo_amenazas is None:
+        return fragmento("sistema_amenazas_criticidad",
+                         lambda: construir_sistema_amenazas_criticidad(get_catalogo_amenazas()))
     
     # Obtener contexto completo de MAGERIT
     contexto_magerit = get_contexto_completo_ia()
@@ -923,27 +854,11 @@ def construir_prompt_amenazas_criticidad(
     for categoria, rangos in DEGRADACION_TIPICA.items():
         degradacion_info += f"  - {categoria}: D={rangos['D']}%, I={rangos['I']}%, C={rangos['C']}%\n"
     
-    prompt = f"""Eres un experto certificado en seguridad de la información y gestión de riesgos bajo la metodología MAGERIT v3 del CCN (Centro Criptológico Nacional de España).
+    return f"""Eres un experto certificado en seguridad de la información y gestión de riesgos bajo la metodología MAGERIT v3 del CCN (Centro Criptológico Nacional de España).
 
 ## CONTEXTO METODOLÓGICO MAGERIT v3
 {contexto_magerit}
 
-## ACTIVO A ANALIZAR
-- **ID**: {activo_info.get('ID_Activo', '')}
-- **Nombre**: {activo_info.get('Nombre_Activo', '')}
-- **Tipo**: {activo_info.get('Tipo_Activo', '')}
-- **Descripción**: {activo_info.get('Descripcion', 'N/A')}
-- **Ubicación**: {activo_info.get('Ubicacion', 'N/A')}
-
-## VALORACIÓN D/I/C DEL ACTIVO
-- **Disponibilidad (D)**: {valoracion.get('Valor_D', 0)} - Nivel: {valoracion.get('D', 'N')}
-- **Integridad (I)**: {valoracion.get('Valor_I', 0)} - Nivel: {valoracion.get('I', 'N')}
-- **Confidencialidad (C)**: {valoracion.get('Valor_C', 0)} - Nivel: {valoracion.get('C', 'N')}
-- **CRITICIDAD**: {valoracion.get('Criticidad', 0)} - Nivel: {valoracion.get('Criticidad_Nivel', 'Sin valorar')}
-
-## AMENAZAS TÍPICAS PARA ACTIVOS TIPO "{activo_info.get('Tipo_Activo', 'General').upper()}"
-{amenazas_tipicas_texto}
-
 ## CATÁLOGO COMPLETO DE AMENAZAS MAGERIT v3 (USAR SOLO ESTOS CÓDIGOS)
 {amenazas_texto}
 
@@ -951,7 +866,7 @@ def construir_prompt_amenazas_criticidad(
 {degradacion_info}
 
 ## TU TAREA
-Basándote en la CRITICIDAD del activo, su tipo y la metodología MAGERIT v3, identifica las amenazas más relevantes.
+Para cada activo que se te indique, basándote en su CRITICIDAD, su tipo y la metodología MAGERIT v3, identifica las amenazas más relevantes.
 Para cada amenaza, debes:
 1. Indicar la VULNERABILIDAD específica que permite que la amenaza se materialice
 2. Estimar la DEGRADACIÓN (0-100%) para D, I, C según la criticidad del activo y la categoría de amenaza
@@ -990,11 +905,50 @@ Responde ÚNICAMENTE con un JSON válido:
 5. **Las vulnerabilidades deben ser específicas y técnicas**
 6. **Aplica las fórmulas MAGERIT: Impacto = MAX(D×DegD, I×DegI, C×DegC)**
 
-Responde SOLO con el JSON, sin explicaciones adicionales:"""
+Responde SOLO con el JSON, sin explicaciones adicionales."""
+
+
+def construir_consulta_amenazas_criticidad(activo_info: Dict, valoracion: Dict) -> str:
+    """Parte variable del análisis por criticidad: datos y valoración del activo"""
+    tipo_activo = str(activo_info.get("Tipo_Activo", "")).lower()
     
-    return prompt
+    # Obtener amenazas típicas para este tipo de activo del contexto de entrenamiento
+    amenazas_tipicas = get_amenazas_para_tipo_activo(tipo_activo)
+    amenazas_tipicas_texto = "\n".join([f"  - {a}" for a in amenazas_tipicas])
+    
+    return f"""## ACTIVO A ANALIZAR
+- **ID**: {activo_info.get('ID_Activo', '')}
+- **Nombre**: {activo_info.get('Nombre_Activo', '')}
+- **Tipo**: {activo_info.get('Tipo_Activo', '')}
+- **Descripción**: {activo_info.get('Descripcion', 'N/A')}
+- **Ubicación**: {activo_info.get('Ubicacion', 'N/A')}
+
+## VALORACIÓN D/I/C DEL ACTIVO
+- **Disponibilidad (D)**: {valoracion.get('Valor_D', 0)} - Nivel: {valoracion.get('D', 'N')}
+- **Integridad (I)**: {valoracion.get('Valor_I', 0)} - Nivel: {valoracion.get('I', 'N')}
+- **Confidencialidad (C)**: {valoracion.get('Valor_C', 0)} - Nivel: {valoracion.get('C', 'N')}
+- **CRITICIDAD**: {valoracion.get('Criticidad', 0)} - Nivel: {valoracion.get('Criticidad_Nivel', 'Sin valorar')}
+
+## AMENAZAS TÍPICAS PARA ACTIVOS TIPO "{activo_info.get('Tipo_Activo', 'General').upper()}"
+{amenazas_tipicas_texto}
+
+Responde SOLO con el JSON:"""
+
+
+def construir_prompt_amenazas_criticidad(
+    activo_info: Dict,
+    valoracion: Dict,
+    catalogo_amenazas: Dict[str, Dict]
+) -> str:
+    """
+    Prompt completo (prefijo fijo + consulta del activo) para /api/generate.
+    El análisis usa las dos partes por separado vía /api/chat.
+    """
+    return (construir_sistema_amenazas_criticidad(catalogo_amenazas) + "\n\n" +
+            construir_consulta_amenazas_criticidad(activo_info, valoracion))
 
 
+@etiquetar_origen("amenazas_criticidad")
 def analizar_amenazas_por_criticidad(
     activo_info: Dict,
     valoracion: Dict,
@@ -1014,8 +968,7 @@ def analizar_amenazas_por_criticidad(
     """
     modelo_usar = modelo or MODELO_DEFAULT
     
-    # Datos para el motor de degradación
-    tipo_activo = str(activo_info.get("Tipo_Activo", ""))
+    # Criticidad para el motor de degradación
     criticidad = valoracion.get("Criticidad", 3)
     
     # Cargar catálogo de amenazas
@@ -1023,84 +976,315 @@ def analizar_amenazas_por_criticidad(
     if not catalogo_amenazas:
         return False, [], "Error: Catálogo de amenazas no disponible"
     
-    # Construir prompt
-    prompt = construir_prompt_amenazas_criticidad(activo_info, valoracion, catalogo_amenazas)
+    # Prefijo fijo (system, memorizado) + consulta del activo
+    sistema = construir_sistema_amenazas_criticidad()
+    consulta = construir_consulta_amenazas_criticidad(activo_info, valoracion)
     
     # Llamar a Ollama
-    exito, respuesta_texto = llamar_ollama(prompt, modelo_usar)
+    exito, respuesta_texto = llamar_ollama(consulta, modelo_usar, system=sistema,
+                                           esquema=esquema_amenazas(catalogo_amenazas))
     
     if not exito:
         # Usar fallback heurístico
-        amenazas = generar_amenazas_heuristicas(activo_info, valoracion, catalogo_amenazas)
-        # Recalcular degradaciones con MOTOR
-        amenazas = calcular_degradacion_amenazas(amenazas, tipo_activo, criticidad)
-        return True, amenazas, "Análisis heurístico + Motor MAGERIT (Ollama no disponible)"
-    
-    # Extraer JSON
-    json_texto = extraer_json_de_respuesta(respuesta_texto)
-    if not json_texto:
-        amenazas = generar_amenazas_heuristicas(activo_info, valoracion, catalogo_amenazas)
-        # Recalcular degradaciones con MOTOR
-        amenazas = calcular_degradacion_amenazas(amenazas, tipo_activo, criticidad)
-        return True, amenazas, "Análisis heurístico + Motor MAGERIT (respuesta IA inválida)"
+        return _analisis_heuristico(activo_info, valoracion, catalogo_amenazas, "Ollama no disponible")
     
-    try:
-        respuesta_json = json.loads(json_texto)
-        amenazas_raw = respuesta_json.get("amenazas_identificadas", [])
-        
-        # Obtener vulnerabilidades del catálogo según tipo de activo
-        vulnerabilidades_tipo = obtener_vulnerabilidades_por_tipo(activo_info.get("Tipo_Activo", ""))
-        
-        # Validar y limpiar amenazas (IA solo selecciona amenazas, MOTOR calcula degradación)
-        amenazas_validas = []
-        for idx, am in enumerate(amenazas_raw):
-            codigo = am.get("codigo_amenaza", "")
-            if codigo in catalogo_amenazas:
-                # MOTOR MAGERIT calcula las degradaciones (no la IA)
-                deg_d, deg_i, deg_c, justificacion = obtener_degradacion_motor(
-                    codigo, tipo_activo, criticidad
-                )
-                
-                # Obtener código de vulnerabilidad del catálogo
-                vuln_texto_ia = am.get("vulnerabilidad", "Vulnerabilidad no especificada")
-                if vulnerabilidades_tipo:
-                    # Buscar la vulnerabilidad más similar o usar la primera
-                    vuln_idx = idx % len(vulnerabilidades_tipo)
-                    vuln_catalogo = vulnerabilidades_tipo[vuln_idx]
-                    cod_vuln = vuln_catalogo["codigo"]
-                    vulnerabilidad_completa = f"{vuln_catalogo['nombre']}: {vuln_catalogo['descripcion']}"
-                else:
-                    cod_vuln = f"V{idx+1:03d}"
-                    vulnerabilidad_completa = vuln_texto_ia
-                
-                amenazas_validas.append({
-                    "codigo_amenaza": codigo,
-                    "codigo_vulnerabilidad": cod_vuln,
-                    "nombre_amenaza": am.get("nombre_amenaza", catalogo_amenazas[codigo]["amenaza"]),
-                    "vulnerabilidad": vulnerabilidad_completa,
-                    "degradacion_d": int(deg_d * 100),
-                    "degradacion_i": int(deg_i * 100),
-                    "degradacion_c": int(deg_c * 100),
-                    "justificacion": justificacion,
-                    "justificacion_ia": am.get("justificacion", ""),
-                    "tipo_amenaza": catalogo_amenazas[codigo].get("tipo_amenaza", ""),
-                    "fuente_degradacion": "MOTOR_MAGERIT"
-                })
+    respuesta_json = extraer_json(respuesta_texto, dict, origen="amenazas_criticidad")
+    if respuesta_json is None:
+        invalidar_ultima_respuesta()
+        return _analisis_heuristico(activo_info, valoracion, catalogo_amenazas, "respuesta IA inválida")
+    
+    amenazas_validas = validar_amenazas_ia(
+        respuesta_json.get("amenazas_identificadas", []), activo_info, criticidad, catalogo_amenazas
+    )
+    if amenazas_validas:
+        resumen = respuesta_json.get("resumen_analisis", "")
+        return True, amenazas_validas, f"IA identificó {len(amenazas_validas)} amenazas. Degradación por Motor MAGERIT. {resumen}"
+    invalidar_ultima_respuesta()
+    return _analisis_heuristico(activo_info, valoracion, catalogo_amenazas, "ninguna amenaza válida de IA")
+
+
+def validar_amenazas_ia(
+    amenazas_raw: List[Dict],
+    activo_info: Dict,
+    criticidad: int,
+    catalogo_amenazas: Dict[str, Dict]
+) -> List[Dict]:
+    """
+    Valida las amenazas elegidas por la IA contra el catálogo. La IA solo
+    selecciona amenazas: el MOTOR MAGERIT calcula las degradaciones y la
+    vulnerabilidad se toma del catálogo del tipo de activo.
+    """
+    if not isinstance(amenazas_raw, list):
+        return []
+    tipo_activo = str(activo_info.get("Tipo_Activo", ""))
+    
+    # Obtener vulnerabilidades del catálogo según tipo de activo
+    vulnerabilidades_tipo = obtener_vulnerabilidades_por_tipo(tipo_activo)
+    
+    # MOTOR MAGERIT calcula las degradaciones (no la IA), todas de una vez
+    seleccionadas = [
+        (idx, am) for idx, am in enumerate(amenazas_raw)
+        if isinstance(am, dict) and am.get("codigo_amenaza", "") in catalogo_amenazas
+    ]
+    codigos = [am["codigo_amenaza"] for _, am in seleccionadas]
+    degradaciones = degradaciones_motor(codigos, [tipo_activo] * len(codigos), [criticidad] * len(codigos))
+    
+    amenazas_validas = []
+    for (idx, am), codigo, (deg_d, deg_i, deg_c) in zip(seleccionadas, codigos, degradaciones.tolist()):
+        justificacion = justificacion_motor(base_motor(codigo), tipo_activo, criticidad)
         
-        if amenazas_validas:
-            resumen = respuesta_json.get("resumen_analisis", "")
-            return True, amenazas_validas, f"IA identificó {len(amenazas_validas)} amenazas. Degradación por Motor MAGERIT. {resumen}"
+        # Obtener código de vulnerabilidad del catálogo
+        vuln_texto_ia = am.get("vulnerabilidad", "Vulnerabilidad no especificada")
+        if vulnerabilidades_tipo:
+            # Buscar la vulnerabilidad más similar o usar la primera
+            vuln_idx = idx % len(vulnerabilidades_tipo)
+            vuln_catalogo = vulnerabilidades_tipo[vuln_idx]
+            cod_vuln = vuln_catalogo["codigo"]
+            vulnerabilidad_completa = f"{vuln_catalogo['nombre']}: {vuln_catalogo['descripcion']}"
         else:
-            amenazas = generar_amenazas_heuristicas(activo_info, valoracion, catalogo_amenazas)
-            # Recalcular degradaciones con MOTOR
-            amenazas = calcular_degradacion_amenazas(amenazas, tipo_activo, criticidad)
-            return True, amenazas, "Análisis heurístico + Motor MAGERIT (ninguna amenaza válida de IA)"
+            cod_vuln = f"V{idx+1:03d}"
+            vulnerabilidad_completa = vuln_texto_ia
+        
+        amenazas_validas.append({
+            "codigo_amenaza": codigo,
+            "codigo_vulnerabilidad": cod_vuln,
+            "nombre_amenaza": am.get("nombre_amenaza", catalogo_amenazas[codigo]["amenaza"]),
+            "vulnerabilidad": vulnerabilidad_completa,
+            "degradacion_d": int(deg_d * 100),
+            "degradacion_i": int(deg_i * 100),
+            "degradacion_c": int(deg_c * 100),
+            "justificacion": justificacion,
+            "justificacion_ia": am.get("justificacion", ""),
+            "tipo_amenaza": catalogo_amenazas[codigo].get("tipo_amenaza", ""),
+            "fuente_degradacion": "MOTOR_MAGERIT"
+        })
+    return amenazas_validas
+
+
+def _analisis_heuristico(
+    activo_info: Dict,
+    valoracion: Dict,
+    catalogo_amenazas: Dict[str, Dict],
+    motivo: str
+) -> Tuple[bool, List[Dict], str]:
+    """Fallback heurístico con degradaciones recalculadas por el MOTOR"""
+    registrar_fallback(motivo)
+    amenazas = _amenazas_heuristicas_motor(activo_info, valoracion, catalogo_amenazas)
+    return True, amenazas, f"Análisis heurístico + Motor MAGERIT ({motivo})"
+
+
+def _amenazas_heuristicas_motor(
+    activo_info: Dict,
+    valoracion: Dict,
+    catalogo_amenazas: Dict[str, Dict]
+) -> List[Dict]:
+    amenazas = generar_amenazas_heuristicas(activo_info, valoracion, catalogo_amenazas)
+    return calcular_degradacion_amenazas(
+        amenazas, str(activo_info.get("Tipo_Activo", "")), valoracion.get("Criticidad", 3)
+    )
+
+
+# ==================== RUTA RÁPIDA HEURÍSTICA ====================
+# El motor heurístico responde primero; solo los activos ambiguos (tipo sin
+# mapeo de amenazas o sin respuestas de control) pasan a la IA.
+
+UMBRAL_CONFIANZA_DEFAULT = 0.8
+PESO_TIPO = 0.6        # el tipo de activo tiene amenazas típicas propias (no las genéricas)
+PESO_RESPUESTAS = 0.4  # el cuestionario aporta la probabilidad real
+RESPUESTAS_CONTROL_PLENAS = 8  # respuestas de control con las que PESO_RESPUESTAS es completo
+
+
+def tipo_cubierto(tipo_activo: str, tipos: Dict = None) -> bool:
+    """True si el tipo tiene amenazas típicas en el mapeo (get_amenazas_para_tipo_activo)"""
+    tipo = str(tipo_activo or "").lower()
+    return any(clave in tipo for clave in (tipos or AMENAZAS_POR_TIPO_ACTIVO))
+
+
+def contar_respuestas_control(respuestas: pd.DataFrame) -> int:
+    """Preguntas de control (bloques B-E) distintas respondidas"""
+    if respuestas.empty or "ID_Pregunta" not in respuestas:
+        return 0
+    return sum(1 for p in set(respuestas["ID_Pregunta"].tolist()) if es_pregunta_control(p))
+
+
+def confianza_heuristica(tipo_activo: str, respuestas_control: int, tipos: Dict = None) -> float:
+    """
+    Confianza (0-1) en que el motor heurístico basta para el activo:
+    cobertura del tipo de activo + respuestas de control del cuestionario.
+    """
+    confianza = PESO_TIPO if tipo_cubierto(tipo_activo, tipos) else 0.0
+    confianza += PESO_RESPUESTAS * min(1.0, respuestas_control / RESPUESTAS_CONTROL_PLENAS)
+    return round(confianza, 3)
+
+
+def get_modo_rapido(eval_id: str) -> Tuple[bool, float]:
+    """(ruta rápida activa, umbral de confianza) configurados para la evaluación"""
+    evaluacion = get_evaluacion(eval_id) or {}
+    umbral = evaluacion.get("Umbral_Confianza_IA")
+    return bool(evaluacion.get("Modo_Rapido_IA")), float(umbral) if umbral is not None else UMBRAL_CONFIANZA_DEFAULT
+
+
+def set_modo_rapido(eval_id: str, activo: bool, umbral: float = None):
+    """Activa o desactiva la ruta rápida heurística de la evaluación"""
+    update_row("EVALUACIONES", {"Modo_Rapido_IA": int(activo), "Umbral_Confianza_IA": umbral},
+               {"ID_Evaluacion": eval_id})
+
+
+def analisis_ruta_rapida(
+    activo_info: Dict,
+    valoracion: Dict,
+    confianza: float,
+    catalogo_amenazas: Dict[str, Dict] = None
+) -> Tuple[bool, List[Dict], str]:
+    """Amenazas del motor heurístico + Motor MAGERIT sin llamar a la IA"""
+    catalogo_amenazas = catalogo_amenazas or get_catalogo_amenazas()
+    if not catalogo_amenazas:
+        return False, [], "Error: Catálogo de amenazas no disponible"
+    amenazas = _amenazas_heuristicas_motor(activo_info, valoracion, catalogo_amenazas)
+    return True, amenazas, f"Ruta rápida heurística (confianza {confianza:.2f}) + Motor MAGERIT"
+
+
+# ==================== ANÁLISIS AGRUPADO (VARIOS ACTIVOS POR LLAMADA) ====================
+
+TAMANO_GRUPO_DEFAULT = 8  # activos por prompt; más alarga la salida y empeora modelos pequeños
+
+ActivoValorado = Tuple[Dict, Dict]
+
+
+def banda_criticidad(criticidad) -> str:
+    """Banda de criticidad de las reglas de degradación del prompt"""
+    try:
+        valor = float(criticidad or 0)
+    except (TypeError, ValueError):
+        valor = 0
+    if valor >= 3:
+        return "ALTA"
+    if valor >= 2:
+        return "MEDIA"
+    if valor >= 1:
+        return "BAJA"
+    return "SIN_VALORAR"
+
+
+def agrupar_activos(
+    activos: List[ActivoValorado],
+    tamano_grupo: int = TAMANO_GRUPO_DEFAULT
+) -> List[List[ActivoValorado]]:
+    """
+    Agrupa (activo, valoración) por (tipo de activo, banda de criticidad) y
+    parte cada grupo en bloques de tamano_grupo. Los activos de un mismo
+    grupo reciben respuestas casi idénticas, así que comparten una llamada.
+    Respeta el orden de llegada dentro de cada grupo.
+    """
+    grupos: Dict[Tuple[str, str], List[ActivoValorado]] = {}
+    for activo, valoracion in activos:
+        clave = (str(activo.get("Tipo_Activo", "")).strip().lower(),
+                 banda_criticidad(valoracion.get("Criticidad")))
+        grupos.setdefault(clave, []).append((activo, valoracion))
+    tamano_grupo = max(1, tamano_grupo)
+    return [miembros[i:i + tamano_grupo]
+            for miembros in grupos.values()
+            for i in range(0, len(miembros), tamano_grupo)]
+
+
+def construir_consulta_grupo(grupo: List[ActivoValorado]) -> str:
+    """Parte variable del análisis agrupado: todos los activos y el formato por activo"""
+    tipo_activo = str(grupo[0][0].get("Tipo_Activo", ""))
+    amenazas_tipicas = get_amenazas_para_tipo_activo(tipo_activo.lower())
+    
+    activos_texto = ""
+    for activo, valoracion in grupo:
+        activos_texto += (
+            f"- **{activo.get('ID_Activo', '')}** | {activo.get('Nombre_Activo', '')} | "
+            f"{activo.get('Descripcion', 'N/A') or 'N/A'} | "
+            f"D={valoracion.get('Valor_D', 0)} I={valoracion.get('Valor_I', 0)} C={valoracion.get('Valor_C', 0)} | "
+            f"Criticidad {valoracion.get('Criticidad', 0)} ({valoracion.get('Criticidad_Nivel', 'Sin valorar')})\n"
+        )
     
-    except json.JSONDecodeError:
-        amenazas = generar_amenazas_heuristicas(activo_info, valoracion, catalogo_amenazas)
-        # Recalcular degradaciones con MOTOR
-        amenazas = calcular_degradacion_amenazas(amenazas, tipo_activo, criticidad)
-        return True, amenazas, "Análisis heurístico + Motor MAGERIT (JSON inválido)"
+    return f"""## LOTE DE {len(grupo)} ACTIVOS DEL TIPO "{tipo_activo.upper() or 'GENERAL'}"
+Todos tienen criticidad {banda_criticidad(grupo[0][1].get('Criticidad'))}.
+(ID | Nombre | Descripción | Valoración | Criticidad)
+{activos_texto}
+## AMENAZAS TÍPICAS PARA ESTE TIPO
+{chr(10).join(f"  - {a}" for a in amenazas_tipicas)}
+
+## FORMATO DE RESPUESTA PARA ESTE LOTE
+Responde con UN objeto JSON con una entrada por activo, usando exactamente los ID indicados:
+
+```json
+{{
+  "resultados": [
+    {{
+      "id_activo": "ID del activo",
+      "amenazas_identificadas": [
+        {{"codigo_amenaza": "A.24", "vulnerabilidad": "Vulnerabilidad específica", "justificacion": "Por qué aplica"}}
+      ]
+    }}
+  ]
+}}
+```
+
+Responde SOLO con el JSON:"""
+
+
+@etiquetar_origen("analisis_grupo")
+def analizar_grupo_por_criticidad(
+    grupo: List[ActivoValorado],
+    modelo: str = None
+) -> Dict[str, Tuple[bool, List[Dict], str]]:
+    """
+    Identifica amenazas para varios activos similares en una sola llamada.
+    
+    La respuesta se valida por activo contra el catálogo y las degradaciones
+    las calcula el MOTOR MAGERIT, igual que en el análisis individual. Si la
+    IA no responde o el JSON no sirve, cada activo recibe el fallback
+    heurístico; si la respuesta omite un activo, ese activo se analiza por
+    separado.
+    
+    Returns:
+        {ID_Activo: (éxito, amenazas, mensaje)}
+    """
+    if len(grupo) == 1:
+        activo, valoracion = grupo[0]
+        return {activo["ID_Activo"]: analizar_amenazas_por_criticidad(activo, valoracion, modelo)}
+    modelo_usar = modelo or MODELO_DEFAULT
+    catalogo_amenazas = get_catalogo_amenazas()
+    if not catalogo_amenazas:
+        return {activo["ID_Activo"]: (False, [], "Error: Catálogo de amenazas no disponible")
+                for activo, _ in grupo}
+    
+    ids_grupo = [activo["ID_Activo"] for activo, _ in grupo]
+    exito, respuesta_texto = llamar_ollama(construir_consulta_grupo(grupo), modelo_usar,
+                                           system=construir_sistema_amenazas_criticidad(),
+                                           esquema=esquema_grupo(ids_grupo, catalogo_amenazas))
+    motivo = "Ollama no disponible"
+    resultados_ia: Dict[str, list] = {}
+    if exito:
+        respuesta_json = extraer_json(respuesta_texto, dict, origen="analisis_grupo")
+        entradas = respuesta_json.get("resultados") if isinstance(respuesta_json, dict) else None
+        if isinstance(entradas, list):
+            for entrada in entradas:
+                if isinstance(entrada, dict):
+                    resultados_ia[str(entrada.get("id_activo", "")).strip()] = entrada.get("amenazas_identificadas", [])
+        else:
+            motivo = "respuesta IA inválida"
+            invalidar_ultima_respuesta()
+    
+    resultados = {}
+    for activo, valoracion in grupo:
+        id_activo = activo["ID_Activo"]
+        if not exito or not resultados_ia:
+            resultados[id_activo] = _analisis_heuristico(activo, valoracion, catalogo_amenazas, motivo)
+            continue
+        amenazas = validar_amenazas_ia(resultados_ia.get(id_activo), activo,
+                                       valoracion.get("Criticidad", 3), catalogo_amenazas)
+        if amenazas:
+            resultados[id_activo] = (True, amenazas, f"IA identificó {len(amenazas)} amenazas "
+                                     f"(lote de {len(grupo)} activos). Degradación por Motor MAGERIT.")
+        else:
+            # Omitido o sin códigos válidos en la respuesta conjunta: llamada individual
+            resultados[id_activo] = analizar_amenazas_por_criticidad(activo, valoracion, modelo)
+    return resultados
 
 
 def generar_amenazas_heuristicas(
@@ -1178,11 +1362,10 @@ def generar_amenazas_heuristicas(
     # Extraer códigos de amenazas de las típicas
     amenazas_codigos = []
     for amenaza_texto in amenazas_tipicas[:6]:
-        # Extraer el código (ej: "N.1: Fuego" -> "N.1")
-        if ": " in amenaza_texto:
-            codigo = amenaza_texto.split(":")[0].strip()
-            if codigo in catalogo_amenazas:
-                amenazas_codigos.append(codigo)
+        # Acepta el código solo ("N.1") o con nombre ("N.1: Fuego")
+        codigo = amenaza_texto.split(":")[0].strip()
+        if codigo in catalogo_amenazas:
+            amenazas_codigos.append(codigo)
     
     if not amenazas_codigos:
         # Default para cualquier activo
@@ -1226,6 +1409,21 @@ def generar_amenazas_heuristicas(
 
 # ==================== SUGERENCIA DE SALVAGUARDAS CON IA ====================
 
+# Peticiones simultáneas del batch de salvaguardas (igual que el servidor Ollama)
+CONCURRENCIA_SALVAGUARDAS = int(os.environ.get("OLLAMA_NUM_PARALLEL") or 4)
+
+
+def zona_salvaguarda(riesgo: float) -> Tuple[str, str]:
+    """(zona, urgencia) del riesgo para la sugerencia de salvaguardas"""
+    if riesgo >= 6:
+        return "CRÍTICO", "Implementación URGENTE e INMEDIATA"
+    if riesgo >= 4:
+        return "ALTO", "Implementación prioritaria a corto plazo"
+    if riesgo >= 2:
+        return "MEDIO", "Planificar implementación a mediano plazo"
+    return "BAJO", "Monitorear y evaluar periódicamente"
+
+@etiquetar_origen("salvaguarda")
 def sugerir_salvaguardas_ia(
     nombre_activo: str,
     tipo_activo: str,
@@ -1270,19 +1468,7 @@ def sugerir_salvaguardas_ia(
         for codigo, info in list(catalogo_controles.items())[:60]
     ])
     
-    # Determinar zona de riesgo
-    if riesgo >= 6:
-        zona = "CRÍTICO"
-        urgencia = "Implementación URGENTE e INMEDIATA"
-    elif riesgo >= 4:
-        zona = "ALTO"
-        urgencia = "Implementación prioritaria a corto plazo"
-    elif riesgo >= 2:
-        zona = "MEDIO"
-        urgencia = "Planificar implementación a mediano plazo"
-    else:
-        zona = "BAJO"
-        urgencia = "Monitorear y evaluar periódicamente"
+    zona, urgencia = zona_salvaguarda(riesgo)
     
     prompt = f"""Eres un experto certificado en ciberseguridad y gestión de riesgos MAGERIT v3 / ISO 27002:2022.
 
@@ -1321,24 +1507,14 @@ REGLAS OBLIGATORIAS:
 Responde SOLO con el JSON:"""
 
     try:
-        response = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": modelo_usar,
-                "prompt": prompt,
-                "stream": False,
-                "options": {"temperature": 0.3}
-            },
-            timeout=TIMEOUT
-        )
+        exito, texto = generar_texto(prompt, modelo_usar, {"temperature": 0.3}, timeout=TIMEOUT,
+                                     formato=formato(esquema_salvaguarda(catalogo_controles)))
+        if not exito:
+            texto = ""
         
-        if response.status_code == 200:
-            texto = response.json().get("response", "")
-            
-            # Extraer JSON
-            json_match = re.search(r'\{[^{}]*\}', texto, re.DOTALL)
-            if json_match:
-                resultado = json.loads(json_match.group())
+        if texto:
+            resultado = extraer_json(texto, dict, origen="salvaguarda")
+            if resultado is not None:
                 salvaguarda = resultado.get("salvaguarda", "Implementar medida de control")
                 control = resultado.get("control_iso", "")
                 
@@ -1351,10 +1527,12 @@ Responde SOLO con el JSON:"""
                     control_completo = sugerir_control_heuristico(amenaza, catalogo_controles)
                 
                 return salvaguarda, control_completo, True
+            invalidar_ultima_respuesta()
     except Exception as e:
         pass
     
     # Fallback heurístico usando el mapeo de entrenamiento
+    registrar_fallback(modelo=modelo_usar)
     salvaguarda = generar_salvaguarda_heuristica(amenaza, vulnerabilidad, zona)
     control = sugerir_control_heuristico(amenaza, catalogo_controles)
     return salvaguarda, control, False
@@ -1496,33 +1674,69 @@ def sugerir_control_heuristico(amenaza: str, catalogo: Dict) -> str:
     return "8.1: Dispositivos de punto final de usuario"
 
 
-def sugerir_salvaguardas_batch(riesgos_df: pd.DataFrame, modelo: str = None) -> pd.DataFrame:
+def sugerir_salvaguardas_batch(
+    riesgos_df: pd.DataFrame,
+    modelo: str = None,
+    concurrencia: int = None,
+    progreso: Optional[Callable[[int, int], None]] = None
+) -> pd.DataFrame:
     """
     Sugiere salvaguardas para múltiples riesgos en batch.
     
+    Los riesgos con la misma terna (amenaza, vulnerabilidad, zona) comparten
+    sugerencia: cada terna única se consulta una sola vez (con los datos del
+    primer activo que la presenta), las consultas corren en paralelo con
+    concurrencia acotada y el resultado se reparte a todas sus filas.
+    
     Args:
         riesgos_df: DataFrame con columnas: Nombre_Activo, Tipo_Activo, Amenaza, Vulnerabilidad, Riesgo
         modelo: Modelo de Ollama a usar
+        concurrencia: Consultas simultáneas (por defecto OLLAMA_NUM_PARALLEL)
+        progreso: Callback (ternas resueltas, ternas únicas) en el hilo que llama
     
     Returns:
-        DataFrame con columnas adicionales: Salvaguarda_Sugerida, Control_ISO, Generado_Por_IA
+        DataFrame con columnas adicionales: Salvaguarda_Sugerida, Control_ISO, Generado_IA
     """
-    resultados = []
-    
-    for idx, row in riesgos_df.iterrows():
-        salvaguarda, control, usó_ia = sugerir_salvaguardas_ia(
-            nombre_activo=row.get("Nombre_Activo", ""),
-            tipo_activo=row.get("Tipo_Activo", ""),
-            amenaza=row.get("Amenaza", ""),
-            vulnerabilidad=row.get("Vulnerabilidad", ""),
-            riesgo=row.get("Riesgo", 0),
-            modelo=modelo
-        )
-        resultados.append({
-            "Salvaguarda_Sugerida": salvaguarda,
-            "Control_ISO": control,
-            "Generado_IA": "✅" if usó_ia else "🔧"
-        })
-    
-    return pd.concat([riesgos_df.reset_index(drop=True), pd.DataFrame(resultados)], axis=1)
-
+    riesgos_df = riesgos_df.reset_index(drop=True)
+    columnas = {c: (riesgos_df[c].fillna("").tolist() if c in riesgos_df else [""] * len(riesgos_df))
+                for c in ("Nombre_Activo", "Tipo_Activo", "Amenaza", "Vulnerabilidad")}
+    valores_riesgo = (riesgos_df["Riesgo"].fillna(0).tolist() if "Riesgo" in riesgos_df
+                      else [0] * len(riesgos_df))
+    claves = [(amenaza, vulnerabilidad, zona_salvaguarda(riesgo)[0])
+              for amenaza, vulnerabilidad, riesgo in zip(columnas["Amenaza"], columnas["Vulnerabilidad"],
+                                                         valores_riesgo)]
+    # Primera fila de cada terna: sus datos de activo y riesgo van al prompt
+    unicas = {}
+    for fila, clave in enumerate(claves):
+        unicas.setdefault(clave, fila)
+    
+    sugerencias: Dict[Tuple, Tuple[str, str, bool]] = {}
+    if unicas:
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrencia or CONCURRENCIA_SALVAGUARDAS),
+                                      thread_name_prefix="salvaguardas_ia")
+        try:
+            futuros = {
+                executor.submit(sugerir_salvaguardas_ia, columnas["Nombre_Activo"][fila],
+                                columnas["Tipo_Activo"][fila], clave[0], clave[1],
+                                valores_riesgo[fila], modelo): clave
+                for clave, fila in unicas.items()
+            }
+            for hechos, futuro in enumerate(as_completed(futuros), start=1):
+                clave = futuros[futuro]
+                try:
+                    sugerencias[clave] = futuro.result()
+                except Exception:
+                    registrar_fallback(modelo=modelo or MODELO_DEFAULT)
+                    sugerencias[clave] = (generar_salvaguarda_heuristica(clave[0], clave[1], clave[2]),
+                                          sugerir_control_heuristico(clave[0], get_catalogo_controles()), False)
+                if progreso:
+                    progreso(hechos, len(unicas))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    resultados = pd.DataFrame(
+        [(salvaguarda, control, "✅" if uso_ia else "🔧")
+         for salvaguarda, control, uso_ia in (sugerencias[clave] for clave in claves)],
+        columns=["Salvaguarda_Sugerida", "Control_ISO", "Generado_IA"]
+    )
+    return pd.concat([riesgos_df, resultados], axis=1)
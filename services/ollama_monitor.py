@@ -2,20 +2,25 @@
 SERVICIO DE MONITOREO Y RECUPERACIÓN AUTOMÁTICA DE OLLAMA
 =========================================================
 Garantiza 100% de disponibilidad de la IA local mediante:
-- Health checks automáticos
+- Health checks en segundo plano con estado cacheado (latencia p50/p95)
 - Reintentos con backoff exponencial
 - Auto-inicio de Ollama si está caído
 - Logging detallado de eventos
-- Cache de respuestas para resiliencia
+- Cache de respuestas compartido (llm_cache_service)
 """
-import requests
+import math
 import time
+import threading
 import subprocess
 import logging
-from typing import Tuple, Optional, Dict, Any
-from pathlib import Path
-import json
-from datetime import datetime, timedelta
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Tuple, Optional, Dict, Any, List
+from datetime import datetime
+
+from services import llm_cache_service
+from services.salida_estructurada import metricas_parseo
+from services.ollama_client import get_cliente, OllamaError
 
 # Configurar logging
 logging.basicConfig(
@@ -25,58 +30,113 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Configuración
-OLLAMA_URL = "http://localhost:11434"
-OLLAMA_API_URL = f"{OLLAMA_URL}/api/generate"
-OLLAMA_TAGS_URL = f"{OLLAMA_URL}/api/tags"
 MAX_REINTENTOS = 5
-TIMEOUT_BASE = 5  # segundos
+TIMEOUT_LLAMADA = 30  # segundos de lectura por intento
 HEALTH_CHECK_INTERVAL = 30  # segundos
+ESPERA_ENTRE_ARRANQUES = 60  # segundos mínimos entre intentos de "ollama serve"
+VENTANA_LATENCIAS = 50  # checks usados para p50/p95
+
+# Opciones de muestreo de las llamadas con reintentos (forman parte de la clave del cache)
+OPCIONES_REINTENTOS = {"temperature": 0.3, "top_p": 0.9, "top_k": 40}
+
 
-# Cache de respuestas (para resiliencia offline)
-CACHE_DIR = Path("c:/capston_riesgos/.ollama_cache")
-CACHE_DIR.mkdir(exist_ok=True)
-CACHE_DURATION = timedelta(hours=24)
+@dataclass
+class EstadoOllama:
+    """Foto del último health check (la publica el hilo del monitor)"""
+    disponible: bool = False
+    mensaje: str = "Sin verificar"
+    modelos: List[str] = field(default_factory=list)
+    modelos_cargados: List[str] = field(default_factory=list)
+    latencia_ms: Optional[float] = None
+    latencia_p50_ms: Optional[float] = None
+    latencia_p95_ms: Optional[float] = None
+    ultimo_check: Optional[datetime] = None
+    intentos_fallidos: int = 0
+
+
+def _percentil(valores: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, math.ceil(p / 100 * len(ordenados)) - 1))]
 
 
 class OllamaHealthMonitor:
-    """Monitor de salud de Ollama con auto-recuperación"""
+    """
+    Monitor de salud de Ollama con auto-recuperación.
+    
+    Un hilo en segundo plano verifica /api/tags cada HEALTH_CHECK_INTERVAL
+    segundos, intenta levantar Ollama si está caído y publica un
+    EstadoOllama. La UI y las llamadas leen esa foto (estado()) en lugar de
+    hacer una petición de red en cada rerun de Streamlit.
+    """
     
-    def __init__(self):
+    def __init__(self, intervalo: float = HEALTH_CHECK_INTERVAL):
+        self.intervalo = intervalo
         self.ultimo_check = None
         self.estado_actual = False
         self.intentos_fallidos = 0
         self.modelos_disponibles = []
+        self._latencias = deque(maxlen=VENTANA_LATENCIAS)
+        self._estado: Optional[EstadoOllama] = None
+        self._lock = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._ultimo_arranque = 0.0
     
     def verificar_salud(self) -> Tuple[bool, str]:
         """
-        Verifica si Ollama está funcionando correctamente.
+        Verifica si Ollama está funcionando correctamente y publica el estado.
         
         Returns:
             (disponible: bool, mensaje: str)
         """
+        cliente = get_cliente()
+        inicio = time.perf_counter()
+        modelos, cargados = [], []
+        disponible, fallo_conexion = False, False
         try:
-            response = requests.get(OLLAMA_TAGS_URL, timeout=3)
-            if response.status_code == 200:
-                data = response.json()
-                self.modelos_disponibles = [m.get("name", "") for m in data.get("models", [])]
-                self.estado_actual = True
-                self.intentos_fallidos = 0
-                self.ultimo_check = datetime.now()
-                logger.info(f"✅ Ollama disponible. Modelos: {', '.join(self.modelos_disponibles[:3])}")
-                return True, f"OK - {len(self.modelos_disponibles)} modelos disponibles"
-            else:
-                self.estado_actual = False
-                return False, f"Error HTTP {response.status_code}"
-        except requests.exceptions.ConnectionError:
-            self.estado_actual = False
-            self.intentos_fallidos += 1
-            return False, "Ollama no está corriendo"
-        except requests.exceptions.Timeout:
-            self.estado_actual = False
-            return False, "Timeout al conectar con Ollama"
+            modelos = cliente.listar_modelos(timeout=3)
+            latencia_ms = (time.perf_counter() - inicio) * 1000
+            cargados = cliente.modelos_cargados(timeout=3)
+            disponible = True
+            mensaje = f"OK - {len(modelos)} modelos disponibles"
+            logger.debug(f"✅ Ollama disponible. Modelos: {', '.join(modelos[:3])}")
+        except OllamaError as e:
+            latencia_ms = None
+            fallo_conexion = e.tipo == "conexion"
+            mensaje = str(e)
         except Exception as e:
-            self.estado_actual = False
-            return False, f"Error: {str(e)}"
+            latencia_ms = None
+            mensaje = f"Error: {str(e)}"
+        
+        # El hilo del monitor y la primera llamada a estado() pueden verificar a la vez:
+        # los atributos y la foto se publican juntos bajo el lock
+        with self._lock:
+            self.estado_actual = disponible
+            self.ultimo_check = datetime.now()
+            if disponible:
+                self.modelos_disponibles = modelos
+                self.intentos_fallidos = 0
+            elif fallo_conexion:
+                self.intentos_fallidos += 1
+            if latencia_ms is not None:
+                self._latencias.append(latencia_ms)
+            latencias = list(self._latencias)
+            self._estado = EstadoOllama(
+                disponible=disponible,
+                mensaje=mensaje,
+                modelos=list(modelos) if disponible else [],
+                modelos_cargados=cargados,
+                latencia_ms=latencia_ms,
+                latencia_p50_ms=_percentil(latencias, 50),
+                latencia_p95_ms=_percentil(latencias, 95),
+                ultimo_check=self.ultimo_check,
+                intentos_fallidos=self.intentos_fallidos
+            )
+        return disponible, mensaje
     
     def intentar_iniciar_ollama(self) -> bool:
         """
@@ -86,6 +146,7 @@ class OllamaHealthMonitor:
             bool: True si se inició exitosamente
         """
         logger.warning("⚠️ Intentando iniciar Ollama automáticamente...")
+        self._ultimo_arranque = time.monotonic()
         
         try:
             # Intentar iniciar Ollama en segundo plano (Windows)
@@ -115,27 +176,69 @@ class OllamaHealthMonitor:
             logger.error(f"❌ Error al iniciar Ollama: {e}")
             return False
     
+    # ---------- Hilo en segundo plano ----------
+    
+    def iniciar(self):
+        """Arranca el hilo de health checks (idempotente)"""
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="tita_monitor_ollama", daemon=True)
+            self._hilo.start()
+    
+    def detener(self, timeout: float = 5):
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+    
+    def solicitar_verificacion(self):
+        """Adelanta el próximo health check (p.ej. tras un error de conexión)"""
+        self._despertar.set()
+    
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._ciclo()
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+    
+    def _ciclo(self):
+        """Un health check; si Ollama está caído, intenta levantarlo (con espera entre arranques)"""
+        try:
+            disponible, mensaje = self.verificar_salud()
+            if not disponible and time.monotonic() - self._ultimo_arranque >= ESPERA_ENTRE_ARRANQUES:
+                logger.warning(f"⚠️ Ollama no disponible: {mensaje}")
+                self.intentar_iniciar_ollama()
+        except Exception as e:
+            logger.error(f"❌ Error en el monitor de Ollama: {e}")
+    
+    def estado(self) -> EstadoOllama:
+        """
+        Último estado publicado, sin esperar a la red. Arranca el monitor si
+        hace falta; solo la primera consulta del proceso hace un check síncrono.
+        """
+        self.iniciar()
+        with self._lock:
+            estado = self._estado
+        if estado is None:
+            self.verificar_salud()
+            with self._lock:
+                estado = self._estado
+        return estado
+    
     def asegurar_disponibilidad(self) -> Tuple[bool, str]:
         """
-        Asegura que Ollama esté disponible, intentando recuperarlo si es necesario.
+        Estado de disponibilidad para las rutas de llamada: no hace peticiones
+        ni arranca Ollama en línea; pide al hilo del monitor un check inmediato
+        (que se encarga de la recuperación) y devuelve la última foto.
         
         Returns:
             (disponible: bool, mensaje: str)
         """
-        # Verificar estado actual
-        disponible, mensaje = self.verificar_salud()
-        
-        if disponible:
-            return True, mensaje
-        
-        # Si no está disponible, intentar recuperarlo
-        logger.warning(f"⚠️ Ollama no disponible: {mensaje}")
-        
-        # Intentar iniciar Ollama
-        if self.intentar_iniciar_ollama():
-            return True, "Ollama recuperado exitosamente"
-        
-        return False, f"No se pudo recuperar Ollama después de {self.intentos_fallidos} intentos"
+        self.solicitar_verificacion()
+        estado = self.estado()
+        return estado.disponible, estado.mensaje
 
 
 # Instancia global del monitor
@@ -145,183 +248,64 @@ _monitor = OllamaHealthMonitor()
 def verificar_ollama_disponible() -> Tuple[bool, list]:
     """
     Verifica si Ollama está disponible y retorna los modelos.
-    Con auto-recuperación integrada.
+    Lee el estado publicado por el monitor (auto-recuperación en segundo plano).
     
     Returns:
         (disponible: bool, modelos: list)
     """
-    disponible, mensaje = _monitor.asegurar_disponibilidad()
-    return disponible, _monitor.modelos_disponibles if disponible else []
+    estado = _monitor.estado()
+    return estado.disponible, estado.modelos
+
+
+def estado_ollama() -> EstadoOllama:
+    """Último estado de Ollama publicado por el monitor en segundo plano"""
+    return _monitor.estado()
+
+
+def iniciar_monitor():
+    """Arranca el hilo de health checks (idempotente)"""
+    _monitor.iniciar()
 
 
 def llamar_ollama_con_reintentos(
     prompt: str, 
     modelo: str = "llama3.2:1b",
-    max_reintentos: int = MAX_REINTENTOS
+    max_reintentos: int = MAX_REINTENTOS,
+    system: str = None,
+    formato: Any = None
 ) -> Tuple[bool, str]:
     """
     Llama a Ollama con reintentos automáticos y backoff exponencial.
     
     Args:
-        prompt: Texto del prompt
+        prompt: Texto del prompt (con system, solo la parte variable)
         modelo: Modelo a usar
         max_reintentos: Número máximo de reintentos
+        system: Prefijo fijo; si se indica, se envía como mensaje system por
+            /api/chat para que Ollama reutilice su KV cache entre llamadas
+        formato: Esquema JSON (o "json") para salida estructurada
     
     Returns:
         (exito: bool, respuesta_o_error: str)
     """
-    for intento in range(max_reintentos):
-        try:
-            # Asegurar que Ollama esté disponible
-            if intento > 0:
-                logger.info(f"🔄 Reintento {intento + 1}/{max_reintentos}")
-                disponible, mensaje = _monitor.asegurar_disponibilidad()
-                if not disponible:
-                    logger.warning(f"⚠️ Ollama no disponible en intento {intento + 1}: {mensaje}")
-                    time.sleep(2 ** intento)  # Backoff exponencial
-                    continue
-            
-            # Timeout progresivo (más tiempo en cada reintento)
-            timeout = TIMEOUT_BASE * (intento + 1)
-            
-            # Llamar a Ollama
-            payload = {
-                "model": modelo,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.3,
-                    "top_p": 0.9,
-                    "top_k": 40
-                }
-            }
-            
-            response = requests.post(
-                OLLAMA_API_URL,
-                json=payload,
-                timeout=timeout
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                respuesta = data.get("response", "").strip()
-                
-                # Guardar en cache para resiliencia
-                guardar_en_cache(prompt, respuesta, modelo)
-                
-                logger.info(f"✅ Respuesta recibida de Ollama (intento {intento + 1})")
-                return True, respuesta
-            else:
-                error_msg = f"HTTP {response.status_code}: {response.text[:200]}"
-                logger.warning(f"⚠️ Error en llamada a Ollama: {error_msg}")
-                
-                if intento < max_reintentos - 1:
-                    time.sleep(2 ** intento)
-                    continue
-                else:
-                    return False, error_msg
-        
-        except requests.exceptions.Timeout:
-            logger.warning(f"⏱️ Timeout en intento {intento + 1} (timeout={timeout}s)")
-            if intento < max_reintentos - 1:
-                time.sleep(2 ** intento)
-                continue
-            else:
-                return False, f"Timeout después de {max_reintentos} intentos"
-        
-        except requests.exceptions.ConnectionError:
-            logger.warning(f"🔌 Error de conexión en intento {intento + 1}")
-            # Intentar recuperar Ollama
-            _monitor.asegurar_disponibilidad()
-            if intento < max_reintentos - 1:
-                time.sleep(2 ** intento)
-                continue
-            else:
-                return False, f"No se pudo conectar después de {max_reintentos} intentos"
-        
-        except Exception as e:
-            logger.error(f"❌ Error inesperado: {e}")
-            if intento < max_reintentos - 1:
-                time.sleep(2 ** intento)
-                continue
-            else:
-                return False, f"Error: {str(e)}"
-    
-    # Si llegamos aquí, todos los reintentos fallaron
-    # Intentar usar cache como último recurso
-    respuesta_cache = obtener_de_cache(prompt, modelo)
-    if respuesta_cache:
-        logger.info("♻️ Usando respuesta desde cache")
-        return True, respuesta_cache
-    
-    return False, f"Todos los reintentos fallaron ({max_reintentos} intentos)"
-
-
-def guardar_en_cache(prompt: str, respuesta: str, modelo: str):
-    """Guarda una respuesta en cache para resiliencia"""
+    # Cache, reintentos con backoff y circuit breaker los aplica el cliente compartido;
+    # ante un error de conexión se pide al hilo del monitor un check inmediato
+    # (es ese hilo el que intenta levantar Ollama, no esta llamada)
+    parametros = dict(timeout=TIMEOUT_LLAMADA, max_intentos=max_reintentos, formato=formato,
+                      al_error_conexion=_monitor.asegurar_disponibilidad)
     try:
-        # Crear hash del prompt para nombre de archivo
-        import hashlib
-        prompt_hash = hashlib.md5(prompt.encode()).hexdigest()
-        cache_file = CACHE_DIR / f"{modelo}_{prompt_hash}.json"
-        
-        cache_data = {
-            "prompt": prompt[:500],  # Solo primeros 500 chars
-            "respuesta": respuesta,
-            "modelo": modelo,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.warning(f"No se pudo guardar en cache: {e}")
-
-
-def obtener_de_cache(prompt: str, modelo: str) -> Optional[str]:
-    """Obtiene una respuesta del cache si existe y no ha expirado"""
-    try:
-        import hashlib
-        prompt_hash = hashlib.md5(prompt.encode()).hexdigest()
-        cache_file = CACHE_DIR / f"{modelo}_{prompt_hash}.json"
-        
-        if not cache_file.exists():
-            return None
-        
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            cache_data = json.load(f)
-        
-        # Verificar si no ha expirado
-        timestamp = datetime.fromisoformat(cache_data["timestamp"])
-        if datetime.now() - timestamp > CACHE_DURATION:
-            return None
-        
-        return cache_data["respuesta"]
-    except Exception as e:
-        logger.warning(f"No se pudo leer del cache: {e}")
-        return None
-
-
-def limpiar_cache():
-    """Limpia el cache de respuestas antiguas"""
-    try:
-        count = 0
-        for cache_file in CACHE_DIR.glob("*.json"):
-            try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    cache_data = json.load(f)
-                
-                timestamp = datetime.fromisoformat(cache_data["timestamp"])
-                if datetime.now() - timestamp > CACHE_DURATION:
-                    cache_file.unlink()
-                    count += 1
-            except:
-                pass
-        
-        if count > 0:
-            logger.info(f"🧹 Limpiado {count} archivos de cache antiguos")
-    except Exception as e:
-        logger.warning(f"Error limpiando cache: {e}")
+        if system:
+            mensajes = [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+            respuesta = get_cliente().chat(mensajes, modelo, OPCIONES_REINTENTOS, **parametros)
+        else:
+            respuesta = get_cliente().generar(prompt, modelo, OPCIONES_REINTENTOS, **parametros)
+    except OllamaError as e:
+        logger.warning(f"⚠️ Ollama no respondió: {e}")
+        return False, str(e)
+    
+    origen = "cache" if respuesta.desde_cache else f"intento {respuesta.intentos}"
+    logger.info(f"✅ Respuesta recibida de Ollama ({origen})")
+    return True, respuesta.texto.strip()
 
 
 def obtener_estado_sistema() -> Dict[str, Any]:
@@ -331,18 +315,17 @@ def obtener_estado_sistema() -> Dict[str, Any]:
     Returns:
         Dict con estado detallado
     """
-    disponible, mensaje = _monitor.verificar_salud()
+    estado = _monitor.estado()
     
     return {
-        "disponible": disponible,
-        "mensaje": mensaje,
-        "modelos": _monitor.modelos_disponibles,
-        "ultimo_check": _monitor.ultimo_check.isoformat() if _monitor.ultimo_check else None,
-        "intentos_fallidos": _monitor.intentos_fallidos,
-        "cache_dir": str(CACHE_DIR),
-        "archivos_cache": len(list(CACHE_DIR.glob("*.json")))
+        "disponible": estado.disponible,
+        "mensaje": estado.mensaje,
+        "modelos": estado.modelos,
+        "modelos_cargados": estado.modelos_cargados,
+        "latencia_p50_ms": estado.latencia_p50_ms,
+        "latencia_p95_ms": estado.latencia_p95_ms,
+        "ultimo_check": estado.ultimo_check.isoformat() if estado.ultimo_check else None,
+        "intentos_fallidos": estado.intentos_fallidos,
+        "cache": llm_cache_service.metricas_cache(),
+        "parseo": metricas_parseo()["total"]
     }
-
-
-# Limpiar cache al importar el módulo
-limpiar_cache()
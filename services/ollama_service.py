@@ -2,11 +2,10 @@
 Servicio de integración con Ollama (IA Local)
 """
 import json
-import re
-import requests
 from typing import Dict, Any, List
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
+from services.ollama_client import get_cliente, OllamaError, invalidar_ultima_respuesta
+from services.salida_estructurada import formato, extraer_json, ESQUEMA_ANALISIS_RIESGO
 
 FALLBACK_JSON = """
 [
@@ -17,7 +16,7 @@ FALLBACK_JSON = """
 """
 
 
-def ollama_generate(model: str, prompt: str, timeout: int = 90):
+def ollama_generate(model: str, prompt: str, timeout: int = 90, esquema: Dict = None):
     """
     Genera texto usando Ollama.
     
@@ -25,44 +24,29 @@ def ollama_generate(model: str, prompt: str, timeout: int = 90):
         model: Modelo a usar (llama3, phi3, mistral)
         prompt: Texto del prompt
         timeout: Timeout en segundos
+        esquema: Esquema JSON de la respuesta (salida estructurada)
         
     Returns:
         Respuesta del modelo o código de error
     """
+    opciones = {"num_predict": 350, "temperature": 0.2}
     try:
-        r = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "num_predict": 350,
-                    "temperature": 0.2
-                }
-            },
-            timeout=timeout
-        )
-        r.raise_for_status()
-        return r.json().get("response", "")
-    except requests.exceptions.Timeout:
-        return "__TIMEOUT__"
+        return get_cliente().generar(prompt, model, opciones, timeout=timeout,
+                                     formato=formato(esquema) if esquema else None).texto
+    except OllamaError as e:
+        if e.tipo == "timeout":
+            return "__TIMEOUT__"
+        return f"__ERROR__:{str(e)}"
     except Exception as e:
         return f"__ERROR__:{str(e)}"
 
 
 def extract_json_array(text: str) -> List[Dict]:
     """Extrae array JSON de texto con formato variable"""
-    try:
-        match = re.search(r"\[.*\]", text, re.DOTALL)
-        if not match:
-            return []
-        arr = match.group(0)
-        arr = re.sub(r",\s*}", "}", arr)
-        arr = re.sub(r",\s*\]", "]", arr)
-        return json.loads(arr)
-    except Exception:
-        return []
+    preguntas = extraer_json(text, list, origen="preguntas")
+    if preguntas is None:
+        invalidar_ultima_respuesta()
+    return preguntas or []
 
 
 def validate_ia_questions(qs, n_ia: int) -> List[Dict]:
@@ -169,7 +153,7 @@ FORMATO OBLIGATORIO (devuelve SOLO esto):
 }}
 """
     
-    raw = ollama_generate(model, prompt, timeout=120)
+    raw = ollama_generate(model, prompt, timeout=120, esquema=ESQUEMA_ANALISIS_RIESGO)
     
     if raw == "__TIMEOUT__" or (isinstance(raw, str) and raw.startswith("__ERROR__")):
         return {
@@ -183,26 +167,18 @@ FORMATO OBLIGATORIO (devuelve SOLO esto):
             "error": True
         }
     
-    # Intentar extraer JSON
-    try:
-        # Buscar JSON en la respuesta
-        match = re.search(r'\{.*\}', raw, re.DOTALL)
-        if match:
-            result = json.loads(match.group(0))
-            
-            # Validar campos obligatorios
-            if 'probabilidad' not in result:
-                result['probabilidad'] = 3
-            if 'impacto' not in result:
-                result['impacto'] = 3
-            if 'riesgo_inherente' not in result:
-                result['riesgo_inherente'] = result['probabilidad'] * result['impacto']
-            
-            result['error'] = False
-            return result
-    except:
-        pass
+    result = extraer_json(raw, dict, origen="analisis_riesgo")
+    if result is not None:
+        # Validar campos obligatorios
+        result.setdefault('probabilidad', 3)
+        result.setdefault('impacto', 3)
+        if 'riesgo_inherente' not in result:
+            result['riesgo_inherente'] = result['probabilidad'] * result['impacto']
+        
+        result['error'] = False
+        return result
     
+    invalidar_ultima_respuesta()
     # Fallback si no se pudo parsear
     return {
         "probabilidad": 3,
@@ -0,0 +1,173 @@
+"""
+Recálculo incremental de las tablas derivadas de la matriz MAGERIT
+
+Cadena de dependencias (por activo):
+    IDENTIFICACION_VALORACION → VULNERABILIDADES_AMENAZAS → RIESGO_AMENAZA
+        → RIESGO_ACTIVOS → MAPA_RIESGOS / RESULTADOS_MADUREZ
+
+Las escrituras de los servicios marcan (evaluación, tabla, activo) como
+sucios en CAMBIOS_PENDIENTES. propagar_cambios() recorre la cadena en orden
+y vuelve a derivar solo las filas de los activos afectados, en lugar de
+reconstruir la evaluación completa.
+
+Uso:
+    from services.recalculo_incremental_service import marcar_sucio, propagar_cambios
+    marcar_sucio(eval_id, "IDENTIFICACION_VALORACION", [id_activo])
+    propagar_cambios(eval_id)
+"""
+import sqlite3
+import time
+import datetime as dt
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Set
+
+from services.database_service import get_connection, write_transaction, upsert_rows, count_rows
+
+
+# Tabla origen → tablas que se derivan de ella
+DEPENDENCIAS: Dict[str, List[str]] = {
+    "IDENTIFICACION_VALORACION": ["VULNERABILIDADES_AMENAZAS"],
+    "VULNERABILIDADES_AMENAZAS": ["RIESGO_AMENAZA"],
+    "RIESGO_AMENAZA": ["RIESGO_ACTIVOS"],
+    "RIESGO_ACTIVOS": ["MAPA_RIESGOS", "RESULTADOS_MADUREZ"],
+}
+
+# Orden topológico de la cadena
+ORDEN_TABLAS = [
+    "IDENTIFICACION_VALORACION",
+    "VULNERABILIDADES_AMENAZAS",
+    "RIESGO_AMENAZA",
+    "RIESGO_ACTIVOS",
+    "MAPA_RIESGOS",
+    "RESULTADOS_MADUREZ",
+]
+
+
+@dataclass
+class ResultadoPropagacion:
+    """Resumen de una propagación incremental"""
+    id_evaluacion: str
+    filas: Dict[str, int] = field(default_factory=dict)
+    activos: Set[str] = field(default_factory=set)
+    segundos: float = 0.0
+
+    @property
+    def total_filas(self) -> int:
+        return sum(self.filas.values())
+
+    def __str__(self) -> str:
+        if not self.activos:
+            return f"{self.id_evaluacion}: sin cambios pendientes"
+        detalle = ", ".join(f"{tabla}: {n}" for tabla, n in self.filas.items())
+        return (f"{self.id_evaluacion}: {len(self.activos)} activos, {self.total_filas} filas "
+                f"re-derivadas en {self.segundos:.2f} s ({detalle})")
+
+
+# ==================== MARCAS DE CAMBIO ====================
+
+def marcar_sucio(id_evaluacion: str, tabla: str, ids_activos: Iterable[str]) -> int:
+    """
+    Registra que los datos de esos activos cambiaron en la tabla indicada,
+    de modo que sus tablas derivadas deben recalcularse.
+
+    Returns:
+        Número de claves marcadas
+    """
+    if tabla not in DEPENDENCIAS:
+        raise ValueError(f"{tabla} no tiene tablas derivadas")
+    fecha = dt.datetime.now().isoformat()
+    filas = [{"ID_Evaluacion": id_evaluacion, "Tabla": tabla, "ID_Activo": id_activo, "Fecha_Marca": fecha}
+             for id_activo in set(ids_activos) if id_activo]
+    upsert_rows("CAMBIOS_PENDIENTES", filas, ["ID_Evaluacion", "Tabla", "ID_Activo"],
+                update_columns=["Fecha_Marca"])
+    return len(filas)
+
+
+def cambios_pendientes(id_evaluacion: str) -> Dict[str, Set[str]]:
+    """Activos marcados por tabla origen"""
+    with get_connection() as conn:
+        filas = conn.execute(
+            "SELECT Tabla, ID_Activo FROM CAMBIOS_PENDIENTES WHERE ID_Evaluacion = ?", (id_evaluacion,)
+        ).fetchall()
+    pendientes: Dict[str, Set[str]] = {}
+    for tabla, id_activo in filas:
+        pendientes.setdefault(tabla, set()).add(id_activo)
+    return pendientes
+
+
+def hay_cambios_pendientes(id_evaluacion: str) -> bool:
+    return count_rows("CAMBIOS_PENDIENTES", {"ID_Evaluacion": id_evaluacion}) > 0
+
+
+def _leer_marcas(id_evaluacion: str, tabla: str) -> List[tuple]:
+    with get_connection() as conn:
+        return conn.execute(
+            "SELECT id, ID_Activo, Fecha_Marca FROM CAMBIOS_PENDIENTES WHERE ID_Evaluacion = ? AND Tabla = ?",
+            (id_evaluacion, tabla)
+        ).fetchall()
+
+
+def _consumir_marcas(marcas: List[tuple]):
+    """Borra las marcas procesadas; si alguna se volvió a marcar entretanto, se conserva"""
+    with write_transaction() as conn:
+        conn.executemany("DELETE FROM CAMBIOS_PENDIENTES WHERE id = ? AND Fecha_Marca = ?",
+                         [(m[0], m[2]) for m in marcas])
+
+
+# ==================== PROPAGACIÓN ====================
+
+def _materializada(id_evaluacion: str, tabla: str) -> bool:
+    """Las tablas derivadas solo se mantienen una vez calculadas para la evaluación"""
+    if tabla == "VULNERABILIDADES_AMENAZAS":
+        return True
+    try:
+        return count_rows(tabla, {"ID_Evaluacion": id_evaluacion}) > 0
+    except sqlite3.OperationalError:
+        return False
+
+
+def _recalcular_madurez(id_evaluacion: str, ids_activos: List[str]) -> int:
+    from services.maturity_service import calcular_madurez_evaluacion, guardar_madurez
+    resultado = calcular_madurez_evaluacion(id_evaluacion, considerar_salvaguardas=False)
+    return 1 if resultado and guardar_madurez(resultado) else 0
+
+
+def propagar_cambios(id_evaluacion: str) -> ResultadoPropagacion:
+    """
+    Recalcula las tablas derivadas de los activos marcados, nivel a nivel.
+
+    Cada nivel recalcula sus tablas derivadas solo para los activos sucios y
+    las marca a su vez, así los niveles siguientes procesan exactamente esos
+    activos. Sin marcas pendientes cuesta una consulta por nivel.
+    """
+    from services import matriz_service as ms
+
+    recalculos = {
+        "VULNERABILIDADES_AMENAZAS": ms.actualizar_impactos_vulnerabilidades,
+        "RIESGO_AMENAZA": lambda e, ids: ms.recalcular_riesgos_evaluacion(e, ids, reemplazar=True).riesgos,
+        "RIESGO_ACTIVOS": ms.actualizar_riesgos_activos,
+        "MAPA_RIESGOS": ms.actualizar_mapa_riesgos,
+        "RESULTADOS_MADUREZ": _recalcular_madurez,
+    }
+
+    resultado = ResultadoPropagacion(id_evaluacion=id_evaluacion)
+    t0 = time.perf_counter()
+    for tabla in ORDEN_TABLAS:
+        if tabla not in DEPENDENCIAS:
+            continue
+        marcas = _leer_marcas(id_evaluacion, tabla)
+        if not marcas:
+            continue
+        activos = sorted({m[1] for m in marcas})
+        resultado.activos.update(activos)
+
+        for derivada in DEPENDENCIAS[tabla]:
+            if _materializada(id_evaluacion, derivada):
+                filas = recalculos[derivada](id_evaluacion, activos)
+                resultado.filas[derivada] = resultado.filas.get(derivada, 0) + filas
+            if derivada in DEPENDENCIAS:
+                # Aunque no esté materializada, los niveles siguientes pueden estarlo
+                marcar_sucio(id_evaluacion, derivada, activos)
+        _consumir_marcas(marcas)
+    resultado.segundos = time.perf_counter() - t0
+    return resultado
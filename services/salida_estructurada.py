@@ -0,0 +1,366 @@
+"""
+Salida estructurada de la IA - Proyecto TITA
+============================================
+Las respuestas de Ollama se pedían como texto libre y luego se buscaba el
+JSON con expresiones regulares; cuando fallaba se caía al heurístico y la
+inferencia se perdía. Aquí están:
+
+- Los esquemas JSON de cada respuesta (campo "format" de Ollama): el modelo
+  genera con gramática restringida y devuelve JSON válido con esa forma.
+  Los códigos MAGERIT/ISO y los IDs de activo se restringen con "enum".
+- Un único parser incremental que admite la respuesta completa o por
+  fragmentos (streaming), ignora el texto alrededor, repara comas finales y
+  recupera los elementos completos de una respuesta truncada.
+- Métricas de parseo por origen (tasa de fallos).
+
+Modo (variable TITA_LLM_SALIDA): "esquema" (por defecto), "json" para
+servidores Ollama sin soporte de esquemas, o "libre" para no enviar format.
+
+Uso:
+    from services.salida_estructurada import formato, esquema_amenazas, extraer_json
+    respuesta = cliente.chat(mensajes, modelo, formato=formato(esquema_amenazas(codigos)))
+    datos = extraer_json(respuesta.texto, dict, origen="amenazas_criticidad")
+"""
+import os
+import re
+import json
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+# ==================== CONFIGURACIÓN ====================
+
+MODO_SALIDA = os.environ.get("TITA_LLM_SALIDA", "esquema")
+
+
+def formato(esquema: Dict) -> Any:
+    """Valor del campo format de Ollama según el modo configurado"""
+    if MODO_SALIDA == "esquema":
+        return esquema
+    if MODO_SALIDA == "json":
+        return "json"
+    return None
+
+
+# ==================== ESQUEMAS ====================
+
+def _texto() -> Dict:
+    return {"type": "string"}
+
+
+def _entero(minimo: int = None, maximo: int = None) -> Dict:
+    esquema = {"type": "integer"}
+    if minimo is not None:
+        esquema["minimum"] = minimo
+    if maximo is not None:
+        esquema["maximum"] = maximo
+    return esquema
+
+
+def _lista(elementos: Dict) -> Dict:
+    return {"type": "array", "items": elementos}
+
+
+def _objeto(propiedades: Dict[str, Dict], requeridos: Iterable[str] = None) -> Dict:
+    return {"type": "object", "properties": propiedades,
+            "required": list(propiedades if requeridos is None else requeridos)}
+
+
+def _codigo(codigos: Optional[Iterable[str]]) -> Dict:
+    """Cadena restringida a los códigos del catálogo (si se conocen)"""
+    codigos = list(codigos or [])
+    return {"type": "string", "enum": codigos} if codigos else _texto()
+
+
+def _amenaza_criticidad(codigos: Optional[Iterable[str]]) -> Dict:
+    return _objeto({
+        "codigo_amenaza": _codigo(codigos),
+        "nombre_amenaza": _texto(),
+        "vulnerabilidad": _texto(),
+        "degradacion_d": _entero(0, 100),
+        "degradacion_i": _entero(0, 100),
+        "degradacion_c": _entero(0, 100),
+        "justificacion": _texto(),
+    }, ["codigo_amenaza", "vulnerabilidad", "justificacion"])
+
+
+def esquema_amenazas(codigos: Iterable[str] = None) -> Dict:
+    """Análisis de amenazas por criticidad de un activo"""
+    return _objeto({
+        "amenazas_identificadas": _lista(_amenaza_criticidad(codigos)),
+        "resumen_analisis": _texto(),
+    })
+
+
+def esquema_grupo(ids_activos: Iterable[str], codigos: Iterable[str] = None) -> Dict:
+    """Análisis agrupado: un resultado por activo del grupo"""
+    return _objeto({
+        "resultados": _lista(_objeto({
+            "id_activo": _codigo(ids_activos),
+            "amenazas_identificadas": _lista(_amenaza_criticidad(codigos)),
+        })),
+    })
+
+
+def esquema_evaluacion_magerit(codigos_amenazas: Iterable[str] = None,
+                               codigos_controles: Iterable[str] = None) -> Dict:
+    """Evaluación completa de un activo (amenazas + controles ISO 27002)"""
+    return _objeto({
+        "probabilidad": _entero(1, 5),
+        "amenazas": _lista(_objeto({
+            "codigo": _codigo(codigos_amenazas),
+            "dimension": {"type": "string", "enum": ["D", "I", "C"]},
+            "justificacion": _texto(),
+            "controles_iso_recomendados": _lista(_objeto({
+                "control": _codigo(codigos_controles),
+                "prioridad": {"type": "string", "enum": ["Alta", "Media", "Baja"]},
+                "motivo": _texto(),
+            })),
+        })),
+        "observaciones": _texto(),
+    })
+
+
+def esquema_salvaguarda(codigos_controles: Iterable[str] = None) -> Dict:
+    return _objeto({
+        "salvaguarda": _texto(),
+        "control_iso": _codigo(codigos_controles),
+        "justificacion": _texto(),
+    })
+
+
+_ACCION = _objeto({"accion": _texto(), "responsable": _texto(), "plazo": _texto(),
+                   "costo": {"type": "string", "enum": ["BAJO", "MEDIO", "ALTO"]}})
+_PUNTO_PROYECCION = _objeto({"mes": _entero(1), "riesgo": {"type": "number"}, "nivel": _texto()})
+
+ESQUEMA_PLAN_TRATAMIENTO = _objeto({
+    "acciones_corto_plazo": _lista(_ACCION),
+    "acciones_mediano_plazo": _lista(_ACCION),
+    "acciones_largo_plazo": _lista(_ACCION),
+    "kpis_seguimiento": _lista(_texto()),
+    "inversion_estimada": _texto(),
+    "reduccion_riesgo_esperada": _texto(),
+})
+
+ESQUEMA_RESUMEN_EJECUTIVO = _objeto({
+    "hallazgos_principales": _lista(_texto()),
+    "recomendaciones_prioritarias": _lista(_texto()),
+    "inversion_estimada": _texto(),
+    "reduccion_riesgo_esperada": _texto(),
+    "conclusion": _texto(),
+})
+
+ESQUEMA_PREDICCION = _objeto({
+    "proyeccion_sin_controles": _lista(_PUNTO_PROYECCION),
+    "proyeccion_con_controles": _lista(_PUNTO_PROYECCION),
+    "factores_incremento": _lista(_texto()),
+    "factores_mitigacion": _lista(_texto()),
+    "recomendacion": _texto(),
+})
+
+ESQUEMA_PRIORIZACION = _objeto({
+    "controles_priorizados": _lista(_objeto({
+        "codigo": _texto(),
+        "costo_estimado": {"type": "string", "enum": ["BAJO", "MEDIO", "ALTO"]},
+        "tiempo_implementacion": _texto(),
+        "roi_seguridad": _entero(1, 5),
+        "justificacion": _texto(),
+    })),
+})
+
+ESQUEMA_ANALISIS_RIESGO = _objeto({
+    "probabilidad": _entero(1, 5),
+    "impacto": _entero(1, 5),
+    "riesgo_inherente": _entero(1, 25),
+    "amenazas": _lista(_objeto({"codigo": _texto(), "nombre": _texto(), "descripcion": _texto(),
+                                "probabilidad": _texto()})),
+    "vulnerabilidades": _lista(_objeto({"nombre": _texto(), "severidad": _entero(1, 5),
+                                        "descripcion": _texto()})),
+    "salvaguardas": _lista(_objeto({"control_iso": _texto(), "nombre": _texto(), "descripcion": _texto(),
+                                    "prioridad": _entero(1, 5)})),
+    "justificacion": _texto(),
+})
+
+ESQUEMA_PREGUNTAS = _lista(_objeto({
+    "ID_Pregunta": _texto(),
+    "Pregunta": _texto(),
+    "Tipo_Respuesta": {"type": "string", "enum": ["0/1", "1-5"]},
+    "Peso": _entero(1, 5),
+    "Dimension": {"type": "string", "enum": ["D", "I", "C"]},
+}, ["Pregunta", "Tipo_Respuesta", "Peso", "Dimension"]))
+
+
+# ==================== PARSER INCREMENTAL ====================
+
+_COMA_FINAL = re.compile(r",(\s*[}\]])")
+
+
+def _decodificar(candidato: str) -> Tuple[bool, Any, bool]:
+    """(ok, valor, reparado)"""
+    try:
+        return True, json.loads(candidato), False
+    except ValueError:
+        pass
+    reparado = _COMA_FINAL.sub(r"\1", candidato)
+    if reparado != candidato:
+        try:
+            return True, json.loads(reparado), True
+        except ValueError:
+            pass
+    return False, None, False
+
+
+class ParserJSONIncremental:
+    """
+    Extrae los objetos/arrays JSON de primer nivel de un texto que puede
+    llegar por fragmentos. Cada valor se devuelve en cuanto se cierra, así
+    que sirve como callback al_token del cliente de Ollama.
+    """
+
+    def __init__(self):
+        self.valores: List[Any] = []
+        self.reparados = 0
+        self._texto = ""
+        self._pos = 0
+        self._inicio: Optional[int] = None
+        self._pila: List[str] = []
+        self._en_cadena = False
+        self._escape = False
+        # Último punto donde el valor abierto puede cortarse y cerrarse (respuesta truncada)
+        self._corte: Optional[Tuple[int, List[str]]] = None
+
+    def alimentar(self, fragmento: str) -> List[Any]:
+        """Añade texto y devuelve los valores completados con él"""
+        self._texto += fragmento
+        nuevos = []
+        texto = self._texto
+        while self._pos < len(texto):
+            c = texto[self._pos]
+            if self._inicio is None:
+                if c in "{[":
+                    self._abrir(c)
+                self._pos += 1
+                continue
+            if self._en_cadena:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._en_cadena = False
+            elif c == '"':
+                self._en_cadena = True
+            elif c in "{[":
+                self._pila.append("}" if c == "{" else "]")
+            elif c in "}]":
+                if c != self._pila[-1]:
+                    self._descartar()
+                    continue
+                self._pila.pop()
+                if not self._pila:
+                    ok, valor, reparado = _decodificar(texto[self._inicio:self._pos + 1])
+                    if not ok:
+                        # Llaves dentro de prosa ("{codigo}"): seguir buscando
+                        self._descartar()
+                        continue
+                    nuevos.append(valor)
+                    self.reparados += reparado
+                    self._inicio = None
+                else:
+                    self._corte = (self._pos + 1, list(self._pila))
+            self._pos += 1
+        if self._inicio is None:
+            # Lo ya recorrido fuera de un valor no hace falta
+            self._texto = self._texto[self._pos:]
+            self._pos = 0
+        self.valores.extend(nuevos)
+        return nuevos
+
+    def finalizar(self) -> List[Any]:
+        """
+        Fin del texto: si quedó un valor abierto (salida cortada por
+        num_predict), se cierra tras su último elemento completo.
+        """
+        if self._inicio is None:
+            return []
+        candidatos = []
+        if not self._en_cadena:
+            candidatos.append((len(self._texto), self._pila))
+        if self._corte is not None:
+            candidatos.append(self._corte)
+        inicio, self._inicio = self._inicio, None
+        for fin, pila in candidatos:
+            candidato = self._texto[inicio:fin].rstrip().rstrip(",") + "".join(reversed(pila))
+            ok, valor, _ = _decodificar(candidato)
+            if ok:
+                self.valores.append(valor)
+                self.reparados += 1
+                return [valor]
+        return []
+
+    def _abrir(self, c: str):
+        self._inicio = self._pos
+        self._pila = ["}" if c == "{" else "]"]
+        self._en_cadena = self._escape = False
+        self._corte = None
+
+    def _descartar(self):
+        self._pos = self._inicio + 1
+        self._inicio = None
+        self._pila = []
+        self._en_cadena = self._escape = False
+        self._corte = None
+
+
+# ==================== EXTRACCIÓN Y MÉTRICAS ====================
+
+_metricas: Dict[str, Dict[str, int]] = {}
+_metricas_lock = threading.Lock()
+_CONTADORES = ("respuestas", "directas", "extraidas", "reparadas", "fallos")
+
+
+def _contar(origen: str, *contadores: str):
+    with _metricas_lock:
+        metricas = _metricas.setdefault(origen, dict.fromkeys(_CONTADORES, 0))
+        for contador in ("respuestas",) + contadores:
+            metricas[contador] += 1
+
+
+def extraer_json(texto: Optional[str], tipo: type = dict, origen: str = "general") -> Optional[Any]:
+    """
+    Primer valor JSON del tipo pedido (dict o list) en la respuesta de la IA,
+    o None si no hay ninguno. Con salida estructurada el texto ya es el JSON;
+    si no, se busca dentro del texto con el parser incremental.
+    """
+    texto = (texto or "").strip()
+    try:
+        valor = json.loads(texto)
+        if isinstance(valor, tipo):
+            _contar(origen, "directas")
+            return valor
+    except ValueError:
+        pass
+    parser = ParserJSONIncremental()
+    parser.alimentar(texto)
+    parser.finalizar()
+    for valor in parser.valores:
+        if isinstance(valor, tipo):
+            _contar(origen, "extraidas", *(("reparadas",) if parser.reparados else ()))
+            return valor
+    _contar(origen, "fallos")
+    return None
+
+
+def metricas_parseo() -> Dict[str, Dict[str, Any]]:
+    """Contadores por origen y total, con la tasa de fallos de parseo"""
+    with _metricas_lock:
+        metricas = {origen: dict(valores) for origen, valores in _metricas.items()}
+    metricas["total"] = {c: sum(m[c] for m in metricas.values()) for c in _CONTADORES}
+    for valores in metricas.values():
+        valores["tasa_fallos"] = valores["fallos"] / valores["respuestas"] if valores["respuestas"] else 0.0
+    return metricas
+
+
+def reiniciar_metricas():
+    with _metricas_lock:
+        _metricas.clear()
@@ -0,0 +1,373 @@
+"""
+Simulación de propagación de fallos (Monte Carlo) - Proyecto TITA
+=================================================================
+Complementa el blast radius determinista de concentration_risk_service con
+una simulación sobre el mismo grafo de dependencias:
+
+- En cada ensayo (un año) cada activo falla con probabilidad 1 - e^(-λ),
+  donde λ es la suma de las frecuencias anuales de sus amenazas MAGERIT
+- Al fallar se degrada según la degradación D media de esas amenazas
+  (DEGRADACION_AMENAZAS o, si no hay fila, el motor de degradación)
+- La degradación baja por las aristas: un dependiente queda al menos en
+  Peso_Dependencia × degradación de su padre, a cualquier profundidad
+- Pérdida = criticidad × degradación
+
+Por activo se obtiene la pérdida esperada (propia y heredada), la
+probabilidad de verse afectado, los percentiles P50/P95/P99 y la pérdida de
+todos sus dependientes (blast radius transitivo). Los ensayos se procesan
+por bloques como matrices NumPy (ensayos × activos), un nivel del grafo a
+la vez. Los resultados se guardan en RESULTADOS_PROPAGACION.
+
+Uso:
+    from services.simulacion_propagacion_service import calcular_propagacion_evaluacion
+    resultados = calcular_propagacion_evaluacion("EVA-001", ensayos=20000, semilla=42)
+"""
+import json
+import datetime as dt
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from services.database_service import get_connection, query_rows, insert_rows, write_transaction
+from services.degradacion_service import cargar_degradaciones
+from services.matriz_degradacion_service import degradaciones_motor
+from services.concentration_risk_service import GrafoDependencias, construir_grafo
+
+
+ENSAYOS_DEFAULT = 20000
+BLOQUE_ENSAYOS = 1000  # ensayos por matriz: acota la memoria a bloque × activos
+CUBETAS_HISTOGRAMA = 200  # resolución de los percentiles: pérdida máxima / 200
+
+# Probabilidad MAGERIT (1-5) → ocurrencias por año, según la escala de los prompts:
+# muy raro (cada 10+ años), poco frecuente (cada 3-5), normal (anual),
+# frecuente (varias veces al año), muy frecuente (mensual)
+FRECUENCIA_ANUAL = {1: 0.1, 2: 0.25, 3: 1.0, 4: 4.0, 5: 12.0}
+
+# Activos sin amenazas analizadas: probabilidad media y degradación por defecto de la tabla
+PROBABILIDAD_DEFAULT = 3
+DEGRADACION_DEFAULT = 0.5
+
+
+# ==================== MODELOS DE DATOS ====================
+
+@dataclass
+class ParametrosFallo:
+    """Frecuencia y severidad de fallo propio de un activo"""
+    frecuencia: float  # λ: ocurrencias por año
+    degradacion: float  # degradación D media cuando falla
+    fuente: str  # 'magerit' o 'defecto'
+
+    @property
+    def probabilidad(self) -> float:
+        """Probabilidad de al menos un fallo en el año (Poisson)"""
+        return float(1.0 - np.exp(-self.frecuencia))
+
+
+@dataclass
+class ResultadoPropagacion:
+    """Resultado de la simulación para un activo"""
+    id_evaluacion: str
+    id_activo: str
+    nombre_activo: str
+    id_host: str
+    nivel: int  # profundidad en el grafo (0 = sin dependencia)
+    frecuencia_anual: float
+    prob_fallo_propio: float
+    prob_afectado: float  # fallo propio o heredado
+    perdida_esperada: float
+    perdida_propia: float
+    perdida_heredada: float
+    impacto_p50: float
+    impacto_p95: float
+    impacto_p99: float
+    num_dependientes: int
+    perdida_dependientes: float  # pérdida esperada de todos sus dependientes
+    perdida_dependientes_p95: float
+    fuente_frecuencia: str
+    ensayos: int
+    fecha_calculo: str
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+# ==================== PARÁMETROS DE FALLO ====================
+
+def parametros_fallo(grafo: GrafoDependencias) -> Dict[str, ParametrosFallo]:
+    """
+    Frecuencia y degradación de fallo de cada activo del grafo con dos
+    consultas: las amenazas del último resultado MAGERIT y las degradaciones
+    registradas de la evaluación.
+    """
+    eval_id = grafo.id_evaluacion
+    # Orden ascendente: la última fila de cada activo es la más reciente
+    magerit = query_rows("RESULTADOS_MAGERIT", {"ID_Evaluacion": eval_id},
+                         columns=["ID_Activo", "Amenazas_JSON"], order_by="Fecha_Evaluacion")
+    amenazas_por_activo = {}
+    for id_activo, amenazas_json in zip(magerit["ID_Activo"].tolist(), magerit["Amenazas_JSON"].tolist()):
+        try:
+            amenazas_por_activo[id_activo] = json.loads(amenazas_json) if amenazas_json else []
+        except (TypeError, ValueError):
+            amenazas_por_activo[id_activo] = []
+
+    degradaciones = cargar_degradaciones(eval_id)
+    degradacion_d = {
+        (id_activo, codigo): float(valor)
+        for id_activo, codigo, valor in zip(degradaciones["ID_Activo"].tolist(),
+                                            degradaciones["Codigo_Amenaza"].tolist(),
+                                            degradaciones["Degradacion_D"].tolist())
+        if valor is not None and not pd.isna(valor)
+    }
+
+    # (activo, código, nivel) de todas las amenazas; las que no tienen
+    # degradación registrada se resuelven con la matriz del motor de una vez
+    filas = []
+    for id_activo in grafo.nodos:
+        for amenaza in amenazas_por_activo.get(id_activo, []):
+            try:
+                nivel = min(5, max(1, int(amenaza.get("probabilidad") or PROBABILIDAD_DEFAULT)))
+            except (TypeError, ValueError):
+                nivel = PROBABILIDAD_DEFAULT
+            filas.append((id_activo, amenaza.get("codigo", ""), nivel))
+    faltantes = [(a, c) for a, c, _ in filas if (a, c) not in degradacion_d]
+    if faltantes:
+        motor = degradaciones_motor([c for _, c in faltantes],
+                                    [grafo.nodos[a].tipo for a, _ in faltantes],
+                                    [grafo.nodos[a].criticidad for a, _ in faltantes])[:, 0]
+        degradacion_motor = dict(zip(faltantes, motor.tolist()))
+    else:
+        degradacion_motor = {}
+
+    frecuencias: Dict[str, float] = {}
+    ponderadas: Dict[str, float] = {}
+    for id_activo, codigo, nivel in filas:
+        deg = degradacion_d.get((id_activo, codigo))
+        if deg is None:
+            deg = degradacion_motor[(id_activo, codigo)]
+        frecuencias[id_activo] = frecuencias.get(id_activo, 0.0) + FRECUENCIA_ANUAL[nivel]
+        ponderadas[id_activo] = ponderadas.get(id_activo, 0.0) + FRECUENCIA_ANUAL[nivel] * deg
+
+    parametros = {}
+    for id_activo in grafo.nodos:
+        frecuencia = frecuencias.get(id_activo, 0.0)
+        if frecuencia > 0:
+            parametros[id_activo] = ParametrosFallo(frecuencia, ponderadas[id_activo] / frecuencia, "magerit")
+        else:
+            parametros[id_activo] = ParametrosFallo(
+                FRECUENCIA_ANUAL[PROBABILIDAD_DEFAULT], DEGRADACION_DEFAULT, "defecto"
+            )
+    return parametros
+
+
+# ==================== SIMULACIÓN ====================
+
+def _como_slice(indices: np.ndarray):
+    """Índices crecientes y consecutivos → slice (vista sin copia); si no, los mismos índices"""
+    if indices.size and np.all(np.diff(indices) == 1):
+        return slice(int(indices[0]), int(indices[-1]) + 1)
+    return indices
+
+
+def _histograma(valores: np.ndarray, maximos: np.ndarray, cubetas: int) -> np.ndarray:
+    """
+    Histograma por fila (activos × cubetas+1). La cubeta 0 es "sin
+    pérdida"; las demás dividen (0, máximo del activo] en tramos iguales.
+    """
+    num = valores.shape[0]
+    escala = np.divide(cubetas, maximos, out=np.zeros_like(maximos), where=maximos > 0)
+    escalados = valores * escala[:, None]
+    np.ceil(escalados, out=escalados)
+    np.minimum(escalados, cubetas, out=escalados)
+    indices = escalados.astype(np.int64)
+    indices += np.arange(num, dtype=np.int64)[:, None] * (cubetas + 1)
+    return np.bincount(indices.ravel(), minlength=num * (cubetas + 1)).reshape(num, cubetas + 1)
+
+
+def _percentil(histograma: np.ndarray, maximos: np.ndarray, ensayos: int, q: float) -> np.ndarray:
+    """Percentil q por activo (límite superior de la cubeta que lo contiene)"""
+    cubetas = histograma.shape[1] - 1
+    rango = max(1, int(np.ceil(q / 100 * ensayos)))
+    cubeta = np.argmax(histograma.cumsum(axis=1) >= rango, axis=1)
+    return cubeta * maximos / cubetas
+
+
+def simular_propagacion(
+    grafo: GrafoDependencias,
+    ensayos: int = ENSAYOS_DEFAULT,
+    semilla: Optional[int] = None,
+    parametros: Dict[str, ParametrosFallo] = None
+) -> List[ResultadoPropagacion]:
+    """
+    Monte Carlo de fallos sobre el grafo de dependencias.
+
+    Args:
+        grafo: Grafo de la evaluación (construir_grafo)
+        ensayos: Años simulados
+        semilla: Semilla del generador (resultados reproducibles)
+        parametros: Frecuencia/degradación por activo (None = parametros_fallo)
+
+    Returns:
+        Un resultado por activo, en el orden topológico del grafo
+    """
+    parametros = parametros or parametros_fallo(grafo)
+    ids = grafo.orden
+    num = len(ids)
+    if num == 0 or ensayos <= 0:
+        return []
+
+    posicion = {id_activo: i for i, id_activo in enumerate(ids)}
+    padre = np.array([posicion.get(grafo.padres.get(id_activo), -1) for id_activo in ids], dtype=np.int64)
+    peso = np.array([grafo.nodos[i].peso for i in ids], dtype=np.float32)
+    valor = np.array([grafo.nodos[i].criticidad for i in ids], dtype=np.float32)
+    frecuencia = np.array([parametros[i].frecuencia for i in ids], dtype=np.float64)
+    probabilidad = (1.0 - np.exp(-frecuencia)).astype(np.float32)
+    severidad = np.array([parametros[i].degradacion for i in ids], dtype=np.float32)
+
+    # El orden topológico garantiza que el padre ya tiene nivel
+    nivel = np.zeros(num, dtype=np.int64)
+    for i in range(num):
+        if padre[i] >= 0:
+            nivel[i] = nivel[padre[i]] + 1
+    niveles = [_como_slice(np.flatnonzero(nivel == n)) for n in range(1, int(nivel.max()) + 1)]
+
+    # Agregación hacia el padre por nivel (del más profundo al raíz): hijos
+    # ordenados por padre para sumar cada grupo con np.add.reduceat
+    agregaciones = []
+    for indices in reversed(niveles):
+        hijos = np.arange(num)[indices]
+        hijos = hijos[np.argsort(padre[hijos], kind="stable")]
+        padres_hijos = padre[hijos]
+        inicios = np.flatnonzero(np.r_[True, padres_hijos[1:] != padres_hijos[:-1]])
+        agregaciones.append((_como_slice(hijos), padres_hijos[inicios], inicios))
+
+    con_dependientes = np.unique(padre[padre >= 0])
+    num_dependientes = np.zeros(num, dtype=np.int64)
+    maximo_dependientes = np.zeros(num, dtype=np.float32)
+    for hijos, padres_grupo, inicios in agregaciones:
+        num_dependientes[padres_grupo] += np.add.reduceat(1 + num_dependientes[hijos], inicios)
+        maximo_dependientes[padres_grupo] += np.add.reduceat(valor[hijos] + maximo_dependientes[hijos], inicios)
+
+    # Matrices activos × ensayos: los niveles y los grupos de hermanos son filas contiguas
+    rng = np.random.default_rng(semilla)
+    suma = np.zeros(num)
+    afectados = np.zeros(num, dtype=np.int64)
+    histograma = np.zeros((num, CUBETAS_HISTOGRAMA + 1), dtype=np.int64)
+    suma_dependientes = np.zeros(con_dependientes.size)
+    histograma_dependientes = np.zeros((con_dependientes.size, CUBETAS_HISTOGRAMA + 1), dtype=np.int64)
+
+    for inicio in range(0, ensayos, BLOQUE_ENSAYOS):
+        bloque = min(BLOQUE_ENSAYOS, ensayos - inicio)
+        degradacion = np.where(rng.random((num, bloque), dtype=np.float32) < probabilidad[:, None],
+                               severidad[:, None], np.float32(0))
+        # La degradación de cada padre baja a sus dependientes, nivel a nivel
+        for indices in niveles:
+            degradacion[indices] = np.maximum(degradacion[indices],
+                                              degradacion[padre[indices]] * peso[indices, None])
+        afectados += np.count_nonzero(degradacion, axis=1)
+        perdida = degradacion
+        perdida *= valor[:, None]
+        suma += perdida.sum(axis=1, dtype=np.float64)
+        histograma += _histograma(perdida, valor, CUBETAS_HISTOGRAMA)
+
+        if con_dependientes.size:
+            dependientes = np.zeros_like(perdida)
+            for hijos, padres_grupo, inicios in agregaciones:
+                dependientes[padres_grupo] += np.add.reduceat(perdida[hijos] + dependientes[hijos], inicios, axis=0)
+            dependientes = dependientes[con_dependientes]
+            suma_dependientes += dependientes.sum(axis=1, dtype=np.float64)
+            histograma_dependientes += _histograma(dependientes, maximo_dependientes[con_dependientes],
+                                                   CUBETAS_HISTOGRAMA)
+
+    esperada = suma / ensayos
+    propia = valor * probabilidad * severidad
+    percentiles = {q: _percentil(histograma, valor, ensayos, q) for q in (50, 95, 99)}
+    esperada_dep = np.zeros(num)
+    p95_dep = np.zeros(num)
+    esperada_dep[con_dependientes] = suma_dependientes / ensayos
+    p95_dep[con_dependientes] = _percentil(histograma_dependientes, maximo_dependientes[con_dependientes],
+                                           ensayos, 95)
+
+    fecha = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    resultados = []
+    for i, id_activo in enumerate(ids):
+        nodo = grafo.nodos[id_activo]
+        resultados.append(ResultadoPropagacion(
+            id_evaluacion=grafo.id_evaluacion,
+            id_activo=id_activo,
+            nombre_activo=nodo.nombre,
+            id_host=grafo.padres.get(id_activo, ""),
+            nivel=int(nivel[i]),
+            frecuencia_anual=round(float(frecuencia[i]), 4),
+            prob_fallo_propio=round(float(probabilidad[i]), 4),
+            prob_afectado=round(afectados[i] / ensayos, 4),
+            perdida_esperada=round(float(esperada[i]), 4),
+            perdida_propia=round(float(propia[i]), 4),
+            # Diferencia con la pérdida analítica propia; el ruido de muestreo no la vuelve negativa
+            perdida_heredada=round(max(0.0, float(esperada[i] - propia[i])), 4),
+            impacto_p50=round(float(percentiles[50][i]), 4),
+            impacto_p95=round(float(percentiles[95][i]), 4),
+            impacto_p99=round(float(percentiles[99][i]), 4),
+            num_dependientes=int(num_dependientes[i]),
+            perdida_dependientes=round(float(esperada_dep[i]), 4),
+            perdida_dependientes_p95=round(float(p95_dep[i]), 4),
+            fuente_frecuencia=parametros[id_activo].fuente,
+            ensayos=ensayos,
+            fecha_calculo=fecha
+        ))
+    return resultados
+
+
+# ==================== FUNCIONES PRINCIPALES ====================
+
+def calcular_propagacion_evaluacion(
+    eval_id: str,
+    ensayos: int = ENSAYOS_DEFAULT,
+    semilla: Optional[int] = None,
+    grafo: GrafoDependencias = None
+) -> List[ResultadoPropagacion]:
+    """Simula la evaluación completa y reemplaza sus filas en RESULTADOS_PROPAGACION"""
+    grafo = grafo or construir_grafo(eval_id)
+    resultados = simular_propagacion(grafo, ensayos, semilla)
+    filas = [{
+        "ID_Evaluacion": r.id_evaluacion,
+        "ID_Activo": r.id_activo,
+        "Nombre_Activo": r.nombre_activo,
+        "ID_Host": r.id_host,
+        "Nivel": r.nivel,
+        "Frecuencia_Anual": r.frecuencia_anual,
+        "Prob_Fallo_Propio": r.prob_fallo_propio,
+        "Prob_Afectado": r.prob_afectado,
+        "Perdida_Esperada": r.perdida_esperada,
+        "Perdida_Propia": r.perdida_propia,
+        "Perdida_Heredada": r.perdida_heredada,
+        "Impacto_P50": r.impacto_p50,
+        "Impacto_P95": r.impacto_p95,
+        "Impacto_P99": r.impacto_p99,
+        "Num_Dependientes": r.num_dependientes,
+        "Perdida_Dependientes": r.perdida_dependientes,
+        "Perdida_Dependientes_P95": r.perdida_dependientes_p95,
+        "Fuente_Frecuencia": r.fuente_frecuencia,
+        "Ensayos": r.ensayos,
+        "Fecha_Calculo": r.fecha_calculo
+    } for r in resultados]
+
+    with write_transaction() as conn:
+        conn.execute("DELETE FROM RESULTADOS_PROPAGACION WHERE ID_Evaluacion = ?", [eval_id])
+        if filas:
+            insert_rows("RESULTADOS_PROPAGACION", filas)
+    return resultados
+
+
+def get_resultados_propagacion(eval_id: str) -> pd.DataFrame:
+    """Resultados de la última simulación, de mayor a menor pérdida esperada"""
+    try:
+        with get_connection() as conn:
+            return pd.read_sql_query('''
+                SELECT * FROM RESULTADOS_PROPAGACION
+                WHERE ID_Evaluacion = ?
+                ORDER BY Perdida_Esperada DESC
+            ''', conn, params=[eval_id])
+    except Exception:
+        return pd.DataFrame()
@@ -0,0 +1,231 @@
+"""
+Telemetría de inferencia de la IA local - Proyecto TITA
+=======================================================
+Ollama devuelve en cada respuesta cuántos tokens evaluó y generó y cuánto
+tardó en cada fase (load_duration, prompt_eval_duration, eval_duration,
+total_duration, en nanosegundos). El cliente compartido registra aquí una
+fila por llamada en TELEMETRIA_LLM:
+
+- modelo, ruta (/api/generate o /api/chat) y origen (servicio que llamó)
+- tokens de prompt y de respuesta, tokens/segundo de generación
+- espera en cola: tiempo de reloj que no corresponde a inferencia
+  (cola del servidor, red y reintentos)
+- aciertos del cache, errores y usos del fallback heurístico
+
+El origen se toma del contexto: las funciones de servicio se decoran con
+@etiquetar_origen("nombre") y todas sus llamadas quedan etiquetadas.
+
+Uso:
+    from services.telemetria_llm_service import tendencia_throughput, resumen_por_modelo
+    df = tendencia_throughput(dias=7, periodo="hora")
+"""
+import os
+import sqlite3
+import inspect
+import functools
+import contextvars
+import datetime as dt
+from typing import Any, Callable, Dict, Optional
+
+import pandas as pd
+
+from services.database_service import get_connection, write_transaction
+
+
+TELEMETRIA_HABILITADA = os.environ.get("TITA_LLM_TELEMETRIA", "1") != "0"
+DIAS_RETENCION = 30
+LIMPIEZA_CADA = 500  # filas insertadas entre pasadas de retención
+
+_origen: contextvars.ContextVar = contextvars.ContextVar("origen_llm", default="general")
+_insertadas = 0
+
+
+# ==================== ORIGEN DE LAS LLAMADAS ====================
+
+def origen_actual() -> str:
+    return _origen.get()
+
+
+def etiquetar_origen(nombre: str):
+    """
+    Decorador: las llamadas a la IA dentro de la función se registran con este
+    origen. En funciones generadoras (respuestas en streaming) el origen se
+    fija en cada reanudación, no solo al crear el generador.
+    """
+    def decorador(funcion: Callable):
+        if inspect.isgeneratorfunction(funcion):
+            @functools.wraps(funcion)
+            def envoltura_generador(*args, **kwargs):
+                generador = funcion(*args, **kwargs)
+                while True:
+                    token = _origen.set(nombre)
+                    try:
+                        valor = next(generador)
+                    except StopIteration as fin:
+                        return fin.value
+                    finally:
+                        _origen.reset(token)
+                    yield valor
+            return envoltura_generador
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            token = _origen.set(nombre)
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                _origen.reset(token)
+        return envoltura
+    return decorador
+
+
+# ==================== REGISTRO ====================
+
+def _segundos(datos: Dict[str, Any], campo: str) -> Optional[float]:
+    valor = datos.get(campo)
+    return valor / 1e9 if valor else None
+
+
+def _insertar(fila: Dict[str, Any]):
+    global _insertadas
+    if not TELEMETRIA_HABILITADA:
+        return
+    fila.setdefault("Fecha", dt.datetime.now().isoformat(timespec="seconds"))
+    fila.setdefault("Origen", origen_actual())
+    columnas = list(fila)
+    try:
+        with write_transaction() as conn:
+            conn.execute(f"INSERT INTO TELEMETRIA_LLM ({', '.join(columnas)}) "
+                         f"VALUES ({', '.join('?' * len(columnas))})", [fila[c] for c in columnas])
+    except sqlite3.Error:
+        # Base sin migrar o bloqueada: la telemetría nunca debe romper una llamada
+        return
+    _insertadas += 1
+    if _insertadas % LIMPIEZA_CADA == 0:
+        limpiar_telemetria()
+
+
+def registrar_llamada(
+    modelo: str,
+    ruta: str,
+    segundos: float,
+    datos: Dict[str, Any] = None,
+    desde_cache: bool = False,
+    intentos: int = 1,
+    primer_token_s: float = None,
+    error: str = None
+):
+    """Una fila por llamada del cliente de Ollama (datos = JSON final de Ollama)"""
+    datos = datos or {}
+    tokens_respuesta = int(datos.get("eval_count") or 0)
+    eval_s = _segundos(datos, "eval_duration")
+    total_s = _segundos(datos, "total_duration")
+    _insertar({
+        "Ruta": ruta,
+        "Modelo": modelo,
+        "Exito": int(error is None),
+        "Desde_Cache": int(desde_cache),
+        "Intentos": intentos,
+        "Tokens_Prompt": int(datos.get("prompt_eval_count") or 0),
+        "Tokens_Respuesta": tokens_respuesta,
+        "Tokens_Por_Segundo": tokens_respuesta / eval_s if eval_s else None,
+        "Segundos_Total": segundos,
+        "Espera_Cola_s": max(0.0, segundos - total_s) if total_s is not None else None,
+        "Carga_s": _segundos(datos, "load_duration"),
+        "Prompt_Eval_s": _segundos(datos, "prompt_eval_duration"),
+        "Eval_s": eval_s,
+        "Primer_Token_s": primer_token_s,
+        "Error": error,
+    })
+
+
+def registrar_fallback(motivo: str = "", modelo: str = ""):
+    """El servicio descartó la IA y usó su método heurístico"""
+    _insertar({"Ruta": "fallback", "Modelo": modelo, "Exito": 0, "Fallback": 1, "Intentos": 0,
+               "Error": motivo[:200] if motivo else None})
+
+
+# ==================== CONSULTAS ====================
+
+_FORMATO_PERIODO = {"hora": 13, "dia": 10}
+
+
+def _desde(dias: float) -> str:
+    return (dt.datetime.now() - dt.timedelta(days=dias)).isoformat(timespec="seconds")
+
+
+def _consulta(sql: str, params: tuple) -> pd.DataFrame:
+    try:
+        with get_connection() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+    except (sqlite3.Error, pd.errors.DatabaseError):
+        return pd.DataFrame()
+
+
+def tendencia_throughput(dias: float = 7, periodo: str = "hora") -> pd.DataFrame:
+    """
+    Inferencias reales (sin cache ni fallback) agrupadas por periodo y modelo:
+    llamadas, tokens/s medio, latencia media, espera media y tokens generados.
+    """
+    largo = _FORMATO_PERIODO[periodo]
+    return _consulta(f'''
+        SELECT substr(Fecha, 1, {largo}) AS Periodo, Modelo,
+               COUNT(*) AS Llamadas,
+               AVG(Tokens_Por_Segundo) AS Tokens_Por_Segundo,
+               AVG(Segundos_Total) AS Latencia_Media_s,
+               AVG(Espera_Cola_s) AS Espera_Media_s,
+               SUM(Tokens_Prompt) AS Tokens_Prompt,
+               SUM(Tokens_Respuesta) AS Tokens_Respuesta
+        FROM TELEMETRIA_LLM
+        WHERE Fecha >= ? AND Exito = 1 AND Desde_Cache = 0 AND Fallback = 0
+        GROUP BY Periodo, Modelo
+        ORDER BY Periodo, Modelo
+    ''', (_desde(dias),))
+
+
+def resumen_por_modelo(dias: float = 7) -> pd.DataFrame:
+    """Totales por modelo: llamadas, aciertos de cache, errores, tokens/s y latencias"""
+    return _consulta('''
+        SELECT Modelo,
+               SUM(Fallback = 0) AS Llamadas,
+               SUM(Desde_Cache) AS Aciertos_Cache,
+               SUM(Exito = 0 AND Fallback = 0) AS Errores,
+               SUM(Fallback) AS Fallbacks,
+               AVG(CASE WHEN Desde_Cache = 0 THEN Tokens_Por_Segundo END) AS Tokens_Por_Segundo,
+               AVG(CASE WHEN Desde_Cache = 0 AND Exito = 1 THEN Segundos_Total END) AS Latencia_Media_s,
+               MAX(CASE WHEN Desde_Cache = 0 AND Exito = 1 THEN Segundos_Total END) AS Latencia_Max_s,
+               AVG(Carga_s) AS Carga_Media_s,
+               AVG(Primer_Token_s) AS Primer_Token_Medio_s,
+               SUM(Tokens_Prompt) AS Tokens_Prompt,
+               SUM(Tokens_Respuesta) AS Tokens_Respuesta
+        FROM TELEMETRIA_LLM
+        WHERE Fecha >= ?
+        GROUP BY Modelo
+        ORDER BY Llamadas DESC
+    ''', (_desde(dias),))
+
+
+def resumen_por_origen(dias: float = 7) -> pd.DataFrame:
+    """Llamadas, cache y fallbacks por servicio de origen"""
+    return _consulta('''
+        SELECT Origen,
+               SUM(Fallback = 0) AS Llamadas,
+               SUM(Desde_Cache) AS Aciertos_Cache,
+               SUM(Exito = 0 AND Fallback = 0) AS Errores,
+               SUM(Fallback) AS Fallbacks,
+               AVG(CASE WHEN Desde_Cache = 0 AND Exito = 1 THEN Segundos_Total END) AS Latencia_Media_s
+        FROM TELEMETRIA_LLM
+        WHERE Fecha >= ?
+        GROUP BY Origen
+        ORDER BY Llamadas DESC
+    ''', (_desde(dias),))
+
+
+def limpiar_telemetria(dias_retencion: float = DIAS_RETENCION) -> int:
+    """Borra las filas más antiguas que la retención; devuelve cuántas"""
+    try:
+        with write_transaction() as conn:
+            return conn.execute("DELETE FROM TELEMETRIA_LLM WHERE Fecha < ?",
+                                (_desde(dias_retencion),)).rowcount
+    except sqlite3.Error:
+        return 0
@@ -0,0 +1,387 @@
+"""
+Cola de trabajos en segundo plano - Proyecto TITA
+
+Las operaciones largas (análisis masivo con IA, salvaguardas en batch, planes
+de tratamiento, riesgo por concentración, exportaciones) se encolan en la
+tabla TRABAJOS y las ejecutan hilos trabajadores del proceso, fuera del ciclo
+de reruns de Streamlit. La UI encola y consulta el estado; el trabajo sigue
+aunque el navegador se cierre, y varios analistas pueden lanzar tareas sin
+bloquear sus sesiones.
+
+Ciclo de vida: encolado → ejecutando → completado | error | cancelado
+
+Uso:
+    from services.trabajos_service import iniciar_workers, encolar_trabajo, get_trabajo
+    iniciar_workers()
+    id_trabajo = encolar_trabajo("concentracion", eval_id)
+    get_trabajo(id_trabajo)["Estado"]
+"""
+import os
+import json
+import uuid
+import socket
+import threading
+import datetime as dt
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from services import database_service
+from services.database_service import write_transaction, insert_rows, query_rows, query_one
+
+
+# ==================== CONFIGURACIÓN ====================
+
+NUM_WORKERS = int(os.environ.get("TITA_WORKERS") or 2)
+INTERVALO_SONDEO = 1.0  # segundos entre consultas de la cola vacía
+INTERVALO_LATIDO = 15.0  # segundos entre latidos de los trabajos en ejecución
+LATIDO_VENCIDO = 4 * INTERVALO_LATIDO  # sin latido → el proceso murió, se reencola
+
+ESTADOS_ACTIVOS = ("encolado", "ejecutando")
+ESTADOS_FINALES = ("completado", "error", "cancelado")
+
+
+class TrabajoCancelado(Exception):
+    """Se lanza dentro de la tarea cuando el usuario pidió cancelarla"""
+
+
+@dataclass
+class ContextoTrabajo:
+    """Lo que recibe cada tarea para informar avance y atender la cancelación"""
+    id_trabajo: str
+    id_evaluacion: str
+
+    def cancelado(self) -> bool:
+        fila = query_one("TRABAJOS", {"ID_Trabajo": self.id_trabajo}, columns=["Cancelar"])
+        return bool(fila and fila["Cancelar"])
+
+    def avance(self, fraccion: float, mensaje: str = ""):
+        """Registra el progreso (0-1); lanza TrabajoCancelado si se pidió cancelar"""
+        with write_transaction() as conn:
+            conn.execute('''
+                UPDATE TRABAJOS SET Progreso = ?, Mensaje = ?, Fecha_Latido = ? WHERE ID_Trabajo = ?
+            ''', (max(0.0, min(1.0, fraccion)), mensaje, _ahora(), self.id_trabajo))
+        if self.cancelado():
+            raise TrabajoCancelado(mensaje)
+
+
+# Tipo de trabajo → (función(contexto, **parametros) → resultado JSON, descripción)
+TIPOS_TRABAJO: Dict[str, tuple] = {}
+
+
+def registrar_tipo(tipo: str, descripcion: str):
+    """Decorador que registra una función como tipo de trabajo encolable"""
+    def decorador(funcion: Callable[..., Any]):
+        TIPOS_TRABAJO[tipo] = (funcion, descripcion)
+        return funcion
+    return decorador
+
+
+def _ahora() -> str:
+    return dt.datetime.now().isoformat()
+
+
+# ==================== API DE LA COLA ====================
+
+def encolar_trabajo(tipo: str, id_evaluacion: str, parametros: Optional[Dict] = None,
+                    usuario: str = "") -> str:
+    """Encola un trabajo y devuelve su ID"""
+    if tipo not in TIPOS_TRABAJO:
+        raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+    id_trabajo = f"JOB-{uuid.uuid4().hex[:12]}"
+    insert_rows("TRABAJOS", [{
+        "ID_Trabajo": id_trabajo, "Tipo": tipo, "ID_Evaluacion": id_evaluacion,
+        "Parametros": json.dumps(parametros or {}, ensure_ascii=False), "Estado": "encolado",
+        "Progreso": 0.0, "Usuario": usuario, "Fecha_Creacion": _ahora(),
+    }])
+    return id_trabajo
+
+
+def get_trabajo(id_trabajo: str) -> Optional[Dict]:
+    """Estado del trabajo con Parametros y Resultado ya decodificados"""
+    fila = query_one("TRABAJOS", {"ID_Trabajo": id_trabajo})
+    if fila is None:
+        return None
+    fila["Parametros"] = json.loads(fila["Parametros"] or "{}")
+    fila["Resultado"] = json.loads(fila["Resultado"]) if fila["Resultado"] else None
+    return fila
+
+
+def listar_trabajos(id_evaluacion: str, tipo: str = None, solo_activos: bool = False) -> pd.DataFrame:
+    """Trabajos de la evaluación, del más reciente al más antiguo"""
+    condiciones = {"ID_Evaluacion": id_evaluacion}
+    if tipo:
+        condiciones["Tipo"] = tipo
+    if solo_activos:
+        condiciones["Estado"] = list(ESTADOS_ACTIVOS)
+    return query_rows(
+        "TRABAJOS", condiciones, order_by="Fecha_Creacion DESC",
+        columns=["ID_Trabajo", "Tipo", "Estado", "Progreso", "Mensaje", "Usuario",
+                 "Fecha_Creacion", "Fecha_Inicio", "Fecha_Fin"]
+    )
+
+
+def ultimo_trabajo(id_evaluacion: str, tipo: str) -> Optional[Dict]:
+    """Trabajo más reciente de ese tipo para la evaluación"""
+    df = listar_trabajos(id_evaluacion, tipo)
+    return get_trabajo(df["ID_Trabajo"].iloc[0]) if not df.empty else None
+
+
+def cancelar_trabajo(id_trabajo: str) -> bool:
+    """
+    Cancela un trabajo: si aún está encolado no llega a ejecutarse; si está
+    en ejecución, la tarea se detiene en su próximo avance().
+    """
+    with write_transaction() as conn:
+        cursor = conn.execute('''
+            UPDATE TRABAJOS SET Estado = 'cancelado', Cancelar = 1, Fecha_Fin = ?
+            WHERE ID_Trabajo = ? AND Estado = 'encolado'
+        ''', (_ahora(), id_trabajo))
+        if cursor.rowcount:
+            return True
+        cursor = conn.execute('''
+            UPDATE TRABAJOS SET Cancelar = 1 WHERE ID_Trabajo = ? AND Estado = 'ejecutando'
+        ''', (id_trabajo,))
+        return cursor.rowcount > 0
+
+
+# ==================== WORKERS ====================
+
+def _tomar_trabajo(worker: str) -> Optional[Dict]:
+    """Reclama el trabajo encolado más antiguo; el UPDATE condicional evita que dos workers tomen el mismo"""
+    with write_transaction() as conn:
+        fila = conn.execute('''
+            SELECT ID_Trabajo FROM TRABAJOS WHERE Estado = 'encolado'
+            ORDER BY Fecha_Creacion, rowid LIMIT 1
+        ''').fetchone()
+        if fila is None:
+            return None
+        ahora = _ahora()
+        cursor = conn.execute('''
+            UPDATE TRABAJOS SET Estado = 'ejecutando', Worker = ?, Fecha_Inicio = ?, Fecha_Latido = ?
+            WHERE ID_Trabajo = ? AND Estado = 'encolado'
+        ''', (worker, ahora, ahora, fila[0]))
+        if cursor.rowcount == 0:
+            return None
+    return get_trabajo(fila[0])
+
+
+def _finalizar(id_trabajo: str, estado: str, mensaje: str, resultado: Any = None):
+    with write_transaction() as conn:
+        conn.execute('''
+            UPDATE TRABAJOS SET Estado = ?, Mensaje = ?, Resultado = ?, Fecha_Fin = ?,
+                Progreso = CASE WHEN ? = 'completado' THEN 1.0 ELSE Progreso END
+            WHERE ID_Trabajo = ?
+        ''', (estado, mensaje, json.dumps(resultado, ensure_ascii=False, default=str)
+              if resultado is not None else None, _ahora(), estado, id_trabajo))
+
+
+def ejecutar_trabajo(trabajo: Dict):
+    """Ejecuta un trabajo ya reclamado y persiste su resultado o error"""
+    funcion, _ = TIPOS_TRABAJO[trabajo["Tipo"]]
+    contexto = ContextoTrabajo(trabajo["ID_Trabajo"], trabajo["ID_Evaluacion"])
+    try:
+        resultado = funcion(contexto, **trabajo["Parametros"])
+    except TrabajoCancelado:
+        _finalizar(trabajo["ID_Trabajo"], "cancelado", "Cancelado por el usuario")
+    except Exception as e:
+        _finalizar(trabajo["ID_Trabajo"], "error", f"{type(e).__name__}: {e}")
+    else:
+        _finalizar(trabajo["ID_Trabajo"], "completado", "Completado", resultado)
+
+
+def procesar_pendientes(worker: str = "sincrono", maximo: int = None) -> int:
+    """Ejecuta en el hilo actual los trabajos encolados (scripts y pruebas)"""
+    procesados = 0
+    while maximo is None or procesados < maximo:
+        trabajo = _tomar_trabajo(worker)
+        if trabajo is None:
+            break
+        ejecutar_trabajo(trabajo)
+        procesados += 1
+    return procesados
+
+
+def reencolar_huerfanos() -> int:
+    """Devuelve a la cola los trabajos cuyo proceso dejó de emitir latidos"""
+    limite = (dt.datetime.now() - dt.timedelta(seconds=LATIDO_VENCIDO)).isoformat()
+    with write_transaction() as conn:
+        cursor = conn.execute('''
+            UPDATE TRABAJOS SET Estado = 'encolado', Worker = NULL, Mensaje = 'Reencolado tras caída del proceso'
+            WHERE Estado = 'ejecutando' AND COALESCE(Fecha_Latido, Fecha_Inicio) < ? AND Cancelar = 0
+        ''', (limite,))
+        return cursor.rowcount
+
+
+_parar = threading.Event()
+_hilos: List[threading.Thread] = []
+_hilos_lock = threading.Lock()
+_prefijo_proceso = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _bucle_worker(nombre: str):
+    while not _parar.is_set():
+        try:
+            trabajo = _tomar_trabajo(nombre)
+        except Exception:
+            trabajo = None
+        if trabajo is None:
+            _parar.wait(INTERVALO_SONDEO)
+            continue
+        ejecutar_trabajo(trabajo)
+
+
+def _bucle_supervisor():
+    """Latido de los trabajos de este proceso y rescate de los huérfanos"""
+    while not _parar.is_set():
+        try:
+            with write_transaction() as conn:
+                conn.execute("UPDATE TRABAJOS SET Fecha_Latido = ? WHERE Estado = 'ejecutando' AND Worker LIKE ?",
+                             (_ahora(), f"{_prefijo_proceso}:%"))
+            reencolar_huerfanos()
+        except Exception:
+            pass
+        _parar.wait(INTERVALO_LATIDO)
+
+
+def iniciar_workers(num_workers: int = None) -> int:
+    """
+    Arranca los hilos trabajadores del proceso (idempotente: Streamlit vuelve
+    a ejecutar el script en cada interacción).
+
+    Returns:
+        Número de hilos trabajadores vivos
+    """
+    with _hilos_lock:
+        _hilos[:] = [h for h in _hilos if h.is_alive()]
+        if _hilos:
+            return len(_hilos) - 1
+        _parar.clear()
+        for i in range(num_workers or NUM_WORKERS):
+            hilo = threading.Thread(target=_bucle_worker, args=(f"{_prefijo_proceso}:{i}",),
+                                    name=f"tita_worker_{i}", daemon=True)
+            hilo.start()
+            _hilos.append(hilo)
+        supervisor = threading.Thread(target=_bucle_supervisor, name="tita_supervisor", daemon=True)
+        supervisor.start()
+        _hilos.append(supervisor)
+        return len(_hilos) - 1
+
+
+def detener_workers(timeout: float = 5.0):
+    """Detiene los hilos trabajadores al terminar el trabajo en curso"""
+    with _hilos_lock:
+        _parar.set()
+        for hilo in _hilos:
+            hilo.join(timeout)
+        _hilos.clear()
+
+
+# ==================== TIPOS DE TRABAJO ====================
+
+def directorio_resultados() -> str:
+    """Carpeta de archivos generados por los trabajos, junto a la base de datos"""
+    ruta = os.path.join(os.path.dirname(os.path.abspath(database_service.DB_PATH)), "trabajos")
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+
+@registrar_tipo("analisis_masivo", "Análisis masivo de activos con IA")
+def _trabajo_analisis_masivo(ctx: ContextoTrabajo, ids_activos: List[str] = None,
+                             concurrencia: int = None, tamano_grupo: int = 1,
+                             modo_rapido: bool = None, umbral_confianza: float = None) -> Dict:
+    from services.analisis_masivo_service import ejecutar_analisis_masivo
+    resultado = ejecutar_analisis_masivo(
+        ctx.id_evaluacion, ids_activos=ids_activos, concurrencia=concurrencia, tamano_grupo=tamano_grupo,
+        modo_rapido=modo_rapido, umbral_confianza=umbral_confianza,
+        progreso=lambda hechos, total, tarea: ctx.avance(hechos / max(total, 1),
+                                                         f"{hechos}/{total}: {tarea.id_activo}")
+    )
+    return {"id_lote": resultado.id_lote, "exitos": resultado.exitos, "errores": resultado.errores,
+            "omitidos": resultado.omitidos, "llamadas_evitadas": resultado.llamadas_evitadas,
+            "resumen": str(resultado)}
+
+
+@registrar_tipo("salvaguardas_batch", "Sugerencia de salvaguardas con IA")
+def _trabajo_salvaguardas(ctx: ContextoTrabajo, id_activo: str = None, modelo: str = None) -> List[Dict]:
+    from services.matriz_service import get_riesgos_evaluacion, get_activos_matriz, guardar_salvaguardas_sugeridas
+    from services.ollama_magerit_service import sugerir_salvaguardas_batch
+    riesgos = get_riesgos_evaluacion(ctx.id_evaluacion)
+    if id_activo:
+        riesgos = riesgos[riesgos["ID_Activo"] == id_activo]
+    activos = get_activos_matriz(ctx.id_evaluacion)
+    if not activos.empty:
+        riesgos = riesgos.merge(activos[["ID_Activo", "Tipo_Activo"]], on="ID_Activo", how="left")
+    ctx.avance(0.0, f"{len(riesgos)} riesgos")
+    resultado = sugerir_salvaguardas_batch(
+        riesgos, modelo, progreso=lambda hechos, total: ctx.avance(hechos / total, f"{hechos}/{total} ternas únicas")
+    )
+    guardar_salvaguardas_sugeridas(ctx.id_evaluacion, resultado, id_activo=id_activo)
+    return json.loads(resultado.to_json(orient="records", force_ascii=False))
+
+
+@registrar_tipo("planes_tratamiento", "Planes de tratamiento con IA")
+def _trabajo_planes(ctx: ContextoTrabajo, modelo: str = None) -> Dict:
+    from services.ia_advanced_service import generar_planes_evaluacion, guardar_resultado_ia
+    planes = generar_planes_evaluacion(
+        ctx.id_evaluacion, modelo,
+        progreso=lambda hechos, total: ctx.avance(hechos / max(total, 1), f"{hechos}/{total} riesgos altos")
+    )
+    if planes:
+        guardar_resultado_ia(ctx.id_evaluacion, "planes_tratamiento",
+                             {"planes": [p.__dict__ for p in planes]}, modelo)
+    return {"planes": len(planes)}
+
+
+@registrar_tipo("concentracion", "Riesgo por concentración")
+def _trabajo_concentracion(ctx: ContextoTrabajo) -> Dict:
+    from services.concentration_risk_service import (
+        construir_grafo, calcular_concentracion_evaluacion, calcular_herencia_evaluacion
+    )
+    grafo = construir_grafo(ctx.id_evaluacion)
+    resultados = calcular_concentracion_evaluacion(ctx.id_evaluacion, grafo)
+    ctx.avance(0.5, f"Blast radius: {len(resultados)} hosts")
+    herencias = calcular_herencia_evaluacion(ctx.id_evaluacion, grafo)
+    return {"hosts": len(resultados), "vms": len(herencias)}
+
+
+@registrar_tipo("propagacion", "Simulación de propagación de fallos")
+def _trabajo_propagacion(ctx: ContextoTrabajo, ensayos: int = None, semilla: int = None) -> Dict:
+    from services.simulacion_propagacion_service import calcular_propagacion_evaluacion, ENSAYOS_DEFAULT
+    ensayos = ensayos or ENSAYOS_DEFAULT
+    ctx.avance(0.0, f"Simulando {ensayos} ensayos")
+    resultados = calcular_propagacion_evaluacion(ctx.id_evaluacion, ensayos, semilla)
+    return {"activos": len(resultados), "ensayos": ensayos,
+            "perdida_esperada": round(sum(r.perdida_esperada for r in resultados), 2)}
+
+
+@registrar_tipo("exportar_matriz_excel", "Exportación de la matriz a Excel")
+def _trabajo_exportar_matriz(ctx: ContextoTrabajo, nombre_evaluacion: str = "Evaluacion") -> Dict:
+    from services.matriz_service import exportar_matriz_excel
+    ctx.avance(0.0, "Generando la matriz")
+    contenido = exportar_matriz_excel(ctx.id_evaluacion, nombre_evaluacion)
+    ctx.avance(0.9, "Guardando el archivo")
+    nombre = f"Matriz_{nombre_evaluacion}_{dt.date.today()}.xlsx"
+    ruta = os.path.join(directorio_resultados(), f"{ctx.id_trabajo}_{nombre}")
+    with open(ruta, "wb") as f:
+        f.write(contenido)
+    return {"archivo": ruta, "nombre": nombre}
+
+
+@registrar_tipo("exportar_powerbi", "Exportación para Power BI")
+def _trabajo_exportar_powerbi(ctx: ContextoTrabajo) -> Dict:
+    from services.export_service import exportar_powerbi_excel
+    nombre = f"PowerBI_{ctx.id_evaluacion}_{dt.date.today()}.xlsx"
+    ruta = os.path.join(directorio_resultados(), f"{ctx.id_trabajo}_{nombre}")
+    ctx.avance(0.0, "Exportando")
+    exito, mensaje = exportar_powerbi_excel(ctx.id_evaluacion, ruta)
+    if not exito:
+        raise RuntimeError(mensaje)
+    try:
+        ctx.avance(1.0, mensaje)
+    except TrabajoCancelado:
+        # Cancelado mientras se exportaba: no dejar el archivo huérfano
+        os.remove(ruta)
+        raise
+    return {"archivo": ruta, "nombre": nombre, "mensaje": mensaje}
@@ -0,0 +1,37 @@
+"""
+Versión de los datos por evaluación - Proyecto TITA
+===================================================
+VERSION_DATOS guarda un contador por evaluación que los triggers de la
+migración v12 incrementan en cada INSERT/UPDATE/DELETE de las tablas de la
+evaluación (inventario, valoraciones, amenazas, riesgos, resultados...).
+Cualquier escritura cuenta, venga de un servicio, de un script o de otro
+proceso, sin que el código que escribe tenga que avisar.
+
+Las cachés derivadas de una evaluación guardan la versión con la que se
+construyeron y se reconstruyen solo cuando cambia (una consulta por clave
+primaria por comprobación).
+
+Uso:
+    from services.version_datos_service import version_evaluacion
+    if cache.version != version_evaluacion(eval_id): ...
+"""
+import sqlite3
+
+from services import database_service as db
+
+
+def version_evaluacion(eval_id: str) -> int:
+    """Contador de cambios de la evaluación (0 si aún no tuvo escrituras)"""
+    try:
+        with db.get_connection() as conn:
+            fila = conn.execute("SELECT Version FROM VERSION_DATOS WHERE ID_Evaluacion = ?",
+                                (eval_id,)).fetchone()
+    except sqlite3.OperationalError:
+        # BD sin migrar: versión siempre nueva, las cachés no sirven datos viejos
+        return -1
+    return fila[0] if fila else 0
+
+
+def clave_version(eval_id: str) -> tuple:
+    """Clave completa para cachés en memoria: BD en uso + versión de la evaluación"""
+    return (db.DB_PATH, eval_id, version_evaluacion(eval_id))
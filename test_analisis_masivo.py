@@ -0,0 +1,205 @@
+"""Pruebas del análisis masivo con IA concurrente y reanudable"""
+import threading
+import time
+
+import pytest
+
+from services import database_service as db
+from services import matriz_service as ms
+from services import analisis_masivo_service as am
+
+
+@pytest.fixture
+def bd_temporal(bd_temporal, monkeypatch):
+    monkeypatch.setattr(am, "ESPERA_REINTENTO", 0.0)
+    return bd_temporal
+
+
+def _poblar(n_activos: int = 8):
+    db.insert_rows("INVENTARIO_ACTIVOS", [
+        {"ID_Activo": f"A{i}", "ID_Evaluacion": "EV", "Nombre_Activo": f"Activo {i}", "Tipo_Activo": "Servidor"}
+        for i in range(n_activos)
+    ])
+    for i in range(n_activos - 1):  # el último activo queda sin valoración D/I/C
+        ms.guardar_valoracion_dic("EV", f"A{i}", f"Activo {i}", d_nivel="A", i_nivel="M", c_nivel="B")
+
+
+class AnalizadorFalso:
+    """Simula Ollama: latencia fija, mide concurrencia y falla a demanda"""
+
+    def __init__(self, latencia=0.05, fallos=None, colgados=()):
+        self.latencia = latencia
+        self.fallos = dict(fallos or {})
+        self.colgados = set(colgados)
+        self.activos = 0
+        self.maximo = 0
+        self.llamadas = []
+        self._lock = threading.Lock()
+
+    def __call__(self, activo, valoracion):
+        id_activo = activo["ID_Activo"]
+        with self._lock:
+            self.llamadas.append(id_activo)
+            self.activos += 1
+            self.maximo = max(self.maximo, self.activos)
+        try:
+            time.sleep(5 if id_activo in self.colgados else self.latencia)
+            with self._lock:
+                if self.fallos.get(id_activo, 0) > 0:
+                    self.fallos[id_activo] -= 1
+                    raise ConnectionError("Ollama no responde")
+            return True, [{"codigo_amenaza": "E.1", "nombre_amenaza": "Errores", "vulnerabilidad": "v",
+                           "degradacion_d": 50, "degradacion_i": 20, "degradacion_c": 0}], "ok"
+        finally:
+            with self._lock:
+                self.activos -= 1
+
+
+def test_concurrencia_acotada_y_resultados_en_orden(bd_temporal):
+    _poblar()
+    ms.agregar_vulnerabilidad_amenaza("EV", "A3", "Activo 3", "v", "a", cod_amenaza="N.1")
+    analizador = AnalizadorFalso(fallos={"A2": 1})
+    avances = []
+
+    resultado = am.ejecutar_analisis_masivo("EV", analizador=analizador, concurrencia=3,
+                                            progreso=lambda h, t, tarea: avances.append((h, t)))
+
+    assert 1 < analizador.maximo <= 3
+    assert [t.id_activo for t in resultado.tareas] == [f"A{i}" for i in range(8)]
+    estados = {t.id_activo: (t.estado, t.mensaje) for t in resultado.tareas}
+    assert estados["A3"] == ("omitido", "Ya analizado")
+    assert estados["A7"] == ("omitido", "Sin valoración DIC")
+    assert resultado.exitos == 6 and resultado.errores == 0
+    assert next(t for t in resultado.tareas if t.id_activo == "A2").intentos == 2
+    assert avances[-1] == (8, 8)
+    va = db.query_one("VULNERABILIDADES_AMENAZAS", {"ID_Activo": "A0"})
+    assert va["Degradacion_D"] == 0.5 and va["Cod_Amenaza"] == "E.1"
+    assert am.lote_pendiente("EV") is None
+
+
+def test_timeout_y_reintentos_agotados_dejan_error(bd_temporal):
+    _poblar(4)
+    analizador = AnalizadorFalso(fallos={"A1": 10}, colgados={"A2"})
+
+    resultado = am.ejecutar_analisis_masivo("EV", analizador=analizador, concurrencia=4,
+                                            timeout_tarea=0.5, reintentos=1)
+
+    estados = {t.id_activo: t for t in resultado.tareas}
+    assert estados["A1"].estado == "error" and "Ollama no responde" in estados["A1"].mensaje
+    assert estados["A1"].intentos == 2
+    assert estados["A2"].estado == "error" and "Timeout" in estados["A2"].mensaje
+    assert estados["A0"].estado == "completado"
+    assert db.count_rows("VULNERABILIDADES_AMENAZAS", {"ID_Activo": "A2"}) == 0
+    assert am.lote_pendiente("EV") == resultado.id_lote
+
+
+def test_lote_interrumpido_se_reanuda_sin_repetir_trabajo(bd_temporal):
+    _poblar(6)
+    id_lote = am.preparar_lote("EV", [f"A{i}" for i in range(6)])
+    with db.get_connection() as conn:
+        # A0 y A1 terminaron antes del corte; A2 quedó a medias
+        conn.execute("UPDATE ANALISIS_MASIVO_TAREAS SET Estado = 'completado' WHERE ID_Activo IN ('A0', 'A1')")
+        conn.execute("UPDATE ANALISIS_MASIVO_TAREAS SET Estado = 'procesando' WHERE ID_Activo = 'A2'")
+    analizador = AnalizadorFalso(latencia=0.0)
+
+    resultado = am.ejecutar_analisis_masivo("EV", analizador=analizador, concurrencia=2)
+
+    assert resultado.id_lote == id_lote
+    assert sorted(analizador.llamadas) == ["A2", "A3", "A4"]
+    assert [t.estado for t in resultado.tareas] == ["completado"] * 5 + ["omitido"]
+    assert db.count_rows("ANALISIS_MASIVO_TAREAS", {"ID_Lote": id_lote}) == 6
+
+
+def test_modo_agrupado_una_llamada_por_tipo_y_banda(bd_temporal):
+    _poblar(6)
+    # Dos bandas de criticidad entre los servidores y un tipo distinto
+    ms.guardar_valoracion_dic("EV", "A4", "Activo 4", d_nivel="B", i_nivel="B", c_nivel="B")
+    db.insert_rows("INVENTARIO_ACTIVOS", [{"ID_Activo": "R1", "ID_Evaluacion": "EV", "Nombre_Activo": "Router",
+                                           "Tipo_Activo": "Red"}])
+    ms.guardar_valoracion_dic("EV", "R1", "Router", d_nivel="A", i_nivel="M", c_nivel="B")
+    llamadas = []
+
+    def analizador_grupo(grupo):
+        ids = [activo["ID_Activo"] for activo, _ in grupo]
+        llamadas.append(ids)
+        # En la primera llamada el lote "olvida" A1: se reintenta solo ese activo
+        return {i: (True, [{"codigo_amenaza": "E.2", "degradacion_d": 40}], "ok")
+                for i in ids if not (i == "A1" and len(llamadas) == 1)}
+
+    resultado = am.ejecutar_analisis_masivo("EV", tamano_grupo=3, analizador_grupo=analizador_grupo,
+                                            concurrencia=1)
+
+    assert llamadas[0] == ["A0", "A1", "A2"] and ["A1"] in llamadas
+    assert sorted(map(sorted, llamadas)) == [["A0", "A1", "A2"], ["A1"], ["A3"], ["A4"], ["R1"]]
+    estados = {t.id_activo: (t.estado, t.intentos) for t in resultado.tareas}
+    assert estados["A1"] == ("completado", 2) and estados["A0"] == ("completado", 1)
+    assert estados["A5"][0] == "omitido" and resultado.exitos == 6
+    assert db.count_rows("VULNERABILIDADES_AMENAZAS", {"ID_Evaluacion": "EV"}) == 6
+
+
+def test_analisis_de_grupo_valida_por_activo(bd_temporal, monkeypatch):
+    import json
+    from services import ollama_magerit_service as oms
+
+    with db.get_connection() as conn:
+        conn.execute("DROP TABLE CATALOGO_AMENAZAS_MAGERIT")
+        conn.execute("CREATE TABLE CATALOGO_AMENAZAS_MAGERIT (codigo TEXT PRIMARY KEY, amenaza TEXT, tipo_amenaza TEXT)")
+        conn.executemany("INSERT INTO CATALOGO_AMENAZAS_MAGERIT VALUES (?, ?, ?)",
+                         [("A.24", "Denegación de servicio", "Ataques"), ("E.2", "Errores", "Errores")])
+    grupo = [({"ID_Activo": f"VM{i}", "Nombre_Activo": f"VM {i}", "Tipo_Activo": "Servidor"},
+              {"Criticidad": 3, "Criticidad_Nivel": "Alto"}) for i in range(3)]
+    respuesta = {"resultados": [
+        {"id_activo": "VM0", "amenazas_identificadas": [{"codigo_amenaza": "A.24"}, {"codigo_amenaza": "X.99"}]},
+        {"id_activo": "VM1", "amenazas_identificadas": [{"codigo_amenaza": "E.2"}]},
+    ]}
+    prompts = []
+
+    def llamar(prompt, modelo=None, system=None, esquema=None):
+        prompts.append((prompt, system))
+        return (True, json.dumps(respuesta)) if len(prompts) == 1 else (False, "sin conexión")
+
+    monkeypatch.setattr(oms, "llamar_ollama", llamar)
+    resultados = oms.analizar_grupo_por_criticidad(grupo)
+
+    assert all(f"VM{i}" in prompts[0][0] for i in range(3)) and "VM0" not in prompts[0][1]
+    assert [a["codigo_amenaza"] for a in resultados["VM0"][1]] == ["A.24"]
+    assert resultados["VM1"][1][0]["fuente_degradacion"] == "MOTOR_MAGERIT"
+    # VM2 no vino en la respuesta conjunta: llamada individual (aquí cae al heurístico)
+    assert len(prompts) == 2 and "VM2" in prompts[1][0] and "heurístico" in resultados["VM2"][2]
+    assert [len(g) for g in oms.agrupar_activos(grupo * 3, tamano_grupo=4)] == [4, 4, 1]
+
+
+def test_ruta_rapida_solo_envia_activos_ambiguos_a_la_ia(bd_temporal):
+    from services import ollama_magerit_service as oms
+
+    with db.get_connection() as conn:
+        conn.execute("DROP TABLE CATALOGO_AMENAZAS_MAGERIT")
+        conn.execute("CREATE TABLE CATALOGO_AMENAZAS_MAGERIT (codigo TEXT PRIMARY KEY, amenaza TEXT, tipo_amenaza TEXT)")
+        conn.executemany("INSERT INTO CATALOGO_AMENAZAS_MAGERIT VALUES (?, ?, ?)",
+                         [("A.24", "Denegación de servicio", "Ataques"), ("A.5", "Suplantación", "Ataques"),
+                          ("E.2", "Errores", "Errores")])
+    db.insert_rows("EVALUACIONES", [{"ID_Evaluacion": "EV", "Nombre": "Evaluación"}])
+    _poblar(5)
+    db.insert_rows("INVENTARIO_ACTIVOS", [{"ID_Activo": "X1", "ID_Evaluacion": "EV", "Nombre_Activo": "Kiosco",
+                                           "Tipo_Activo": "Kiosco"}])
+    ms.guardar_valoracion_dic("EV", "X1", "Kiosco", d_nivel="A", i_nivel="M", c_nivel="B")
+    # A0, A1 y el tipo desconocido X1 con cuestionario completo; A2 con dos respuestas de control
+    db.insert_rows("RESPUESTAS", [
+        {"ID_Evaluacion": "EV", "ID_Activo": a, "ID_Pregunta": f"PF-{b}0{n}", "Valor_Numerico": 2}
+        for a in ("A0", "A1", "X1") for b in "BC" for n in range(1, 5)
+    ] + [{"ID_Evaluacion": "EV", "ID_Activo": "A2", "ID_Pregunta": f"PF-B0{n}", "Valor_Numerico": 2}
+         for n in (1, 2)])
+    assert oms.confianza_heuristica("Servidor Virtual", 8) == pytest.approx(1.0)
+    assert oms.confianza_heuristica("Kiosco", 8) < oms.UMBRAL_CONFIANZA_DEFAULT
+
+    oms.set_modo_rapido("EV", True)
+    analizador = AnalizadorFalso(latencia=0.0)
+    resultado = am.ejecutar_analisis_masivo("EV", analizador=analizador, concurrencia=2)
+
+    assert sorted(analizador.llamadas) == ["A2", "A3", "X1"]
+    rutas = {t.id_activo: t.ruta for t in resultado.tareas}
+    assert rutas["A0"] == rutas["A1"] == "heuristica" and rutas["X1"] == "ia"
+    assert resultado.llamadas_evitadas == 2 and resultado.exitos == 5
+    assert [t.ruta for t in am.get_tareas_lote(resultado.id_lote)] == [t.ruta for t in resultado.tareas]
+    amenazas = db.query_rows("VULNERABILIDADES_AMENAZAS", {"ID_Activo": "A0"})
+    assert set(amenazas["Cod_Amenaza"].tolist()) <= {"A.24", "A.5"} and len(amenazas) == 2
@@ -0,0 +1,74 @@
+"""Pruebas del registro de catálogos en memoria"""
+import os
+import json
+
+import pytest
+
+from services import database_service as db
+from services import catalogos_service as cs
+from services import ia_context_magerit
+from services import ollama_magerit_service as oms
+
+
+@pytest.fixture
+def bd_temporal(bd_temporal):
+    with db.get_connection() as conn:
+        conn.execute("DROP TABLE CATALOGO_AMENAZAS_MAGERIT")
+        conn.execute("CREATE TABLE CATALOGO_AMENAZAS_MAGERIT (codigo TEXT PRIMARY KEY, amenaza TEXT, "
+                     "tipo_amenaza TEXT, dimension_afectada TEXT)")
+        conn.executemany("INSERT INTO CATALOGO_AMENAZAS_MAGERIT VALUES (?, ?, ?, ?)",
+                         [("A.24", "Denegación de servicio", "Ataques", "D"),
+                          ("E.2", "Errores del administrador", "Errores", "I")])
+    cs.invalidar()
+    yield bd_temporal
+    cs.invalidar()
+
+
+def test_carga_unica_e_invalidacion_por_version(bd_temporal):
+    cargas = cs.metricas_registro()["cargas_bd"]
+    assert oms.get_catalogo_amenazas()["A.24"]["tipo_amenaza"] == "Ataques"
+    contexto = ia_context_magerit.get_contexto_completo_ia()
+    for _ in range(5):
+        oms.get_catalogo_amenazas()
+        assert ia_context_magerit.get_contexto_completo_ia() is contexto
+    assert cs.metricas_registro()["cargas_bd"] == cargas + 1
+    assert cs.get_catalogos().amenazas_por_tipo == {"Ataques": ["A.24"], "Errores": ["E.2"]}
+
+    # Edición de filas marcada explícitamente
+    with db.get_connection() as conn:
+        conn.execute("INSERT INTO CATALOGO_AMENAZAS_MAGERIT VALUES ('N.1', 'Fuego', 'Desastres', 'D')")
+    cs.marcar_catalogos_modificados(cs.TABLA_AMENAZAS)
+    assert "N.1" in oms.get_catalogo_amenazas()
+    assert "**N.1**: Fuego" in ia_context_magerit.get_contexto_completo_ia()
+
+    # Recrear la tabla (seed) cambia schema_version: se detecta sin marcar nada
+    with db.get_connection() as conn:
+        conn.execute("DROP TABLE CATALOGO_AMENAZAS_MAGERIT")
+        conn.execute("CREATE TABLE CATALOGO_AMENAZAS_MAGERIT (codigo TEXT PRIMARY KEY, amenaza TEXT, "
+                     "tipo_amenaza TEXT)")
+        conn.execute("INSERT INTO CATALOGO_AMENAZAS_MAGERIT VALUES ('A.5', 'Suplantación', 'Ataques')")
+    assert list(oms.get_catalogo_amenazas()) == ["A.5"]
+    assert oms.get_catalogo_amenazas()["A.5"]["dimension_afectada"] == "D"
+    assert "A.24" not in ia_context_magerit.get_contexto_completo_ia()
+
+
+def test_json_y_fragmentos_por_fecha_de_archivo(bd_temporal, tmp_path):
+    ruta = str(tmp_path / "vulnerabilidades.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump({"SW": {"vulnerabilidades": [1]}}, f)
+    construcciones = []
+
+    @cs.fragmento_catalogo(ruta)
+    def contar_vulnerabilidades():
+        construcciones.append(1)
+        return len(cs.cargar_json(ruta)["SW"]["vulnerabilidades"])
+
+    assert contar_vulnerabilidades() == 1 and contar_vulnerabilidades() == 1
+    assert cs.cargar_json(ruta) is cs.cargar_json(ruta)
+    assert len(construcciones) == 1
+
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump({"SW": {"vulnerabilidades": [1, 2, 3]}}, f)
+    os.utime(ruta, ns=(0, os.stat(ruta).st_mtime_ns + 10 ** 9))
+    assert contar_vulnerabilidades() == 3 and len(construcciones) == 2
+    assert cs.cargar_json(str(tmp_path / "no_existe.json"), {}) == {}
@@ -0,0 +1,73 @@
+"""Pruebas del contexto memorizado por versión de datos y del chatbot en streaming"""
+import json
+
+import pytest
+
+from services import database_service as db
+from services import ia_advanced_service as ia
+from services.ollama_client import OllamaError
+from services.telemetria_llm_service import origen_actual
+from services.version_datos_service import version_evaluacion
+
+
+@pytest.fixture
+def bd_temporal(bd_temporal):
+    db.insert_rows("EVALUACIONES", [{"ID_Evaluacion": "EV", "Nombre": "Evaluación"}])
+    db.insert_rows("RESULTADOS_MAGERIT", [{
+        "ID_Evaluacion": "EV", "ID_Activo": "A1", "Nombre_Activo": "Servidor web", "Riesgo_Inherente": 12,
+        "Nivel_Riesgo": "ALTO", "Amenazas_JSON": json.dumps([{"codigo": "A.24", "nivel_riesgo": "ALTO"}])
+    }])
+    return bd_temporal
+
+
+def test_contexto_se_reconstruye_solo_si_cambian_los_datos(bd_temporal, monkeypatch):
+    construcciones = []
+    original = ia._construir_contexto_evaluacion
+    monkeypatch.setattr(ia, "_construir_contexto_evaluacion",
+                        lambda eval_id: construcciones.append(eval_id) or original(eval_id))
+
+    version = version_evaluacion("EV")
+    primero = ia.contexto_evaluacion("EV")
+    for _ in range(5):
+        assert ia.contexto_evaluacion("EV") == primero
+    assert len(construcciones) == 1 and "Servidor web" in primero
+
+    # Cualquier escritura en las tablas de la evaluación sube la versión (triggers)
+    db.insert_rows("RESULTADOS_MAGERIT", [{"ID_Evaluacion": "EV", "ID_Activo": "A2", "Nombre_Activo": "Base de datos",
+                                           "Riesgo_Inherente": 20, "Nivel_Riesgo": "CRÍTICO"}])
+    assert version_evaluacion("EV") > version
+    nuevo = ia.contexto_evaluacion("EV")
+    assert len(construcciones) == 2 and "Base de datos" in nuevo
+    # Otra evaluación no invalida esta
+    db.insert_rows("INVENTARIO_ACTIVOS", [{"ID_Activo": "X", "ID_Evaluacion": "OTRA", "Nombre_Activo": "x"}])
+    ia.contexto_evaluacion("EV")
+    assert len(construcciones) == 2
+
+
+def test_chatbot_en_streaming(bd_temporal, monkeypatch):
+    llamadas = []
+
+    class ClienteFalso:
+        fallar = False
+
+        def generar_stream(self, prompt, modelo, opciones=None, timeout=None, system=None):
+            llamadas.append({"prompt": prompt, "system": system, "origen": origen_actual()})
+            if self.fallar:
+                raise OllamaError("Ollama no está corriendo", tipo="conexion")
+            yield from ["El activo ", "más crítico ", "es Servidor web."]
+
+    cliente = ClienteFalso()
+    monkeypatch.setattr(ia, "get_cliente", lambda: cliente)
+    historial = []
+    fragmentos = list(ia.consultar_chatbot_magerit_stream("EV", "¿Cuál es el activo más crítico?", historial))
+
+    assert fragmentos == ["El activo ", "más crítico ", "es Servidor web."]
+    assert historial[-1] == {"rol": "assistant", "contenido": "El activo más crítico es Servidor web."}
+    # Datos de la evaluación en el system (prefijo estable), la pregunta en el prompt
+    assert "Servidor web" in llamadas[0]["system"] and "activo más crítico?" in llamadas[0]["prompt"]
+    assert llamadas[0]["origen"] == "chatbot"
+
+    cliente.fallar = True
+    respuesta = "".join(ia.consultar_chatbot_magerit_stream("EV", "¿Qué activo es más crítico?", historial))
+    assert "Servidor web" in respuesta and len(historial) == 4
+    assert llamadas[1]["system"] == llamadas[0]["system"]
@@ -0,0 +1,84 @@
+"""Pruebas del grafo de dependencias para concentración y riesgo heredado"""
+import pytest
+
+from services import database_service as db
+from services import concentration_risk_service as crs
+
+
+def _activo(id_activo, tipo, id_host="", dependencia="total"):
+    return {"ID_Activo": id_activo, "ID_Evaluacion": "EVA-G", "Nombre_Activo": id_activo,
+            "Tipo_Activo": tipo, "ID_Host": id_host, "Tipo_Dependencia": dependencia}
+
+
+def _magerit(id_activo, impacto, riesgo):
+    return {"ID_Evaluacion": "EVA-G", "ID_Activo": id_activo, "Impacto_D": impacto, "Impacto_I": 1,
+            "Impacto_C": 1, "Riesgo_Inherente": riesgo, "Fecha_Evaluacion": "2026-01-01"}
+
+
+def test_un_nivel_host_vm_y_persistencia(bd_temporal):
+    db.insert_rows("EVALUACIONES", [{"ID_Evaluacion": "EVA-G", "Nombre": "Grafo"}])
+    db.insert_rows("INVENTARIO_ACTIVOS", [
+        _activo("HOST", "Servidor Físico"),
+        _activo("VM1", "Servidor Virtual", "HOST"),
+        _activo("VM2", "Servidor Virtual", "HOST"),
+        _activo("VM3", "Servidor Virtual", "HOST", "parcial"),
+        _activo("VM4", "Servidor Virtual"),
+        _activo("HOST2", "Servidor Físico"),
+    ])
+    db.insert_rows("RESULTADOS_MAGERIT", [_magerit("VM1", 5, 4.0), _magerit("VM2", 4, 14.0),
+                                          _magerit("VM3", 2, 2.0), _magerit("HOST", 3, 6.0)])
+
+    resultados = {r.id_host: r for r in crs.calcular_concentracion_evaluacion("EVA-G")}
+    host = resultados["HOST"]
+    # 5 + 4 + 2 × 0.5 (VM3 con dependencia parcial)
+    assert host.blast_radius == pytest.approx(10.0) and host.factor_concentracion == 2
+    assert host.num_vms_dependientes == 3 and host.impacto_d_ajustado == 5
+    assert host.es_spof and [v["id"] for v in host.vms_criticas] == ["VM1", "VM2"]
+    assert host.riesgo_ajustado == pytest.approx(15.0)
+    assert resultados["HOST2"].num_vms_dependientes == 0 and not resultados["HOST2"].es_spof
+
+    herencias = {r.id_activo: r for r in crs.calcular_herencia_evaluacion("EVA-G")}
+    assert herencias["VM1"].ajuste_aplicado and herencias["VM1"].riesgo_final == pytest.approx(10.5)
+    assert not herencias["VM2"].ajuste_aplicado and herencias["VM2"].riesgo_final == 14.0
+    assert herencias["VM4"].nombre_host == "(Sin host asignado)"
+
+    # Recalcular actualiza las filas en lugar de duplicarlas
+    crs.calcular_concentracion_evaluacion("EVA-G")
+    assert db.count_rows("RESULTADOS_CONCENTRACION", {"ID_Evaluacion": "EVA-G"}) == 2
+    assert db.count_rows("RIESGO_HEREDADO", {"ID_Evaluacion": "EVA-G"}) == 4
+    assert set(crs.get_vms_con_riesgo_heredado("EVA-G")["ID_Activo"]) == {"VM1", "VM3"}
+
+
+def test_cadena_multinivel_y_ciclos(bd_temporal):
+    db.insert_rows("EVALUACIONES", [{"ID_Evaluacion": "EVA-G", "Nombre": "Grafo"}])
+    db.insert_rows("INVENTARIO_ACTIVOS", [
+        _activo("APP", "Aplicación", "VM"),
+        _activo("VM", "Servidor Virtual", "HOST"),
+        _activo("HOST", "Servidor Físico", "DC"),
+        _activo("DC", "Instalación"),
+        _activo("X", "Servidor Virtual", "Y"),
+        _activo("Y", "Servidor Virtual", "X"),
+    ])
+    db.insert_rows("RESULTADOS_MAGERIT", [_magerit("APP", 5, 2.0), _magerit("VM", 4, 2.0)])
+
+    grafo = crs.construir_grafo("EVA-G")
+    assert grafo.orden.index("DC") < grafo.orden.index("HOST") < grafo.orden.index("VM") < grafo.orden.index("APP")
+    assert len(grafo.ciclos) == 1 and set(grafo.orden) == set(grafo.nodos)
+
+    concentracion = crs.calcular_concentracion_grafo(grafo)
+    assert set(concentracion) >= {"DC", "HOST", "VM"}
+    # La aplicación llega al datacenter a través de la VM y del host
+    assert concentracion["VM"].blast_radius == 5
+    assert concentracion["HOST"].blast_radius == 9 and concentracion["DC"].blast_radius == 12
+    # El recuento heredado solo cuenta Servidores Virtuales (la aplicación no)
+    assert concentracion["DC"].num_vms_dependientes == concentracion["HOST"].num_vms_dependientes == 1
+    assert concentracion["VM"].num_vms_dependientes == 0
+    assert [v["id"] for v in concentracion["DC"].vms_criticas] == ["VM", "APP"]
+
+    herencias = {r.id_activo: r for r in crs.calcular_herencia_grafo(grafo, concentracion)}
+    # Cada nivel recibe el mayor entre el riesgo ajustado de su padre y lo que este heredó
+    assert herencias["HOST"].riesgo_host == pytest.approx(15.0)
+    assert herencias["VM"].riesgo_host == pytest.approx(12.0)
+    assert herencias["APP"].riesgo_host == pytest.approx(15.0)
+    assert herencias["APP"].riesgo_final == pytest.approx(10.5) and herencias["APP"].id_host == "VM"
+    assert sum(r.justificacion.startswith("Dependencia circular") for r in herencias.values()) == 1
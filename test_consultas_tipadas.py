@@ -0,0 +1,50 @@
+"""Pruebas de la capa de consultas tipadas (filtros resueltos en SQLite)"""
+import pytest
+
+from services import database_service as db
+
+
+@pytest.fixture
+def bd_temporal(bd_vacia):
+    with db.get_connection() as conn:
+        conn.execute("CREATE TABLE INVENTARIO_ACTIVOS (ID_Evaluacion TEXT, ID_Activo TEXT, Nombre_Activo TEXT)")
+        conn.execute("CREATE TABLE RESULTADOS_MAGERIT (ID_Evaluacion TEXT, ID_Activo TEXT, Riesgo_Residual REAL)")
+    db.insert_rows("INVENTARIO_ACTIVOS", [
+        {"ID_Evaluacion": "EVA-001", "ID_Activo": "A1", "Nombre_Activo": "Servidor"},
+        {"ID_Evaluacion": "EVA-001", "ID_Activo": "A2", "Nombre_Activo": "Firewall"},
+        {"ID_Evaluacion": "EVA-002", "ID_Activo": "A3", "Nombre_Activo": "NAS"},
+    ])
+    db.insert_rows("RESULTADOS_MAGERIT", [
+        {"ID_Evaluacion": "EVA-001", "ID_Activo": "A1", "Riesgo_Residual": 4.0},
+        {"ID_Evaluacion": "EVA-002", "ID_Activo": "A3", "Riesgo_Residual": 9.0},
+    ])
+    return bd_vacia
+
+
+def test_activos_filtrados_y_proyectados(bd_temporal):
+    activos = db.get_activos_evaluacion("EVA-001", columns=["ID_Activo"])
+    assert list(activos.columns) == ["ID_Activo"]
+    assert sorted(activos["ID_Activo"]) == ["A1", "A2"]
+    assert db.get_activo("EVA-002", "A1") is None
+    assert db.get_activo("EVA-002", "A3")["Nombre_Activo"] == "NAS"
+
+
+def test_condiciones_in_y_conteo(bd_temporal):
+    filas = db.query_rows("INVENTARIO_ACTIVOS", {"ID_Activo": ["A1", "A3"]}, order_by="ID_Activo")
+    assert list(filas["ID_Activo"]) == ["A1", "A3"]
+    assert db.query_rows("INVENTARIO_ACTIVOS", {"ID_Activo": []}).empty
+    assert db.count_rows("INVENTARIO_ACTIVOS", {"ID_Evaluacion": "EVA-001"}) == 2
+    assert db.count_rows("TABLA_INEXISTENTE") == 0
+
+
+def test_solo_la_tabla_inexistente_se_tolera(bd_temporal):
+    assert db.query_rows("TABLA_INEXISTENTE", columns=["ID_Activo"]).columns.tolist() == ["ID_Activo"]
+    assert db.query_one("TABLA_INEXISTENTE", {"ID_Activo": "A1"}) is None
+    with pytest.raises(Exception, match="no such column"):
+        db.query_rows("INVENTARIO_ACTIVOS", order_by="Columna_Inexistente")
+
+
+def test_resultados_por_evaluacion(bd_temporal):
+    res = db.get_resultados_magerit_evaluacion("EVA-002")
+    assert list(res["ID_Activo"]) == ["A3"]
+    assert db.get_resultados_magerit_evaluacion("EVA-001", id_activo="A2").empty
@@ -0,0 +1,53 @@
+"""Pruebas de la escritura en bloque (insert_rows / upsert_rows)"""
+import pytest
+
+from services import database_service as db
+
+
+@pytest.fixture
+def bd_temporal(bd_vacia):
+    with db.get_connection() as conn:
+        conn.execute("CREATE TABLE T (a TEXT, b TEXT, v INTEGER, nombre TEXT, UNIQUE(a, b))")
+        conn.execute("CREATE TABLE SIN_INDICE (a TEXT, v INTEGER)")
+    return bd_vacia
+
+
+def test_insert_rows_por_bloques(bd_temporal):
+    filas = [{"a": str(i), "b": "x", "v": i} for i in range(250)]
+    resultado = db.insert_rows("T", filas, chunk_size=100)
+    assert resultado.filas == 250
+    assert resultado.transacciones == 3
+    assert resultado.filas_por_segundo > 0
+    assert db.count_rows("T") == 250
+
+
+def test_insert_rows_columnas_en_distinto_orden(bd_temporal):
+    db.insert_rows("T", [{"a": "1", "b": "x", "v": 1}, {"v": 2, "b": "y", "a": "2"}])
+    assert db.query_one("T", {"a": "2"})["v"] == 2
+
+
+def test_upsert_rows_on_conflict(bd_temporal):
+    db.insert_rows("T", [{"a": "1", "b": "x", "v": 1, "nombre": "original"}])
+    db.upsert_rows("T", [{"a": "1", "b": "x", "v": 9, "nombre": "nuevo"},
+                         {"a": "2", "b": "x", "v": 2, "nombre": "nuevo"}],
+                   ["a", "b"], update_columns=["v"])
+    fila = db.query_one("T", {"a": "1"})
+    assert (fila["v"], fila["nombre"]) == (9, "original")
+    assert db.count_rows("T") == 2
+
+
+def test_upsert_sin_indice_unico(bd_temporal):
+    db.upsert_row("SIN_INDICE", {"a": "k", "v": 1}, ["a"])
+    db.upsert_rows("SIN_INDICE", [{"a": "k", "v": 2}, {"a": "m", "v": 3}], ["a"])
+    assert db.count_rows("SIN_INDICE") == 2
+    assert db.query_one("SIN_INDICE", {"a": "k"})["v"] == 2
+
+
+def test_write_transaction_revierte_todo(bd_temporal):
+    with pytest.raises(RuntimeError):
+        with db.write_transaction():
+            db.insert_rows("T", [{"a": "1", "b": "x"}], chunk_size=1)
+            db.delete_rows("T", {"a": "1"})
+            db.insert_rows("T", [{"a": "2", "b": "x"}])
+            raise RuntimeError("fallo")
+    assert db.count_rows("T") == 0
@@ -0,0 +1,111 @@
+"""Pruebas del cache persistente de respuestas de la IA"""
+import time
+
+import pytest
+
+from services import database_service as db
+from services import llm_cache_service as cache
+from services import ollama_monitor
+from services import ollama_client
+
+
+@pytest.fixture
+def bd_temporal(bd_temporal, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_HABILITADA", True)
+    cache.reiniciar_metricas()
+    return bd_temporal
+
+
+def test_lectura_a_traves_y_clave_por_opciones(bd_temporal):
+    llamadas = []
+
+    def generar():
+        llamadas.append(1)
+        return True, f"respuesta {len(llamadas)}"
+
+    assert cache.con_cache("llama3", "prompt", {"temperature": 0.3}, generar) == (True, "respuesta 1")
+    assert cache.con_cache("llama3", "prompt", {"temperature": 0.3}, generar) == (True, "respuesta 1")
+    # Otro modelo u otras opciones de muestreo son otra entrada
+    assert cache.con_cache("llama3", "prompt", {"temperature": 0.7}, generar) == (True, "respuesta 2")
+    assert cache.con_cache("phi3", "prompt", {"temperature": 0.3}, generar) == (True, "respuesta 3")
+    # Los fallos no se cachean
+    assert cache.con_cache("llama3", "otro", None, lambda: (False, "Timeout")) == (False, "Timeout")
+    assert cache.obtener("llama3", "otro") is None
+
+    metricas = cache.metricas_cache()
+    assert len(llamadas) == 3
+    assert metricas["aciertos"] == 1 and metricas["entradas"] == 3
+    assert metricas["tasa_aciertos"] == pytest.approx(1 / 6)
+
+
+def test_ttl_y_expulsion_lru(bd_temporal, monkeypatch):
+    for i in range(5):
+        cache.guardar("m", f"p{i}", "x" * 100)
+    with db.get_connection() as conn:
+        conn.executemany("UPDATE LLM_CACHE SET Fecha_Acceso = ? WHERE Prompt_Hash = ?",
+                         [(time.time() - 100 + i, cache.hash_prompt(f"p{i}")) for i in range(5)])
+    assert cache.obtener("m", "p0") is not None  # p0 pasa a ser la más reciente
+
+    assert cache.limpiar_cache(max_entradas=3) == 2
+    assert [cache.obtener("m", p) is not None for p in ("p0", "p1", "p2", "p3", "p4")] == \
+        [True, False, False, True, True]
+
+    assert cache.limpiar_cache(max_bytes=250) == 1
+    assert cache.metricas_cache()["entradas"] == 2
+
+    monkeypatch.setattr(cache, "CACHE_TTL_SEGUNDOS", -1)
+    assert cache.obtener("m", "p4") is None
+    assert cache.limpiar_cache() == 2
+
+
+def test_llamada_con_reintentos_no_infiere_si_hay_cache(bd_temporal, monkeypatch):
+    peticiones = []
+
+    class Respuesta:
+        status_code = 200
+
+        def json(self):
+            return {"response": " amenazas "}
+
+    def post(url, json, timeout, stream=False):
+        peticiones.append(json)
+        return Respuesta()
+
+    monkeypatch.setattr(ollama_client.get_cliente().session, "post", post)
+
+    assert ollama_monitor.llamar_ollama_con_reintentos("analiza", "llama3") == (True, "amenazas")
+    assert ollama_monitor.llamar_ollama_con_reintentos("analiza", "llama3") == (True, "amenazas")
+    assert len(peticiones) == 1
+    assert peticiones[0]["options"] == ollama_monitor.OPCIONES_REINTENTOS
+
+
+def test_respuesta_invalida_se_retira_y_los_aciertos_no_escriben(bd_temporal, monkeypatch):
+    from services import ollama_service
+
+    peticiones = []
+
+    class Respuesta:
+        status_code = 200
+
+        def json(self):
+            return {"response": "esto no es JSON" if len(peticiones) == 1 else '[{"Pregunta": "¿Backups?"}]'}
+
+    def post(url, json, timeout, stream=False):
+        peticiones.append(json)
+        return Respuesta()
+
+    monkeypatch.setattr(ollama_client.get_cliente().session, "post", post)
+
+    # La respuesta sin JSON se descarta: la siguiente llamada vuelve a inferir
+    assert ollama_service.extract_json_array(ollama_service.ollama_generate("llama3", "preguntas")) == []
+    assert ollama_service.extract_json_array(ollama_service.ollama_generate("llama3", "preguntas")) != []
+    assert len(peticiones) == 2
+
+    # Un acierto no toma el lock de escritura; la posición LRU se vuelca en la siguiente escritura
+    cache.guardar("m", "p", "x")
+    lock_escritura = db._db_lock
+    monkeypatch.setattr(db, "_db_lock", None)
+    assert cache.obtener("m", "p") == "x"
+    monkeypatch.setattr(db, "_db_lock", lock_escritura)
+    cache.limpiar_cache()
+    assert db.query_one("LLM_CACHE", {"Prompt_Hash": cache.hash_prompt("p")})["Aciertos"] == 1
@@ -0,0 +1,59 @@
+"""Pruebas de la madurez por agregados SQL y su snapshot por versión de datos"""
+import pytest
+
+from services import database_service as db
+from services import maturity_service as madurez
+
+
+def _poblar(riesgos, estados):
+    db.insert_rows("INVENTARIO_ACTIVOS", [
+        {"ID_Activo": f"A{i}", "ID_Evaluacion": "EV", "Nombre_Activo": f"Activo {i}"} for i in range(3)
+    ])
+    db.insert_rows("RIESGO_AMENAZA", [
+        {"ID_Evaluacion": "EV", "ID_Activo": "A0", "Amenaza": f"Amenaza {i}", "Riesgo": r}
+        for i, r in enumerate(riesgos)
+    ])
+    db.insert_rows("SALVAGUARDAS", [
+        {"ID_Evaluacion": "EV", "ID_Activo": "A0", "Salvaguarda": f"S{i}", "Estado": e}
+        for i, e in enumerate(estados)
+    ])
+
+
+def test_agregados_en_una_consulta(bd_temporal):
+    _poblar([None, 3.99, 4, 5.99, 6, 12.5], ["Implementada", "pendiente", None, "En curso - IMPLEMENTADA"])
+
+    agregados = madurez.calcular_agregados_madurez("EV")
+
+    assert (agregados.total_activos, agregados.total_riesgos) == (3, 6)
+    assert (agregados.riesgos_bajos, agregados.riesgos_medios, agregados.riesgos_altos) == (2, 2, 2)
+    assert agregados.riesgo_promedio == pytest.approx((3.99 + 4 + 5.99 + 6 + 12.5) / 6)
+    assert agregados.riesgo_maximo == 12.5
+    assert (agregados.total_salvaguardas, agregados.salvaguardas_implementadas) == (4, 2)
+    assert madurez.calcular_agregados_madurez("OTRA").total_activos == 0
+    assert madurez.calcular_madurez_evaluacion("OTRA") is None
+
+
+def test_snapshot_se_reutiliza_hasta_que_cambian_los_datos(bd_temporal, monkeypatch):
+    _poblar([2, 3, 8], ["Implementada"])
+    calculos = []
+    calcular = madurez.calcular_agregados_madurez
+    monkeypatch.setattr(madurez, "calcular_agregados_madurez", lambda e: calculos.append(e) or calcular(e))
+
+    inherente = madurez.calcular_madurez_evaluacion("EV")
+    assert madurez.guardar_madurez(inherente) and len(calculos) == 1
+    guardado = madurez.get_madurez_evaluacion("EV")
+    assert guardado["Modo_Calculo"] == "inherente" and guardado["Total_Riesgos"] == 3
+
+    # Renders de Tab 9 y Tab 10 sin cambios en los datos: sin consultar las tablas
+    for _ in range(3):
+        assert madurez.calcular_madurez_evaluacion("EV").to_dict() == inherente.to_dict()
+        con_controles = madurez.calcular_madurez_evaluacion("EV", considerar_salvaguardas=True)
+    assert len(calculos) == 1 and con_controles.pct_controles_implementados == 100.0
+
+    # Un riesgo nuevo cambia la versión: se recalcula una vez y se actualiza el snapshot
+    db.insert_rows("RIESGO_AMENAZA", [{"ID_Evaluacion": "EV", "ID_Activo": "A1", "Amenaza": "Nueva", "Riesgo": 9}])
+    assert madurez.calcular_madurez_evaluacion("EV").total_controles_posibles == 4
+    madurez.calcular_madurez_evaluacion("EV", considerar_salvaguardas=True)
+    assert len(calculos) == 2
+    guardado = madurez.get_madurez_evaluacion("EV")
+    assert guardado["Total_Riesgos"] == 4 and guardado["Puntuacion_Total"] == inherente.puntuacion_total
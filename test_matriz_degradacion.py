@@ -0,0 +1,56 @@
+"""Pruebas de la matriz de degradación y la resolución en bloque por evaluación"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from services import database_service as db
+from services import degradacion_service as ds
+from services import matriz_degradacion_service as mds
+
+
+def test_matriz_equivale_al_motor_escalar():
+    codigos = ["A.24", "E.1", "N.1", "I.5", "A.99", "Z.1", "", None]
+    tipos = ["Servidor Físico", "Base de Datos", "datos", "Aplicación Web", "Red", "Otro", "", None]
+    criticidades = [0, 1, 3, 5, 2.5, 7]
+    combinaciones = list(itertools.product(codigos, tipos, criticidades))
+
+    obtenido = mds.degradaciones_motor(*zip(*combinaciones))
+    esperado = np.array([ds.obtener_degradacion_motor(c or "", t or "", k)[:3] for c, t, k in combinaciones])
+    assert np.array_equal(obtenido, esperado)
+
+    amenazas = ds.calcular_degradacion_amenazas([{"codigo_amenaza": "A.24"}, {"codigo_amenaza": "X.1"}], "Servidor", 4)
+    d, i, c, justificacion = ds.obtener_degradacion_motor("A.24", "Servidor", 4)
+    assert (amenazas[0]["degradacion_d"], amenazas[0]["degradacion_i"]) == (int(d * 100), int(i * 100))
+    assert amenazas[0]["justificacion_motor"] == justificacion
+
+
+def test_resolver_usa_registradas_y_guarda_sugerencias_en_bloque(bd_temporal, monkeypatch):
+    db.insert_rows("DEGRADACION_AMENAZAS", [{"ID_Evaluacion": "EV", "ID_Activo": "A1", "Codigo_Amenaza": "N.1",
+                                             "Degradacion_D": 0.1, "Degradacion_I": 0.2, "Degradacion_C": 0.9}])
+    pares = pd.DataFrame({
+        "ID_Activo": ["A1", "A1", "A2", "A3"],
+        "codigo": ["N.1", "A.24", "A.24", "A.24"],
+        "Tipo_Activo": ["Servidor", "Servidor", "Servidor", "Base de Datos"],
+        "tipo_amenaza": ["Desastres", "Ataques intencionados", "Ataques intencionados", "Ataques intencionados"],
+    })
+    sugeridas, guardados = [], []
+    sugerir = mds.sugerir_degradacion_ia
+    monkeypatch.setattr(mds, "sugerir_degradacion_ia", lambda **kw: sugeridas.append(kw) or sugerir(**kw))
+    monkeypatch.setattr(mds, "upsert_rows", lambda *args, **kw: guardados.append(args) or db.upsert_rows(*args, **kw))
+    mds._sugerencia.cache_clear()
+
+    resultado = mds.resolver_degradaciones("EV", pares)
+
+    assert resultado[["Degradacion_D", "Degradacion_I", "Degradacion_C"]].iloc[0].tolist() == [0.1, 0.2, 0.9]
+    esperada = sugerir(tipo_activo="Servidor", codigo_amenaza="A.24", tipo_amenaza="Ataques intencionados")
+    assert resultado["Degradacion_C"].iloc[1] == resultado["Degradacion_C"].iloc[2] == esperada.degradacion_c
+    # Una sugerencia por combinación (tipo de activo, amenaza) y un solo guardado
+    assert len(sugeridas) == 2 and len(guardados) == 1
+    registradas = ds.cargar_degradaciones("EV")
+    assert sorted(registradas["Fuente"]) == ["IA", "IA", "IA", "manual"]
+    assert len(ds.cargar_degradaciones("EV", ["A2", "A3"])) == 2 and ds.cargar_degradaciones("EV", []).empty
+
+    # Segunda pasada: todo registrado, sin sugerencias ni escrituras
+    mds.resolver_degradaciones("EV", pares)
+    assert len(sugeridas) == 2 and len(guardados) == 1
@@ -0,0 +1,75 @@
+"""Pruebas de las migraciones versionadas del esquema y de los índices de la matriz"""
+import pytest
+
+from services import database_service as db
+from services import migracion_service as mig
+
+
+def _plan(sql: str, params=()) -> str:
+    with db.get_connection() as conn:
+        filas = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return " | ".join(fila[3] for fila in filas)
+
+
+def test_version_registrada_e_idempotente(bd_temporal):
+    assert mig.version_actual() == mig.VERSION_ESQUEMA
+    assert mig.aplicar_migraciones() == []
+    assert db.count_rows("SCHEMA_VERSION") == len(mig.MIGRACIONES)
+
+
+def test_columnas_agregadas_por_migracion(bd_temporal):
+    with db.get_connection() as conn:
+        assert {"ID_Host", "Tipo_Dependencia"} <= set(mig.columnas_tabla(conn, "INVENTARIO_ACTIVOS"))
+        assert "Respuestas_JSON" in mig.columnas_tabla(conn, "IDENTIFICACION_VALORACION")
+        assert "Riesgo_Objetivo" in mig.columnas_tabla(conn, "RESULTADOS_MAGERIT")
+
+
+def test_migracion_fallida_no_deja_cambios(bd_temporal, monkeypatch):
+    def _fallida(conn):
+        conn.execute("CREATE TABLE A_MEDIAS (id INTEGER)")
+        raise RuntimeError("fallo a mitad de la migración")
+
+    version = mig.VERSION_ESQUEMA + 1
+    monkeypatch.setattr(mig, "MIGRACIONES", mig.MIGRACIONES + [mig.Migracion(version, "fallida", _fallida)])
+    with pytest.raises(RuntimeError):
+        mig.aplicar_migraciones(hasta=version)
+    with db.get_connection() as conn:
+        assert not mig.tabla_existe(conn, "A_MEDIAS")
+    assert mig.version_actual() == mig.VERSION_ESQUEMA
+
+
+def test_migra_base_existente_con_duplicados(bd_vacia, caplog):
+    with db.get_connection() as conn:
+        conn.execute("""CREATE TABLE RIESGO_AMENAZA (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        ID_Evaluacion TEXT NOT NULL, ID_Activo TEXT NOT NULL, Nombre_Activo TEXT,
+                        ID_Vulnerabilidad_Amenaza INTEGER, Amenaza TEXT NOT NULL, Riesgo REAL)""")
+        conn.executemany(
+            "INSERT INTO RIESGO_AMENAZA (ID_Evaluacion, ID_Activo, ID_Vulnerabilidad_Amenaza, Amenaza, Riesgo) "
+            "VALUES ('E', 'A', 7, 'x', ?)", [(1.0,), (2.0,)]
+        )
+    assert mig.aplicar_migraciones() == [m.version for m in mig.MIGRACIONES]
+    filas = db.query_rows("RIESGO_AMENAZA", {"ID_Vulnerabilidad_Amenaza": 7})
+    assert list(filas["Riesgo"]) == [2.0]
+    assert "1 filas duplicadas eliminadas de RIESGO_AMENAZA" in caplog.text
+
+
+@pytest.mark.parametrize("sql, params", [
+    ("SELECT * FROM VULNERABILIDADES_AMENAZAS WHERE ID_Evaluacion = ? AND ID_Activo = ?", ("E", "A")),
+    ("SELECT id FROM RIESGO_AMENAZA WHERE ID_Vulnerabilidad_Amenaza = ?", (1,)),
+    ("SELECT * FROM RIESGO_AMENAZA WHERE ID_Evaluacion = ? AND ID_Activo = ?", ("E", "A")),
+    ("SELECT * FROM SALVAGUARDAS WHERE ID_Evaluacion = ? AND ID_Activo = ?", ("E", "A")),
+    ("SELECT * FROM IDENTIFICACION_VALORACION WHERE ID_Evaluacion = ? AND ID_Activo = ?", ("E", "A")),
+    ("SELECT * FROM RIESGO_ACTIVOS WHERE ID_Evaluacion = ?", ("E",)),
+    ("SELECT * FROM RESULTADOS_MAGERIT WHERE ID_Evaluacion = ?", ("E",)),
+    ("SELECT * FROM RESULTADOS_MAGERIT WHERE ID_Evaluacion = ? AND ID_Activo = ?", ("E", "A")),
+    ("SELECT * FROM DEGRADACION_AMENAZAS WHERE ID_Evaluacion = ? AND ID_Activo = ? AND Codigo_Amenaza = ?",
+     ("E", "A", "A.5")),
+    ("SELECT * FROM MAPA_RIESGOS WHERE ID_Evaluacion = ?", ("E",)),
+    ("DELETE FROM MAPA_RIESGOS WHERE ID_Evaluacion = ? AND ID_Activo = ?", ("E", "A")),
+    ("SELECT * FROM CAMBIOS_PENDIENTES WHERE ID_Evaluacion = ? AND Tabla = ?", ("E", "RIESGO_AMENAZA")),
+    ("DELETE FROM AUDITORIA_CAMBIOS WHERE Fecha_Hora < ?", ("2020-01-01",)),
+])
+def test_consultas_calientes_usan_indice(bd_temporal, sql, params):
+    plan = _plan(sql, params)
+    assert "USING" in plan and "INDEX" in plan, plan
+    assert "SCAN" not in plan, plan
@@ -0,0 +1,95 @@
+"""Pruebas del monitor de salud de Ollama en segundo plano"""
+import threading
+import time
+
+import pytest
+
+from services import ollama_monitor
+from services.ollama_client import OllamaError
+
+
+class ClienteFalso:
+    def __init__(self, disponible=True):
+        self.disponible = disponible
+        self.checks = 0
+
+    def listar_modelos(self, timeout=3):
+        self.checks += 1
+        if not self.disponible:
+            raise OllamaError("Ollama no está corriendo", tipo="conexion")
+        return ["llama3.2:1b", "phi3"]
+
+    def modelos_cargados(self, timeout=3):
+        return ["llama3.2:1b"]
+
+
+def _esperar(condicion, segundos=2.0):
+    limite = time.monotonic() + segundos
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.01)
+    return condicion()
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    falso = ClienteFalso()
+    monkeypatch.setattr(ollama_monitor, "get_cliente", lambda: falso)
+    return falso
+
+
+def test_estado_cacheado_sin_peticiones_por_consulta(cliente):
+    monitor = ollama_monitor.OllamaHealthMonitor(intervalo=3600)
+    monitor.iniciar()
+    try:
+        assert _esperar(lambda: monitor._estado is not None) and cliente.checks == 1
+        for _ in range(20):
+            estado = monitor.estado()
+        assert cliente.checks == 1
+        assert estado.disponible and estado.modelos == ["llama3.2:1b", "phi3"]
+        assert estado.modelos_cargados == ["llama3.2:1b"] and estado.latencia_p50_ms is not None
+
+        # Un error de conexión en una llamada adelanta el check del hilo, sin red en línea
+        assert monitor.asegurar_disponibilidad()[0]
+        assert _esperar(lambda: cliente.checks == 2)
+    finally:
+        monitor.detener()
+
+
+def test_recuperacion_en_segundo_plano_con_espera(cliente, monkeypatch):
+    cliente.disponible = False
+    monitor = ollama_monitor.OllamaHealthMonitor(intervalo=3600)
+    arranques = []
+    monkeypatch.setattr(monitor, "intentar_iniciar_ollama",
+                        lambda: arranques.append(1) or monitor.__setattr__("_ultimo_arranque", time.monotonic()))
+
+    monitor._ciclo()
+    monitor._ciclo()
+    estado = monitor._estado
+    assert not estado.disponible and estado.modelos == [] and estado.intentos_fallidos == 2
+    # Solo un "ollama serve" dentro de ESPERA_ENTRE_ARRANQUES
+    assert len(arranques) == 1
+
+
+def test_checks_concurrentes_publican_un_estado_coherente(cliente):
+    cliente.disponible = False
+    monitor = ollama_monitor.OllamaHealthMonitor(intervalo=3600)
+    hilos = [threading.Thread(target=lambda: [monitor.verificar_salud() for _ in range(50)]) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    estado = monitor._estado
+    assert monitor.intentos_fallidos == estado.intentos_fallidos == 400
+    assert estado.ultimo_check == monitor.ultimo_check and not estado.disponible
+
+    cliente.disponible = True
+    monitor.verificar_salud()
+    estado = monitor._estado
+    assert estado.disponible and estado.intentos_fallidos == 0 and estado.modelos == monitor.modelos_disponibles
+
+
+def test_percentiles_de_latencia():
+    latencias = [float(i) for i in range(1, 101)]
+    assert ollama_monitor._percentil(latencias, 50) == 50.0
+    assert ollama_monitor._percentil(latencias, 95) == 95.0
+    assert ollama_monitor._percentil([], 50) is None
@@ -0,0 +1,104 @@
+"""Pruebas del motor MAGERIT por lotes frente al cálculo activo por activo"""
+import random
+
+import pytest
+
+from services import database_service as db
+from services import magerit_engine as motor
+
+
+AMENAZAS = [("N.1", "Fuego", "Desastres Naturales"), ("I.5", "Avería de origen físico", "De origen industrial"),
+            ("E.1", "Errores de los usuarios", "Errores y fallos no intencionados"),
+            ("A.24", "Denegación de servicio", "Ataques intencionados"), ("A.11", "Acceso no autorizado",
+                                                                          "Ataques intencionados")]
+CONTROLES = [("5.29", "Continuidad", "Organizacional"), ("8.13", "Backups", "Tecnológico"),
+             ("8.7", "Antimalware", "Tecnológico"), ("8.20", "Seguridad de redes", "Tecnológico")]
+PREGUNTAS = ["A01", "A02", "A03", "A04", "A05", "B01", "B02", "C01", "C03", "D01"]
+
+
+@pytest.fixture
+def bd_temporal(bd_temporal):
+    with db.get_connection() as conn:
+        conn.execute("DROP TABLE CATALOGO_AMENAZAS_MAGERIT")
+        conn.execute("CREATE TABLE CATALOGO_AMENAZAS_MAGERIT (codigo TEXT PRIMARY KEY, amenaza TEXT, tipo_amenaza TEXT)")
+        conn.executemany("INSERT INTO CATALOGO_AMENAZAS_MAGERIT VALUES (?, ?, ?)", AMENAZAS)
+        conn.execute("CREATE TABLE CATALOGO_CONTROLES_ISO27002 (codigo TEXT PRIMARY KEY, nombre TEXT, categoria TEXT)")
+        conn.executemany("INSERT INTO CATALOGO_CONTROLES_ISO27002 VALUES (?, ?, ?)", CONTROLES)
+    return bd_temporal
+
+
+def _poblar(n_activos: int, semilla: int = 7) -> dict:
+    rnd = random.Random(semilla)
+    db.insert_rows("EVALUACIONES", [{"ID_Evaluacion": "EV", "Nombre": "Lote"}])
+    db.insert_rows("INVENTARIO_ACTIVOS", [
+        {"ID_Activo": f"A{i}", "ID_Evaluacion": "EV", "Nombre_Activo": f"Activo {i}",
+         "Tipo_Activo": rnd.choice(["Servidor", "Base de Datos", "Aplicación"])}
+        for i in range(n_activos)
+    ])
+    respuestas = []
+    for i in range(n_activos - 1):  # el último activo queda sin respuestas
+        for codigo in rnd.sample(PREGUNTAS, rnd.randint(1, len(PREGUNTAS))):
+            prefijo = "PV" if i % 2 else "PF"
+            respuestas.append({"ID_Evaluacion": "EV", "ID_Activo": f"A{i}", "ID_Pregunta": f"{prefijo}-{codigo}",
+                               "Valor_Numerico": rnd.randint(1, 4), "Peso": rnd.randint(1, 5),
+                               "Dimension": rnd.choice("DIC")})
+    db.insert_rows("RESPUESTAS", respuestas)
+
+    analisis = {}
+    for i in range(n_activos):
+        amenazas = [{
+            "codigo": codigo, "dimension": rnd.choice("dic"), "justificacion": "j",
+            "controles_iso_recomendados": [{"control": c, "prioridad": "Alta", "motivo": "m"}
+                                           for c in rnd.sample(["5.29", "8.7", "9.99"], 2)],
+        } for codigo, _, _ in rnd.sample(AMENAZAS, rnd.randint(0, 3))]
+        if i == 0:
+            amenazas.append({"codigo": "X.99", "dimension": "D"})  # fuera del catálogo
+        analisis[f"A{i}"] = {"amenazas": amenazas, "probabilidad": rnd.randint(1, 5), "observaciones": f"obs {i}"}
+    # Una degradación ya registrada debe prevalecer sobre la sugerida
+    db.insert_rows("DEGRADACION_AMENAZAS", [{"ID_Evaluacion": "EV", "ID_Activo": "A1", "Codigo_Amenaza": "N.1",
+                                             "Degradacion_D": 0.1, "Degradacion_I": 0.2, "Degradacion_C": 0.9}])
+    return analisis
+
+
+def _comparable(resultado):
+    return {k: v for k, v in motor.asdict(resultado).items() if k != "fecha_evaluacion"}
+
+
+def test_lote_equivale_a_activo_por_activo(bd_temporal):
+    analisis = _poblar(25)
+    lote = motor.evaluar_evaluacion_magerit("EV", analisis)
+
+    assert list(lote) == list(analisis)
+    for activo_id, datos in analisis.items():
+        individual = motor.evaluar_activo_magerit("EV", activo_id, datos["amenazas"], datos["probabilidad"],
+                                                  datos["observaciones"])
+        esperado, obtenido = _comparable(individual), _comparable(lote[activo_id])
+        # El orden de los controles existentes globales proviene de un set en el cálculo individual
+        esperado["controles_existentes_global"] = sorted(esperado["controles_existentes_global"])
+        assert obtenido == esperado, activo_id
+
+
+def test_sugerencias_de_degradacion_se_guardan_en_bloque(bd_temporal):
+    analisis = _poblar(6)
+    pares = sum(len([a for a in d["amenazas"] if a["codigo"] != "X.99"]) for d in analisis.values())
+
+    motor.evaluar_evaluacion_magerit("EV", analisis)
+
+    registradas = db.query_rows("DEGRADACION_AMENAZAS", {"ID_Evaluacion": "EV"})
+    assert len(registradas) >= pares
+    fila = db.query_one("DEGRADACION_AMENAZAS", {"ID_Activo": "A1", "Codigo_Amenaza": "N.1"})
+    assert fila["Degradacion_C"] == 0.9
+
+
+def test_recalculo_desde_resultados_guardados(bd_temporal):
+    analisis = _poblar(8)
+    lote = motor.evaluar_evaluacion_magerit("EV", analisis, modelo_ia="llama3")
+    assert motor.guardar_resultados_magerit(list(lote.values())) == len(lote)
+    assert db.count_rows("RESULTADOS_MAGERIT", {"ID_Evaluacion": "EV"}) == len(lote)
+
+    recalculado = motor.evaluar_evaluacion_magerit("EV")
+
+    for activo_id, resultado in lote.items():
+        assert recalculado[activo_id].riesgo_residual_global == resultado.riesgo_residual_global
+        assert [a.codigo for a in recalculado[activo_id].amenazas] == [a.codigo for a in resultado.amenazas]
+        assert recalculado[activo_id].modelo_ia == "llama3"
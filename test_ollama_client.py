@@ -0,0 +1,168 @@
+"""Pruebas del cliente compartido de Ollama"""
+import json
+
+import pytest
+import requests
+
+from services import database_service as db
+from services import llm_cache_service as cache
+from services.ollama_client import (
+    OllamaClient,
+    OllamaError,
+    CircuitoAbierto,
+    CircuitBreaker,
+    PoliticaReintentos
+)
+
+
+@pytest.fixture
+def bd_temporal(bd_temporal, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_HABILITADA", True)
+    return bd_temporal
+
+
+class RespuestaFalsa:
+    def __init__(self, status_code=200, datos=None, lineas=None):
+        self.status_code = status_code
+        self.datos = datos or {}
+        self.lineas = lineas or []
+        self.text = json.dumps(self.datos)
+
+    def json(self):
+        return self.datos
+
+    def iter_lines(self):
+        for linea in self.lineas:
+            yield linea if isinstance(linea, bytes) else json.dumps(linea).encode("utf-8")
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _cliente(monkeypatch, respuestas, **kwargs):
+    """Cliente cuya sesión devuelve (o lanza) los elementos de respuestas en orden"""
+    cliente = OllamaClient(politica=PoliticaReintentos(max_intentos=3, espera_base=0), **kwargs)
+    peticiones = []
+
+    def post(url, json, timeout, stream=False):
+        peticiones.append(json)
+        siguiente = respuestas.pop(0)
+        if isinstance(siguiente, Exception):
+            raise siguiente
+        return siguiente
+
+    monkeypatch.setattr(cliente.session, "post", post)
+    return cliente, peticiones
+
+
+def test_reintentos_keep_alive_y_cache(bd_temporal, monkeypatch):
+    cliente, peticiones = _cliente(monkeypatch, [
+        requests.exceptions.ConnectionError(),
+        RespuestaFalsa(503),
+        RespuestaFalsa(datos={"response": "ok", "eval_count": 7}),
+    ])
+    recuperaciones = []
+
+    respuesta = cliente.generar("p", "llama3", {"temperature": 0.3},
+                                al_error_conexion=lambda: recuperaciones.append(1))
+    assert (respuesta.texto, respuesta.intentos, respuesta.tokens_respuesta) == ("ok", 3, 7)
+    assert recuperaciones == [1]
+    assert peticiones[0]["keep_alive"] == cliente.keep_alive and peticiones[0]["stream"] is False
+
+    # Segunda llamada idéntica: del cache, sin HTTP
+    repetida = cliente.generar("p", "llama3", {"temperature": 0.3})
+    assert repetida.desde_cache and repetida.texto == "ok" and len(peticiones) == 3
+
+    # Un 4xx es un error de la petición: no se reintenta
+    cliente, peticiones = _cliente(monkeypatch, [RespuestaFalsa(404), RespuestaFalsa()], usar_cache=False)
+    with pytest.raises(OllamaError) as error:
+        cliente.generar("p", "inexistente")
+    assert error.value.status == 404 and len(peticiones) == 1
+
+
+def test_circuit_breaker_abre_y_prueba_en_semiabierto(bd_temporal, monkeypatch):
+    circuito = CircuitBreaker(umbral_fallos=2, enfriamiento=60)
+    cliente, peticiones = _cliente(monkeypatch, [requests.exceptions.Timeout()] * 2 +
+                                   [RespuestaFalsa(datos={"response": "de vuelta"})],
+                                   circuito=circuito, usar_cache=False)
+
+    with pytest.raises(CircuitoAbierto):
+        cliente.generar("p", "llama3")
+    assert circuito.estado == "abierto" and len(peticiones) == 2
+
+    # Abierto: falla rápido sin tocar la red
+    with pytest.raises(CircuitoAbierto):
+        cliente.generar("p", "llama3")
+    assert len(peticiones) == 2
+
+    circuito.abierto_desde -= 60
+    assert circuito.estado == "semiabierto"
+    assert cliente.generar("p", "llama3").texto == "de vuelta"
+    assert circuito.estado == "cerrado" and circuito.fallos == 0
+
+
+def test_streaming_entrega_tokens_y_guarda_respuesta(bd_temporal, monkeypatch):
+    lineas = [{"response": "Ame"}, {"response": "nazas"}, {"response": "", "done": True, "eval_count": 2}]
+    cliente, peticiones = _cliente(monkeypatch, [RespuestaFalsa(lineas=lineas)])
+
+    tokens = []
+    respuesta = cliente.generar("p", "llama3", al_token=tokens.append)
+    assert tokens == ["Ame", "nazas"] and respuesta.texto == "Amenazas"
+    assert peticiones[0]["stream"] is True
+    assert respuesta.primer_token_s is not None and respuesta.tokens_respuesta == 2
+
+    # El iterador de streaming reutiliza la respuesta completa del cache
+    assert list(cliente.generar_stream("p", "llama3")) == ["Amenazas"]
+    assert len(peticiones) == 1
+
+
+def test_streaming_ndjson_malformado_es_error(bd_temporal, monkeypatch):
+    lineas = [{"response": "Ame"}, b'{"response": "naz', {"response": "", "done": True}]
+    cliente, _ = _cliente(monkeypatch, [RespuestaFalsa(lineas=lineas)], usar_cache=False)
+
+    # El iterador no termina en silencio con la respuesta a medias
+    recibidos = []
+    with pytest.raises(OllamaError, match="JSON"):
+        for fragmento in cliente.generar_stream("p", "llama3"):
+            recibidos.append(fragmento)
+    assert recibidos == ["Ame"]
+
+
+def test_analisis_por_criticidad_reutiliza_prefijo_por_chat(bd_temporal, monkeypatch):
+    from services import ollama_client, ollama_magerit_service as oms
+
+    with db.get_connection() as conn:
+        conn.execute("DROP TABLE CATALOGO_AMENAZAS_MAGERIT")
+        conn.execute("CREATE TABLE CATALOGO_AMENAZAS_MAGERIT (codigo TEXT PRIMARY KEY, amenaza TEXT, "
+                     "tipo_amenaza TEXT, dimension_afectada TEXT)")
+        conn.executemany("INSERT INTO CATALOGO_AMENAZAS_MAGERIT VALUES (?, ?, ?, ?)",
+                         [("A.24", "Denegación de servicio", "Ataques", "D"),
+                          ("E.2", "Errores del administrador", "Errores", "I")])
+
+    peticiones = []
+    contenido = json.dumps({"amenazas_identificadas": [{"codigo_amenaza": "A.24"}]})
+
+    def post(url, json, timeout, stream=False):
+        peticiones.append((url, json))
+        return RespuestaFalsa(datos={"message": {"role": "assistant", "content": contenido}, "done": True})
+
+    monkeypatch.setattr(ollama_client.get_cliente().session, "post", post)
+
+    for id_activo, tipo in (("ACT-1", "Servidor"), ("ACT-2", "Base de datos")):
+        exito, amenazas, _ = oms.analizar_amenazas_por_criticidad(
+            {"ID_Activo": id_activo, "Nombre_Activo": id_activo, "Tipo_Activo": tipo},
+            {"Criticidad": 3, "Valor_D": 3, "Valor_I": 2, "Valor_C": 1})
+        assert exito and [a["codigo_amenaza"] for a in amenazas] == ["A.24"]
+
+    (url1, p1), (url2, p2) = peticiones
+    assert url1.endswith("/api/chat") and url2.endswith("/api/chat")
+    # Mismo prefijo system byte a byte; solo cambia el mensaje del activo
+    assert p1["messages"][0] == p2["messages"][0] and p1["messages"][0]["role"] == "system"
+    assert p1["messages"][1] != p2["messages"][1] and "ACT-1" not in p1["messages"][0]["content"]
+    assert p1["keep_alive"] == ollama_client.KEEP_ALIVE
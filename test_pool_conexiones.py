@@ -0,0 +1,87 @@
+"""Pruebas del pool de conexiones SQLite (WAL, reutilización por hilo, transacciones anidadas)"""
+import threading
+
+import pytest
+
+from services import database_service as db
+
+
+@pytest.fixture
+def bd_temporal(bd_vacia):
+    with db.get_connection() as conn:
+        conn.execute("CREATE TABLE T (k TEXT PRIMARY KEY, v INTEGER)")
+    return bd_vacia
+
+
+def test_pragmas_y_reutilizacion(bd_temporal):
+    with db.get_connection() as c1:
+        assert c1.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert c1.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    with db.get_connection() as c2:
+        assert c2 is c1
+
+
+def test_anidado_hace_commit_solo_al_salir(bd_temporal):
+    with pytest.raises(RuntimeError):
+        with db.get_connection() as externo:
+            with db.get_connection() as interno:
+                interno.execute("INSERT INTO T VALUES ('a', 1)")
+            assert externo.in_transaction
+            raise RuntimeError("fallo")
+    assert not db.row_exists("T", {"k": "a"})
+
+    db.insert_row("T", {"k": "b", "v": 2})
+    assert db.row_exists("T", {"k": "b"})
+
+
+def test_conexion_distinta_por_hilo(bd_temporal):
+    conexiones = []
+
+    def trabajo():
+        with db.get_connection() as conn:
+            conexiones.append(conn)
+        db.insert_row("T", {"k": threading.current_thread().name, "v": 0})
+
+    hilos = [threading.Thread(target=trabajo, name=f"h{i}") for i in range(4)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+    assert len({id(c) for c in conexiones}) == 4
+    assert len(db.read_table("T")) == 4
+
+
+def test_conexiones_de_hilos_terminados_se_cierran(bd_temporal):
+    hilo = threading.Thread(target=lambda: db.read_table("T"))
+    hilo.start()
+    hilo.join()
+    assert len(db._conexiones_pool) == 2
+
+    otro = threading.Thread(target=lambda: db.read_table("T"))
+    otro.start()
+    otro.join()
+    # La conexión del primer hilo se cerró al abrir la del segundo
+    assert len(db._conexiones_pool) == 2
+
+
+def test_close_connections_reabre_en_otros_hilos(bd_temporal):
+    cerrado, seguir = threading.Event(), threading.Event()
+    lecturas = []
+
+    def trabajador():
+        lecturas.append(len(db.read_table("T")))
+        cerrado.set()
+        seguir.wait()
+        lecturas.append(len(db.read_table("T")))
+
+    hilo = threading.Thread(target=trabajador)
+    hilo.start()
+    cerrado.wait()
+    db.close_connections()
+    db.insert_row("T", {"k": "x", "v": 1})
+    seguir.set()
+    hilo.join()
+
+    # El trabajador no recibe la conexión cerrada (ProgrammingError): abre otra
+    assert lecturas == [0, 1]
@@ -0,0 +1,76 @@
+"""Pruebas de la simulación Monte Carlo de propagación de fallos"""
+import json
+
+import pytest
+
+from services import database_service as db
+from services import concentration_risk_service as crs
+from services import simulacion_propagacion_service as sps
+
+
+@pytest.fixture
+def bd_temporal(bd_temporal):
+    db.insert_rows("EVALUACIONES", [{"ID_Evaluacion": "EVA-P", "Nombre": "Propagación"}])
+    db.insert_rows("INVENTARIO_ACTIVOS", [
+        {"ID_Activo": id_activo, "ID_Evaluacion": "EVA-P", "Nombre_Activo": id_activo, "Tipo_Activo": tipo,
+         "ID_Host": host, "Tipo_Dependencia": dependencia}
+        for id_activo, tipo, host, dependencia in [
+            ("HOST", "Servidor Físico", "", "total"),
+            ("VM1", "Servidor Virtual", "HOST", "total"),
+            ("VM2", "Servidor Virtual", "HOST", "parcial"),
+            ("APP", "Aplicación", "VM1", "total"),
+        ]
+    ])
+    db.insert_rows("RESULTADOS_MAGERIT", [
+        {"ID_Evaluacion": "EVA-P", "ID_Activo": id_activo, "Impacto_D": impacto, "Impacto_I": 1, "Impacto_C": 1,
+         "Riesgo_Inherente": 0, "Fecha_Evaluacion": "2026-01-01"}
+        for id_activo, impacto in [("HOST", 3), ("VM1", 4), ("VM2", 4), ("APP", 5)]
+    ])
+    return bd_temporal
+
+
+def _parametros(**frecuencias):
+    return {id_activo: sps.ParametrosFallo(frecuencias.get(id_activo, 0.0), 0.8, "magerit")
+            for id_activo in ("HOST", "VM1", "VM2", "APP")}
+
+
+def test_fallo_seguro_se_propaga_por_la_cadena(bd_temporal):
+    grafo = crs.construir_grafo("EVA-P")
+    resultados = {r.id_activo: r for r in sps.simular_propagacion(grafo, 3000, 1, _parametros(HOST=50.0))}
+
+    # VM1 total: 4 × 0.8; VM2 parcial: 4 × 0.8 × 0.5; APP bajo VM1: 5 × 0.8
+    assert resultados["VM1"].perdida_esperada == pytest.approx(3.2, rel=1e-3)
+    assert resultados["VM2"].impacto_p95 == pytest.approx(1.6, rel=1e-2)
+    assert resultados["APP"].perdida_esperada == pytest.approx(4.0, rel=1e-3)
+    assert resultados["APP"].nivel == 2 and resultados["APP"].prob_afectado == 1.0
+    assert resultados["APP"].perdida_propia == 0 and resultados["APP"].perdida_heredada == pytest.approx(4.0, rel=1e-3)
+
+    host = resultados["HOST"]
+    assert host.num_dependientes == 3 and host.prob_fallo_propio == pytest.approx(1.0)
+    assert host.perdida_dependientes == pytest.approx(3.2 + 1.6 + 4.0, rel=1e-3)
+    assert resultados["VM1"].num_dependientes == 1 and resultados["VM2"].perdida_dependientes == 0
+
+
+def test_montecarlo_converge_y_se_guarda(bd_temporal):
+    grafo = crs.construir_grafo("EVA-P")
+    resultados = {r.id_activo: r for r in sps.simular_propagacion(grafo, 20000, 7, _parametros(HOST=1.0))}
+    # P(fallo del host) = 1 - e^-1
+    assert resultados["HOST"].prob_fallo_propio == pytest.approx(0.6321, abs=1e-3)
+    assert resultados["VM1"].prob_afectado == pytest.approx(0.632, abs=0.015)
+    assert resultados["VM1"].perdida_esperada == pytest.approx(3.2 * 0.632, rel=0.03)
+    assert resultados["VM1"].impacto_p50 == pytest.approx(3.2, rel=1e-2) and resultados["VM1"].impacto_p99 > 0
+
+    # Frecuencia desde las amenazas MAGERIT y la degradación registrada
+    db.update_row("RESULTADOS_MAGERIT", {"Amenazas_JSON": json.dumps([{"codigo": "A.24", "probabilidad": 3}])},
+                  {"ID_Evaluacion": "EVA-P", "ID_Activo": "HOST"})
+    db.insert_rows("DEGRADACION_AMENAZAS", [{"ID_Evaluacion": "EVA-P", "ID_Activo": "HOST",
+                                             "Codigo_Amenaza": "A.24", "Degradacion_D": 0.9}])
+    parametros = sps.parametros_fallo(grafo)
+    assert (parametros["HOST"].frecuencia, parametros["HOST"].degradacion) == (1.0, 0.9)
+    assert parametros["VM1"].fuente == "defecto"
+
+    primera = sps.calcular_propagacion_evaluacion("EVA-P", 2000, semilla=3)
+    segunda = sps.calcular_propagacion_evaluacion("EVA-P", 2000, semilla=3)
+    assert [r.perdida_esperada for r in primera] == [r.perdida_esperada for r in segunda]
+    guardados = sps.get_resultados_propagacion("EVA-P")
+    assert len(guardados) == 4 and set(guardados["Fuente_Frecuencia"]) == {"magerit", "defecto"}
@@ -0,0 +1,100 @@
+"""Pruebas del recálculo incremental de las tablas derivadas de la matriz"""
+from services import database_service as db
+from services import matriz_service as ms
+from services import recalculo_incremental_service as inc
+from services.maturity_service import calcular_madurez_evaluacion, guardar_madurez
+
+
+CODIGOS = ["A.5", "E.1", "N.1", "I.5"]
+NIVELES = ["B", "M", "A", "N"]
+
+
+def _poblar(n_activos: int = 10):
+    db.insert_rows("INVENTARIO_ACTIVOS", [
+        {"ID_Activo": f"A{i}", "ID_Evaluacion": "EV", "Nombre_Activo": f"Activo {i}"} for i in range(n_activos)
+    ])
+    for i in range(n_activos):
+        nivel = NIVELES[i % len(NIVELES)]
+        ms.guardar_valoracion_dic("EV", f"A{i}", f"Activo {i}", d_nivel=nivel, i_nivel="B", c_nivel="N")
+        ms.agregar_vulnerabilidades_amenazas("EV", f"A{i}", f"Activo {i}", [
+            {"amenaza": f"Amenaza {c}", "cod_amenaza": c, "vulnerabilidad": "v",
+             "deg_d": 0.2 * (j + 1), "deg_i": 0.1, "deg_c": 0.0}
+            for j, c in enumerate(CODIGOS)
+        ])
+    # Cálculo completo inicial de toda la cadena
+    ms.recalcular_riesgos_evaluacion("EV")
+    ms.recalcular_todos_riesgos_activos("EV")
+    ms.generar_mapa_riesgos("EV")
+    guardar_madurez(calcular_madurez_evaluacion("EV"))
+    inc.propagar_cambios("EV")
+    assert not inc.hay_cambios_pendientes("EV")
+
+
+def _estado():
+    riesgos = db.query_rows("RIESGO_AMENAZA", {"ID_Evaluacion": "EV"},
+                            columns=["ID_Vulnerabilidad_Amenaza", "Frecuencia", "Impacto", "Riesgo"],
+                            order_by="ID_Vulnerabilidad_Amenaza")
+    activos = db.query_rows("RIESGO_ACTIVOS", {"ID_Evaluacion": "EV"},
+                            columns=["ID_Activo", "Riesgo_Actual", "Estado", "Num_Amenazas"], order_by="ID_Activo")
+    mapa = db.query_rows("MAPA_RIESGOS", {"ID_Evaluacion": "EV"},
+                         columns=["ID_Activo", "Descripcion_Amenaza", "Impacto", "Frecuencia", "Zona_Riesgo"],
+                         order_by="ID_Activo, Descripcion_Amenaza")
+    return (riesgos.round(9).to_dict("records"), activos.round(9).to_dict("records"),
+            mapa.round(9).to_dict("records"))
+
+
+def _reconstruccion_completa():
+    ms.recalcular_riesgos_evaluacion("EV", reemplazar=True)
+    ms.recalcular_todos_riesgos_activos("EV")
+    ms.generar_mapa_riesgos("EV")
+    return _estado()
+
+
+def test_cambio_dic_de_un_activo_solo_rederiva_ese_activo(bd_temporal):
+    _poblar()
+
+    ms.guardar_valoracion_dic("EV", "A0", "Activo 0", d_nivel="A", i_nivel="A", c_nivel="A")
+    assert inc.cambios_pendientes("EV") == {"IDENTIFICACION_VALORACION": {"A0"}}
+
+    resultado = inc.propagar_cambios("EV")
+
+    assert resultado.activos == {"A0"}
+    assert resultado.filas["VULNERABILIDADES_AMENAZAS"] == len(CODIGOS)
+    assert resultado.filas["RIESGO_AMENAZA"] == len(CODIGOS)
+    assert resultado.filas["RIESGO_ACTIVOS"] == 1
+    assert resultado.filas["MAPA_RIESGOS"] == len(CODIGOS)
+    assert resultado.filas["RESULTADOS_MADUREZ"] == 1
+    assert not inc.hay_cambios_pendientes("EV")
+
+    incremental = _estado()
+    assert incremental == _reconstruccion_completa()
+
+
+def test_eliminar_amenaza_propaga_hasta_el_mapa(bd_temporal):
+    _poblar()
+    id_va = db.query_one("VULNERABILIDADES_AMENAZAS", {"ID_Activo": "A2", "Cod_Amenaza": "A.5"})["id"]
+
+    assert ms.eliminar_vulnerabilidad_amenaza(id_va)
+    inc.propagar_cambios("EV")
+
+    assert db.count_rows("RIESGO_AMENAZA", {"ID_Activo": "A2"}) == len(CODIGOS) - 1
+    assert db.query_one("RIESGO_ACTIVOS", {"ID_Activo": "A2"})["Num_Amenazas"] == len(CODIGOS) - 1
+    assert db.count_rows("MAPA_RIESGOS", {"ID_Activo": "A2"}) == len(CODIGOS) - 1
+    ids = db.query_rows("MAPA_RIESGOS", {"ID_Evaluacion": "EV"}, columns=["Riesgo_ID"])["Riesgo_ID"]
+    assert sorted(ids, key=lambda r: int(r[1:])) == [f"R{n}" for n in range(1, len(ids) + 1)]
+    assert _estado() == _reconstruccion_completa()
+
+
+def test_tablas_no_calculadas_no_se_materializan(bd_temporal):
+    db.insert_rows("INVENTARIO_ACTIVOS", [{"ID_Activo": "A0", "ID_Evaluacion": "EV", "Nombre_Activo": "x"}])
+    ms.guardar_valoracion_dic("EV", "A0", "x", d_nivel="A")
+    ms.agregar_vulnerabilidad_amenaza("EV", "A0", "x", "v", "a", cod_amenaza="E.1", deg_d=0.5)
+
+    resultado = inc.propagar_cambios("EV")
+
+    assert resultado.activos == {"A0"}
+    assert db.count_rows("RIESGO_AMENAZA", {"ID_Evaluacion": "EV"}) == 0
+    assert db.count_rows("MAPA_RIESGOS", {"ID_Evaluacion": "EV"}) == 0
+    assert db.query_one("VULNERABILIDADES_AMENAZAS", {"ID_Activo": "A0"})["Impacto"] == 1.5
+    assert not inc.hay_cambios_pendientes("EV")
+    assert str(inc.propagar_cambios("EV")) == "EV: sin cambios pendientes"
@@ -0,0 +1,83 @@
+"""Pruebas del recálculo en bloque de RIESGO_AMENAZA frente al cálculo amenaza por amenaza"""
+import random
+
+from services import database_service as db
+from services import matriz_service as ms
+from services.cuestionario_dic_service import calcular_frecuencia_todas_amenazas
+
+
+CODIGOS = ["A.5", "A.24", "E.1", "E.8", "N.1", "I.5", "X.1", ""]
+
+
+def _poblar(n_activos: int = 12, semilla: int = 3):
+    rnd = random.Random(semilla)
+    db.insert_rows("INVENTARIO_ACTIVOS", [
+        {"ID_Activo": f"A{i}", "ID_Evaluacion": "EV", "Nombre_Activo": f"Activo {i}"} for i in range(n_activos)
+    ])
+    # Algunos activos quedan sin valoración D/I/C (frecuencia media por defecto)
+    db.insert_rows("IDENTIFICACION_VALORACION", [
+        {"ID_Evaluacion": "EV", "ID_Activo": f"A{i}", "Nombre_Activo": f"Activo {i}", "Criticidad": i % 4}
+        for i in range(n_activos) if i % 5
+    ])
+    for i in range(n_activos):
+        ms.agregar_vulnerabilidades_amenazas("EV", f"A{i}", f"Activo {i}", [
+            {"amenaza": f"Amenaza {c}", "cod_amenaza": c, "vulnerabilidad": "v",
+             "deg_d": rnd.choice([0.1, 0.5, 1.0]), "deg_i": rnd.random(), "deg_c": 0.0}
+            for c in rnd.sample(CODIGOS, 4)
+        ])
+
+
+def _riesgos():
+    columnas = ["ID_Vulnerabilidad_Amenaza", "ID_Activo", "Nombre_Activo", "Amenaza",
+                "Frecuencia", "Frecuencia_Nivel", "Impacto", "Riesgo"]
+    return db.query_rows("RIESGO_AMENAZA", {"ID_Evaluacion": "EV"}, columns=columnas,
+                         order_by="ID_Vulnerabilidad_Amenaza").to_dict("records")
+
+
+def test_bloque_equivale_a_amenaza_por_amenaza(bd_temporal):
+    _poblar()
+    for i in range(12):
+        for am in calcular_frecuencia_todas_amenazas("EV", f"A{i}"):
+            ms.calcular_riesgo_amenaza("EV", f"A{i}", am["id_va"], am["frecuencia"])
+    esperado = _riesgos()
+
+    avances, bloqueos = [], []
+    resultado = ms.recalcular_riesgos_evaluacion("EV", reemplazar=True, chunk_size=10,
+                                                 progreso=lambda hechos, total: avances.append((hechos, total))
+                                                 or bloqueos.append(db._db_lock._is_owned()))
+
+    assert _riesgos() == esperado
+    assert resultado.riesgos == len(esperado) == 48
+    assert resultado.activos == 12
+    assert avances == [(0, 48), (10, 48), (20, 48), (30, 48), (40, 48), (48, 48)]
+    assert not any(bloqueos)  # la UI no retiene el lock de escritura
+    assert "riesgos/s" in str(resultado)
+
+
+def test_upsert_actualiza_sin_duplicar_y_filtra_activos(bd_temporal):
+    _poblar()
+    ms.recalcular_riesgos_evaluacion("EV")
+    with db.get_connection() as conn:
+        conn.execute("UPDATE IDENTIFICACION_VALORACION SET Criticidad = 3 WHERE ID_Activo = 'A1'")
+        conn.execute("UPDATE VULNERABILIDADES_AMENAZAS SET Impacto = 2.0 WHERE ID_Activo = 'A1'")
+
+    resultado = ms.recalcular_riesgos_evaluacion("EV", ids_activos=["A1"])
+
+    assert resultado.riesgos == 4
+    assert db.count_rows("RIESGO_AMENAZA", {"ID_Evaluacion": "EV"}) == 48
+    riesgos_a1 = db.query_rows("RIESGO_AMENAZA", {"ID_Activo": "A1"})
+    assert set(riesgos_a1["Impacto"]) == {2.0}
+    assert (riesgos_a1["Riesgo"] == riesgos_a1["Frecuencia"] * 2.0).all()
+
+
+def test_reemplazar_solo_borra_activos_recalculados(bd_temporal):
+    _poblar()
+    ms.recalcular_riesgos_evaluacion("EV")
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM VULNERABILIDADES_AMENAZAS WHERE ID_Activo = 'A2' AND Cod_Amenaza != ''")
+
+    ms.recalcular_riesgos_evaluacion("EV", ids_activos=["A2"], reemplazar=True)
+
+    restantes = db.count_rows("VULNERABILIDADES_AMENAZAS", {"ID_Activo": "A2"})
+    assert db.count_rows("RIESGO_AMENAZA", {"ID_Activo": "A2"}) == restantes
+    assert db.count_rows("RIESGO_AMENAZA", {"ID_Activo": "A3"}) == 4
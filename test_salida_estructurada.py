@@ -0,0 +1,79 @@
+"""Pruebas de la salida estructurada (esquemas JSON y parser incremental)"""
+import json
+
+import pytest
+
+from services import database_service as db
+from services import salida_estructurada as se
+
+
+@pytest.fixture
+def bd_temporal(bd_temporal):
+    se.reiniciar_metricas()
+    return bd_temporal
+
+
+def test_parser_incremental_por_fragmentos():
+    texto = ('Usa el formato {codigo}. ```json\n{"amenazas": [{"codigo": "A.24", "nota": "x}"},], "n": 1}\n```'
+             ' y además [1, 2]')
+    parser = se.ParserJSONIncremental()
+    completados = []
+    for i in range(0, len(texto), 4):
+        completados.append(parser.alimentar(texto[i:i + 4]))
+    assert parser.valores == [{"amenazas": [{"codigo": "A.24", "nota": "x}"}], "n": 1}, [1, 2]]
+    # Cada valor se entrega en cuanto se cierra, no al final
+    assert [i for i, valores in enumerate(completados) if valores][0] < len(completados) - 3
+    assert parser.reparados == 1
+
+    # Respuesta cortada por num_predict: se conservan los elementos completos
+    truncado = se.ParserJSONIncremental()
+    truncado.alimentar('{"amenazas_identificadas": [{"codigo_amenaza": "A.24"}, {"codigo_amenaza": "E.2", "vuln')
+    assert truncado.finalizar() == [{"amenazas_identificadas": [{"codigo_amenaza": "A.24"}]}]
+
+
+def test_extraer_json_metricas_por_origen():
+    se.reiniciar_metricas()
+    assert se.extraer_json('{"a": 1}', origen="plan") == {"a": 1}
+    assert se.extraer_json('Claro: [{"Pregunta": "p"}]', list, origen="preguntas") == [{"Pregunta": "p"}]
+    assert se.extraer_json("Lo siento, no puedo", origen="plan") is None
+    assert se.extraer_json('[1]', dict, origen="plan") is None
+
+    metricas = se.metricas_parseo()
+    assert metricas["plan"]["directas"] == 1 and metricas["plan"]["fallos"] == 2
+    assert metricas["preguntas"]["extraidas"] == 1
+    assert metricas["total"]["respuestas"] == 4 and metricas["total"]["tasa_fallos"] == pytest.approx(0.5)
+
+
+def test_analisis_envia_esquema_con_codigos_del_catalogo(bd_temporal, monkeypatch):
+    from services import ollama_client, ollama_magerit_service as oms
+
+    with db.get_connection() as conn:
+        conn.execute("DROP TABLE CATALOGO_AMENAZAS_MAGERIT")
+        conn.execute("CREATE TABLE CATALOGO_AMENAZAS_MAGERIT (codigo TEXT PRIMARY KEY, amenaza TEXT, tipo_amenaza TEXT)")
+        conn.executemany("INSERT INTO CATALOGO_AMENAZAS_MAGERIT VALUES (?, ?, ?)",
+                         [("A.24", "Denegación de servicio", "Ataques"), ("E.2", "Errores", "Errores")])
+    peticiones = []
+
+    class Respuesta:
+        status_code = 200
+
+        def json(self):
+            contenido = json.dumps({"amenazas_identificadas": [{"codigo_amenaza": "E.2", "vulnerabilidad": "v",
+                                                                "justificacion": "j"}]})
+            return {"message": {"role": "assistant", "content": contenido}, "done": True}
+
+    def post(url, json, timeout, stream=False):
+        peticiones.append(json)
+        return Respuesta()
+
+    monkeypatch.setattr(ollama_client.get_cliente().session, "post", post)
+    monkeypatch.setattr(se, "MODO_SALIDA", "esquema")
+
+    exito, amenazas, mensaje = oms.analizar_amenazas_por_criticidad(
+        {"ID_Activo": "ESQ-1", "Nombre_Activo": "ESQ-1", "Tipo_Activo": "Servidor"}, {"Criticidad": 2})
+
+    assert exito and [a["codigo_amenaza"] for a in amenazas] == ["E.2"] and "heurístico" not in mensaje
+    esquema = peticiones[0]["format"]
+    codigo = esquema["properties"]["amenazas_identificadas"]["items"]["properties"]["codigo_amenaza"]
+    assert codigo["enum"] == ["A.24", "E.2"]
+    assert se.metricas_parseo()["amenazas_criticidad"]["directas"] == 1
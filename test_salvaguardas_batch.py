@@ -0,0 +1,84 @@
+"""Pruebas de la sugerencia de salvaguardas en batch (ternas únicas en paralelo)"""
+import threading
+import time
+
+import pandas as pd
+
+from services import matriz_service as ms
+from services import ollama_magerit_service as oms
+
+
+def _riesgos(n_activos: int = 10) -> pd.DataFrame:
+    filas = []
+    for i in range(n_activos):
+        # Todos los activos comparten dos ternas; el riesgo 7 y el 6.5 caen en la misma zona
+        filas.append({"id": 2 * i, "ID_Activo": f"A{i}", "Nombre_Activo": f"Activo {i}", "Tipo_Activo": "Servidor",
+                      "Amenaza": "Denegación de servicio", "Vulnerabilidad": "Sin DDoS", "Riesgo": 7 - (i % 2) / 2})
+        filas.append({"id": 2 * i + 1, "ID_Activo": f"A{i}", "Nombre_Activo": f"Activo {i}",
+                      "Tipo_Activo": "Servidor", "Amenaza": "Errores del administrador",
+                      "Vulnerabilidad": "Sin procedimientos", "Riesgo": 3})
+    filas.append({"id": 99, "ID_Activo": "A0", "Nombre_Activo": "Activo 0", "Tipo_Activo": "Servidor",
+                  "Amenaza": "Errores del administrador", "Vulnerabilidad": "Sin procedimientos", "Riesgo": 4.5})
+    return pd.DataFrame(filas)
+
+
+def test_ternas_unicas_en_paralelo_y_reparto(monkeypatch):
+    llamadas, activos, maximo = [], [0], [0]
+    lock = threading.Lock()
+
+    def sugerir(nombre_activo, tipo_activo, amenaza, vulnerabilidad, riesgo, modelo=None):
+        with lock:
+            llamadas.append((amenaza, riesgo))
+            activos[0] += 1
+            maximo[0] = max(maximo[0], activos[0])
+        time.sleep(0.05)
+        with lock:
+            activos[0] -= 1
+        return f"Salvaguarda {amenaza} {oms.zona_salvaguarda(riesgo)[0]}", "8.20: Seguridad de redes", True
+
+    monkeypatch.setattr(oms, "sugerir_salvaguardas_ia", sugerir)
+    avances = []
+    riesgos = _riesgos()
+    resultado = oms.sugerir_salvaguardas_batch(riesgos, concurrencia=2,
+                                               progreso=lambda hechos, total: avances.append((hechos, total)))
+
+    # 21 filas, 3 ternas (la de riesgo 4.5 cae en otra zona)
+    assert len(llamadas) == 3 and maximo[0] == 2 and avances[-1] == (3, 3)
+    assert len(resultado) == len(riesgos) and resultado["id"].tolist() == riesgos["id"].tolist()
+    por_id = dict(zip(resultado["id"].tolist(), resultado["Salvaguarda_Sugerida"].tolist()))
+    assert por_id[0] == por_id[2] == "Salvaguarda Denegación de servicio CRÍTICO"
+    assert por_id[1] == "Salvaguarda Errores del administrador MEDIO"
+    assert por_id[99] == "Salvaguarda Errores del administrador ALTO"
+    assert set(resultado["Generado_IA"]) == {"✅"}
+
+
+def test_guardar_en_una_transaccion_conserva_las_manuales(bd_temporal, monkeypatch):
+    monkeypatch.setattr(oms, "sugerir_salvaguardas_ia",
+                        lambda *args, **kwargs: ("Activar WAF", "8.20: Seguridad de redes", False))
+    ms.agregar_salvaguarda("EV", "A0", "Activo 0", "Revisión manual")
+    sugeridas = oms.sugerir_salvaguardas_batch(_riesgos(3))
+
+    assert ms.guardar_salvaguardas_sugeridas("EV", sugeridas) == 7
+    # Regenerar sustituye solo las automáticas
+    assert ms.guardar_salvaguardas_sugeridas("EV", sugeridas) == 7
+    guardadas = ms.get_salvaguardas_evaluacion("EV")
+    assert len(guardadas) == 8 and (guardadas["Salvaguarda"] == "Revisión manual").sum() == 1
+    automaticas = guardadas[guardadas["Origen"].notna()]
+    assert set(automaticas["Origen"]) == {"heuristica"} and set(automaticas["Control_ISO"]) == {"8.20: Seguridad de redes"}
+    assert automaticas.loc[automaticas["Riesgo_ID"] == "99", "Prioridad"].item() == "Media"
+
+
+def test_regenerar_conserva_el_estado_de_las_sugerencias(bd_temporal, monkeypatch):
+    monkeypatch.setattr(oms, "sugerir_salvaguardas_ia",
+                        lambda *args, **kwargs: ("Activar WAF", "8.20: Seguridad de redes", False))
+    sugeridas = oms.sugerir_salvaguardas_batch(_riesgos(3))
+    ms.guardar_salvaguardas_sugeridas("EV", sugeridas)
+    implementada = ms.get_salvaguardas_evaluacion("EV").query("Riesgo_ID == '0'")["id"].item()
+    assert ms.actualizar_estado_salvaguarda(implementada, "Implementada")
+
+    # Solo se sustituyen las pendientes; la implementada no se duplica como pendiente
+    assert ms.guardar_salvaguardas_sugeridas("EV", sugeridas) == 6
+    guardadas = ms.get_salvaguardas_evaluacion("EV")
+    assert len(guardadas) == 7
+    assert guardadas.loc[guardadas["id"] == implementada, "Estado"].item() == "Implementada"
+    assert (guardadas["Riesgo_ID"] == "0").sum() == 1
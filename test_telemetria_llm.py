@@ -0,0 +1,73 @@
+"""Pruebas de la telemetría de inferencia de la IA"""
+import pytest
+import requests
+
+from services import database_service as db
+from services import llm_cache_service as cache
+from services import telemetria_llm_service as tel
+from services.ollama_client import OllamaClient, OllamaError, PoliticaReintentos
+
+
+@pytest.fixture
+def bd_temporal(bd_temporal, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_HABILITADA", True)
+    monkeypatch.setattr(tel, "TELEMETRIA_HABILITADA", True)
+    return bd_temporal
+
+
+class Respuesta:
+    status_code = 200
+
+    def json(self):
+        return {"response": "ok", "done": True, "prompt_eval_count": 120, "eval_count": 50,
+                "eval_duration": 2_500_000_000, "prompt_eval_duration": 400_000_000,
+                "load_duration": 100_000_000, "total_duration": 3_000_000_000}
+
+
+def test_cada_llamada_registra_tokens_cache_y_errores(bd_temporal, monkeypatch):
+    cliente = OllamaClient(politica=PoliticaReintentos(max_intentos=1, espera_base=0))
+    respuestas = [Respuesta(), requests.exceptions.ConnectionError()]
+
+    def post(url, json, timeout, stream=False):
+        siguiente = respuestas.pop(0)
+        if isinstance(siguiente, Exception):
+            raise siguiente
+        return siguiente
+
+    monkeypatch.setattr(cliente.session, "post", post)
+
+    @tel.etiquetar_origen("prueba")
+    def analizar(prompt):
+        return cliente.generar(prompt, "llama3", {"temperature": 0.3})
+
+    analizar("a")
+    analizar("a")  # acierto de cache
+    with pytest.raises(OllamaError):
+        cliente.generar("b", "llama3")
+
+    filas = db.query_rows("TELEMETRIA_LLM", order_by="ID")
+    assert filas["Origen"].tolist() == ["prueba", "prueba", "general"]
+    assert filas["Desde_Cache"].tolist() == [0, 1, 0] and filas["Exito"].tolist() == [1, 1, 0]
+    real = filas.iloc[0]
+    assert real["Tokens_Prompt"] == 120 and real["Tokens_Respuesta"] == 50
+    assert real["Tokens_Por_Segundo"] == pytest.approx(20.0) and real["Carga_s"] == pytest.approx(0.1)
+    assert filas.iloc[2]["Error"].startswith("conexion")
+
+
+def test_agregados_por_modelo_periodo_y_origen(bd_temporal):
+    datos = {"eval_count": 40, "eval_duration": 2_000_000_000, "total_duration": 2_500_000_000}
+    tel.registrar_llamada("llama3", "/api/chat", 3.0, datos)
+    tel.registrar_llamada("llama3", "/api/chat", 5.0, dict(datos, eval_count=80))
+    tel.registrar_llamada("phi3", "/api/generate", 0.0, desde_cache=True)
+    tel.etiquetar_origen("resumen_ejecutivo")(tel.registrar_fallback)("IA caída")
+
+    tendencia = tel.tendencia_throughput(dias=1, periodo="dia")
+    assert tendencia["Modelo"].tolist() == ["llama3"]
+    assert tendencia.iloc[0]["Tokens_Por_Segundo"] == pytest.approx(30.0)
+    assert tendencia.iloc[0]["Espera_Media_s"] == pytest.approx(1.5)
+
+    modelos = tel.resumen_por_modelo(dias=1).set_index("Modelo")
+    assert modelos.loc["llama3", "Llamadas"] == 2 and modelos.loc["phi3", "Aciertos_Cache"] == 1
+    origenes = tel.resumen_por_origen(dias=1).set_index("Origen")
+    assert origenes.loc["resumen_ejecutivo", "Fallbacks"] == 1
+    assert tel.limpiar_telemetria(dias_retencion=-1) == 4
@@ -0,0 +1,64 @@
+"""Pruebas de la tendencia multi-evaluación (resúmenes versionados y deltas por ventana)"""
+import pytest
+
+from services import database_service as db
+from services import comparativa_service as comp
+
+
+def _resultado(eval_id, activo, promedio, maximo=None, inherente=None):
+    return {"ID_Evaluacion": eval_id, "ID_Activo": activo, "Nombre_Activo": f"Activo {activo}",
+            "Riesgo_Promedio": promedio, "Riesgo_Maximo": maximo, "Riesgo_Inherente": inherente}
+
+
+def _poblar():
+    # Fechas desordenadas respecto a los IDs: la serie se ordena por fecha
+    db.insert_rows("EVALUACIONES", [
+        {"ID_Evaluacion": "EV3", "Nombre": "Marzo", "Fecha": "2025-03-01"},
+        {"ID_Evaluacion": "EV1", "Nombre": "Enero", "Fecha": "2025-01-01"},
+        {"ID_Evaluacion": "EV2", "Nombre": "Febrero", "Fecha": "2025-02-01"},
+    ])
+    db.insert_rows("RESULTADOS_MAGERIT", [
+        _resultado("EV1", "A", 8, 10), _resultado("EV1", "B", 4, 6),
+        _resultado("EV2", "A", 5, 9), _resultado("EV2", "B", None, 7, inherente=6),
+        _resultado("EV3", "A", 9, 9),  # reevaluado: cuenta la última fila del activo
+        _resultado("EV3", "A", 2, 3), _resultado("EV3", "B", 4, 4),
+    ])
+
+
+def test_deltas_por_ventana_globales_y_por_activo(bd_temporal):
+    _poblar()
+    assert comp.actualizar_resumenes() == 3
+
+    serie = comp.tendencia_evaluaciones()
+    assert serie["ID_Evaluacion"].tolist() == ["EV1", "EV2", "EV3"]
+    assert serie["Riesgo_Promedio"].tolist() == pytest.approx([6, 5, 5])
+    assert serie["Delta_Promedio"].tolist()[1:] == pytest.approx([-1, 0])
+    assert serie["Delta_Maximo"].tolist()[1:] == pytest.approx([-1, 0])  # el máximo usa todas las filas
+
+    activos = comp.tendencia_activos(["EV1", "EV2", "EV3"])
+    a = activos[activos["ID_Activo"] == "A"]
+    b = activos[activos["ID_Activo"] == "B"]
+    assert a["Riesgo"].tolist() == [8, 5, 2] and a["Delta"].tolist()[1:] == [-3, -3]
+    assert a["Delta_Acumulado"].tolist()[-1] == -6
+    assert b["Riesgo"].tolist() == [4, 6, 4]  # sin Riesgo_Promedio usa el inherente
+
+    # Subconjunto de la serie: el delta es respecto a la anterior seleccionada
+    tendencia = comp.get_tendencia_riesgo(["EV3", "EV1"])
+    assert [t["evaluacion"] for t in tendencia] == ["Marzo", "Enero"]
+    assert tendencia[0]["delta_promedio"] == pytest.approx(-1) and tendencia[1]["delta_promedio"] is None
+
+    comparativa = comp.comparar_evaluaciones("EV1", "EV3")
+    assert (comparativa.activos_mejorados, comparativa.activos_sin_cambio) == (1, 1)
+    assert comparativa.detalle_mejoras[0]["delta"] == -6 and comparativa.total_activos_destino == 2
+
+
+def test_resumenes_solo_se_recalculan_si_cambian_los_datos(bd_temporal):
+    _poblar()
+    comp.actualizar_resumenes()
+    assert comp.actualizar_resumenes() == 0
+    assert comp.get_tendencia_riesgo(["EV1", "EV2", "EV3"]) and comp.actualizar_resumenes() == 0
+
+    db.insert_rows("RESULTADOS_MAGERIT", [_resultado("EV2", "C", 20, 20)])
+    assert comp.actualizar_resumenes(["EV1", "EV2", "EV3"]) == 1
+    serie = comp.tendencia_evaluaciones(["EV2"])
+    assert serie["Num_Activos"].tolist() == [3] and serie["Riesgo_Maximo"].tolist() == [20]
@@ -0,0 +1,109 @@
+"""Pruebas de la cola de trabajos en segundo plano"""
+import time
+import threading
+import datetime as dt
+
+import pytest
+
+from services import database_service as db
+from services import trabajos_service as ts
+
+
+@pytest.fixture
+def bd_temporal(bd_temporal, monkeypatch):
+    monkeypatch.setattr(ts, "INTERVALO_SONDEO", 0.05)
+    monkeypatch.setitem(ts.TIPOS_TRABAJO, "prueba", (_tarea_prueba, "Tarea de prueba"))
+    yield bd_temporal
+    ts.detener_workers()
+
+
+_liberar = threading.Event()
+
+
+def _tarea_prueba(ctx, pasos=3, fallar=False, esperar=False):
+    for i in range(pasos):
+        if esperar:
+            _liberar.wait(5)
+        ctx.avance((i + 1) / pasos, f"paso {i + 1}")
+    if fallar:
+        raise RuntimeError("fallo simulado")
+    return {"pasos": pasos, "evaluacion": ctx.id_evaluacion}
+
+
+def _esperar_estado(id_trabajo, estados, limite=5.0):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        trabajo = ts.get_trabajo(id_trabajo)
+        if trabajo["Estado"] in estados:
+            return trabajo
+        time.sleep(0.02)
+    raise AssertionError(f"{id_trabajo} sigue en {trabajo['Estado']}")
+
+
+def test_ciclo_completo_con_resultado_y_error(bd_temporal):
+    ok = ts.encolar_trabajo("prueba", "EV", {"pasos": 4})
+    ko = ts.encolar_trabajo("prueba", "EV", {"fallar": True})
+
+    assert ts.get_trabajo(ok)["Estado"] == "encolado"
+    assert ts.procesar_pendientes() == 2
+
+    trabajo = ts.get_trabajo(ok)
+    assert trabajo["Estado"] == "completado" and trabajo["Progreso"] == 1.0
+    assert trabajo["Resultado"] == {"pasos": 4, "evaluacion": "EV"}
+    fallido = ts.get_trabajo(ko)
+    assert fallido["Estado"] == "error" and "fallo simulado" in fallido["Mensaje"]
+    assert list(ts.listar_trabajos("EV")["ID_Trabajo"]) == [ko, ok]
+    with pytest.raises(ValueError):
+        ts.encolar_trabajo("inexistente", "EV")
+
+
+def test_workers_en_segundo_plano_y_cancelacion(bd_temporal):
+    _liberar.clear()
+    assert ts.iniciar_workers(2) == 2
+    assert ts.iniciar_workers(2) == 2  # idempotente entre reruns
+
+    largo = ts.encolar_trabajo("prueba", "EV", {"pasos": 50, "esperar": True})
+    _esperar_estado(largo, {"ejecutando"})
+    rapidos = [ts.encolar_trabajo("prueba", "EV") for _ in range(3)]
+    for id_trabajo in rapidos:
+        assert _esperar_estado(id_trabajo, ts.ESTADOS_FINALES)["Estado"] == "completado"
+
+    assert ts.cancelar_trabajo(largo)
+    _liberar.set()
+    cancelado = _esperar_estado(largo, ts.ESTADOS_FINALES)
+    assert cancelado["Estado"] == "cancelado" and cancelado["Progreso"] < 1.0
+    assert ts.listar_trabajos("EV", solo_activos=True).empty
+
+
+def test_cancelar_encolado_y_reencolar_huerfanos(bd_temporal):
+    encolado = ts.encolar_trabajo("prueba", "EV")
+    assert ts.cancelar_trabajo(encolado)
+    assert ts.procesar_pendientes() == 0
+    assert ts.get_trabajo(encolado)["Estado"] == "cancelado"
+
+    huerfano = ts.encolar_trabajo("prueba", "EV")
+    assert ts._tomar_trabajo("otro-host:1:0")["ID_Trabajo"] == huerfano
+    viejo = (dt.datetime.now() - dt.timedelta(seconds=ts.LATIDO_VENCIDO + 1)).isoformat()
+    with db.get_connection() as conn:
+        conn.execute("UPDATE TRABAJOS SET Fecha_Latido = ? WHERE ID_Trabajo = ?", (viejo, huerfano))
+
+    assert ts.reencolar_huerfanos() == 1
+    assert ts.procesar_pendientes() == 1
+    assert ts.get_trabajo(huerfano)["Estado"] == "completado"
+
+
+def test_exportacion_cancelada_durante_la_ejecucion(bd_temporal, tmp_path, monkeypatch):
+    from services import export_service
+
+    def exportar(eval_id, ruta):
+        open(ruta, "wb").close()
+        ts.cancelar_trabajo(id_trabajo)  # el usuario cancela mientras se exporta
+        return True, "ok"
+
+    monkeypatch.setattr(ts, "directorio_resultados", lambda: str(tmp_path))
+    monkeypatch.setattr(export_service, "exportar_powerbi_excel", exportar)
+    id_trabajo = ts.encolar_trabajo("exportar_powerbi", "EV")
+    ts.procesar_pendientes()
+
+    assert ts.get_trabajo(id_trabajo)["Estado"] == "cancelado"
+    assert not list(tmp_path.glob(f"{id_trabajo}_*"))